@@ -18,6 +18,7 @@ from model import (
     ExternalIntegration,
     Identifier,
     LicensePool,
+    LookupCache,
     PresentationCalculationPolicy,
     Timestamp,
     Work,
@@ -171,6 +172,12 @@ class BaseCoverageProvider(object):
         status. This option is only used on the Metadata Wrangler.
         """
         self._db = _db
+
+        # Keep the Identifiers, Subjects and Contributors looked up
+        # while providing coverage in memory, for as long as the
+        # session lasts.
+        LookupCache.install(_db)
+
         if not self.__class__.SERVICE_NAME:
             raise ValueError(
                 "%s must define SERVICE_NAME." % self.__class__.__name__
@@ -1595,3 +1602,30 @@ class WorkClassificationCoverageProvider(
     # This is going to be expensive -- we might as well recalculate
     # everything.
     POLICY = PresentationCalculationPolicy.recalculate_everything()
+
+
+class NewWorkPresentationCoverageProvider(WorkClassificationCoverageProvider):
+    """Calculate the presentation for Works that were created without
+    one, such as the Works created by
+    LicensePool.consolidate_works_in_bulk, so they can become
+    presentation-ready.
+
+    WorkClassificationCoverageProvider only looks at Works that are
+    already presentation-ready. This provider looks at Works that
+    aren't, but only if they've been registered for coverage.
+    """
+    SERVICE_NAME = "New work presentation coverage provider"
+
+    def __init__(self, _db, **kwargs):
+        kwargs['registered_only'] = True
+        super(NewWorkPresentationCoverageProvider, self).__init__(
+            _db, **kwargs
+        )
+
+    def items_that_need_coverage(self, identifiers=None, **kwargs):
+        # Skip over PresentationReadyWorkCoverageProvider, which would
+        # only find Works that are already presentation-ready.
+        qu = WorkCoverageProvider.items_that_need_coverage(
+            self, identifiers, **kwargs
+        )
+        return qu.filter(Work.presentation_ready==False)
@@ -12,7 +12,9 @@ from opds_import import SimplifiedOPDSLookup
 import logging
 from config import Configuration
 from metadata_layer import (
+    BulkMetadataImporter,
     CSVMetadataImporter,
+    Metadata,
     ReplacementPolicy,
 )
 from model import (
@@ -24,10 +26,11 @@ from model import (
     DataSource,
     Edition,
     Identifier,
+    LookupCache,
     Subject,
     Work,
 )
-from util import LanguageCodes
+from util import LanguageCodes, batch_lazily
 
 class CustomListFromCSV(CSVMetadataImporter):
     """Create a CustomList, with entries, from a CSV file."""
@@ -68,6 +71,10 @@ class CustomListFromCSV(CSVMetadataImporter):
         data_source = DataSource.lookup(_db, self.data_source_name)
         now = datetime.datetime.utcnow()
 
+        # A CSV file tends to mention the same Subjects and
+        # Contributors over and over.
+        LookupCache.install(_db)
+
         # Find or create the CustomList object itself.
         custom_list, was_new = get_one_or_create(
             _db,
@@ -81,10 +88,18 @@ class CustomListFromCSV(CSVMetadataImporter):
         custom_list.updated = now
 
         # Turn the rows of the CSV file into a sequence of Metadata
-        # objects, then turn each Metadata into a CustomListEntry object.
-        for metadata in self.to_metadata(dictreader):
-            entry = self.metadata_to_list_entry(
-                custom_list, data_source, now, metadata)
+        # objects, then turn each Metadata into a CustomListEntry
+        # object. The database objects needed by a batch of rows are
+        # found or created all at once.
+        batches = batch_lazily(
+            self.to_metadata(dictreader),
+            BulkMetadataImporter.DEFAULT_BATCH_SIZE
+        )
+        for batch in batches:
+            Metadata.prepare_to_apply(_db, batch)
+            for metadata in batch:
+                entry = self.metadata_to_list_entry(
+                    custom_list, data_source, now, metadata)
 
     def metadata_to_list_entry(self, custom_list, data_source, now, metadata):
         """Convert a Metadata object to a CustomListEntry."""
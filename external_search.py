@@ -1,5 +1,9 @@
-from collections import defaultdict
+from collections import (
+    defaultdict,
+    deque,
+)
 import contextlib
+import copy
 import datetime
 
 import json
@@ -15,6 +19,7 @@ from elasticsearch_dsl import (
     Search,
     SF,
 )
+from elasticsearch_dsl.response import Hit
 from elasticsearch_dsl.query import (
     Bool,
     DisMax,
@@ -59,7 +64,10 @@ from model import (
     Work,
     WorkCoverageRecord,
 )
-from lane import Pagination
+from lane import (
+    Lane,
+    Pagination,
+)
 from monitor import WorkSweepMonitor
 from coverage import (
     CoverageFailure,
@@ -70,12 +78,15 @@ from selftest import (
     HasSelfTests,
     SelfTestResult,
 )
+from util.cache import LRUCache
 from util.personal_names import display_name_to_sort_name
 from util.problem_detail import ProblemDetail
 from util.stopwords import ENGLISH_STOPWORDS
 
+import hashlib
 import os
 import logging
+import random
 import re
 import time
 
@@ -106,9 +117,20 @@ class ExternalSearchIndex(HasSelfTests):
     TEST_SEARCH_TERM_KEY = u'test_search_term'
     DEFAULT_TEST_SEARCH_TERM = u'test'
 
+    RESULT_CACHE_TTL_KEY = u'result_cache_ttl'
+    RESULT_CACHE_SIZE_KEY = u'result_cache_size'
+    DEFAULT_RESULT_CACHE_SIZE = 1000
+
+    SLOW_QUERY_THRESHOLD_KEY = u'slow_query_threshold'
+    PROFILE_SAMPLE_RATE_KEY = u'profile_sample_rate'
+
     work_document_type = 'work-type'
     __client = None
 
+    # Like the client, the search result cache is shared by every
+    # ExternalSearchIndex in this process.
+    __result_cache = None
+
     CURRENT_ALIAS_SUFFIX = 'current'
     VERSION_RE = re.compile('-v([0-9]+)$')
 
@@ -123,7 +145,28 @@ class ExternalSearchIndex(HasSelfTests):
           "label": _("Test search term"),
           "default": DEFAULT_TEST_SEARCH_TERM,
           "description": _("Self tests will use this value as the search term.")
-        }
+        },
+        { "key": RESULT_CACHE_TTL_KEY,
+          "label": _("Search result cache lifetime (in seconds)"),
+          "type": "number",
+          "description": _("If this is set, the results of identical searches run within this many seconds of each other will be reused instead of asking Elasticsearch again. Leave this blank to disable the cache.")
+        },
+        { "key": RESULT_CACHE_SIZE_KEY,
+          "label": _("Search result cache size"),
+          "type": "number",
+          "default": DEFAULT_RESULT_CACHE_SIZE,
+          "description": _("The maximum number of search results pages to keep in the cache.")
+        },
+        { "key": SLOW_QUERY_THRESHOLD_KEY,
+          "label": _("Slow search threshold (in milliseconds)"),
+          "type": "number",
+          "description": _("If this is set, any search that takes Elasticsearch longer than this will be logged, along with details about the search. Leave this blank to disable the slow search log.")
+        },
+        { "key": PROFILE_SAMPLE_RATE_KEY,
+          "label": _("Search profiling sample rate"),
+          "type": "number",
+          "description": _("A number between 0 and 1. This proportion of searches will be run with Elasticsearch's profiler turned on, and the profile will be logged. Profiling slows down searches, so keep this number small. Leave this blank to disable profiling.")
+        },
     ]
 
     SITEWIDE = True
@@ -136,6 +179,7 @@ class ExternalSearchIndex(HasSelfTests):
         This method is only intended for use in testing.
         """
         cls.__client = None
+        cls.__result_cache = None
 
     @classmethod
     def search_integration(cls, _db):
@@ -184,7 +228,8 @@ class ExternalSearchIndex(HasSelfTests):
         return cls(_db, *args, **kwargs)
 
     def __init__(self, _db, url=None, works_index=None, test_search_term=None,
-                 in_testing=False, mapping=None):
+                 in_testing=False, mapping=None, result_cache=None,
+                 profiler=None):
         """Constructor
 
         :param in_testing: Set this to true if you don't want an
@@ -194,10 +239,18 @@ class ExternalSearchIndex(HasSelfTests):
 
         :param mapping: A custom Mapping object, for use in unit tests. By
         default, the most recent mapping will be instantiated.
+
+        :param result_cache: A SearchResultCache to use instead of the
+        one (if any) described by the site configuration.
+
+        :param profiler: A SearchProfiler to use instead of the one
+        described by the site configuration.
         """
         self.log = logging.getLogger("External search index")
         self.works_index = None
         self.works_alias = None
+        self.result_cache = result_cache
+        self.profiler = profiler
         integration = None
 
         self.mapping = mapping or CurrentMapping()
@@ -222,6 +275,13 @@ class ExternalSearchIndex(HasSelfTests):
                 works_index = self.works_index_name(_db)
             test_search_term = integration.setting(
                 self.TEST_SEARCH_TERM_KEY).value
+        if integration and not self.result_cache:
+            self.result_cache = self.configured_result_cache(integration)
+        if not self.profiler:
+            if integration:
+                self.profiler = self.configured_profiler(integration)
+            else:
+                self.profiler = SearchProfiler()
         if not url:
             raise CannotLoadConfiguration(
                 "No URL configured to Elasticsearch server."
@@ -268,6 +328,38 @@ class ExternalSearchIndex(HasSelfTests):
             return elasticsearch_bulk(self.__client, docs, **kwargs)
         self.bulk = bulk
 
+    @classmethod
+    def configured_result_cache(cls, integration):
+        """Find or create the SearchResultCache described by an
+        ExternalIntegration.
+
+        :return: A SearchResultCache, or None if the cache is disabled.
+        """
+        ttl = integration.setting(cls.RESULT_CACHE_TTL_KEY).int_value
+        if not ttl or ttl <= 0:
+            return None
+        max_size = integration.setting(
+            cls.RESULT_CACHE_SIZE_KEY
+        ).int_value or cls.DEFAULT_RESULT_CACHE_SIZE
+        cache = ExternalSearchIndex.__result_cache
+        if (not cache or cache.ttl != ttl
+            or cache.backend.max_size != max_size):
+            cache = SearchResultCache(LRUCache(max_size=max_size), ttl=ttl)
+            ExternalSearchIndex.__result_cache = cache
+        return cache
+
+    @classmethod
+    def configured_profiler(cls, integration):
+        """Create the SearchProfiler described by an ExternalIntegration."""
+        return SearchProfiler(
+            slow_query_threshold=integration.setting(
+                cls.SLOW_QUERY_THRESHOLD_KEY
+            ).int_value,
+            sample_rate=integration.setting(
+                cls.PROFILE_SAMPLE_RATE_KEY
+            ).float_value or 0,
+        )
+
     def set_works_index_and_alias(self, _db):
         """Finds or creates the works_index and works_alias based on
         the current configuration.
@@ -406,6 +498,14 @@ class ExternalSearchIndex(HasSelfTests):
             )
 
         self.works_alias = self.__client.works_alias = alias_name
+        self.search_results_invalidated()
+
+    def search_results_invalidated(self):
+        """The search index alias now points to a different index, so
+        any cached search results are obsolete.
+        """
+        if self.result_cache:
+            self.result_cache.clear()
 
     def base_index_name(self, index_or_alias):
         """Removes version or current suffix from base index name"""
@@ -498,11 +598,9 @@ class ExternalSearchIndex(HasSelfTests):
             for q in queries:
                 yield []
 
-        # Create a MultiSearch.
-        multi = MultiSearch(using=self.__client)
-
         # Give it a Search object for every query definition passed in
         # as part of `queries`.
+        searches = []
         for (query_string, filter, pagination) in queries:
             search = self.create_search_doc(
                 query_string, filter=filter, pagination=pagination, debug=debug
@@ -515,28 +613,75 @@ class ExternalSearchIndex(HasSelfTests):
                     score_mode="sum"
                 )
                 search = search.query(function_score)
-            multi = multi.add(search)
-
-        a = time.time()
-        # NOTE: This is the code that actually executes the ElasticSearch
-        # request.
-        resultset = [x for x in multi.execute()]
-
-        if debug:
-            b = time.time()
+            searches.append(search)
+
+        # Debugging requires a fresh look at the search results, so
+        # bypass the cache in that case.
+        cache = None
+        if not debug:
+            cache = self.result_cache
+        resultset = [None] * len(searches)
+        cache_keys = [None] * len(searches)
+        if cache:
+            for i, search in enumerate(searches):
+                cache_keys[i] = cache.key(
+                    self.works_alias, self.works_index, search
+                )
+                resultset[i] = cache.get(cache_keys[i])
+        needs_search = [i for i, x in enumerate(resultset) if x is None]
+
+        if needs_search:
+            # Create a MultiSearch for the queries that weren't cached.
+            # A sample of the searches will be profiled.
+            multi = MultiSearch(using=self.__client)
+            for i in needs_search:
+                search = searches[i]
+                if self.profiler.should_profile():
+                    search = search.extra(profile=True)
+                multi = multi.add(search)
+
+            a = time.time()
+            # NOTE: This is the code that actually executes the
+            # ElasticSearch request.
+            responses = multi.execute()
+            client_time = time.time() - a
+            for i, results in zip(needs_search, responses):
+                resultset[i] = results
+                filter = queries[i][1]
+                self.profiler.record(
+                    searches[i], results, client_time,
+                    query_string=queries[i][0],
+                    searches_in_request=len(needs_search),
+                    lane_id=filter.lane_id if filter else None,
+                    facets=filter.facets if filter else None,
+                )
+                if cache and cache.is_complete(results):
+                    cache.set(cache_keys[i], results)
+
+            if debug:
+                b = time.time()
+                self.log.debug(
+                    "Elasticsearch query %r completed in %.3fsec",
+                    query_string, b-a
+                )
+                for results in resultset:
+                    for i, result in enumerate(results):
+                        self.log.debug(
+                            '%02d "%s" (%s) work=%s score=%.3f shard=%s',
+                            i, result.sort_title, result.sort_author,
+                            result.meta['id'],
+                            result.meta.explanation['value'] or 0,
+                            result.meta['shard']
+                        )
+        if cache:
             self.log.debug(
-                "Elasticsearch query %r completed in %.3fsec",
-                query_string, b-a
+                "Search result cache: %d/%d queries cached, %r",
+                len(searches) - len(needs_search), len(searches), cache.stats
             )
-            for results in resultset:
-                for i, result in enumerate(results):
-                    self.log.debug(
-                        '%02d "%s" (%s) work=%s score=%.3f shard=%s',
-                        i, result.sort_title, result.sort_author, result.meta['id'],
-                        result.meta.explanation['value'] or 0, result.meta['shard']
-                    )
 
-        for i, results in enumerate(resultset):
+        for (query_string, filter, pagination), results in zip(
+            queries, resultset
+        ):
             # Tell the Pagination object about the page that was just
             # 'loaded' so that Pagination.next_page will work.
             #
@@ -545,6 +690,163 @@ class ExternalSearchIndex(HasSelfTests):
             pagination.page_loaded(results)
             yield results
 
+    def query_works_grouped(self, filters, pagination, debug=False):
+        """Find a page of works for each of several Filters with a
+        single request, rather than one request per Filter.
+
+        Each search uses a 'filters' aggregation with one bucket per
+        Filter, and a 'top_hits' sub-aggregation to pick the
+        highest-scoring works in each bucket. A work has only one
+        score per search, so Filters with different scoring functions
+        -- e.g. sublanes that feature different CustomLists -- go into
+        different searches. All the searches are sent to Elasticsearch
+        together.
+
+        :param filters: A list of Filter objects.
+        :param pagination: A Pagination object, used to determine how
+            many works to find for each Filter. Its page_loaded() method
+            will be called once for each Filter.
+        :return: A list of lists of Hit objects, one per Filter.
+        """
+        if not self.works_alias:
+            return [[] for filter in filters]
+        if not filters:
+            return []
+
+        # Group the Filters by their scoring functions.
+        groups = []
+        for i, filter in enumerate(filters):
+            for group in groups:
+                if filters[group[0]].scoring_functions == filter.scoring_functions:
+                    group.append(i)
+                    break
+            else:
+                groups.append([i])
+
+        multi = MultiSearch(using=self.__client)
+        searches = []
+        aggregation_for_filter = {}
+        for n, group in enumerate(groups):
+            search, aggregations = self._grouped_search(
+                filters, group, pagination
+            )
+            for i, name in aggregations.items():
+                aggregation_for_filter[i] = (n, name)
+            searches.append(search)
+            multi = multi.add(search)
+
+        a = time.time()
+        responses = multi.execute()
+        client_time = time.time() - a
+        for group, search, response in zip(groups, searches, responses):
+            # A grouped search covers every lane it has a bucket for. The
+            # filters all share the same facets.
+            self.profiler.record(
+                search, response, client_time,
+                searches_in_request=len(searches),
+                lane_id=[filters[i].lane_id for i in group],
+                facets=filters[group[0]].facets,
+            )
+        if debug:
+            self.log.debug(
+                "Elasticsearch grouped query for %d filters (%d searches) completed in %.3fsec",
+                len(filters), len(searches), client_time
+            )
+
+        resultsets = []
+        for i, filter in enumerate(filters):
+            n, name = aggregation_for_filter[i]
+            aggregations = responses[n].to_dict().get(
+                'aggregations', {}
+            )
+            bucket = aggregations[name]['buckets'][str(i)]
+            hits = [Hit(x) for x in bucket['top']['hits']['hits']]
+            pagination.page_loaded(hits)
+            resultsets.append(hits)
+        return resultsets
+
+    def _grouped_search(self, filters, group, pagination):
+        """Build one of the searches run by query_works_grouped.
+
+        :param filters: All of the Filters being searched.
+        :param group: The indexes of the Filters (all with the same
+            scoring functions) to be handled by this search.
+        :return: A 2-tuple (search, aggregations). `aggregations` maps
+            the index of each Filter to the name of the aggregation
+            holding the Filter's bucket.
+        """
+        search = Query(None).build(self.search)
+
+        # The scoring functions only need to run on works that are in
+        # one of this search's buckets.
+        queries = [filters[i].to_query() for i in group]
+        if len(queries) == 1:
+            [in_buckets] = queries
+        else:
+            in_buckets = Bool(should=queries, minimum_should_match=1)
+        functions = [
+            self._restrict_scoring_function(function, in_buckets)
+            for function in filters[group[0]].scoring_functions
+        ]
+        if functions:
+            function_score = FunctionScore(
+                query=dict(match_all=dict()),
+                functions=functions,
+                score_mode="sum"
+            )
+            search = search.query(function_score)
+        search = search.extra(size=0)
+
+        # A top_hits aggregation can only sort its buckets one way, so
+        # Filters with different sort orders or script fields go into
+        # different 'filters' aggregations.
+        variants = []
+        aggregations = {}
+        for i in group:
+            filter = filters[i]
+            variant = (filter.sort_order, filter.script_fields)
+            if variant not in variants:
+                variants.append(variant)
+            aggregations[i] = "groups%d" % variants.index(variant)
+
+        source = ["work_id"]
+        for n, (sort_order, script_fields) in enumerate(variants):
+            name = "groups%d" % n
+            buckets = dict(
+                (str(i), filters[i].to_query())
+                for i in group if aggregations[i] == name
+            )
+            top_hits = dict(
+                size=pagination.size, _source=source + script_fields.keys()
+            )
+            if pagination.offset:
+                top_hits['from'] = pagination.offset
+            if sort_order:
+                top_hits['sort'] = sort_order
+            if script_fields:
+                top_hits['script_fields'] = script_fields
+            search.aggs.bucket(
+                name, 'filters', filters=buckets
+            ).metric('top', 'top_hits', **top_hits)
+        return search, aggregations
+
+    @classmethod
+    def _restrict_scoring_function(cls, function, query):
+        """Make a scoring function apply only to works that match `query`.
+
+        :param function: A scoring function, either a ScoreFunction
+            object or a dictionary.
+        :return: A dictionary describing the restricted function.
+        """
+        if not isinstance(function, dict):
+            function = function.to_dict()
+        function = dict(function)
+        restriction = function.get('filter')
+        if restriction:
+            query = Bool(filter=[restriction, query])
+        function['filter'] = query
+        return function
+
     def count_works(self, filter):
         """Instead of retrieving works that match `filter`, count the total."""
         if filter is not None and filter.match_nothing is True:
@@ -639,6 +941,64 @@ class ExternalSearchIndex(HasSelfTests):
 
         return successes, failures
 
+    def bulk_update_availability(self, works):
+        """Update only the availability information in the search
+        documents for a batch of works.
+
+        If a work doesn't have a search document yet, it's marked as
+        needing a full reindex instead.
+
+        :return: A 2-tuple (successes, failures), as with bulk_update().
+        """
+        if not works:
+            return [], []
+
+        time1 = time.time()
+        docs = Work.to_availability_search_documents(works)
+        actions = []
+        for doc in docs:
+            work_id = doc.pop('_id')
+            actions.append(
+                dict(_op_type="update", _index=self.works_index,
+                     _type=self.work_document_type, _id=work_id, doc=doc)
+            )
+        time2 = time.time()
+
+        success_count, errors = self.bulk(
+            actions, raise_on_error=False, raise_on_exception=False,
+        )
+        time3 = time.time()
+        self.log.info(
+            "Created %i availability updates in %.2f seconds, uploaded in %.2f seconds",
+            len(actions), time2 - time1, time3 - time2
+        )
+
+        errors_by_id = dict()
+        for error in errors:
+            details = error.get('update', {})
+            error_id = details.get('_id', None)
+            if error_id is not None:
+                errors_by_id[int(error_id)] = details
+        updated_ids = set(x['_id'] for x in actions)
+
+        successes = []
+        failures = []
+        for work in works:
+            details = errors_by_id.get(work.id)
+            if details and details.get('status') == 404:
+                # There's no search document to update. Create one.
+                work.external_index_needs_updating()
+                successes.append(work)
+            elif details:
+                failures.append(
+                    (work, details.get('error', None) or "Update failed")
+                )
+            elif work.id in updated_ids:
+                successes.append(work)
+            else:
+                failures.append((work, "Work not indexed"))
+        return successes, failures
+
     def remove_work(self, work):
         """Remove the search document for `work` from the search index.
         """
@@ -729,6 +1089,275 @@ class ExternalSearchIndex(HasSelfTests):
         )
 
 
+class SearchResultCache(object):
+    """Remember the results of recent searches, so that popular
+    searches don't have to go to Elasticsearch every time.
+
+    Results are keyed by a hash of the Elasticsearch query document,
+    so two searches share a cache entry exactly when they would send
+    the same query to the same index.
+
+    Only the parts of a search result that are needed to build a feed
+    (the work ID, the script fields, and the sort values used for
+    pagination) are kept. They are stored as plain data, so the
+    backend may be anything that can store JSON-like objects --
+    an in-process LRUCache, or a client for an external key-value
+    store.
+    """
+
+    DEFAULT_TTL = 60
+
+    def __init__(self, backend=None, ttl=DEFAULT_TTL):
+        """Constructor.
+
+        :param backend: An object with `get(key)`, `set(key, value, ttl)`
+            and `clear()` methods. By default, an in-process LRUCache
+            is used.
+        :param ttl: Search results will be reused for this many seconds.
+        """
+        if backend is None:
+            backend = LRUCache()
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def key(cls, alias, index, search):
+        """Calculate the cache key for an Elasticsearch search.
+
+        :param alias: The name of the alias being searched.
+        :param index: The name of the index the alias points to.
+        :param search: An elasticsearch-dsl Search object.
+        """
+        document = json.dumps(
+            [alias, index, search.to_dict()], sort_keys=True, default=unicode
+        )
+        return hashlib.sha1(document).hexdigest()
+
+    @classmethod
+    def serialize(cls, results):
+        """Turn a list of Hit objects into plain data."""
+        return [
+            dict(meta=hit.meta.to_dict(), source=hit.to_dict())
+            for hit in results
+        ]
+
+    @classmethod
+    def deserialize(cls, data):
+        """Turn the output of serialize() back into a list of Hit
+        objects.
+        """
+        hits = []
+        for item in data:
+            document = dict(
+                ("_" + k, v) for k, v in item['meta'].items()
+            )
+            document['_source'] = item['source']
+            hits.append(Hit(document))
+        return hits
+
+    def get(self, key):
+        """Look up the results of a search.
+
+        :return: A list of Hit objects, or None if the search
+            results are not cached.
+        """
+        data = self.backend.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.deserialize(data)
+
+    @classmethod
+    def is_complete(cls, response):
+        """Is this a complete set of search results?
+
+        A search that timed out, or that failed on some shards, may be
+        missing results. Caching it would keep serving the incomplete
+        results after Elasticsearch has recovered.
+
+        :param response: An elasticsearch-dsl Response.
+        """
+        data = response.to_dict()
+        shards = data.get('_shards') or {}
+        return not data.get('timed_out') and not shards.get('failed')
+
+    def set(self, key, results):
+        """Cache the results of a search."""
+        self.backend.set(key, self.serialize(results), self.ttl)
+
+    def clear(self):
+        """Forget all cached search results."""
+        self.backend.clear()
+
+    @property
+    def stats(self):
+        """Describe how well the cache is working."""
+        lookups = self.hits + self.misses
+        if lookups:
+            hit_rate = float(self.hits) / lookups
+        else:
+            hit_rate = None
+        return dict(hits=self.hits, misses=self.misses, hit_rate=hit_rate)
+
+
+class SearchProfiler(object):
+    """Gather information about the searches sent to Elasticsearch,
+    so that slow searches can be tracked down.
+
+    Every search that's actually sent to Elasticsearch is turned into
+    a 'search report' -- a dictionary describing the search and how
+    long it took. The most recent reports are kept in memory. Reports
+    for slow searches, searches that failed on some shards, and
+    searches that were profiled are also logged as JSON, so they can
+    be summarized later by SearchReportScript.
+    """
+
+    # Every logged search report starts with this message.
+    LOG_MESSAGE = "Elasticsearch search report: "
+
+    def __init__(self, slow_query_threshold=None, sample_rate=0,
+                 max_reports=100):
+        """Constructor.
+
+        :param slow_query_threshold: Log every search that takes
+            Elasticsearch at least this many milliseconds.
+        :param sample_rate: Run this proportion of searches with
+            Elasticsearch's profiler turned on, and log the profile.
+        :param max_reports: Keep this many recent search reports in
+            memory.
+        """
+        self.slow_query_threshold = slow_query_threshold
+        self.sample_rate = sample_rate
+        self.reports = deque(maxlen=max_reports)
+        self.log = logging.getLogger("Search profiler")
+
+    def random(self):
+        """Pick a random number. This method exists so it can be mocked."""
+        return random.random()
+
+    def should_profile(self):
+        """Should the next search be profiled?"""
+        return bool(self.sample_rate) and self.random() < self.sample_rate
+
+    @classmethod
+    def fingerprint(cls, search):
+        """Identify the structure of a search, ignoring the specific
+        values being searched for.
+
+        Two searches for different query strings, or two different
+        pages of the same lane, will usually have the same fingerprint.
+
+        :param search: An elasticsearch-dsl Search object.
+        """
+        def shape(value):
+            if isinstance(value, dict):
+                return dict((k, shape(v)) for k, v in value.items())
+            if isinstance(value, (list, tuple)):
+                shapes = [shape(x) for x in value]
+                if all(x == "?" for x in shapes):
+                    # A list of values, e.g. collection IDs, has the
+                    # same shape no matter how long it is.
+                    return ["?"]
+                return shapes
+            return "?"
+        search = search.to_dict()
+
+        # Profiling doesn't change what's being searched for.
+        search.pop('profile', None)
+        document = json.dumps(shape(search), sort_keys=True)
+        return hashlib.sha1(document).hexdigest()[:16]
+
+    def record(self, search, response, client_time, query_string=None,
+               searches_in_request=1, lane_id=None, facets=None):
+        """Create a search report for a search that was just run,
+        and log it if necessary.
+
+        :param search: The elasticsearch-dsl Search object that was run.
+        :param response: The elasticsearch-dsl Response for the search.
+        :param client_time: The number of seconds between sending the
+            request and receiving the response.
+        :param query_string: The query string, if any, being searched for.
+        :param searches_in_request: The number of searches sent to
+            Elasticsearch in the same request. `client_time` covers all
+            of them.
+        :param lane_id: The ID of the Lane being searched, or a list of
+            IDs for a grouped search that covers several lanes.
+        :param facets: The query string for the facet settings in use.
+        :return: The search report.
+        """
+        data = response.to_dict()
+        shards = data.get('_shards') or {}
+        hits = data.get('hits') or {}
+        report = dict(
+            fingerprint=self.fingerprint(search),
+            query_string=query_string,
+            lane_id=lane_id,
+            facets=facets,
+            took_ms=data.get('took'),
+            client_ms=int(client_time * 1000),
+            searches_in_request=searches_in_request,
+            total_hits=hits.get('total'),
+            hits_returned=len(hits.get('hits') or []),
+            shards_failed=shards.get('failed', 0),
+            timed_out=data.get('timed_out', False),
+        )
+        if shards.get('failures'):
+            report['shard_failures'] = [
+                (failure.get('reason') or {}).get('reason')
+                for failure in shards['failures']
+            ]
+        if 'profile' in data:
+            report['profile'] = data['profile']
+
+        threshold = self.slow_query_threshold
+        report['slow'] = bool(
+            threshold and report['took_ms'] is not None
+            and report['took_ms'] >= threshold
+        )
+        self.reports.append(report)
+
+        if report['slow'] or report['shards_failed'] or report['timed_out']:
+            level = logging.WARN
+        elif 'profile' in report:
+            level = logging.INFO
+        else:
+            level = None
+        if level:
+            self.log.log(level, self.LOG_MESSAGE + "%s", json.dumps(
+                report, sort_keys=True
+            ))
+        return report
+
+    @classmethod
+    def parse_log_line(cls, line):
+        """Find the search report in a line from a log file.
+
+        :param line: A line of text, possibly from a file of JSON log
+            records.
+        :return: A search report, or None if the line doesn't contain one.
+        """
+        if cls.LOG_MESSAGE not in line:
+            return None
+        try:
+            record = json.loads(line)
+            if isinstance(record, dict) and 'message' in record:
+                # This line was written by a JSONFormatter.
+                line = record['message']
+        except ValueError:
+            # This line was written by some other formatter.
+            pass
+        index = line.find(cls.LOG_MESSAGE)
+        if index == -1:
+            return None
+        try:
+            return json.loads(line[index+len(cls.LOG_MESSAGE):])
+        except ValueError:
+            return None
+
+
 class MappingDocument(object):
     """This class knows a lot about how the 'properties' section of an
     Elasticsearch mapping document (or one of its subdocuments) is
@@ -1408,6 +2037,18 @@ class Query(SearchBase):
     # a class-level instance.
     SPELLCHECKER = SpellChecker()
 
+    # Building the Elasticsearch-DSL query for a query string means
+    # running the QueryParser and generating dozens of hypotheses,
+    # but the result depends only on the query string. Keep the
+    # queries built for recent query strings around, so that popular
+    # searches don't have to be rebuilt every time. Set this to None
+    # to disable the cache.
+    QUERY_CACHE = LRUCache(max_size=5000)
+
+    # Spellchecking is also relatively slow, so remember which
+    # recently seen sets of words passed spellcheck.
+    SPELLCHECK_CACHE = LRUCache(max_size=5000)
+
     def __init__(self, query_string, filter=None, use_query_parser=True):
         """Store a query string and filter.
 
@@ -1422,7 +2063,7 @@ class Query(SearchBase):
             build a subquery from the _remaining_ portion of a larger
             query string?
         """
-        self.query_string = query_string or ""
+        self.query_string = self.normalize_query_string(query_string)
         self.filter = filter
         self.use_query_parser = use_query_parser
 
@@ -1450,7 +2091,7 @@ class Query(SearchBase):
         # Depending on the query, the stregnth of a fuzzy hypothesis
         # may be reduced even further -- that's determined here.
         if self.words:
-            if self.SPELLCHECKER.unknown(self.words):
+            if self.spellcheck_failed(self.words):
                 # Spell check failed. This is the default behavior, if
                 # only because peoples' names will generally fail spell
                 # check. Fuzzy queries will be given their full weight.
@@ -1469,6 +2110,29 @@ class Query(SearchBase):
             # run the 'fuzzy' hypotheses at all.
             self.fuzzy_coefficient = 0
 
+    @classmethod
+    def normalize_query_string(cls, query_string):
+        """Normalize a query string so that insignificant differences
+        (leading, trailing, and repeated whitespace) don't stop two
+        searches from sharing a cached query.
+        """
+        if not query_string:
+            return ""
+        return " ".join(query_string.split())
+
+    @classmethod
+    def spellcheck_failed(cls, words):
+        """Do any of these words fail spellcheck?
+
+        :param words: A list of words.
+        """
+        key = tuple(word.lower() for word in words)
+        failed = cls.SPELLCHECK_CACHE.get(key)
+        if failed is None:
+            failed = bool(cls.SPELLCHECKER.unknown(words))
+            cls.SPELLCHECK_CACHE.set(key, failed)
+        return failed
+
     def build(self, elasticsearch, pagination=None):
         """Make an Elasticsearch-DSL Search object out of this query.
 
@@ -1552,6 +2216,26 @@ class Query(SearchBase):
 
     @property
     def elasticsearch_query(self):
+        """Build an Elasticsearch-DSL Query object for this query string,
+        or find one built earlier for the same query string.
+
+        The return value may be shared with other Query objects, so it
+        must not be modified.
+        """
+        cache = self.QUERY_CACHE
+        if cache is None:
+            return self._build_elasticsearch_query()
+
+        # Subclasses may build queries differently, so the class is
+        # part of the cache key.
+        key = (self.__class__, self.use_query_parser, self.query_string)
+        query = cache.get(key)
+        if query is None:
+            query = self._build_elasticsearch_query()
+            cache.set(key, query)
+        return query
+
+    def _build_elasticsearch_query(self):
         """Build an Elasticsearch-DSL Query object for this query string."""
 
         # The query will most likely be a dis_max query, which tests a
@@ -2124,13 +2808,63 @@ class Filter(SearchBase):
         Contributor.DIRECTOR_ROLE, Contributor.ACTOR_ROLE
     ]
 
+    # Building the part of a Filter that comes from a Lane requires a
+    # number of database queries. When asked, we keep the results
+    # around until the site configuration changes.
+    WORKLIST_TEMPLATE_CACHE = LRUCache(max_size=5000)
+
+    # We'll check the database for site configuration changes made by
+    # other processes at most this often (in seconds).
+    CONFIGURATION_CHECK_INTERVAL = 1
+
     @classmethod
-    def from_worklist(cls, _db, worklist, facets):
+    def from_worklist(cls, _db, worklist, facets, cache=False):
         """Create a Filter that finds only works that belong in the given
         WorkList and EntryPoint.
 
         :param worklist: A WorkList
         :param facets: A SearchFacets object.
+        :param cache: If this is True and `worklist` is a Lane,
+            information obtained from the database about the Lane and
+            its parents will be reused until the site configuration
+            changes. Changes to the Lane that haven't been written to
+            the database will be ignored. Lanes that get their
+            CustomLists from a DataSource are never cached, since
+            creating a CustomList doesn't change the site
+            configuration.
+        """
+        key = None
+        template = None
+        if (cache and isinstance(worklist, Lane) and worklist.id
+            and not any(x.list_datasource_id for x in worklist.hierarchy)):
+            last_update = Configuration.site_configuration_last_update(
+                _db, timeout=cls.CONFIGURATION_CHECK_INTERVAL
+            )
+            key = (worklist.id, last_update)
+            template = cls.WORKLIST_TEMPLATE_CACHE.get(key)
+        if template is None:
+            template = cls.worklist_template(_db, worklist)
+            if key:
+                cls.WORKLIST_TEMPLATE_CACHE.set(key, template)
+
+        args, kwargs = template
+        if key:
+            # The Filter may modify the lists it's given, so don't
+            # give it the cached copies.
+            args, kwargs = copy.deepcopy(template)
+        filter = cls(*args, facets=facets, **kwargs)
+        if isinstance(worklist, Lane):
+            filter.lane_id = worklist.id
+        return filter
+
+    @classmethod
+    def worklist_template(cls, _db, worklist):
+        """Gather the information about a WorkList needed to create a
+        Filter for it.
+
+        :return: A 2-tuple (args, kwargs) of arguments to the Filter
+            constructor. These contain no database objects, so they can
+            be stored and reused.
         """
         library = worklist.get_library(_db)
         # For most configuration settings there is a single value --
@@ -2141,7 +2875,12 @@ class Filter(SearchBase):
         fiction = inherit_one('fiction')
         audiences = inherit_one('audiences')
         target_age = inherit_one('target_age')
-        collections = inherit_one('collection_ids') or library
+        collections = inherit_one('collection_ids')
+        if not collections:
+            if library:
+                collections = [x.id for x in library.collections]
+            else:
+                collections = None
 
         license_datasource_id = inherit_one('license_datasource_id')
 
@@ -2149,8 +2888,12 @@ class Filter(SearchBase):
         # set of restrictions from every item in the WorkList hierarchy.
         # _All_ restrictions must be met for a work to match the filter.
         inherit_some = worklist.inherited_values
-        genre_id_restrictions = inherit_some('genre_ids')
-        customlist_id_restrictions = inherit_some('customlist_ids')
+        genre_id_restrictions = [
+            cls._filter_ids(x) for x in inherit_some('genre_ids')
+        ]
+        customlist_id_restrictions = [
+            cls._filter_ids(x) for x in inherit_some('customlist_ids')
+        ]
 
         # See if there are any excluded audiobook sources on this
         # site.
@@ -2164,13 +2907,20 @@ class Filter(SearchBase):
             allow_holds = True
         else:
             allow_holds = library.allow_holds
-        return cls(
+        if target_age and not isinstance(target_age, (int, tuple)):
+            # It's a SQLAlchemy range object. Convert it to a tuple.
+            target_age = numericrange_to_tuple(target_age)
+        args = (
             collections, media, languages, fiction, audiences,
-            target_age, genre_id_restrictions, customlist_id_restrictions,
-            facets,
-            excluded_audiobook_data_sources=excluded_audiobook_data_sources,
+            target_age, genre_id_restrictions, customlist_id_restrictions
+        )
+        kwargs = dict(
+            excluded_audiobook_data_sources=cls._filter_ids(
+                excluded_audiobook_data_sources
+            ),
             allow_holds=allow_holds, license_datasource=license_datasource_id
         )
+        return args, kwargs
 
     def __init__(self, collections=None, media=None, languages=None,
                  fiction=None, audiences=None, target_age=None,
@@ -2328,6 +3078,11 @@ class Filter(SearchBase):
 
         self.script_fields = script_fields or dict()
 
+        # Remember which lane and facet settings this Filter was made
+        # for, so search reports can say where a search came from.
+        self.lane_id = None
+        self.facets = getattr(facets, 'query_string', None)
+
         # Give the Facets object a chance to modify any or all of this
         # information.
         if facets:
@@ -2560,6 +3315,27 @@ class Filter(SearchBase):
 
         return f, nested_filters
 
+    def to_query(self):
+        """Convert this object to a single Elasticsearch-DSL Query
+        object, with any nested filters turned into nested queries.
+
+        This is useful when a Filter needs to be used somewhere other
+        than as the filter for an entire search -- for instance, as
+        one of the buckets in a 'filters' aggregation.
+        """
+        base_filter, nested_filters = self.build()
+        clauses = []
+        if base_filter:
+            clauses.append(base_filter)
+        for path, subfilters in nested_filters.items():
+            for subfilter in subfilters:
+                clauses.append(
+                    Nested(path=path, query=Bool(filter=subfilter))
+                )
+        if not clauses:
+            return MatchAll()
+        return Bool(filter=clauses)
+
     @classmethod
     def universal_base_filter(cls, _chain_filters=None):
         """Build a set of restrictions on the main search document that are
@@ -3208,13 +3984,33 @@ class MockExternalSearchIndex(ExternalSearchIndex):
         for (query_string, filter, pagination) in queries:
             yield self.query_works(query_string, filter, pagination, debug)
 
+    def query_works_grouped(self, filters, pagination, debug=False):
+        # As with query_works_multi, implement this by calling
+        # query_works once per filter.
+        return [
+            self.query_works(None, filter, pagination, debug)
+            for filter in filters
+        ]
+
     def count_works(self, filter):
         return len(self.docs)
 
     def bulk(self, docs, **kwargs):
+        errors = []
         for doc in docs:
+            if doc.get('_op_type') == 'update':
+                # Apply a partial update to an existing document.
+                key = self._key(doc['_index'], doc['_type'], doc['_id'])
+                if key not in self.docs:
+                    errors.append(
+                        dict(update=dict(_id=doc['_id'], status=404,
+                                         error="document missing"))
+                    )
+                    continue
+                self.docs[key].update(doc['doc'])
+                continue
             self.index(doc['_index'], doc['_type'], doc['_id'], doc)
-        return len(docs), []
+        return len(docs) - len(errors), errors
 
 class MockMeta(dict):
     """Mock the .meta object associated with an Elasticsearch search
@@ -3265,11 +4061,18 @@ class SearchIndexCoverageProvider(WorkPresentationProvider):
             search_index_client or ExternalSearchIndex(self._db)
         )
 
+    def update_search_index(self, works):
+        """Send the search documents for some works to the search index.
+
+        :return: A 2-tuple (successes, failures).
+        """
+        return self.search_index_client.bulk_update(works)
+
     def process_batch(self, works):
         """
         :return: a mixed list of Works and CoverageFailure objects.
         """
-        successes, failures = self.search_index_client.bulk_update(works)
+        successes, failures = self.update_search_index(works)
 
         records = list(successes)
         for (work, error) in failures:
@@ -3278,3 +4081,22 @@ class SearchIndexCoverageProvider(WorkPresentationProvider):
             records.append(CoverageFailure(work, error))
 
         return records
+
+
+class SearchIndexAvailabilityCoverageProvider(SearchIndexCoverageProvider):
+    """Make sure the availability information in the search index is
+    up to date.
+
+    LicensePool availability changes far more often than anything
+    else about a Work, so these changes get their own queue, and only
+    the 'licensepools' part of the search document is updated.
+    """
+
+    SERVICE_NAME = 'Search index availability coverage provider'
+
+    DEFAULT_BATCH_SIZE = 1000
+
+    OPERATION = WorkCoverageRecord.UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION
+
+    def update_search_index(self, works):
+        return self.search_index_client.bulk_update_availability(works)
@@ -44,6 +44,7 @@ from sqlalchemy.orm import (
     joinedload,
     lazyload,
     relationship,
+    selectinload,
 )
 from sqlalchemy.sql.expression import literal
 
@@ -70,6 +71,7 @@ from model import (
     Library,
     LicensePool,
     LicensePoolDeliveryMechanism,
+    Resource,
     Session,
     Work,
     WorkGenre,
@@ -1262,6 +1264,18 @@ class WorkList(object):
     # By default, a WorkList does not draw from CustomLists
     uses_customlists = False
 
+    # If this is True, the Works found by a search will be loaded
+    # directly by ID, trusting the search index to have applied the
+    # WorkList's restrictions, rather than through a database query
+    # that applies all of those restrictions a second time.
+    HYDRATE_FROM_SEARCH_INDEX = False
+
+    # If this is True, groups() finds the featured works for all of
+    # this WorkList's sublanes with a single aggregation query, rather
+    # than one search per sublane, and loads the Works only after
+    # removing works that would be duplicated across sublanes.
+    GROUPS_BY_AGGREGATION = False
+
     def max_cache_age(self, type):
         """Determine how long a feed for this WorkList should be cached
         internally.
@@ -1825,20 +1839,20 @@ class WorkList(object):
             # be safe.
             has_script_fields = False
 
-        # The simplest way to turn Hits into Works is to create a
-        # DatabaseBackedWorkList that fetches those specific Works
-        # while applying the general availability filters.
-        #
-        # If facets were passed in, then they are used to further
-        # filter the list.
-        #
-        # TODO: There's a lot of room for improvement here, but
-        # performance isn't a big concern -- it's just ugly.
-        wl = SpecificWorkList(work_ids)
-        wl.initialize(self.get_library(_db))
-        qu = wl.works_from_database(_db, facets=facets)
         a = time.time()
-        all_works = qu.all()
+        if self.HYDRATE_FROM_SEARCH_INDEX:
+            all_works = self.works_by_id(_db, work_ids)
+        else:
+            # The simplest way to turn Hits into Works is to create a
+            # DatabaseBackedWorkList that fetches those specific Works
+            # while applying the general availability filters.
+            #
+            # If facets were passed in, then they are used to further
+            # filter the list.
+            wl = SpecificWorkList(work_ids)
+            wl.initialize(self.get_library(_db))
+            qu = wl.works_from_database(_db, facets=facets)
+            all_works = qu.all()
 
         # Create a list of lists with the same membership as the original
         # `resultsets`, but with Hit objects replaced with Work objects.
@@ -1865,6 +1879,58 @@ class WorkList(object):
         )
         return work_lists
 
+    def works_by_id(self, _db, work_ids):
+        """Load Works found by the search index, for use in an OPDS feed.
+
+        Unlike works_from_database(), this doesn't re-apply the
+        WorkList's bibliographic restrictions or the facets -- the
+        search index has already done that. The Works are looked up by
+        primary key and the objects needed to build their OPDS entries
+        are loaded in a small number of separate queries, rather than
+        through one query that joins them all together.
+
+        The only restriction applied here is the one the search index
+        can't apply: a Work is only returned if one of its
+        LicensePools in this WorkList's collections has some way of
+        delivering the book.
+
+        :return: A list of Works, in no particular order.
+        """
+        if not work_ids:
+            return []
+        LPDM = LicensePoolDeliveryMechanism
+        delivery_mechanisms = selectinload(
+            Work.license_pools
+        ).joinedload(LicensePool.delivery_mechanisms)
+        qu = _db.query(Work).filter(
+            Work.id.in_(work_ids)
+        ).options(
+            joinedload(Work.presentation_edition),
+            selectinload(Work.license_pools).joinedload(
+                LicensePool.identifier
+            ),
+            delivery_mechanisms.joinedload(LPDM.delivery_mechanism),
+            delivery_mechanisms.joinedload(LPDM.resource).joinedload(
+                Resource.representation
+            ),
+        )
+        qu = DatabaseBackedWorkList._defer_unused_fields(qu)
+
+        collection_ids = self.collection_ids
+        if collection_ids is not None:
+            collection_ids = set(collection_ids)
+        works = []
+        for work in qu:
+            for pool in work.license_pools:
+                if pool.superceded or not pool.delivery_mechanisms:
+                    continue
+                if (collection_ids is not None
+                    and pool.collection_id not in collection_ids):
+                    continue
+                works.append(work)
+                break
+        return works
+
     @property
     def search_target(self):
         """By default, a WorkList is searchable."""
@@ -1955,13 +2021,54 @@ class WorkList(object):
             parent_lane = None
 
         queryable_lane_set = set(queryable_lanes)
-        works_and_lanes = list(
-            self._featured_works_with_lanes(
-                _db, queryable_lanes, pagination=pagination,
+        if self.GROUPS_BY_AGGREGATION:
+            by_lane = self._featured_works_by_aggregation(
+                _db, queryable_lanes, target_size, pagination=pagination,
                 facets=facets, search_engine=search_engine, debug=debug
             )
-        )
+        else:
+            works_and_lanes = list(
+                self._featured_works_with_lanes(
+                    _db, queryable_lanes, pagination=pagination,
+                    facets=facets, search_engine=search_engine, debug=debug
+                )
+            )
+            by_lane = self._fill_groups(
+                works_and_lanes, target_size, key=lambda work: work.id
+            )
+
+        for lane in relevant_lanes:
+            if lane in queryable_lane_set:
+                # We found results for this lane through the main query.
+                # Yield those results.
+                for work in by_lane.get(lane, []):
+                    yield (work, lane)
+            else:
+                # We didn't try to use the main query to find results
+                # for this lane because we knew the results, if there
+                # were any, wouldn't be representative. This is most
+                # likely because this 'lane' is a WorkList and not a
+                # Lane at all. Do a whole separate query and plug it
+                # in at this point.
+                for x in lane.groups(
+                    _db, include_sublanes=False,
+                        pagination=pagination, facets=facets,
+                ):
+                    yield x
 
+    @classmethod
+    def _fill_groups(cls, items_and_lanes, target_size, key):
+        """Divide a sequence of featured items among lanes, avoiding
+        using the same item in two lanes unless there's no other way
+        to fill out a lane.
+
+        :param items_and_lanes: A sequence of (item, Lane) 2-tuples,
+            with all the items for a given lane grouped together.
+        :param target_size: Try to find this many items for each lane.
+        :param key: A function that identifies the Work represented
+            by an item.
+        :return: A dictionary mapping each Lane to a list of items.
+        """
         def _done_with_lane(lane):
             """Called when we're done with a Lane, either because
             the lane changes or we've reached the end of the list.
@@ -1980,7 +2087,7 @@ class WorkList(object):
         by_lane = defaultdict(list)
         working_lane = None
         might_need_to_reuse = dict()
-        for work, lane in works_and_lanes:
+        for item, lane in items_and_lanes:
             if lane != working_lane:
                 # Either we're done with the old lane, or we're just
                 # starting and there was no old lane.
@@ -1993,36 +2100,63 @@ class WorkList(object):
                 # We've already filled this lane.
                 continue
 
-            if work.id in used_works:
-                if work.id not in used_works_this_lane:
+            work_id = key(item)
+            if work_id in used_works:
+                if work_id not in used_works_this_lane:
                     # We already used this work in another lane, but we
                     # might need to use it again to fill out this lane.
-                    might_need_to_reuse[work.id] = work
+                    might_need_to_reuse[work_id] = item
             else:
-                by_lane[lane].append(work)
-                used_works.add(work.id)
-                used_works_this_lane.add(work.id)
+                by_lane[lane].append(item)
+                used_works.add(work_id)
+                used_works_this_lane.add(work_id)
 
         # Close out the last lane encountered.
         _done_with_lane(working_lane)
-        for lane in relevant_lanes:
-            if lane in queryable_lane_set:
-                # We found results for this lane through the main query.
-                # Yield those results.
-                for work in by_lane.get(lane, []):
-                    yield (work, lane)
-            else:
-                # We didn't try to use the main query to find results
-                # for this lane because we knew the results, if there
-                # were any, wouldn't be representative. This is most
-                # likely because this 'lane' is a WorkList and not a
-                # Lane at all. Do a whole separate query and plug it
-                # in at this point.
-                for x in lane.groups(
-                    _db, include_sublanes=False,
-                        pagination=pagination, facets=facets,
-                ):
-                    yield x
+        return by_lane
+
+    def _featured_works_by_aggregation(
+        self, _db, lanes, target_size, pagination, facets, search_engine,
+        debug=False
+    ):
+        """Find featured works for a number of lanes with a single
+        aggregation query.
+
+        Duplicates are removed from the search results before any
+        Works are loaded, and then the Works for all the lanes are
+        loaded at once.
+
+        :param lanes: A list of Lanes (presumably sublanes of `self`).
+        :param target_size: Try to find this many works for each lane.
+        :param pagination: A Pagination object explaining how many
+            items to ask for. This should be slightly more than
+            `target_size`, so that there's some slack to remove
+            duplicates across lanes.
+        :return: A dictionary mapping each Lane to a list of Works.
+        """
+        if not lanes:
+            return {}
+        from external_search import Filter
+        filters = []
+        for lane in lanes:
+            overview_facets = lane.overview_facets(_db, facets)
+            filters.append(
+                Filter.from_worklist(_db, lane, overview_facets, cache=True)
+            )
+        resultsets = search_engine.query_works_grouped(
+            filters, pagination, debug=debug
+        )
+        hits_and_lanes = []
+        for lane, hits in zip(lanes, resultsets):
+            for hit in hits:
+                hits_and_lanes.append((hit, lane))
+        hits_by_lane = self._fill_groups(
+            hits_and_lanes, target_size, key=lambda hit: hit.work_id
+        )
+        works = self.works_for_resultsets(
+            _db, [hits_by_lane.get(lane, []) for lane in lanes], facets=facets
+        )
+        return dict(zip(lanes, works))
 
     def _featured_works_with_lanes(
         self, _db, lanes, pagination, facets, search_engine, debug=False
@@ -2064,7 +2198,9 @@ class WorkList(object):
         for lane in lanes:
             overview_facets = lane.overview_facets(_db, facets)
             from external_search import Filter
-            filter = Filter.from_worklist(_db, lane, overview_facets)
+            filter = Filter.from_worklist(
+                _db, lane, overview_facets, cache=True
+            )
             queries.append((None, filter, pagination))
         resultsets = list(search_engine.query_works_multi(queries))
         works = self.works_for_resultsets(_db, resultsets, facets=facets)
@@ -3130,3 +3266,16 @@ def configuration_relevant_update(mapper, connection, target):
         # Remove this information whenever the Lane configuration
         # changes. This will force it to be recalculated.
         Library._has_root_lane_cache.clear()
+
+
+@event.listens_for(Lane.customlists, 'append')
+@event.listens_for(Lane.customlists, 'remove')
+def configuration_relevant_customlist_change(target, value, initiator):
+    # A Lane's CustomLists aren't one of its own columns, so changing
+    # them doesn't trigger configuration_relevant_update. But the
+    # Filter templates cached by Filter.from_worklist include them.
+    if hasattr(target, '_customlist_ids'):
+        del target._customlist_ids
+    if Session.object_session(target) is not None:
+        # A new Lane will trigger its own change when it's inserted.
+        site_configuration_has_changed(target, cooldown=0)
@@ -1,9 +1,19 @@
 
+import copy
 import datetime
 import logging
 import json
 import os
 import socket
+from Queue import (
+    Empty,
+    Full,
+    Queue,
+)
+from threading import (
+    Thread,
+    current_thread,
+)
 from flask_babel import lazy_gettext as _
 from config import Configuration
 from StringIO import StringIO
@@ -15,6 +25,10 @@ from model import ExternalIntegration, ConfigurationSetting
 from util.string_helpers import native_string
 
 class JSONFormatter(logging.Formatter):
+    # Every record we log is a flat dictionary of strings, so there's
+    # no need to check for circular references.
+    encoder = json.JSONEncoder(check_circular=False)
+
     hostname = socket.gethostname()
     fqdn = socket.getfqdn()
     if len(fqdn) > len(hostname):
@@ -61,11 +75,21 @@ class JSONFormatter(logging.Formatter):
             level=record.levelname,
             filename=record.filename,
             message=message,
-            timestamp=datetime.datetime.utcnow().isoformat()
+            # The record may be formatted some time after it was
+            # created, e.g. by a QueueHandler's background thread, so
+            # use the time the record was created rather than the
+            # current time.
+            timestamp=datetime.datetime.utcfromtimestamp(
+                record.created
+            ).isoformat()
         )
         if record.exc_info:
             data['traceback'] = self.formatException(record.exc_info)
-        return json.dumps(data)
+        elif record.exc_text:
+            # The traceback was formatted ahead of time, e.g. by a
+            # QueueHandler.
+            data['traceback'] = record.exc_text
+        return self.encoder.encode(data)
 
 
 class StringFormatter(logging.Formatter):
@@ -79,6 +103,177 @@ class StringFormatter(logging.Formatter):
         return native_string(data)
 
 
+class QueueHandler(logging.Handler):
+    """A log handler that puts records in a bounded queue and lets a
+    background thread pass them on to other handlers.
+
+    This moves the cost of formatting log records and of sending them
+    to a (possibly slow) log sink off of the thread that's doing the
+    actual work. Like any other handler, a QueueHandler is closed by
+    logging.shutdown() when the process exits, so records still in the
+    queue at that point are not lost.
+    """
+
+    # What to do with a new record when the queue is full.
+    DROP_NEWEST = 'drop_newest'
+    DROP_OLDEST = 'drop_oldest'
+    BLOCK = 'block'
+    OVERFLOW_POLICIES = [DROP_NEWEST, DROP_OLDEST, BLOCK]
+
+    DEFAULT_CAPACITY = 10000
+
+    # Put on the queue to tell the background thread to stop.
+    _STOP = object()
+
+    # Formats tracebacks before records are put on the queue.
+    _exception_formatter = logging.Formatter()
+
+    def __init__(self, handlers, capacity=DEFAULT_CAPACITY,
+                 overflow_policy=DROP_NEWEST):
+        """Constructor.
+
+        :param handlers: The log handlers that will actually process
+            the records, in the background thread.
+        :param capacity: The maximum number of records to hold in the
+            queue.
+        :param overflow_policy: One of OVERFLOW_POLICIES.
+        """
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(
+                "Unknown overflow policy: %s" % overflow_policy
+            )
+        super(QueueHandler, self).__init__()
+        self.handlers = list(handlers)
+        self.overflow_policy = overflow_policy
+        self.queue = Queue(maxsize=capacity)
+
+        # Counters for records that went into the queue, records
+        # that were dropped because the queue was full, and records
+        # that were processed by the background thread.
+        self.queued = 0
+        self.dropped = 0
+        self.handled = 0
+
+        self._thread = Thread(target=self._monitor, name="log-queue")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prepare(self, record):
+        """Make a copy of `record` that's safe to handle on the
+        background thread.
+
+        The message is interpolated and the traceback formatted right
+        away, so the background thread never has to look at the
+        arguments or the exception. They may be objects (e.g. database
+        objects) that aren't safe to use from another thread, or that
+        will have changed by the time the record is handled.
+        """
+        # As in JSONFormatter, strings are converted to native strings
+        # so that mixing Unicode and bytestrings doesn't fail.
+        message = native_string(record.msg)
+        args = record.args
+        if isinstance(args, tuple):
+            args = tuple(
+                native_string(x) if isinstance(x, (bytes, unicode)) else x
+                for x in args
+            )
+        if args:
+            try:
+                message = message % args
+            except Exception, e:
+                message = "Log message could not be formatted. Exception: %r. Original message: message=%r args=%r" % (
+                    e, message, args
+                )
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = self._exception_formatter.formatException(
+                record.exc_info
+            )
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+    def emit(self, record):
+        """Put a record in the queue for the background thread to
+        handle.
+
+        Called with this handler's lock held, so the counters don't
+        need any additional locking.
+        """
+        try:
+            record = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        policy = self.overflow_policy
+        if policy == self.BLOCK and current_thread() is self._thread:
+            # One of the real handlers logged something. The
+            # background thread can't wait for itself to make room
+            # in the queue.
+            policy = self.DROP_NEWEST
+
+        if policy == self.BLOCK:
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except Full:
+                self.dropped += 1
+                if policy == self.DROP_NEWEST:
+                    return
+                # Make room by throwing out the oldest record.
+                try:
+                    self.queue.get_nowait()
+                except Empty:
+                    pass
+                try:
+                    self.queue.put_nowait(record)
+                except Full:
+                    return
+        self.queued += 1
+
+    def _monitor(self):
+        """Pass records from the queue to the real handlers until
+        told to stop.
+        """
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        handler.handleError(record)
+            self.handled += 1
+
+    @property
+    def stats(self):
+        """Summarize the state of the queue."""
+        return dict(
+            queued=self.queued, dropped=self.dropped,
+            handled=self.handled, pending=self.queue.qsize(),
+        )
+
+    def close(self):
+        """Handle any records still in the queue, then stop the
+        background thread and close the real handlers.
+        """
+        if self._thread.is_alive():
+            # This bypasses the overflow policy: we're willing to
+            # wait for the background thread to make room.
+            self.queue.put(self._STOP)
+            self._thread.join()
+            for handler in self.handlers:
+                handler.close()
+        super(QueueHandler, self).close()
+
+
 class Logger(object):
     """Abstract base class for logging"""
 
@@ -397,6 +592,8 @@ class LogConfiguration(object):
     # Settings for the integration with protocol=INTERNAL_LOGGING
     LOG_LEVEL = 'log_level'
     DATABASE_LOG_LEVEL = 'database_log_level'
+    LOG_QUEUE_SIZE = 'log_queue_size'
+    LOG_QUEUE_OVERFLOW = 'log_queue_overflow'
     LOG_LEVEL_UI = [
         { "key": DEBUG, "value": _("Debug") },
         { "key": INFO, "value": _("Info") },
@@ -417,6 +614,20 @@ class LogConfiguration(object):
           "description": _("Database logs are extremely verbose, so unless you're diagnosing a database-related problem, it's a good idea to set a higher log level for database messages."),
           "default": WARN,
         },
+        { "key": LOG_QUEUE_SIZE, "label": _("Log Queue Size"),
+          "type": "number",
+          "description": _("If this is set, log messages will be formatted and sent to the log destinations by a background thread, so a slow log destination won't slow down the application. This is the maximum number of log messages that can be waiting to be sent."),
+        },
+        { "key": LOG_QUEUE_OVERFLOW, "label": _("Log Queue Overflow"),
+          "type": "select",
+          "options": [
+              { "key": QueueHandler.DROP_NEWEST, "label": _("Drop the newest message") },
+              { "key": QueueHandler.DROP_OLDEST, "label": _("Drop the oldest message") },
+              { "key": QueueHandler.BLOCK, "label": _("Wait until there is room") },
+          ],
+          "description": _("What to do with a new log message when the log queue is full."),
+          "default": QueueHandler.DROP_NEWEST,
+        },
     ]
 
     @classmethod
@@ -432,6 +643,10 @@ class LogConfiguration(object):
         log_level, database_log_level, new_handlers, errors = (
             cls.from_configuration(_db, testing)
         )
+        new_handlers, queue_errors = cls.queue_handlers(
+            _db, new_handlers, testing
+        )
+        errors.extend(queue_errors)
 
         # Replace the set of handlers associated with the root logger.
         logger = logging.getLogger()
@@ -442,6 +657,10 @@ class LogConfiguration(object):
             handler.setLevel(log_level)
         for handler in old_handlers:
             logger.removeHandler(handler)
+            if isinstance(handler, QueueHandler):
+                # Flush any records still waiting to be written and
+                # stop the background thread.
+                handler.close()
 
         # Set the loggers for various verbose libraries to the database
         # log level, which is probably higher than the normal log level.
@@ -517,3 +736,30 @@ class LogConfiguration(object):
                 )
 
         return log_level, database_log_level, handlers, errors
+
+    @classmethod
+    def queue_handlers(cls, _db, handlers, testing=False):
+        """If a log queue is configured in the database, wrap
+        `handlers` in a single QueueHandler so their work happens in a
+        background thread.
+
+        :return: A 2-tuple (handlers, errors).
+        """
+        if not _db or testing or not handlers:
+            return handlers, []
+
+        queue_size = ConfigurationSetting.sitewide(
+            _db, cls.LOG_QUEUE_SIZE
+        ).int_value
+        if not queue_size or queue_size <= 0:
+            return handlers, []
+
+        overflow_policy = (
+            ConfigurationSetting.sitewide(_db, cls.LOG_QUEUE_OVERFLOW).value
+            or QueueHandler.DROP_NEWEST
+        )
+        try:
+            return [QueueHandler(handlers, queue_size, overflow_policy)], []
+        except ValueError, e:
+            # Fall back to handling log records on the current thread.
+            return handlers, ["Error creating log queue %s" % unicode(e)]
@@ -18,16 +18,21 @@ from sqlalchemy.orm.exc import (
 from sqlalchemy.orm import aliased
 import csv
 import datetime
+import functools
 import logging
 import re
+import time
+from io import BytesIO
 
+from concurrent.futures import ProcessPoolExecutor
 from pymarc import MARCReader
 
 from classifier import Classifier
-from util import LanguageCodes
+from util import LanguageCodes, batch_lazily
 from util.http import RemoteIntegrationException
 from util.personal_names import name_tidy
 from util.median import median
+from util.worker_pools import bounded_map
 from model import (
     get_one,
     get_one_or_create,
@@ -46,6 +51,7 @@ from model import (
     LicensePool,
     LicensePoolDeliveryMechanism,
     LinkRelations,
+    LookupCache,
     Subject,
     Hyperlink,
     PresentationCalculationPolicy,
@@ -78,7 +84,8 @@ class ReplacementPolicy(object):
             analytics=None,
             http_get=None,
             even_if_not_apparently_updated=False,
-            presentation_calculation_policy=None
+            presentation_calculation_policy=None,
+            thumbnail_processes=0,
     ):
         self.identifiers = identifiers
         self.subjects = subjects
@@ -96,6 +103,9 @@ class ReplacementPolicy(object):
             presentation_calculation_policy or
             PresentationCalculationPolicy()
         )
+        # The number of worker processes to use when scaling down
+        # cover images. See Representation.scale_batch.
+        self.thumbnail_processes = thumbnail_processes
 
     @classmethod
     def from_license_source(cls, _db, **args):
@@ -432,6 +442,20 @@ class ContributorData(object):
     ):
         response = metadata_client.canonicalize_author_name(
             identifier_obj, self.display_name)
+        return self._sort_name_from_canonicalizer_response(
+            response, identifier_obj, self.display_name
+        )
+
+    @classmethod
+    def _sort_name_from_canonicalizer_response(
+            cls, response, identifier_obj, display_name
+    ):
+        """Extract a sort name from the metadata wrangler's response
+        to an author name canonicalization request.
+
+        :return: The sort name, or None if the canonicalizer couldn't
+            find one.
+        """
         sort_name = None
 
         if isinstance(response, basestring):
@@ -443,12 +467,12 @@ class ContributorData(object):
                 sort_name = response.content
                 log.info(
                     "Canonicalizer found sort name for %r: %s => %s",
-                    identifier_obj, self.display_name, sort_name
+                    identifier_obj, display_name, sort_name
                 )
             else:
                 log.warn(
                     "Canonicalizer could not find sort name for %r/%s",
-                    identifier_obj, self.display_name
+                    identifier_obj, display_name
                 )
         return sort_name
 
@@ -708,12 +732,18 @@ class MetaToModelUtility(object):
 
     log = logging.getLogger("Abstract metadata layer - mirror code")
 
-    def mirror_link(self, model_object, data_source, link, link_obj, policy):
+    def mirror_link(self, model_object, data_source, link, link_obj, policy,
+                    thumbnails=None):
         """Retrieve a copy of the given link and make sure it gets
         mirrored. If it's a full-size image, create a thumbnail and
         mirror that too.
 
         The model_object can be either a pool or an edition.
+
+        :param thumbnails: If this is a list, a thumbnail is not
+            created right away. Instead, the information necessary to
+            create it is appended to the list, so the caller can
+            create a lot of thumbnails at once with make_thumbnails().
         """
         if link_obj.rel not in Hyperlink.MIRRORED:
             # we only host locally open-source epubs and cover images
@@ -888,17 +918,11 @@ class MetaToModelUtility(object):
                 data_source, identifier, thumbnail_filename,
                 Edition.MAX_THUMBNAIL_HEIGHT
             )
-            thumbnail, is_new = representation.scale(
-                max_height=Edition.MAX_THUMBNAIL_HEIGHT,
-                max_width=Edition.MAX_THUMBNAIL_WIDTH,
-                destination_url=thumbnail_url,
-                destination_media_type=Representation.PNG_MEDIA_TYPE,
-                force=True
-            )
-            if is_new:
-                # A thumbnail was created distinct from the original
-                # image. Mirror it as well.
-                mirror.mirror_one(thumbnail, mirror_to=thumbnail_url, collection=collection)
+            thumbnail = (representation, thumbnail_url, mirror, collection)
+            if thumbnails is None:
+                self.make_thumbnails([thumbnail], policy)
+            else:
+                thumbnails.append(thumbnail)
 
         if link_obj.rel in Hyperlink.SELF_HOSTED_BOOKS:
             # If we mirrored book content successfully, remove it from
@@ -907,6 +931,39 @@ class MetaToModelUtility(object):
             if representation.mirrored_at and not representation.mirror_exception:
                 representation.content = None
 
+    def make_thumbnails(self, thumbnails, policy):
+        """Scale down a number of full-size images and mirror the
+        thumbnails.
+
+        The images are scaled using policy.thumbnail_processes
+        worker processes.
+
+        :param thumbnails: A list of 4-tuples (representation,
+            thumbnail_url, mirror, collection), as gathered by
+            mirror_link().
+        """
+        if not thumbnails:
+            return
+        requests = [
+            (representation, thumbnail_url, Representation.PNG_MEDIA_TYPE)
+            for representation, thumbnail_url, mirror, collection
+            in thumbnails
+        ]
+        results = Representation.scale_batch(
+            requests,
+            max_height=Edition.MAX_THUMBNAIL_HEIGHT,
+            max_width=Edition.MAX_THUMBNAIL_WIDTH,
+            force=True, processes=policy.thumbnail_processes
+        )
+        for (representation, thumbnail_url, mirror, collection), (
+                thumbnail, is_new, stats) in zip(thumbnails, results):
+            if is_new:
+                # A thumbnail was created distinct from the original
+                # image. Mirror it as well.
+                mirror.mirror_one(
+                    thumbnail, mirror_to=thumbnail_url, collection=collection
+                )
+
 
 class CirculationData(MetaToModelUtility):
     """Information about actual copies of a book that can be delivered to
@@ -1600,6 +1657,130 @@ class Metadata(MetaToModelUtility):
             create_if_not_exists=create_if_not_exists
         )
 
+    @classmethod
+    def find_sort_names(cls, _db, metadatas, metadata_client):
+        """Find sort names for the primary authors of `metadatas` that
+        don't have one, asking the metadata wrangler about all of them
+        at once rather than one at a time during apply().
+
+        Each author is looked up by the first ISBN of their book, if
+        there is one. If the canonicalizer can't find a sort name,
+        one is guessed from the display name, as find_sort_name()
+        would eventually do. If the request itself fails, the author
+        is left for find_sort_name() to deal with.
+        """
+        canonicalize = getattr(
+            metadata_client, 'canonicalize_author_names', None
+        )
+        if not canonicalize:
+            return
+
+        # Several books may have the same author.
+        authors = defaultdict(list)
+        for metadata in metadatas:
+            author = metadata.primary_author
+            if not author or author.sort_name or not author.display_name:
+                continue
+            sort_name = author.display_name_to_sort_name_from_existing_contributor(
+                _db, author.display_name
+            )
+            if sort_name:
+                author.sort_name = sort_name
+                continue
+            identifier_obj = None
+            for identifier in metadata.identifiers:
+                if identifier.type == Identifier.ISBN:
+                    identifier_obj, ignore = identifier.load(_db)
+                    break
+            authors[(identifier_obj, author.display_name)].append(author)
+        if not authors:
+            return
+
+        log = logging.getLogger("Abstract metadata layer")
+        for key, response in canonicalize(authors.keys()):
+            identifier_obj, display_name = key
+            if isinstance(response, Exception):
+                log.error(
+                    "Metadata client exception while determining sort name for %s",
+                    display_name, exc_info=response
+                )
+                continue
+            sort_name = (
+                ContributorData._sort_name_from_canonicalizer_response(
+                    response, identifier_obj, display_name
+                ) or display_name_to_sort_name(display_name)
+            )
+            for author in authors[key]:
+                author.sort_name = sort_name
+
+    @classmethod
+    def prepare_to_apply(cls, _db, metadatas):
+        """Find or create, in a handful of set-based queries, the
+        Identifiers, Editions, Subjects, Contributors and
+        CoverageRecords that apply() would otherwise look up one at a
+        time for each of `metadatas`.
+
+        This only does anything if a LookupCache is installed on `_db`
+        (see LookupCache.installed()). DataSources are already kept in
+        memory, so they don't need this treatment.
+        """
+        if LookupCache.for_session(_db) is None:
+            return
+
+        foreign_ids = set()
+        subjects = set()
+        sort_names = set()
+        for metadata in metadatas:
+            identifiers = list(metadata.identifiers)
+            if metadata.circulation and metadata.circulation._primary_identifier:
+                identifiers.append(metadata.circulation._primary_identifier)
+            for identifier in identifiers:
+                foreign_ids.add((identifier.type, identifier.identifier))
+            for subject in metadata.subjects:
+                subjects.add((subject.type, subject.identifier, subject.name))
+            for contributor in metadata.contributors:
+                # Only Contributors looked up solely by name can be
+                # prepared this way.
+                if (contributor.sort_name and not contributor.lc
+                    and not contributor.viaf):
+                    sort_names.add(contributor.sort_name)
+        Identifier.prepare_to_look_up(_db, foreign_ids)
+
+        # Group the primary identifiers by data source, so we can find
+        # the Editions and CoverageRecords for each data source at
+        # once.
+        by_data_source = defaultdict(list)
+        for metadata in metadatas:
+            if not metadata.primary_identifier:
+                continue
+            try:
+                data_source = metadata.data_source(_db)
+                result = Identifier.for_foreign_id(
+                    _db, metadata.primary_identifier.type,
+                    metadata.primary_identifier.identifier
+                )
+            except ValueError:
+                # apply() will run into the same problem and deal
+                # with it.
+                continue
+            if result:
+                identifier, ignore = result
+                by_data_source[data_source].append(identifier)
+
+        internal_processing = DataSource.lookup(
+            _db, DataSource.INTERNAL_PROCESSING
+        )
+        for data_source, identifiers in by_data_source.items():
+            Edition.prepare_to_look_up(_db, data_source, identifiers)
+            CoverageRecord.prepare_to_look_up(_db, identifiers, data_source)
+            CoverageRecord.prepare_to_look_up(
+                _db, identifiers, internal_processing,
+                operation=CoverageRecord.METADATA_UPLOAD_OPERATION
+            )
+
+        Subject.prepare_to_look_up(_db, subjects)
+        Contributor.prepare_to_look_up(_db, sort_names)
+
 
     def consolidate_identifiers(self):
         by_weight = defaultdict(list)
@@ -2181,9 +2362,18 @@ class CSVMetadataImporter(object):
         self.sort_author_field = sort_author_field
         self.display_author_field = display_author_field
 
-    def to_metadata(self, dictreader):
+    # When rows are turned into Metadata objects by worker processes,
+    # the number of rows given to a worker at once.
+    WORKER_CHUNK_SIZE = 500
+
+    def to_metadata(self, dictreader, processes=0):
         """Turn the CSV file in `dictreader` into a sequence of Metadata.
 
+        :param processes: If this is more than zero, the rows are
+            turned into Metadata objects by this many worker
+            processes. The file is still read a chunk at a time, and
+            the Metadata objects come out in the same order as the rows.
+
         :yield: A sequence of Metadata objects.
         """
         fields = dictreader.fieldnames
@@ -2202,8 +2392,19 @@ class CSVMetadataImporter(object):
                 (possibilities, fields)
             )
 
-        for row in dictreader:
-            yield self.row_to_metadata(row)
+        if not processes:
+            for row in dictreader:
+                yield self.row_to_metadata(row)
+            return
+
+        convert = functools.partial(csv_rows_to_metadata, self)
+        chunks = batch_lazily(dictreader, self.WORKER_CHUNK_SIZE)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for metadatas in bounded_map(
+                executor, convert, chunks, processes * 2
+            ):
+                for metadata in metadatas:
+                    yield metadata
 
     def row_to_metadata(self, row):
         title = self._field(row, self.title_field)
@@ -2378,65 +2579,269 @@ class MARCExtractor(object):
                 continue
         return None
 
+    # When records are turned into Metadata objects by worker
+    # processes, the number of records given to a worker at once.
+    WORKER_CHUNK_SIZE = 500
+
     @classmethod
     def parse(cls, file, data_source_name, default_medium_type=None):
-        reader = MARCReader(file)
-        metadata_records = []
-
-        for record in reader:
-            title = record.title()
-            if title.endswith(' /'):
-                title = title[:-len(' /')]
-            issued_year = cls.parse_year(record.pubyear())
-            publisher = record.publisher()
-            if publisher.endswith(','):
-                publisher = publisher[:-1]
-
-            links = []
-            summary = record.notes()[0]['a']
-
-            if summary:
-                summary_link = LinkData(
-                    rel=Hyperlink.DESCRIPTION,
-                    media_type=Representation.TEXT_PLAIN,
-                    content=summary,
-                )
-                links.append(summary_link)
+        return list(cls.iterate(file, data_source_name, default_medium_type))
+
+    @classmethod
+    def iterate(cls, file, data_source_name, default_medium_type=None,
+                processes=0):
+        """Turn a MARC file into Metadata objects, one record at a time.
+
+        :param processes: If this is more than zero, the records are
+            turned into Metadata objects by this many worker
+            processes. The Metadata objects come out in the same
+            order as the records.
+        """
+        if not processes:
+            for record in MARCReader(file):
+                yield cls.record_to_metadata(record, data_source_name)
+            return
 
-            isbn = record['020']['a'].split(" ")[0]
-            primary_identifier = IdentifierData(
-                Identifier.ISBN, isbn
+        convert = functools.partial(marc_records_to_metadata, data_source_name)
+        chunks = batch_lazily(cls.raw_records(file), cls.WORKER_CHUNK_SIZE)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for metadatas in bounded_map(
+                executor, convert, chunks, processes * 2
+            ):
+                for metadata in metadatas:
+                    yield metadata
+
+    @classmethod
+    def raw_records(cls, file):
+        """Split a MARC file into records without parsing them.
+
+        :param file: A file-like object or, like MARCReader, a
+            bytestring.
+        :yield: A sequence of bytestrings, each containing one record.
+        """
+        if isinstance(file, bytes):
+            file = BytesIO(file)
+        while True:
+            # Each record starts with its length, including the
+            # length itself.
+            first5 = file.read(5)
+            if not first5:
+                return
+            yield first5 + file.read(int(first5) - 5)
+
+    @classmethod
+    def record_to_metadata(cls, record, data_source_name):
+        """Turn a pymarc Record into a Metadata object."""
+        title = record.title()
+        if title.endswith(' /'):
+            title = title[:-len(' /')]
+        issued_year = cls.parse_year(record.pubyear())
+        publisher = record.publisher()
+        if publisher.endswith(','):
+            publisher = publisher[:-1]
+
+        links = []
+        summary = record.notes()[0]['a']
+
+        if summary:
+            summary_link = LinkData(
+                rel=Hyperlink.DESCRIPTION,
+                media_type=Representation.TEXT_PLAIN,
+                content=summary,
             )
+            links.append(summary_link)
+
+        isbn = record['020']['a'].split(" ")[0]
+        primary_identifier = IdentifierData(
+            Identifier.ISBN, isbn
+        )
 
-            subjects = [SubjectData(
-                Classifier.FAST,
-                subject['a'],
-            ) for subject in record.subjects()]
+        subjects = [SubjectData(
+            Classifier.FAST,
+            subject['a'],
+        ) for subject in record.subjects()]
 
-            author = record.author()
-            if author:
-                author = cls.name_cleanup(author)
-                author_names = [author]
-            else:
-                author_names = ['Anonymous']
-            contributors = [
-                ContributorData(
-                    sort_name=author,
-                    roles=[Contributor.AUTHOR_ROLE],
+        author = record.author()
+        if author:
+            author = cls.name_cleanup(author)
+            author_names = [author]
+        else:
+            author_names = ['Anonymous']
+        contributors = [
+            ContributorData(
+                sort_name=author,
+                roles=[Contributor.AUTHOR_ROLE],
+            )
+            for author in author_names
+        ]
+
+        return Metadata(
+            data_source=data_source_name,
+            title=title,
+            language='eng',
+            medium=Edition.BOOK_MEDIUM,
+            publisher=publisher,
+            issued=issued_year,
+            primary_identifier=primary_identifier,
+            subjects=subjects,
+            contributors=contributors,
+            links=links
+        )
+
+
+def csv_rows_to_metadata(importer, rows):
+    """Turn some rows of a CSV file into Metadata objects.
+
+    This is a module-level function so it can be run in a worker
+    process.
+
+    :param importer: A CSVMetadataImporter.
+    :param rows: A list of dictionaries.
+    """
+    return [importer.row_to_metadata(row) for row in rows]
+
+
+def marc_records_to_metadata(data_source_name, records):
+    """Turn some MARC records into Metadata objects.
+
+    This is a module-level function so it can be run in a worker
+    process.
+
+    :param records: A list of bytestrings, as yielded by
+        MARCExtractor.raw_records.
+    """
+    return list(
+        MARCExtractor.iterate(BytesIO(b"".join(records)), data_source_name)
+    )
+
+
+class BulkMetadataImporter(object):
+    """Apply a long sequence of Metadata objects--a publisher's whole
+    catalog, say--to the database, a batch at a time.
+
+    The Identifiers, Editions, Subjects and Contributors needed by a
+    batch are found or created with a handful of set-based queries
+    (see Metadata.prepare_to_apply) before the batch is applied, and
+    each batch is committed before the next one is read.
+    """
+
+    log = logging.getLogger("Bulk metadata importer")
+
+    DEFAULT_BATCH_SIZE = 1000
+
+    # The stages of an import, in the order they happen.
+    STAGES = ['read', 'prepare', 'apply', 'commit']
+
+    def __init__(self, _db, collection=None, replace=None,
+                 metadata_client=None, batch_size=None):
+        """Constructor.
+
+        :param collection: Passed into Metadata.apply.
+        :param replace: A ReplacementPolicy. By default,
+            ReplacementPolicy.from_metadata_source() is used.
+        :param metadata_client: Passed into Metadata.apply.
+        :param batch_size: The number of Metadata objects to apply at
+            once.
+        """
+        self._db = _db
+        self.collection = collection
+        self.replace = replace or ReplacementPolicy.from_metadata_source()
+        self.metadata_client = metadata_client
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+
+    def import_metadata(self, metadatas):
+        """Apply a sequence of Metadata objects to the database.
+
+        :param metadatas: Any iterable of Metadata objects, such as
+            the output of CSVMetadataImporter.to_metadata or
+            MARCExtractor.iterate. It's consumed one batch at a time.
+
+        :return: A dictionary of statistics: the number of `rows`
+            read, the number of `editions` created or updated, the
+            number of `failures`, the seconds spent on each stage of
+            the import (`read` includes parsing the input, which may
+            happen in worker processes), `seconds` in total and `rows_per_second`.
+        """
+        stats = dict(rows=0, editions=0, failures=0)
+        for stage in self.STAGES:
+            stats[stage] = 0
+        start = time.time()
+
+        batches = batch_lazily(metadatas, self.batch_size)
+        with LookupCache.installed(self._db):
+            while True:
+                stage_start = time.time()
+                batch = next(batches, None)
+                stats['read'] += time.time() - stage_start
+                if batch is None:
+                    break
+                self.import_batch(batch, stats)
+                self.log.info(
+                    "%(rows)d rows imported, %(rows_per_second).1f/sec.",
+                    self._finish_stats(stats, start)
                 )
-                for author in author_names
-            ]
 
-            metadata_records.append(Metadata(
-                data_source=data_source_name,
-                title=title,
-                language='eng',
-                medium=Edition.BOOK_MEDIUM,
-                publisher=publisher,
-                issued=issued_year,
-                primary_identifier=primary_identifier,
-                subjects=subjects,
-                contributors=contributors,
-                links=links
-            ))
-        return metadata_records
+        stats = self._finish_stats(stats, start)
+        self.log.info(
+            "Imported %(rows)d rows (%(editions)d editions, %(failures)d "
+            "failures) in %(seconds).2fs: %(rows_per_second).1f rows/sec. "
+            "Read: %(read).2fs, prepare: %(prepare).2fs, apply: "
+            "%(apply).2fs, commit: %(commit).2fs.", stats
+        )
+        return stats
+
+    def import_batch(self, batch, stats):
+        """Apply one batch of Metadata objects and commit the results."""
+        stage_start = time.time()
+        Metadata.prepare_to_apply(self._db, batch)
+        stats['prepare'] += time.time() - stage_start
+
+        stage_start = time.time()
+        for metadata in batch:
+            stats['rows'] += 1
+            if self.apply(metadata):
+                stats['editions'] += 1
+            else:
+                stats['failures'] += 1
+        stats['apply'] += time.time() - stage_start
+
+        stage_start = time.time()
+        self._db.commit()
+        stats['commit'] += time.time() - stage_start
+
+    def apply(self, metadata):
+        """Apply a single Metadata object.
+
+        The Metadata is applied inside a savepoint. If anything goes
+        wrong, only the changes made for this Metadata are rolled
+        back, and the rest of the batch is still imported.
+
+        :return: The Edition that was created or updated, or None if
+            the Metadata couldn't be applied.
+        """
+        if not metadata.primary_identifier:
+            self.log.warn("Ignoring %r: no primary identifier.", metadata)
+            return None
+        transaction = self._db.begin_nested()
+        try:
+            edition, is_new = metadata.edition(self._db)
+            metadata.apply(
+                edition, self.collection,
+                metadata_client=self.metadata_client, replace=self.replace
+            )
+            transaction.commit()
+        except Exception, e:
+            # Rather than scratch the whole batch, treat this as a
+            # failure that only applies to this item.
+            self.log.error("Error importing %r", metadata, exc_info=e)
+            transaction.rollback()
+            return None
+        return edition
+
+    def _finish_stats(self, stats, start):
+        stats['seconds'] = time.time() - start
+        if stats['seconds']:
+            stats['rows_per_second'] = stats['rows'] / stats['seconds']
+        else:
+            stats['rows_per_second'] = 0.0
+        return stats
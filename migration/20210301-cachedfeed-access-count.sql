@@ -0,0 +1,5 @@
+-- Keep track of how often each cached feed is requested, so that
+-- popular feeds can be regenerated before they go stale.
+alter table cachedfeeds add column access_count integer default 0;
+alter table cachedfeeds add column last_accessed timestamp without time zone;
+create index ix_cachedfeeds_last_accessed on cachedfeeds (last_accessed);
@@ -0,0 +1,3 @@
+-- New cached feeds are stored compressed. Feeds cached before this
+-- change stay in the 'content' column until they're regenerated.
+alter table cachedfeeds add column compressed_content bytea;
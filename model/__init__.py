@@ -549,6 +549,7 @@ from patron import (
     PatronProfileStorage,
 )
 from listeners import *
+from lookupcache import LookupCache
 from resource import (
     Hyperlink,
     Representation,
@@ -12,7 +12,10 @@ from . import (
 from collections import namedtuple
 import datetime
 import logging
+import random
+import zlib
 from sqlalchemy import (
+    Binary,
     Column,
     DateTime,
     ForeignKey,
@@ -20,8 +23,12 @@ from sqlalchemy import (
     Integer,
     Unicode,
 )
+from sqlalchemy import inspect
+from sqlalchemy.orm.session import Session
+from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import (
     and_,
+    or_,
 )
 from ..util.flask_util import OPDSFeedResponse
 
@@ -54,8 +61,12 @@ class CachedFeed(Base):
     # A 'page' feed is associated with a set of values for pagination.
     pagination = Column(Unicode, nullable=False)
 
-    # The content of the feed.
-    content = Column(Unicode, nullable=True)
+    # The content of the feed. New feeds are stored in
+    # `compressed_content`; `_content` holds feeds that were cached
+    # before compression was introduced, or while it's turned off.
+    # Use the `content` property rather than either field.
+    _content = Column("content", Unicode, nullable=True)
+    compressed_content = Column(Binary, nullable=True)
 
     # Every feed is associated with a Library.
     library_id = Column(
@@ -66,6 +77,27 @@ class CachedFeed(Base):
     work_id = Column(Integer, ForeignKey('works.id'),
         nullable=True, index=True)
 
+    # How many times this feed has been requested, and when it was
+    # last requested. This helps decide which feeds are popular
+    # enough to be regenerated before they go stale.
+    access_count = Column(Integer, default=0)
+    last_accessed = Column(DateTime, nullable=True, index=True)
+
+    # These fields are potentially large and can be deferred if you
+    # don't need the content of a feed.
+    LARGE_FIELDS = ['_content', 'compressed_content']
+
+    # If this is True, feed content is zlib-compressed before it's
+    # stored in the database. Cached feeds are mostly repetitive XML,
+    # so this makes them several times smaller.
+    COMPRESS_CONTENT = True
+    COMPRESSION_LEVEL = 6
+
+    # Updating a popular feed's row on every request would make it a
+    # write hotspot, so only about one request in this many is
+    # recorded, and it counts as this many requests.
+    ACCESS_SAMPLE_RATE = 10
+
     # Distinct types of feeds that might be cached.
     GROUPS_TYPE = u'groups'
     PAGE_TYPE = u'page'
@@ -84,7 +116,7 @@ class CachedFeed(Base):
 
     @classmethod
     def fetch(cls, _db, worklist, facets, pagination, refresher_method,
-              max_age=None, raw=False, **response_kwargs
+              max_age=None, raw=False, record_access=True, **response_kwargs
     ):
         """Retrieve a cached feed from the database if possible.
 
@@ -113,6 +145,11 @@ class CachedFeed(Base):
             converted into a Flask Response object will be returned. If this
             is True, the CachedFeed object itself will be returned. In most
             non-test situations the default is better.
+        :param record_access: If this is True (the default), the
+            request for this feed is counted (see ACCESS_SAMPLE_RATE),
+            so that popular feeds can be regenerated before they go
+            stale. Set this to False when the feed isn't being
+            requested on behalf of a client.
 
         :return: A Response or CachedFeed containing up-to-date content.
         """
@@ -132,7 +169,10 @@ class CachedFeed(Base):
         # TODO: this constraint_clause might not be necessary anymore.
         # ISTR it was an attempt to avoid race conditions, and we do a
         # better job of that now.
-        constraint_clause = and_(cls.content!=None, cls.timestamp!=None)
+        constraint_clause = and_(
+            or_(cls._content!=None, cls.compressed_content!=None),
+            cls.timestamp!=None
+        )
         kwargs = dict(
             on_multiple='interchangeable',
             constraint=constraint_clause,
@@ -181,6 +221,9 @@ class CachedFeed(Base):
         elif feed_obj:
             feed_data = feed_obj.content
 
+        if record_access and feed_obj:
+            feed_obj.record_access()
+
         if raw and feed_obj:
             return feed_obj
 
@@ -202,6 +245,28 @@ class CachedFeed(Base):
             **response_kwargs
         )
 
+    def record_access(self):
+        """Count a request for this feed, if it's one of the requests
+        being sampled.
+
+        The counter is incremented in the database rather than in
+        Python, so simultaneous requests can't overwrite each other's
+        counts.
+        """
+        rate = self.ACCESS_SAMPLE_RATE
+        if rate > 1 and random.randint(1, rate) != 1:
+            return
+        _db = Session.object_session(self)
+        _db.query(CachedFeed).filter(CachedFeed.id==self.id).update(
+            {
+                CachedFeed.access_count:
+                func.coalesce(CachedFeed.access_count, 0) + rate,
+                CachedFeed.last_accessed: datetime.datetime.utcnow(),
+            },
+            synchronize_session=False
+        )
+        _db.expire(self, ['access_count', 'last_accessed'])
+
     @classmethod
     def feed_type(cls, worklist, facets):
         """Determine the 'type' of the feed.
@@ -342,14 +407,47 @@ class CachedFeed(Base):
             pagination_key=pagination_key
         )
 
+    @property
+    def content(self):
+        """The content of the feed, decompressed if necessary."""
+        if self.compressed_content is not None:
+            return zlib.decompress(self.compressed_content).decode("utf8")
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        """Set the content of the feed, compressing it if
+        COMPRESS_CONTENT is set.
+        """
+        if value is not None and self.COMPRESS_CONTENT:
+            if isinstance(value, unicode):
+                value = value.encode("utf8")
+            self.compressed_content = zlib.compress(
+                value, self.COMPRESSION_LEVEL
+            )
+            self._content = None
+        else:
+            self.compressed_content = None
+            self._content = value
+
     def update(self, _db, content):
         self.content = content
         self.timestamp = datetime.datetime.utcnow()
         flush(_db)
 
     def __repr__(self):
-        if self.content:
-            length = len(self.content)
+        # Describing a feed shouldn't load its content if the content
+        # was deferred.
+        state = inspect(self)
+        unloaded = state.unloaded if state.persistent else ()
+        if 'compressed_content' in unloaded:
+            length = "content not loaded"
+        elif self.compressed_content is not None:
+            length = "%d compressed" % len(self.compressed_content)
+        elif '_content' in unloaded:
+            length = "content not loaded"
+        elif self._content:
+            length = len(self._content)
         else:
             length = "No content"
         return "<CachedFeed #%s %s %s %s %s %s %s >" % (
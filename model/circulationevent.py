@@ -4,6 +4,7 @@
 
 from . import (
     Base,
+    flush,
     get_one_or_create,
 )
 
@@ -18,6 +19,7 @@ from sqlalchemy import (
     String,
     Unicode,
 )
+from sqlalchemy.dialects.postgresql import insert
 
 class CirculationEvent(Base):
 
@@ -135,10 +137,7 @@ class CirculationEvent(Base):
         """Log a CirculationEvent to the database, assuming it
         hasn't already been recorded.
         """
-        if new_value is None or old_value is None:
-            delta = None
-        else:
-            delta = new_value - old_value
+        delta = cls._delta(old_value, new_value)
         if not start:
             start = datetime.datetime.utcnow()
         if not end:
@@ -157,3 +156,81 @@ class CirculationEvent(Base):
         if was_new:
             logging.info("EVENT %s %s=>%s", event_name, old_value, new_value)
         return event, was_new
+
+    @classmethod
+    def bulk_log(cls, _db, events, batch_size=1000):
+        """Log a large number of CirculationEvents to the database,
+        skipping any that have already been recorded.
+
+        Instead of a SELECT and an INSERT per event, each batch of
+        events is written with a single multi-row INSERT ... ON
+        CONFLICT DO NOTHING, relying on the unique indexes on
+        (license_pool, library, type, start) to detect duplicates.
+
+        :param events: A list of dictionaries, each containing the
+            keyword arguments you would pass into log():
+            `license_pool`, `event_name`, `old_value`, `new_value`,
+            and optionally `start`, `end`, `library` and `location`.
+
+        :param batch_size: The number of events to send to the
+            database in each INSERT statement.
+
+        :return: A list of booleans, one per item in `events`,
+            indicating whether that event was newly recorded.
+        """
+        # Make sure every LicensePool and Library has an ID.
+        flush(_db)
+
+        now = datetime.datetime.utcnow()
+        rows = []
+        for event in events:
+            old_value = event.get('old_value')
+            new_value = event.get('new_value')
+            start = event.get('start') or now
+            license_pool = event.get('license_pool')
+            library = event.get('library')
+            rows.append(dict(
+                license_pool_id=license_pool.id if license_pool else None,
+                library_id=library.id if library else None,
+                type=event['event_name'],
+                start=start,
+                end=event.get('end') or start,
+                old_value=old_value,
+                new_value=new_value,
+                delta=cls._delta(old_value, new_value),
+                location=event.get('location'),
+            ))
+
+        table = cls.__table__
+        created = set()
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i+batch_size]
+            statement = insert(table).values(
+                batch
+            ).on_conflict_do_nothing().returning(
+                table.c.license_pool_id, table.c.library_id,
+                table.c.type, table.c.start
+            )
+            new_rows = _db.execute(statement).fetchall()
+            created.update(tuple(x) for x in new_rows)
+            logging.info(
+                "EVENTS: %d logged, %d new", len(batch), len(new_rows)
+            )
+
+        # Report each newly created event as new exactly once, even if
+        # it was passed in more than once.
+        results = []
+        for row in rows:
+            key = (row['license_pool_id'], row['library_id'], row['type'],
+                   row['start'])
+            is_new = key in created
+            if is_new:
+                created.remove(key)
+            results.append(is_new)
+        return results
+
+    @classmethod
+    def _delta(cls, old_value, new_value):
+        if new_value is None or old_value is None:
+            return None
+        return new_value - old_value
@@ -4,6 +4,7 @@
 
 from . import (
     Base,
+    flush,
     get_one,
     get_one_or_create,
     numericrange_to_string,
@@ -12,6 +13,7 @@ from . import (
 )
 from constants import DataSourceConstants
 from hasfulltablecache import HasFullTableCache
+from lookupcache import LookupCache
 
 from .. import classifier
 from ..classifier import (
@@ -34,10 +36,14 @@ from sqlalchemy import (
     Unicode,
     UniqueConstraint,
 )
-from sqlalchemy.dialects.postgresql import INT4RANGE
+from sqlalchemy.dialects.postgresql import (
+    INT4RANGE,
+    insert,
+)
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import tuple_
 from sqlalchemy.sql.functions import func
 
 class Subject(Base):
@@ -216,7 +222,18 @@ class Subject(Base):
             find_with = dict(name=name, on_multiple='interchangeable')
             create_with = dict()
 
-        if autocreate:
+        # Type + identifier is unique, so a Subject found that way can
+        # be kept in a LookupCache.
+        cache = None
+        subject = LookupCache.UNKNOWN
+        if identifier:
+            cache = LookupCache.for_session(_db)
+        if cache is not None:
+            subject = cache.get(_db, Subject, (type, identifier))
+
+        if subject is not LookupCache.UNKNOWN and subject is not None:
+            new = False
+        elif autocreate:
             subject, new = get_one_or_create(
                 _db, Subject, type=type,
                 create_method_kwargs=create_with,
@@ -225,12 +242,52 @@ class Subject(Base):
         else:
             subject = get_one(_db, Subject, type=type, **find_with)
             new = False
+        if cache is not None and subject is not None:
+            cache.set(Subject, (type, identifier), subject)
         if name and not subject.name:
             # We just discovered the name of a subject that previously
             # had only an ID.
             subject.name = name
         return subject, new
 
+    @classmethod
+    def prepare_to_look_up(cls, _db, subjects):
+        """Find or create a number of Subjects at once, so that lookup()
+        can find them without going to the database.
+
+        This only does anything if a LookupCache is installed on `_db`.
+
+        :param subjects: A list of (type, identifier, name)
+            3-tuples. Subjects with no identifier are ignored, since
+            they can't be looked up this way.
+        """
+        cache = LookupCache.for_session(_db)
+        if cache is None:
+            return
+        names = dict()
+        for type, identifier, name in subjects:
+            if not type or not identifier:
+                continue
+            key = (type, identifier)
+            if cache.get(_db, cls, key) is LookupCache.UNKNOWN:
+                if name or key not in names:
+                    names[key] = name
+        if not names:
+            return
+
+        flush(_db)
+        insert_statement = insert(cls.__table__).values(
+            [dict(type=type, identifier=identifier, name=name)
+             for (type, identifier), name in names.items()]
+        ).on_conflict_do_nothing()
+        _db.execute(insert_statement)
+
+        qu = _db.query(cls).filter(
+            tuple_(cls.type, cls.identifier).in_(list(names.keys()))
+        )
+        for subject in qu:
+            cache.set(cls, (subject.type, subject.identifier), subject)
+
     @classmethod
     def common_but_not_assigned_to_genre(cls, _db, min_occurances=1000,
                                          type_restriction=None):
@@ -7,6 +7,7 @@ from . import (
     flush,
     get_one_or_create,
 )
+from lookupcache import LookupCache
 
 import logging
 import re
@@ -210,9 +211,17 @@ class Contributor(Base):
             # return all of them.
             #
             # We currently do not check aliases when doing name lookups.
+            cache = LookupCache.for_session(_db)
+            if cache is not None:
+                contributors = cache.get(_db, Contributor, sort_name)
+                if contributors not in (LookupCache.UNKNOWN, None):
+                    return contributors, new
+
             q = _db.query(Contributor).filter(Contributor.sort_name==sort_name)
             contributors = q.all()
             if contributors:
+                if cache is not None:
+                    cache.set(Contributor, sort_name, contributors)
                 return contributors, new
             else:
                 try:
@@ -225,6 +234,8 @@ class Contributor(Base):
                     _db.rollback()
                     contributors = q.all()
                     new = False
+                if cache is not None and contributors:
+                    cache.set(Contributor, sort_name, contributors)
         else:
             # We are perfecly happy to create a Contributor based solely
             # on lc or viaf.
@@ -249,6 +260,40 @@ class Contributor(Base):
 
         return contributors, new
 
+    @classmethod
+    def prepare_to_look_up(cls, _db, sort_names):
+        """Find or create Contributors for a number of sort names at once,
+        so that lookup() can find them by name without going to the
+        database.
+
+        This only does anything if a LookupCache is installed on `_db`.
+        """
+        cache = LookupCache.for_session(_db)
+        if cache is None:
+            return
+        sort_names = set(
+            x for x in sort_names
+            if x and cache.get(_db, cls, x) is LookupCache.UNKNOWN
+        )
+        if not sort_names:
+            return
+
+        by_name = dict()
+        qu = _db.query(cls).filter(cls.sort_name.in_(sort_names))
+        for contributor in qu:
+            by_name.setdefault(contributor.sort_name, []).append(contributor)
+
+        # As in lookup(), a Contributor is created for a name only if
+        # there's no Contributor with that name already.
+        for sort_name in sort_names - set(by_name.keys()):
+            contributor = cls(sort_name=sort_name, aliases=None, extra=dict())
+            _db.add(contributor)
+            by_name[sort_name] = [contributor]
+        flush(_db)
+
+        for sort_name, contributors in by_name.items():
+            cache.set(cls, sort_name, contributors)
+
 
     @property
     def sort_name(self):
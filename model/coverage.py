@@ -7,6 +7,7 @@ from . import (
     get_one,
     get_one_or_create,
 )
+from lookupcache import LookupCache
 
 import datetime
 from sqlalchemy import (
@@ -370,7 +371,14 @@ class CoverageRecord(Base, BaseCoverageRecord):
         if isinstance(data_source, basestring):
             data_source = DataSource.lookup(_db, data_source)
 
-        return get_one(
+        cache = LookupCache.for_session(_db)
+        key = cls._cache_key(identifier, data_source, operation, collection)
+        if cache is not None and key:
+            record = cache.get(_db, cls, key)
+            if record is not LookupCache.UNKNOWN:
+                return record
+
+        record = get_one(
             _db, CoverageRecord,
             identifier=identifier,
             data_source=data_source,
@@ -378,6 +386,58 @@ class CoverageRecord(Base, BaseCoverageRecord):
             collection=collection,
             on_multiple='interchangeable',
         )
+        if cache is not None and key and record:
+            cache.set(cls, key, record)
+        return record
+
+    @classmethod
+    def _cache_key(cls, identifier, data_source, operation, collection):
+        """The key under which a CoverageRecord is kept in a LookupCache.
+
+        :return: A tuple, or None if the record can't be cached because
+            the database objects don't have IDs yet.
+        """
+        if collection:
+            collection_id = collection.id
+            if collection_id is None:
+                return None
+        else:
+            collection_id = None
+        if identifier.id is None or data_source.id is None:
+            return None
+        return (identifier.id, data_source.id, operation, collection_id)
+
+    @classmethod
+    def prepare_to_look_up(cls, _db, identifiers, data_source, operation=None,
+                           collection=None):
+        """Find the CoverageRecords, if any, for a number of Identifiers at
+        once, so that lookup() can find them without going to the
+        database--even when they don't exist.
+
+        This only does anything if a LookupCache is installed on `_db`.
+        """
+        cache = LookupCache.for_session(_db)
+        if cache is None:
+            return
+        keys = dict()
+        for identifier in identifiers:
+            key = cls._cache_key(identifier, data_source, operation, collection)
+            if key and cache.get(_db, cls, key) is LookupCache.UNKNOWN:
+                keys[identifier.id] = key
+        if not keys:
+            return
+
+        qu = _db.query(cls).filter(
+            cls.identifier_id.in_(keys.keys()),
+            cls.data_source==data_source,
+            cls.operation==operation,
+            cls.collection==collection,
+        )
+        found = dict((record.identifier_id, record) for record in qu)
+        for identifier_id, key in keys.items():
+            # Cache None for an Identifier with no CoverageRecord, so
+            # that lookup() knows not to look for it.
+            cache.set(cls, key, found.get(identifier_id))
 
     @classmethod
     def add_for(self, edition, data_source, operation=None, timestamp=None,
@@ -394,14 +454,24 @@ class CoverageRecord(Base, BaseCoverageRecord):
             raise ValueError(
                 "Cannot create a coverage record for %r." % edition)
         timestamp = timestamp or datetime.datetime.utcnow()
-        coverage_record, is_new = get_one_or_create(
-            _db, CoverageRecord,
-            identifier=identifier,
-            data_source=data_source,
-            operation=operation,
-            collection=collection,
-            on_multiple='interchangeable'
-        )
+        cache = LookupCache.for_session(_db)
+        key = self._cache_key(identifier, data_source, operation, collection)
+        coverage_record = None
+        if cache is not None and key:
+            coverage_record = cache.get(_db, CoverageRecord, key)
+        if coverage_record in (None, LookupCache.UNKNOWN):
+            coverage_record, is_new = get_one_or_create(
+                _db, CoverageRecord,
+                identifier=identifier,
+                data_source=data_source,
+                operation=operation,
+                collection=collection,
+                on_multiple='interchangeable'
+            )
+            if cache is not None and key:
+                cache.set(CoverageRecord, key, coverage_record)
+        else:
+            is_new = False
         coverage_record.status = status
         coverage_record.timestamp = timestamp
         return coverage_record, is_new
@@ -488,6 +558,16 @@ class CoverageRecord(Base, BaseCoverageRecord):
         updated_or_created_results.extend(inserts)
         _db.commit()
 
+        # Any cached knowledge of these records is now out of date.
+        cache = LookupCache.for_session(_db)
+        if cache is not None:
+            for identifier in identifiers:
+                key = cls._cache_key(
+                    identifier, data_source, operation, collection
+                )
+                if key:
+                    cache.delete(cls, key)
+
         # Default return for the case when all of the identifiers were
         # ignored.
         new_records = list()
@@ -525,6 +605,7 @@ class WorkCoverageRecord(Base, BaseCoverageRecord):
     GENERATE_OPDS_OPERATION = u'generate-opds'
     GENERATE_MARC_OPERATION = u'generate-marc'
     UPDATE_SEARCH_INDEX_OPERATION = u'update-search-index'
+    UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION = u'update-search-index-availability'
 
     id = Column(Integer, primary_key=True)
     work_id = Column(Integer, ForeignKey('works.id'), index=True)
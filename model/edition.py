@@ -4,6 +4,7 @@
 
 from . import (
     Base,
+    flush,
     get_one,
     get_one_or_create,
     PresentationCalculationPolicy,
@@ -25,10 +26,12 @@ from licensing import (
     DeliveryMechanism,
     LicensePool,
 )
+from lookupcache import LookupCache
 
 from collections import defaultdict
 import logging
 from sqlalchemy import (
+    bindparam,
     Column,
     Date,
     Enum,
@@ -38,9 +41,13 @@ from sqlalchemy import (
     String,
     Unicode,
 )
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import (
+    JSON,
+    insert,
+)
 from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.session import Session
 from ..util import (
     LanguageCodes,
@@ -278,6 +285,15 @@ class Edition(Base, EditionConstants):
         identifier, ignore = Identifier.for_foreign_id(
             _db, foreign_id_type, foreign_id)
 
+        cache = LookupCache.for_session(_db)
+        if cache is not None and identifier is not None:
+            key = (data_source.id, identifier.id)
+            edition = cache.get(_db, Edition, key)
+            if edition is not LookupCache.UNKNOWN and edition is not None:
+                if create_if_not_exists:
+                    return edition, False
+                return edition
+
         # Combine the two to get/create a Edition.
         if create_if_not_exists:
             f = get_one_or_create
@@ -288,8 +304,51 @@ class Edition(Base, EditionConstants):
         r = f(_db, Edition, data_source=data_source,
                  primary_identifier=identifier,
                  **kwargs)
+        if cache is not None and identifier is not None:
+            if isinstance(r, tuple):
+                edition = r[0]
+            else:
+                edition = r
+            if edition is not None:
+                cache.set(Edition, key, edition)
         return r
 
+    @classmethod
+    def prepare_to_look_up(cls, _db, data_source, identifiers):
+        """Find or create the Editions representing a data source's view
+        of a number of Identifiers, so that for_foreign_id() can find
+        them without going to the database.
+
+        This only does anything if a LookupCache is installed on `_db`.
+        """
+        cache = LookupCache.for_session(_db)
+        if cache is None:
+            return
+        if isinstance(data_source, basestring):
+            data_source = DataSource.lookup(_db, data_source)
+        identifier_ids = set(
+            i.id for i in identifiers
+            if cache.get(_db, cls, (data_source.id, i.id)) is LookupCache.UNKNOWN
+        )
+        if not identifier_ids:
+            return
+
+        flush(_db)
+        insert_statement = insert(cls.__table__).values(
+            [dict(data_source_id=data_source.id, primary_identifier_id=x)
+             for x in identifier_ids]
+        ).on_conflict_do_nothing()
+        _db.execute(insert_statement)
+
+        qu = _db.query(cls).filter(
+            cls.data_source==data_source,
+            cls.primary_identifier_id.in_(identifier_ids)
+        )
+        for edition in qu:
+            cache.set(
+                cls, (data_source.id, edition.primary_identifier_id), edition
+            )
+
     @property
     def license_pools(self):
         """The LicensePools that provide access to the book described
@@ -597,8 +656,7 @@ class Edition(Base, EditionConstants):
         norm_author = w.normalize_author(author)
 
         old_id = self.permanent_work_id
-        self.permanent_work_id = self.calculate_permanent_work_id_for_title_and_author(
-            title, author, medium)
+        self.permanent_work_id = w.permanent_id(norm_title, norm_author, medium)
         args = (
             "Permanent work ID for %d: %s/%s -> %s/%s/%s -> %s (was %s)",
             self.id, title, author, norm_title, norm_author, medium,
@@ -619,6 +677,65 @@ class Edition(Base, EditionConstants):
         return WorkIDCalculator.permanent_id(
             norm_title, norm_author, medium)
 
+    @classmethod
+    def calculate_permanent_work_ids(cls, _db, editions):
+        """Calculate permanent work IDs for a number of Editions at once,
+        and write the ones that changed to the database in a single
+        statement.
+
+        :return: The number of Editions whose permanent work ID changed.
+        """
+        editions = list(editions)
+        if not editions:
+            return 0
+
+        # Make sure every Edition has an ID.
+        flush(_db)
+
+        books = []
+        for edition in editions:
+            title = edition.title_for_permanent_work_id
+            medium = cls.medium_for_permanent_work_id.get(edition.medium, None)
+            if not title or not medium:
+                books.append(None)
+            else:
+                books.append(
+                    (title, edition.author_for_permanent_work_id, medium)
+                )
+        calculated = iter(
+            WorkIDCalculator.permanent_ids([x for x in books if x])
+        )
+
+        changes = []
+        for edition, book in zip(editions, books):
+            if book:
+                permanent_work_id = next(calculated)
+            else:
+                # If a book has no title or medium, it has no permanent
+                # work ID.
+                permanent_work_id = None
+            old_id = edition.permanent_work_id
+            if old_id == permanent_work_id:
+                continue
+            logging.info(
+                "Permanent work ID for %d: %s -> %s (was %s)",
+                edition.id, book, permanent_work_id, old_id
+            )
+            # The new value is about to be written directly to the
+            # database, so the session shouldn't treat it as a change.
+            set_committed_value(edition, 'permanent_work_id', permanent_work_id)
+            changes.append(dict(_id=edition.id, pwid=permanent_work_id))
+
+        if changes:
+            table = cls.__table__
+            _db.execute(
+                table.update().where(
+                    table.c.id==bindparam('_id')
+                ).values(permanent_work_id=bindparam('pwid')),
+                changes
+            )
+        return len(changes)
+
     UNKNOWN_AUTHOR = u"[Unknown]"
 
 
@@ -15,6 +15,7 @@ from constants import IdentifierConstants, LinkRelations
 from coverage import CoverageRecord
 from datasource import DataSource
 from licensing import LicensePoolDeliveryMechanism, RightsStatus
+from lookupcache import LookupCache
 from measurement import Measurement
 from sqlalchemy import (
     Boolean,
@@ -26,15 +27,16 @@ from sqlalchemy import (
     UniqueConstraint,
     func,
 )
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import joinedload, relationship
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql import select
-from sqlalchemy.sql.expression import and_, or_
+from sqlalchemy.sql.expression import and_, or_, tuple_
 
 from ..util.string_helpers import native_string
 from ..util.summary import SummaryEvaluator
-from . import Base, PresentationCalculationPolicy, create, get_one, get_one_or_create
+from . import Base, PresentationCalculationPolicy, create, flush, get_one, get_one_or_create
 
 
 @six.add_metaclass(ABCMeta)
@@ -160,6 +162,13 @@ class Identifier(Base, IdentifierConstants):
         if not foreign_identifier_type or not foreign_id:
             return None
 
+        cache = LookupCache.for_session(_db)
+        key = (foreign_identifier_type, foreign_id)
+        if cache is not None:
+            identifier = cache.get(_db, cls, key)
+            if identifier is not LookupCache.UNKNOWN and identifier is not None:
+                return identifier, False
+
         if autocreate:
             m = get_one_or_create
         else:
@@ -168,10 +177,55 @@ class Identifier(Base, IdentifierConstants):
         result = m(_db, cls, type=foreign_identifier_type,
                    identifier=foreign_id)
 
-        if isinstance(result, tuple):
-            return result
-        else:
-            return result, False
+        if not isinstance(result, tuple):
+            result = (result, False)
+        if cache is not None and result[0] is not None:
+            cache.set(cls, key, result[0])
+        return result
+
+    @classmethod
+    def prepare_to_look_up(cls, _db, foreign_ids):
+        """Find or create a number of Identifiers at once, so that
+        for_foreign_id() can find them without going to the database.
+
+        This only does anything if a LookupCache is installed on `_db`.
+
+        :param foreign_ids: A list of (type, identifier) 2-tuples.
+            Invalid identifiers are ignored.
+        """
+        cache = LookupCache.for_session(_db)
+        if cache is None:
+            return
+        keys = set()
+        for foreign_type, foreign_id in foreign_ids:
+            try:
+                key = cls.prepare_foreign_type_and_identifier(
+                    foreign_type, foreign_id
+                )
+            except ValueError:
+                continue
+            if all(key) and cache.get(_db, cls, key) is LookupCache.UNKNOWN:
+                keys.add(key)
+        if not keys:
+            return
+
+        # Make sure any Identifiers waiting to be written to the
+        # database get there before we look for them with a query
+        # the session doesn't know about.
+        flush(_db)
+        keys = list(keys)
+        table = cls.__table__
+        insert_statement = insert(table).values(
+            [dict(type=type, identifier=identifier)
+             for type, identifier in keys]
+        ).on_conflict_do_nothing()
+        _db.execute(insert_statement)
+
+        qu = _db.query(cls).filter(
+            tuple_(cls.type, cls.identifier).in_(keys)
+        )
+        for identifier in qu:
+            cache.set(cls, (identifier.type, identifier.identifier), identifier)
 
     @classmethod
     def prepare_foreign_type_and_identifier(cls, foreign_type, foreign_identifier):
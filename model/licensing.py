@@ -20,9 +20,17 @@ from sqlalchemy import (
     String,
     Unicode,
     UniqueConstraint,
+    and_,
+    bindparam,
+    exists,
+    or_,
 )
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import (
+    aliased,
+    relationship,
+    selectinload,
+)
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql.functions import func
 
@@ -895,8 +903,16 @@ class LicensePool(Base):
         return best
 
     @classmethod
-    def consolidate_works(cls, _db, batch_size=10):
-        """Assign a (possibly new) Work to every unassigned LicensePool."""
+    def consolidate_works(cls, _db, batch_size=10, bulk=False):
+        """Assign a (possibly new) Work to every unassigned LicensePool.
+
+        :param bulk: If this is True, open-access LicensePools are first
+            grouped into Works with consolidate_works_in_bulk(). Only the
+            LicensePools it can't handle go through calculate_work() one
+            at a time.
+        """
+        if bulk:
+            cls.consolidate_works_in_bulk(_db)
         a = 0
         lps = cls.with_no_work(_db)
         logging.info(
@@ -916,6 +932,192 @@ class LicensePool(Base):
         _db.commit()
 
 
+    @classmethod
+    def consolidate_works_in_bulk(cls, _db, batch_size=1000):
+        """Assign Works to unassigned open-access LicensePools using a
+        handful of set-based queries, rather than calling
+        calculate_work() on each LicensePool.
+
+        The LicensePools are grouped by the permanent work ID, medium
+        and language of their presentation Editions. A group joins the
+        open-access Work that already exists for that combination, or
+        gets a new Work whose presentation Edition is one of the
+        group's Editions. Every Work that gained LicensePools, new or
+        not, is registered as needing a full presentation
+        recalculation. NewWorkPresentationCoverageProvider takes care
+        of the new Works, which aren't presentation-ready yet, and
+        WorkClassificationCoverageProvider takes care of the rest.
+
+        LicensePools this method can't handle safely are left alone
+        for calculate_work() to deal with: pools that aren't open
+        access or have no presentation Edition, pools that share an
+        Identifier with a pool that already has a Work, and pools
+        whose combination already has more than one candidate Work.
+
+        :param batch_size: Handle this many groups at a time,
+            committing after each batch.
+        :return: A 2-tuple (number of LicensePools assigned a Work,
+            number of Works created).
+        """
+        from coverage import (
+            CoverageRecord,
+            WorkCoverageRecord,
+        )
+        from contributor import Contribution
+        from edition import Edition
+        from work import Work
+
+        orphaned = and_(
+            LicensePool.work_id==None,
+            LicensePool.open_access==True,
+        )
+
+        # Make sure the presentation Editions have up-to-date
+        # permanent work IDs, since that's what the LicensePools
+        # will be grouped by.
+        editions = _db.query(Edition).join(
+            LicensePool, LicensePool.presentation_edition_id==Edition.id
+        ).filter(orphaned).options(
+            selectinload(Edition.contributions).joinedload(
+                Contribution.contributor
+            )
+        ).all()
+        Edition.calculate_permanent_work_ids(_db, editions)
+
+        # All LicensePools for a given Identifier must share a Work,
+        # so leave out any LicensePool whose Identifier has some other
+        # LicensePool that we're not going to be handling here.
+        other = aliased(LicensePool)
+        conflict = exists().where(
+            and_(
+                other.identifier_id==LicensePool.identifier_id,
+                other.id!=LicensePool.id,
+                or_(other.work_id!=None, other.open_access!=True),
+            )
+        )
+        groups = _db.query(
+            Edition.permanent_work_id, Edition.medium, Edition.language,
+            func.array_agg(LicensePool.id),
+            func.min(Edition.id),
+        ).select_from(LicensePool).join(
+            Edition, LicensePool.presentation_edition_id==Edition.id
+        ).filter(orphaned).filter(
+            Edition.permanent_work_id!=None
+        ).filter(
+            Edition.title!=None
+        ).filter(
+            ~conflict
+        ).group_by(
+            Edition.permanent_work_id, Edition.medium, Edition.language
+        ).all()
+        logging.info(
+            "Assigning Works in bulk to %d groups of open-access LicensePools.",
+            len(groups)
+        )
+
+        work_edition = aliased(Edition)
+        pools_assigned = works_created = 0
+        for start in range(0, len(groups), batch_size):
+            batch = dict(
+                ((pwid, medium, language), (pool_ids, edition_id))
+                for pwid, medium, language, pool_ids, edition_id
+                in groups[start:start+batch_size]
+            )
+
+            # Find the open-access Works that already exist for these
+            # combinations. As in
+            # Work._potential_open_access_works_for_permanent_work_id,
+            # a Work whose presentation Edition belongs to some other
+            # combination doesn't count.
+            candidates = dict((key, set()) for key in batch)
+            existing = _db.query(
+                Edition.permanent_work_id, Edition.medium, Edition.language,
+                LicensePool.work_id, work_edition.permanent_work_id,
+                work_edition.medium, work_edition.language,
+            ).select_from(LicensePool).join(
+                Edition, LicensePool.presentation_edition_id==Edition.id
+            ).join(
+                Work, LicensePool.work_id==Work.id
+            ).outerjoin(
+                work_edition, Work.presentation_edition_id==work_edition.id
+            ).filter(
+                LicensePool.open_access==True
+            ).filter(
+                Edition.permanent_work_id.in_(
+                    list(set(pwid for pwid, medium, language in batch))
+                )
+            ).distinct()
+            for row in existing:
+                key = tuple(row[:3])
+                work_key = tuple(row[4:])
+                if key not in candidates:
+                    continue
+                if work_key != (None, None, None) and work_key != key:
+                    continue
+                candidates[key].add(row[3])
+
+            assignments = []
+            new_works = []
+            for key, (pool_ids, edition_id) in batch.items():
+                work_ids = candidates[key]
+                if len(work_ids) > 1:
+                    # The data is in an inconsistent state.
+                    # calculate_work() knows how to merge the Works.
+                    continue
+                if work_ids:
+                    [work_id] = work_ids
+                    assignments.extend(
+                        dict(_id=pool_id, _work_id=work_id)
+                        for pool_id in pool_ids
+                    )
+                else:
+                    new_works.append((edition_id, pool_ids))
+
+            if new_works:
+                table = Work.__table__
+                created = _db.execute(
+                    table.insert().values([
+                        dict(presentation_edition_id=edition_id)
+                        for edition_id, pool_ids in new_works
+                    ]).returning(table.c.id, table.c.presentation_edition_id)
+                )
+                work_for_edition = dict(
+                    (edition_id, work_id) for work_id, edition_id in created
+                )
+                for edition_id, pool_ids in new_works:
+                    assignments.extend(
+                        dict(_id=pool_id, _work_id=work_for_edition[edition_id])
+                        for pool_id in pool_ids
+                    )
+                works_created += len(new_works)
+
+            if assignments:
+                table = LicensePool.__table__
+                _db.execute(
+                    table.update().where(
+                        table.c.id==bindparam('_id')
+                    ).values(work_id=bindparam('_work_id')),
+                    assignments
+                )
+                pools_assigned += len(assignments)
+
+                work_ids = set(x['_work_id'] for x in assignments)
+                works = _db.query(Work).filter(Work.id.in_(work_ids)).all()
+                WorkCoverageRecord.bulk_add(
+                    works, WorkCoverageRecord.CLASSIFY_OPERATION,
+                    status=CoverageRecord.REGISTERED
+                )
+
+            # Committing also expires the objects in the session, which
+            # don't know about the changes made above.
+            _db.commit()
+
+        logging.info(
+            "Assigned Works in bulk to %d LicensePools, creating %d new Works.",
+            pools_assigned, works_created
+        )
+        return pools_assigned, works_created
+
     def calculate_work(
         self, known_edition=None, exclude_search=False,
         even_if_no_title=False
@@ -27,6 +27,7 @@ from licensing import (
     DeliveryMechanism,
     LicensePool,
 )
+from lookupcache import LookupCache
 from work import Work
 
 from threading import RLock
@@ -215,6 +216,15 @@ def refresh_library_cache(mapper, connection, target):
     # the cache will be repopulated.
     Library.reset_cache()
 
+@event.listens_for(Session, 'after_soft_rollback')
+def clear_lookup_cache(session, previous_transaction):
+    # Objects in a session's LookupCache may have been created or
+    # changed in the transaction that was just rolled back, and
+    # there's no cheap way to tell which ones, so forget them all.
+    cache = LookupCache.for_session(session)
+    if cache is not None:
+        cache.clear()
+
 # When a pool gets a work and a presentation edition for the first time,
 # the work should be added to any custom lists associated with the pool's
 # collection.
@@ -293,10 +303,13 @@ def licensepool_storage_status_change(target, value, oldvalue, initiator):
 
 @event.listens_for(Work.last_update_time, 'set')
 def last_update_time_change(target, value, oldvalue, initator):
-    """A Work needs to have its search document re-indexed whenever its
+    """A Work needs to have its search document updated whenever its
     last_update_time changes.
 
-    Among other things, this happens whenever the LicensePool's availability
-    information changes.
+    This happens whenever the LicensePool's availability information
+    changes, so only the availability information in the search
+    document is updated. Code that changes a Work's bibliographic
+    information is responsible for calling
+    external_index_needs_updating().
     """
-    target.external_index_needs_updating()
+    target.external_index_availability_needs_updating()
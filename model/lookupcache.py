@@ -0,0 +1,151 @@
+# encoding: utf-8
+# LookupCache
+import contextlib
+
+from ..util.cache import LRUCache
+
+
+class LookupCache(object):
+    """An in-memory map of database objects that would otherwise be
+    looked up one at a time, keyed the way the lookup methods
+    (e.g. Identifier.for_foreign_id) look them up.
+
+    A LookupCache is attached to a database session with install(). While
+    it's installed, the lookup methods consult it before going to the
+    database, and remember what they find. Objects can also be loaded
+    into it in bulk ahead of time--see Metadata.prepare_to_apply().
+
+    Unlike HasFullTableCache, this is meant for tables that are too
+    big to keep in memory, so it only holds the objects used most
+    recently.
+    """
+
+    # The key under which the cache is stored in Session.info.
+    SESSION_KEY = 'lookup_cache'
+
+    # The number of objects to keep in a cache by default.
+    DEFAULT_MAX_SIZE = 10000
+
+    # Returned by get() when the cache has no opinion about a key.
+    UNKNOWN = object()
+
+    def __init__(self, max_size=None):
+        self._objects = LRUCache(max_size=max_size or self.DEFAULT_MAX_SIZE)
+
+        # Knowledge that an object _doesn't_ exist is only trusted
+        # for the duration of an installed() block, since we have no
+        # way of knowing when someone else creates the object.
+        self._missing = set()
+
+    @classmethod
+    def for_session(cls, _db):
+        """Find the LookupCache installed on the given session, if any."""
+        if _db is None:
+            return None
+        return _db.info.get(cls.SESSION_KEY)
+
+    @classmethod
+    def install(cls, _db, max_size=None):
+        """Make sure a LookupCache is installed on the given session.
+
+        Once installed, a LookupCache lasts as long as the session, or
+        until it's uninstalled.
+
+        :return: A 2-tuple (cache, is_new).
+        """
+        if _db is None:
+            return None, False
+        cache = cls.for_session(_db)
+        if cache is not None:
+            return cache, False
+        cache = cls(max_size=max_size)
+        _db.info[cls.SESSION_KEY] = cache
+        return cache, True
+
+    @classmethod
+    def uninstall(cls, _db):
+        _db.info.pop(cls.SESSION_KEY, None)
+
+    @classmethod
+    @contextlib.contextmanager
+    def installed(cls, _db):
+        """Install a LookupCache on a session for the duration of a
+        `with` block. If one was already installed, it's left in place,
+        but anything learned about objects that don't exist is
+        forgotten at the end of the block.
+        """
+        cache, is_new = cls.install(_db)
+        try:
+            yield cache
+        finally:
+            if is_new:
+                cls.uninstall(_db)
+            elif cache is not None:
+                cache._missing.clear()
+
+    def get(self, _db, model, key):
+        """Look up an object in the cache.
+
+        :param model: The class of the object, e.g. Identifier.
+        :param key: The values the object is looked up by.
+        :return: The cached value, which may be None (the object is known
+            not to exist) or a list (the lookup finds more than one
+            object). If nothing is known about the key, or the cached
+            object is no longer part of the session (because it was
+            expunged, say), LookupCache.UNKNOWN. The whole cache is
+            cleared whenever the session is rolled back, since a
+            rollback can leave cached objects in the session that no
+            longer correspond to a row.
+        """
+        key = (model.__name__, key)
+        if key in self._missing:
+            self._objects.hits += 1
+            return None
+        value = self._objects.get(key, self.UNKNOWN)
+        if value is self.UNKNOWN:
+            return value
+        if isinstance(value, list):
+            objects = value
+        else:
+            objects = [value]
+        if any(obj not in _db for obj in objects):
+            # This isn't really a hit.
+            self._objects.delete(key)
+            self._objects.hits -= 1
+            self._objects.misses += 1
+            return self.UNKNOWN
+        return value
+
+    def set(self, model, key, value):
+        """Put an object in the cache.
+
+        :param value: The object. None means the object is known not
+            to exist.
+        """
+        key = (model.__name__, key)
+        if value is None:
+            self._objects.delete(key)
+            self._missing.add(key)
+        else:
+            self._missing.discard(key)
+            self._objects.set(key, value)
+
+    def delete(self, model, key):
+        key = (model.__name__, key)
+        self._objects.delete(key)
+        self._missing.discard(key)
+
+    def clear(self):
+        self._objects.clear()
+        self._missing.clear()
+
+    def __len__(self):
+        return len(self._objects) + len(self._missing)
+
+    @property
+    def stats(self):
+        """Describe how well the cache is working.
+
+        :return: A dictionary in the format of LRUCache.stats.
+        """
+        return self._objects.stats
@@ -22,6 +22,7 @@ from licensing import (
 from ..util.http import HTTP
 from ..util.string_helpers import native_string
 
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 import datetime
 import json
@@ -54,6 +55,59 @@ import traceback
 import urllib
 import urlparse
 
+def shrink_image(image, max_width, max_height):
+    """Scale down a PIL image, in place, so that it fits within
+    `max_width` x `max_height`.
+    """
+    # If this is a JPEG, have the decoder do most of the work by
+    # decoding the image at a reduced scale. This is much faster than
+    # decoding at full size and then resizing, and it never goes
+    # below the requested size, so the final resize below still
+    # determines the exact output size. For other formats this does
+    # nothing.
+    image.draft('RGB', (max_width, max_height))
+    image.thumbnail((max_width, max_height), Image.LANCZOS)
+
+
+def scale_image(content, max_width, max_height, pil_formats):
+    """Decode an image, scale it down, and encode the result in one or
+    more formats.
+
+    This works on bytestrings rather than database objects, so that it
+    can be run in a worker process.
+
+    :param content: The original image, as a bytestring.
+    :param pil_formats: A list of PIL format names, e.g. ["png", "webp"].
+
+    :return: A dictionary with the keys `size` (the size of the
+        scaled image), `outputs` (a dictionary mapping each PIL format
+        to the encoded image), `seconds` (the time spent) and
+        `exception` (a traceback, if something went wrong).
+    """
+    start = time.time()
+    result = dict(size=None, outputs={}, exception=None)
+    try:
+        image = Image.open(BytesIO(content))
+        try:
+            shrink_image(image, max_width, max_height)
+        except IOError, e:
+            # I'm not sure why, but sometimes just trying
+            # it again works.
+            shrink_image(image, max_width, max_height)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        result['size'] = image.size
+        for pil_format in pil_formats:
+            output = BytesIO()
+            image.save(output, pil_format)
+            result['outputs'][pil_format] = output.getvalue()
+            output.close()
+    except Exception, e:
+        result['exception'] = traceback.format_exc()
+    result['seconds'] = time.time() - start
+    return result
+
+
 class Resource(Base):
     """An external resource that may be mirrored locally.
     E.g: a cover image, an epub, a description.
@@ -1323,99 +1377,154 @@ class Representation(Base, MediaTypes):
         (eventually) be uploaded to.
         :return: A 2-tuple (Representation, is_new)
         """
-        _db = Session.object_session(self)
+        [(representation, is_new, stats)] = self.scale_batch(
+            [(self, destination_url, destination_media_type)],
+            max_height, max_width, force=force
+        )
+        return representation, is_new
+
+    @classmethod
+    def scale_batch(cls, requests, max_height, max_width, force=False,
+                    processes=None):
+        """Scale down a number of images, doing the CPU-intensive work in
+        a pool of worker processes.
+
+        Each image is decoded only once, no matter how many thumbnails
+        are requested for it, so this is also a good way to create
+        e.g. a JPEG thumbnail alongside a PNG one.
+
+        :param requests: A list of 3-tuples (representation,
+            destination_url, destination_media_type), with the same
+            meaning as the arguments to scale().
+        :param processes: The number of worker processes to use. If
+            this is None, one per CPU will be used. If this is zero,
+            all the work will be done in this process.
+
+        :return: A list with one 3-tuple (Representation, is_new,
+            stats) per request. The first two items have the same
+            meaning as scale()'s return value. `stats` is a dictionary
+            describing the work done: `seconds` spent decoding and
+            scaling the original image, the size of the original in
+            `original_bytes`, and the size of the thumbnail in
+            `thumbnail_bytes`. The sizes are None unless a thumbnail
+            was actually made.
+        """
+        now = datetime.datetime.utcnow()
+        results = [None] * len(requests)
+
+        # Group the requests by original image, and figure out which
+        # ones actually require some work.
+        jobs = []
+        by_original = dict()
+        for i, (original, url, media_type) in enumerate(requests):
+            if not media_type in cls.pil_format_for_media_type:
+                raise ValueError(
+                    "Unsupported destination media type: %s" % media_type
+                )
+            stats = dict(seconds=None, original_bytes=None,
+                         thumbnail_bytes=None)
+            results[i] = (original, False, stats)
+            if original not in by_original:
+                by_original[original] = original._prepare_to_scale(
+                    max_height, max_width
+                )
+            if by_original[original] is None:
+                continue
+
+            _db = Session.object_session(original)
+            thumbnail, is_new = get_one_or_create(
+                _db, Representation, url=url, media_type=media_type
+            )
+            if thumbnail not in original.thumbnails:
+                thumbnail.thumbnail_of = original
+            if not is_new and not force:
+                results[i] = (thumbnail, False, stats)
+                continue
+            jobs.append((i, original, thumbnail))
+
+        # Scale each original image once, in every format we need.
+        formats_for_original = dict()
+        for i, original, thumbnail in jobs:
+            pil_format = cls.pil_format_for_media_type[thumbnail.media_type]
+            formats = formats_for_original.setdefault(original, [])
+            if pil_format not in formats:
+                formats.append(pil_format)
+        originals = list(formats_for_original.keys())
+        args = [
+            (by_original[x], max_width, max_height, formats_for_original[x])
+            for x in originals
+        ]
+        if processes == 0 or len(args) < 2:
+            # It's not worth starting worker processes for a single
+            # image.
+            scaled = [scale_image(*x) for x in args]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                scaled = list(executor.map(scale_image, *zip(*args)))
+        scaled = dict(zip(originals, scaled))
+
+        # Store the results.
+        for i, original, thumbnail in jobs:
+            result = scaled[original]
+            stats = results[i][2]
+            stats['seconds'] = result['seconds']
+            if result['exception']:
+                original.scale_exception = result['exception']
+                original.scaled_at = None
+                # This most likely indicates a problem during the fetch
+                # phase. Set fetch_exception so we'll retry the fetch.
+                original.fetch_exception = (
+                    "Error found while scaling: %s" % result['exception']
+                )
+                continue
+            pil_format = cls.pil_format_for_media_type[thumbnail.media_type]
+            thumbnail.content = result['outputs'][pil_format]
+            thumbnail.image_width, thumbnail.image_height = result['size']
+            thumbnail.mirrored_at = None
+            thumbnail.mirror_exception = None
+            thumbnail.scale_exception = None
+            thumbnail.scaled_at = now
+            stats['original_bytes'] = len(by_original[original])
+            stats['thumbnail_bytes'] = len(thumbnail.content)
+            results[i] = (thumbnail, True, stats)
+            logging.info(
+                "Scaled %s to %s in %.2f sec: %d bytes => %d bytes",
+                original.url, thumbnail.url, stats['seconds'],
+                stats['original_bytes'], stats['thumbnail_bytes']
+            )
+        return results
 
-        if not destination_media_type in self.pil_format_for_media_type:
-            raise ValueError("Unsupported destination media type: %s" % destination_media_type)
+    def _prepare_to_scale(self, max_height, max_width):
+        """Get ready to scale this image down.
 
-        pil_format = self.pil_format_for_media_type[destination_media_type]
+        This reads the image's header to find its size, which is much
+        cheaper than decoding the whole image.
 
-        # Make sure we actually have an image to scale.
-        image = None
+        :return: The image content as a bytestring, or None if there's
+            no need (or no way) to scale this image.
+        """
         try:
             image = self.as_image()
         except Exception, e:
             self.scale_exception = traceback.format_exc()
             self.scaled_at = None
-            # This most likely indicates an error during the fetch
-            # phrase.
             self.fetch_exception = "Error found while scaling: %s" % (
                 self.scale_exception)
             logging.error("Error found while scaling %r", self, exc_info=e)
-
+            return None
         if not image:
-            return self, False
-
-        # Now that we've loaded the image, take the opportunity to set
-        # the image size of the original representation.
+            return None
         self.image_width, self.image_height = image.size
-
-        # If the image is already a thumbnail-size bitmap, don't bother.
-        if (self.clean_media_type != Representation.SVG_MEDIA_TYPE
-            and self.image_height <= max_height
+        if (self.image_height <= max_height
             and self.image_width <= max_width):
+            # The image is already a thumbnail-size bitmap.
             self.thumbnails = []
-            return self, False
-
-        # Do we already have a representation for the given URL?
-        thumbnail, is_new = get_one_or_create(
-            _db, Representation, url=destination_url,
-            media_type=destination_media_type
-        )
-        if thumbnail not in self.thumbnails:
-            thumbnail.thumbnail_of = self
-
-        if not is_new and not force:
-            # We found a preexisting thumbnail and we're allowed to
-            # use it.
-            return thumbnail, is_new
-
-        # At this point we have a parent Representation (self), we
-        # have a Representation that will contain a thumbnail
-        # (thumbnail), and we know we need to actually thumbnail the
-        # parent into the thumbnail.
-        #
-        # Because the representation of this image is being
-        # changed, it will need to be mirrored later on.
-        now = datetime.datetime.utcnow()
-        thumbnail.mirrored_at = None
-        thumbnail.mirror_exception = None
-
-        args = [(max_width, max_height),
-                Image.ANTIALIAS]
-        try:
-            image.thumbnail(*args)
-        except IOError, e:
-            # I'm not sure why, but sometimes just trying
-            # it again works.
-            original_exception = traceback.format_exc()
-            try:
-                image.thumbnail(*args)
-            except IOError, e:
-                self.scale_exception = original_exception
-                self.scaled_at = None
-                return self, False
-
-        # Save the thumbnail image to the database under
-        # thumbnail.content.
-        output = BytesIO()
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+            return None
+        fh = self.content_fh()
         try:
-            image.save(output, pil_format)
-        except Exception, e:
-            self.scale_exception = traceback.format_exc()
-            self.scaled_at = None
-            # This most likely indicates a problem during the fetch phase,
-            # Set fetch_exception so we'll retry the fetch.
-            self.fetch_exception = "Error found while scaling: %s" % (self.scale_exception)
-            return self, False
-        thumbnail.content = output.getvalue()
-        thumbnail.image_width, thumbnail.image_height = image.size
-        output.close()
-        thumbnail.scale_exception = None
-        thumbnail.scaled_at = now
-        return thumbnail, True
+            return fh.read()
+        finally:
+            fh.close()
 
     @property
     def thumbnail_size_quality_penalty(self):
@@ -86,6 +86,23 @@ class WorkGenre(Base):
         return "%s (%d%%)" % (self.genre.name, self.affinity*100)
 
 
+def query_to_json(query):
+    """Convert the results of a query to a JSON object."""
+    return select(
+        [func.row_to_json(literal_column(query.name))]
+    ).select_from(query)
+
+def query_to_json_array(query):
+    """Convert the results of a query into a JSON array."""
+    return select(
+        [func.array_to_json(
+            func.array_agg(
+                func.row_to_json(
+                    literal_column(query.name)
+                )))]
+    ).select_from(query)
+
+
 class Work(Base):
     APPEALS_URI = "http://librarysimplified.org/terms/appeals/"
 
@@ -1221,6 +1238,17 @@ class Work(Base):
             WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
         )
 
+    def external_index_availability_needs_updating(self):
+        """Mark this work as needing the availability information in its
+        search document updated.
+
+        This is much cheaper than reindexing the work, and it's all
+        that needs to happen when a LicensePool's availability changes.
+        """
+        return self._reset_coverage(
+            WorkCoverageRecord.UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION
+        )
+
     def update_external_index(self, client, add_coverage_record=True):
         """Create a WorkCoverageRecord so that this work's
         entry in the search index can be modified or deleted.
@@ -1448,6 +1476,20 @@ class Work(Base):
         if len(works) > 50:
             _db.execute("set work_mem='200MB'")
 
+        result = _db.execute(cls.search_document_query(works, policy))
+        if result:
+            return [r[0] for r in result]
+
+    @classmethod
+    def search_document_query(cls, works, policy=None):
+        """Build the query used by to_search_documents().
+
+        This is kept separate so the query can be inspected (e.g. with
+        EXPLAIN ANALYZE) without being run.
+
+        :return: A SQLAlchemy selectable that yields one JSON search
+            document per Work.
+        """
         # This query gets relevant columns from Work and Edition for the Works we're
         # interested in. The work_id, edition_id, and identifier_id columns are used
         # by other subqueries to filter, and the remaining columns are used directly
@@ -1501,22 +1543,6 @@ class Work(Base):
             works_alias.name + '.' + works_alias.c.quality.name
         )
 
-        def query_to_json(query):
-            """Convert the results of a query to a JSON object."""
-            return select(
-                [func.row_to_json(literal_column(query.name))]
-            ).select_from(query)
-
-        def query_to_json_array(query):
-            """Convert the results of a query into a JSON array."""
-            return select(
-                [func.array_to_json(
-                    func.array_agg(
-                        func.row_to_json(
-                            literal_column(query.name)
-                        )))]
-            ).select_from(query)
-
         # This subquery gets Collection IDs for collections
         # that own more than zero licenses for this book.
         from classification import (
@@ -1524,76 +1550,11 @@ class Work(Base):
             Subject,
         )
         from customlist import CustomListEntry
-        from licensing import LicensePool
-
-        # We need information about LicensePools for a few reasons:
-        #
-        # * We always want to filter out Works that are not available
-        #   in any of the collections associated with a given library
-        #   -- either because no licenses are owned, because the
-        #   LicensePools are suppressed, or (TODO) because there are no
-        #   delivery mechanisms.
-        # * A patron may want to sort a list of books by availability
-        #   date.
-        # * A patron may want to show only books currently available,
-        #   or only open-access books.
-        #
-        # Whenever LicensePool.open_access is changed, or
-        # licenses_available moves to zero or away from zero, the
-        # LicensePool signals that its Work needs reindexing.
-        #
-        # The work quality field is stored in the main document, but
-        # it's also stored here, so that we can apply a nested filter
-        # that combines quality with other fields found only in the subdocument.
 
-        def explicit_bool(label, t):
-            # Ensure we always generate True/False instead of
-            # True/None. Elasticsearch can't filter on null values.
-            return case([(t, True)], else_=False).label(label)
-
-        licensepools = select(
-            [
-                LicensePool.id.label('licensepool_id'),
-                LicensePool.data_source_id.label('data_source_id'),
-                LicensePool.collection_id.label('collection_id'),
-                LicensePool.open_access.label('open_access'),
-                LicensePool.suppressed,
-
-                explicit_bool(
-                    'available',
-                    or_(
-                        LicensePool.unlimited_access,
-                        LicensePool.self_hosted,
-                        LicensePool.licenses_available > 0,
-                    )
-                ),
-                explicit_bool(
-                    'licensed',
-                    or_(
-                        LicensePool.unlimited_access,
-                        LicensePool.self_hosted,
-                        LicensePool.licenses_owned > 0
-                    )
-                ),
-                work_quality_column,
-                Edition.medium,
-                func.extract(
-                    "EPOCH",
-                    LicensePool.availability_time,
-                ).label('availability_time')
-            ]
-        ).where(
-            and_(
-                LicensePool.work_id==work_id_column,
-                work_presentation_edition_id_column==Edition.id,
-                or_(
-                    LicensePool.open_access,
-                    LicensePool.unlimited_access,
-                    LicensePool.self_hosted,
-                    LicensePool.licenses_owned>0,
-                ),
-            )
-        ).alias("licensepools_subquery")
+        licensepools = cls._licensepools_search_subquery(
+            work_id_column, work_presentation_edition_id_column,
+            work_quality_column
+        )
         licensepools_json = query_to_json_array(licensepools)
 
         # This subquery gets CustomList IDs for all lists
@@ -1765,11 +1726,87 @@ class Work(Base):
         ).alias("search_data_subquery")
 
         # Finally, convert everything to json.
-        search_json = query_to_json(search_data)
+        return query_to_json(search_data)
 
-        result = _db.execute(search_json)
-        if result:
-            return [r[0] for r in result]
+    @classmethod
+    def _licensepools_search_subquery(
+        cls, work_id_column, work_presentation_edition_id_column,
+        work_quality_column
+    ):
+        """Build the subquery that creates the 'licensepools' part of a
+        Work's search document.
+        """
+        from licensing import LicensePool
+
+        # We need information about LicensePools for a few reasons:
+        #
+        # * We always want to filter out Works that are not available
+        #   in any of the collections associated with a given library
+        #   -- either because no licenses are owned, because the
+        #   LicensePools are suppressed, or (TODO) because there are no
+        #   delivery mechanisms.
+        # * A patron may want to sort a list of books by availability
+        #   date.
+        # * A patron may want to show only books currently available,
+        #   or only open-access books.
+        #
+        # Whenever LicensePool.open_access is changed, or
+        # licenses_available moves to zero or away from zero, the
+        # LicensePool signals that its Work needs reindexing.
+        #
+        # The work quality field is stored in the main document, but
+        # it's also stored here, so that we can apply a nested filter
+        # that combines quality with other fields found only in the subdocument.
+
+        def explicit_bool(label, t):
+            # Ensure we always generate True/False instead of
+            # True/None. Elasticsearch can't filter on null values.
+            return case([(t, True)], else_=False).label(label)
+
+        licensepools = select(
+            [
+                LicensePool.id.label('licensepool_id'),
+                LicensePool.data_source_id.label('data_source_id'),
+                LicensePool.collection_id.label('collection_id'),
+                LicensePool.open_access.label('open_access'),
+                LicensePool.suppressed,
+
+                explicit_bool(
+                    'available',
+                    or_(
+                        LicensePool.unlimited_access,
+                        LicensePool.self_hosted,
+                        LicensePool.licenses_available > 0,
+                    )
+                ),
+                explicit_bool(
+                    'licensed',
+                    or_(
+                        LicensePool.unlimited_access,
+                        LicensePool.self_hosted,
+                        LicensePool.licenses_owned > 0
+                    )
+                ),
+                work_quality_column,
+                Edition.medium,
+                func.extract(
+                    "EPOCH",
+                    LicensePool.availability_time,
+                ).label('availability_time')
+            ]
+        ).where(
+            and_(
+                LicensePool.work_id==work_id_column,
+                work_presentation_edition_id_column==Edition.id,
+                or_(
+                    LicensePool.open_access,
+                    LicensePool.unlimited_access,
+                    LicensePool.self_hosted,
+                    LicensePool.licenses_owned>0,
+                ),
+            )
+        ).alias("licensepools_subquery")
+        return licensepools
 
     @classmethod
     def target_age_query(self, foreign_work_id_field):
@@ -1802,6 +1839,55 @@ class Work(Base):
         """Generate a search document for this Work."""
         return Work.to_search_documents([self])[0]
 
+    @classmethod
+    def to_availability_search_documents(cls, works):
+        """Generate partial search documents for these Works, containing
+        only the information that changes when a LicensePool's
+        availability changes.
+
+        These documents can be used to update existing search
+        documents much more cheaply than generating the full documents
+        with to_search_documents().
+
+        :return: A list of dictionaries, each containing '_id',
+            'last_update_time' and 'licensepools'.
+        """
+        if not works:
+            return []
+
+        _db = Session.object_session(works[0])
+        works_alias = select(
+            [Work.id.label('work_id'),
+             Work.presentation_edition_id,
+             Work.quality,
+             func.extract(
+                 "EPOCH",
+                 Work.last_update_time,
+             ).label('last_update_time')
+            ],
+            Work.id.in_((w.id for w in works))
+        ).alias('works_alias')
+
+        def column(name):
+            return literal_column(works_alias.name + '.' + name)
+
+        licensepools = cls._licensepools_search_subquery(
+            column(works_alias.c.work_id.name),
+            column(works_alias.c.presentation_edition_id.name),
+            column(works_alias.c.quality.name),
+        )
+        availability_data = select(
+            [works_alias.c.work_id.label("_id"),
+             works_alias.c.last_update_time,
+             query_to_json_array(licensepools).label("licensepools"),
+            ]
+        ).select_from(
+            works_alias
+        ).alias("availability_data_subquery")
+
+        result = _db.execute(query_to_json(availability_data))
+        return [r[0] for r in result]
+
     def mark_licensepools_as_superceded(self):
         """Make sure that all but the single best open-access LicensePool for
         this Work are superceded. A non-open-access LicensePool should
@@ -1,8 +1,12 @@
 import datetime
 import logging
 import traceback
+import urlparse
 
-from sqlalchemy.orm import defer
+from sqlalchemy.orm import (
+    defer,
+    selectinload,
+)
 from sqlalchemy.sql.expression import (
     and_,
     or_,
@@ -16,6 +20,7 @@ from model import (
     CirculationEvent,
     Collection,
     CollectionMissing,
+    Contribution,
     CoverageRecord,
     Credential,
     CustomListEntry,
@@ -32,6 +37,7 @@ from model import (
     get_one_or_create,
 )
 from model.configuration import ConfigurationSetting
+from util.problem_detail import ProblemDetail
 
 
 class CollectionMonitorLogger(logging.LoggerAdapter):
@@ -677,6 +683,32 @@ class PermanentWorkIDRefreshMonitor(EditionSweepMonitor):
     """
     SERVICE_NAME = "Permanent work ID refresh"
 
+    # Calculating a permanent work ID is cheap, so it's worth doing a
+    # lot of them at once.
+    DEFAULT_BATCH_SIZE = 1000
+
+    def item_query(self):
+        """Load each Edition's contributors along with the Edition, since
+        they're needed to find the author.
+        """
+        qu = super(PermanentWorkIDRefreshMonitor, self).item_query()
+        return qu.options(
+            selectinload(Edition.contributions).joinedload(
+                Contribution.contributor
+            )
+        )
+
+    def process_items(self, editions):
+        """Recalculate permanent work IDs for a batch of Editions,
+        and write the ones that changed in a single UPDATE.
+        """
+        changed = Edition.calculate_permanent_work_ids(self._db, editions)
+        self.log.log(
+            self.COMPLETION_LOG_LEVEL,
+            "Calculated permanent work IDs for %d editions, %d changed.",
+            len(editions), changed
+        )
+
     def process_item(self, edition):
         edition.calculate_permanent_work_id()
 
@@ -777,6 +809,192 @@ class CustomListEntryWorkUpdateMonitor(CustomListEntrySweepMonitor):
         item.set_work()
 
 
+class CachedFeedPrewarmMonitor(Monitor):
+    """Regenerate popular cached feeds shortly before they go stale, so
+    that patrons don't have to wait while they're generated.
+
+    Feeds are prioritized using the access counters kept up to date
+    by CachedFeed.fetch. Only feeds for Lanes are regenerated.
+
+    Feeds that are cached forever never go stale, so they're skipped.
+    By default, that includes every grouped feed for a Lane (see
+    Lane.max_cache_age); those are kept up to date by a script that
+    regenerates them in the background.
+
+    Feeds are generated with an instance of ANNOTATOR_CLASS (a plain
+    opds.Annotator if that's not set). An application whose Annotator
+    needs more information to get started should override
+    annotator().
+    """
+    SERVICE_NAME = "Cached feed pre-warmer"
+
+    # The Annotator to use when regenerating feeds.
+    ANNOTATOR_CLASS = None
+
+    # Only feeds that have been requested at least this many times are
+    # worth regenerating ahead of time.
+    MINIMUM_ACCESS_COUNT = 10
+
+    # Only feeds that have been requested this recently are worth
+    # regenerating ahead of time.
+    RECENTLY_ACCESSED = datetime.timedelta(days=1)
+
+    # Regenerate no more than this many feeds in a single run.
+    MAXIMUM_FEEDS = 100
+
+    # Regenerate a feed if it will go stale within this many
+    # seconds. This should be a bit longer than the interval between
+    # runs of this monitor.
+    LEAD_TIME = 10*60
+
+    FEED_TYPES = [CachedFeed.GROUPS_TYPE, CachedFeed.PAGE_TYPE]
+
+    def __init__(self, _db, search_engine=None):
+        super(CachedFeedPrewarmMonitor, self).__init__(_db)
+        self.search_engine = search_engine
+
+    def annotator(self, lane, facets):
+        """Create the Annotator to use when regenerating a feed for
+        `lane`.
+        """
+        from opds import Annotator
+        annotator_class = self.ANNOTATOR_CLASS or Annotator
+        return annotator_class()
+
+    def query(self):
+        """Find the most popular CachedFeeds, most popular first."""
+        cutoff = datetime.datetime.utcnow() - self.RECENTLY_ACCESSED
+        return self._db.query(CachedFeed).filter(
+            CachedFeed.lane_id != None
+        ).filter(
+            CachedFeed.type.in_(self.FEED_TYPES)
+        ).filter(
+            CachedFeed.access_count >= self.MINIMUM_ACCESS_COUNT
+        ).filter(
+            CachedFeed.last_accessed >= cutoff
+        ).options(
+            *[defer(x) for x in CachedFeed.LARGE_FIELDS]
+        ).order_by(
+            CachedFeed.access_count.desc(), CachedFeed.id
+        ).limit(self.MAXIMUM_FEEDS)
+
+    def run_once(self, progress):
+        now = datetime.datetime.utcnow()
+        feeds = self.query().all()
+        refreshed = 0
+        for feed in feeds:
+            if self.prewarm(feed, now):
+                refreshed += 1
+                self._db.commit()
+        return TimestampData(
+            achievements="Feeds considered: %d. Feeds regenerated: %d." % (
+                len(feeds), refreshed
+            )
+        )
+
+    def prewarm(self, feed, now=None):
+        """Regenerate a CachedFeed if it's about to go stale.
+
+        :return: True if the feed was regenerated; False otherwise.
+        """
+        now = now or datetime.datetime.utcnow()
+        arguments = self.feed_arguments(feed)
+        if arguments is None:
+            self.log.warn("Can't reproduce the request for %r", feed)
+            return False
+        lane, facets, pagination = arguments
+
+        max_age = CachedFeed.max_cache_age(lane, feed.type, facets)
+        if (max_age in (CachedFeed.CACHE_FOREVER, CachedFeed.IGNORE_CACHE)
+            or max_age <= 0):
+            # This feed either never goes stale or is never cached.
+            return False
+
+        if feed.timestamp is not None:
+            expires = feed.timestamp + datetime.timedelta(seconds=max_age)
+            if expires > now + datetime.timedelta(seconds=self.LEAD_TIME):
+                # There's no need to regenerate this feed yet.
+                return False
+
+        self.log.info("Regenerating %r", feed)
+        self.refresh(lane, facets, pagination, feed.type)
+        return True
+
+    def feed_arguments(self, feed):
+        """Recreate the Lane, faceting object, and Pagination that were
+        used to generate a CachedFeed.
+
+        :return: A 3-tuple (lane, facets, pagination), or None if the
+            CachedFeed's keys can't be reproduced exactly.
+        """
+        from entrypoint import EntryPoint
+        from lane import (
+            Facets,
+            FeaturedFacets,
+            Pagination,
+        )
+        lane = feed.lane
+        library = lane.get_library(self._db)
+        get_header = lambda name, default=None: default
+
+        facet_arguments = dict(urlparse.parse_qsl(feed.facets or ""))
+        get_facet = lambda name, default=None: facet_arguments.get(
+            name, default
+        )
+        if feed.type == CachedFeed.GROUPS_TYPE:
+            facets = FeaturedFacets.from_request(
+                library, library, get_facet, get_header, lane,
+                minimum_featured_quality=library.minimum_featured_quality
+            )
+        else:
+            facets = Facets.from_request(
+                library, library, get_facet, get_header, lane
+            )
+        if isinstance(facets, ProblemDetail):
+            return None
+
+        # from_request() would fill in a default EntryPoint, but we
+        # need exactly the EntryPoint (if any) used the first time.
+        facets.entrypoint = EntryPoint.BY_INTERNAL_NAME.get(
+            facet_arguments.get(Facets.ENTRY_POINT_FACET_GROUP_NAME)
+        )
+
+        pagination = None
+        if feed.pagination:
+            pagination_arguments = dict(urlparse.parse_qsl(feed.pagination))
+            pagination = Pagination.from_request(pagination_arguments.get)
+            if isinstance(pagination, ProblemDetail):
+                return None
+
+        # If the keys have changed, regenerating the feed would create
+        # a brand new CachedFeed rather than refreshing this one.
+        if (CachedFeed.feed_type(lane, facets) != feed.type
+            or facets.query_string != (feed.facets or "")
+            or (pagination.query_string if pagination else "")
+            != (feed.pagination or "")):
+            return None
+        return lane, facets, pagination
+
+    def refresh(self, lane, facets, pagination, feed_type):
+        """Regenerate a feed and store it in the database."""
+        from opds import AcquisitionFeed
+        annotator = self.annotator(lane, facets)
+        if feed_type == CachedFeed.GROUPS_TYPE:
+            method = AcquisitionFeed.groups
+            url = annotator.groups_url(lane, facets)
+        else:
+            method = AcquisitionFeed.page
+            url = annotator.feed_url(lane, facets, pagination)
+
+        # A max_age of zero forces the feed to be regenerated. Since
+        # no patron asked for this feed, the request isn't counted.
+        return method(
+            self._db, lane.display_name, url, lane, annotator,
+            facets=facets, pagination=pagination, max_age=0,
+            search_engine=self.search_engine, record_access=False
+        )
+
+
 class ReaperMonitor(Monitor):
     """A Monitor that deletes database rows that have expired but
     have no other process to delete them.
@@ -1,9 +1,12 @@
+import json
 import logging
+import re
 
 import webpub_manifest_parser.opds2.ast as opds2_ast
 from flask_babel import lazy_gettext as _
 from six import StringIO
 from six.moves.urllib.parse import urljoin, urlparse
+from webpub_manifest_parser.core.parsers import DateTimeParser
 from webpub_manifest_parser.errors import BaseError
 from webpub_manifest_parser.opds2.parsers import OPDS2DocumentParserFactory
 from webpub_manifest_parser.opds2.registry import (
@@ -30,6 +33,7 @@ from .model import (
     Identifier,
     LicensePool,
     LinkRelations,
+    LookupCache,
     MediaTypes,
     Representation,
     RightsStatus,
@@ -87,6 +91,138 @@ def parse_feed(feed, silent=True):
     return parsed_feed
 
 
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _scan_json_object(document, array_keys=()):
+    """Walk through the keys of a JSON object without decoding the
+    whole thing at once.
+
+    :param document: A string containing a JSON object.
+    :type document: str
+
+    :param array_keys: Keys whose values are arrays that should be
+        decoded one item at a time.
+    :type array_keys: Iterable[str]
+
+    :return: An iterable of 3-tuples (key, value, offset). For most keys,
+        `value` is the decoded value and `offset` is None. For keys in
+        `array_keys`, there is one 3-tuple per item in the array,
+        and `offset` is where that item starts in the document, so it
+        can be decoded again later with _decode_json_at().
+    :rtype: Iterable[Tuple[str, Any, Optional[int]]]
+    """
+
+    def skip_whitespace(index):
+        return _JSON_WHITESPACE.match(document, index).end()
+
+    def expect(index, characters):
+        index = skip_whitespace(index)
+        character = document[index:index + 1]
+        if not character or character not in characters:
+            raise ValueError(
+                "Expected {0} at character {1}".format(
+                    " or ".join(repr(c) for c in characters), index
+                )
+            )
+        return character, skip_whitespace(index + 1)
+
+    character, index = expect(0, "{")
+    if document[index:index + 1] == "}":
+        return
+    while True:
+        key, index = _JSON_DECODER.raw_decode(document, index)
+        character, index = expect(index, ":")
+        if key in array_keys and document[index:index + 1] == "[":
+            index = skip_whitespace(index + 1)
+            if document[index:index + 1] == "]":
+                index += 1
+            else:
+                while True:
+                    offset = index
+                    item, index = _JSON_DECODER.raw_decode(document, index)
+                    yield key, item, offset
+                    character, index = expect(index, ",]")
+                    if character == "]":
+                        break
+        else:
+            value, index = _JSON_DECODER.raw_decode(document, index)
+            yield key, value, None
+        character, index = expect(index, ",}")
+        if character == "}":
+            return
+        if document[index:index + 1] != '"':
+            raise ValueError("Expected a key at character {0}".format(index))
+
+
+def _decode_json_at(document, offset):
+    """Decode the JSON value that starts at the given offset."""
+    return _JSON_DECODER.raw_decode(document, offset)[0]
+
+
+def parse_feed_incrementally(feed, silent=True):
+    """Parse an OPDS 2.0 feed one publication at a time.
+
+    Rather than building an object graph for the entire feed,
+    each publication is parsed as part of a feed that contains
+    the original feed's metadata and links, and nothing else. Only one
+    publication needs to be held in memory at a time.
+
+    :param feed: OPDS 2.0 feed
+    :type feed: Union[str, dict, opds2_ast.OPDS2Feed]
+
+    :param silent: Boolean value indicating whether to raise
+        an exception if a publication can't be parsed. If this is True,
+        the publication is skipped.
+    :type silent: bool
+
+    :return: An iterable of 2-tuples (feed, publication)
+    :rtype: Iterable[Tuple[opds2_ast.OPDS2Feed, opds2_ast.OPDS2Publication]]
+    """
+    if not is_string(feed):
+        # The feed has already been loaded into memory; there's
+        # nothing to be gained by parsing it piece by piece.
+        parsed_feed = parse_feed(feed, silent=silent)
+        if parsed_feed:
+            for publication in OPDS2Importer._get_publications(parsed_feed):
+                yield parsed_feed, publication
+        return
+
+    feed_header = {}
+
+    def parse_publications(key, item):
+        if key == "groups":
+            publications = item.get("publications") or []
+        else:
+            publications = [item]
+        for publication in publications:
+            document = dict(feed_header, publications=[publication])
+            parsed_feed = parse_feed(document, silent=silent)
+            if parsed_feed:
+                yield parsed_feed, parsed_feed.publications[0]
+
+    # Publications that show up before the feed's metadata and links
+    # can't be parsed yet. Rather than keep them around, we note where
+    # they are and come back to them at the end.
+    postponed = []
+    for key, value, offset in _scan_json_object(
+        feed, ("publications", "groups")
+    ):
+        if offset is None:
+            if key in ("metadata", "links"):
+                feed_header[key] = value
+        elif "metadata" in feed_header and "links" in feed_header:
+            for result in parse_publications(key, value):
+                yield result
+        else:
+            postponed.append((key, offset))
+
+    for key, offset in postponed:
+        for result in parse_publications(key, _decode_json_at(feed, offset)):
+            yield result
+
+
 class OPDS2Importer(OPDSImporter):
     """Imports editions and license pools from an OPDS 2.0 feed."""
 
@@ -94,6 +230,12 @@ class OPDS2Importer(OPDSImporter):
     DESCRIPTION = _(u"Import books from a publicly-accessible OPDS 2.0 feed.")
     NEXT_LINK_RELATION = u"next"
 
+    # If this is set, feeds are parsed one publication at a time with
+    # parse_feed_incrementally(), and imported STREAMING_BATCH_SIZE
+    # publications at a time, rather than all at once.
+    STREAMING_PARSER = False
+    STREAMING_BATCH_SIZE = 100
+
     def __init__(
         self,
         db,
@@ -782,15 +924,55 @@ class OPDS2Importer(OPDSImporter):
 
         return open_access_rights_link
 
+    def _scan_feed(self, feed):
+        """Walk through the top-level keys of an OPDS 2.0 feed, decoding
+        publications one at a time.
+
+        :param feed: OPDS 2.0 feed
+        :type feed: str
+
+        :return: An iterable of 2-tuples (key, value). Each publication,
+            including those inside groups, is yielded separately under
+            the 'publications' key.
+        :rtype: Iterable[Tuple[str, Any]]
+        """
+        try:
+            for key, value, offset in _scan_json_object(
+                feed, ("publications", "groups")
+            ):
+                if key == "groups" and offset is not None:
+                    for publication in value.get("publications") or []:
+                        yield "publications", publication
+                else:
+                    yield key, value
+        except ValueError:
+            self._logger.exception("Failed to parse the OPDS 2.0 feed")
+
     def extract_next_links(self, feed):
         """Extracts "next" links from the feed.
 
+        If STREAMING_PARSER is set, only the feed's own links are
+        decoded; publications are skipped over one at a time.
+
         :param feed: OPDS 2.0 feed
         :type feed: Union[str, opds2_ast.OPDS2Feed]
 
         :return: List of "next" links
         :rtype: List[str]
         """
+        if self.STREAMING_PARSER and is_string(feed):
+            next_links = []
+            for key, value in self._scan_feed(feed):
+                if key != "links":
+                    continue
+                for link in value or []:
+                    rels = link.get("rel") or []
+                    if is_string(rels):
+                        rels = [rels]
+                    if self.NEXT_LINK_RELATION in rels and link.get("href"):
+                        next_links.append(link["href"])
+            return next_links
+
         parsed_feed = parse_feed(feed)
 
         if not parsed_feed:
@@ -807,9 +989,33 @@ class OPDS2Importer(OPDSImporter):
         :param feed: OPDS 2.0 feed
         :type feed: Union[str, opds2_ast.OPDS2Feed]
 
+        If STREAMING_PARSER is set, publications are decoded one at a
+        time, and only their identifiers and modification dates are
+        looked at.
+
         :return: A list of 2-tuples containing publication's identifiers and their last modified dates
         :rtype: List[Tuple[str, datetime.datetime]]
         """
+        if self.STREAMING_PARSER and is_string(feed):
+            dates = []
+            date_parser = DateTimeParser()
+            for key, publication in self._scan_feed(feed):
+                if key != "publications":
+                    continue
+                metadata = publication.get("metadata") or {}
+                if not metadata.get("modified"):
+                    continue
+                try:
+                    modified = date_parser.parse(metadata["modified"])
+                except BaseError:
+                    self._logger.warning(
+                        "Ignoring invalid modification date %r",
+                        metadata["modified"]
+                    )
+                    continue
+                dates.append((metadata.get("identifier"), modified))
+            return dates
+
         parsed_feed = parse_feed(feed)
 
         if not parsed_feed:
@@ -832,21 +1038,87 @@ class OPDS2Importer(OPDSImporter):
         :param feed_url: Feed URL used to resolve relative links
         :type feed_url: Optional[str]f
         """
-        feed = parse_feed(feed, silent=False)
         publication_metadata_dictionary = {}
         failures = {}
 
-        for publication in self._get_publications(feed):
-            publication_metadata = self._extract_publication_metadata(
-                feed, publication, self.data_source_name
+        if self.STREAMING_PARSER:
+            publication_metadatas = self.extract_feed_data_incrementally(
+                feed, feed_url
+            )
+        else:
+            feed = parse_feed(feed, silent=False)
+            publication_metadatas = (
+                self._extract_publication_metadata(
+                    feed, publication, self.data_source_name
+                )
+                for publication in self._get_publications(feed)
             )
 
+        for publication_metadata in publication_metadatas:
             publication_metadata_dictionary[
                 publication_metadata.primary_identifier.identifier
             ] = publication_metadata
 
         return publication_metadata_dictionary, failures
 
+    def extract_feed_data_incrementally(self, feed, feed_url=None):
+        """Turn an OPDS 2.0 feed into Metadata objects, one publication at a time.
+
+        :param feed: OPDS 2.0 feed
+        :type feed: Union[str, opds2_ast.OPDS2Feed]
+
+        :param feed_url: Feed URL used to resolve relative links
+        :type feed_url: Optional[str]
+
+        :return: An iterable of Metadata objects
+        :rtype: Iterable[Metadata]
+        """
+        for parsed_feed, publication in parse_feed_incrementally(
+            feed, silent=False
+        ):
+            yield self._extract_publication_metadata(
+                parsed_feed, publication, self.data_source_name
+            )
+
+    def import_from_feed(self, feed, feed_url=None):
+        """Import the books in an OPDS 2.0 feed.
+
+        If STREAMING_PARSER is set, the feed is parsed and imported a
+        batch of publications at a time, so the entire feed never has
+        to be held in memory.
+        """
+        if not self.STREAMING_PARSER:
+            return super(OPDS2Importer, self).import_from_feed(feed, feed_url)
+
+        imported_editions = {}
+        pools = {}
+        works = {}
+        failures = {}
+
+        with LookupCache.installed(self._db) as lookups:
+            batch = {}
+            for publication_metadata in self.extract_feed_data_incrementally(
+                feed, feed_url
+            ):
+                batch[
+                    publication_metadata.primary_identifier.identifier
+                ] = publication_metadata
+                if len(batch) >= self.STREAMING_BATCH_SIZE:
+                    self._import_metadata_objs(
+                        batch, failures, imported_editions, pools, works
+                    )
+                    batch = {}
+            if batch:
+                self._import_metadata_objs(
+                    batch, failures, imported_editions, pools, works
+                )
+            self._logger.info(
+                "Lookup cache: %(hits)d hits, %(misses)d misses, %(size)d items",
+                lookups.stats
+            )
+
+        return imported_editions.values(), pools.values(), works.values(), failures
+
 
 class OPDS2ImportMonitor(OPDSImportMonitor):
     PROTOCOL = ExternalIntegration.OPDS2_IMPORT
@@ -1,11 +1,21 @@
+import copy
 import datetime
+import itertools
 import logging
+import threading
+import time
 import traceback
 import urllib
 from io import BytesIO, StringIO
 
 import dateutil
 import feedparser
+import requests
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait,
+)
 from config import CannotLoadConfiguration, IntegrationException
 from coverage import CoverageFailure
 from flask_babel import lazy_gettext as _
@@ -32,9 +42,11 @@ from model import (
     Hyperlink,
     Identifier,
     LicensePool,
+    LookupCache,
     Measurement,
     Representation,
     RightsStatus,
+    SessionManager,
     Subject,
     get_one,
 )
@@ -43,11 +55,17 @@ from monitor import CollectionMonitor
 
 from selftest import HasSelfTests, SelfTestResult
 from six.moves.urllib.parse import urljoin, urlparse
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm.session import Session
-from util.http import HTTP, BadResponseException
+from util.http import (
+    HTTP,
+    BadResponseException,
+    RequestNetworkException,
+)
 from util.opds_writer import OPDSFeed, OPDSMessage
 from util.string_helpers import base64
+from util.worker_pools import DatabaseJob, DatabasePool
 from util.xmlparser import XMLParser
 
 from .classifier import Classifier
@@ -80,6 +98,26 @@ class SimplifiedOPDSLookup(object):
 
     LOOKUP_ENDPOINT = "lookup"
 
+    # Identifiers are sent to the server in batches of at most this
+    # many...
+    URN_BATCH_SIZE = 100
+
+    # ...and the URN arguments for a batch are kept short enough that
+    # the URL won't be rejected.
+    MAX_URN_ARGS_LENGTH = 6000
+
+    # When looking up more than one batch, send this many requests
+    # at once.
+    MAX_CONCURRENT_REQUESTS = 4
+
+    # A request that fails for a reason that might be temporary is
+    # tried this many times in all...
+    MAX_ATTEMPTS = 3
+
+    # ...waiting this many seconds before the first retry, and twice
+    # as long before each retry after that.
+    RETRY_BACKOFF = 1
+
     @classmethod
     def check_content_type(cls, response):
         content_type = response.headers.get('content-type')
@@ -105,27 +143,157 @@ class SimplifiedOPDSLookup(object):
         if not base_url.endswith('/'):
             base_url += "/"
         self.base_url = base_url
+        self.max_concurrent_requests = self.MAX_CONCURRENT_REQUESTS
+        self._local = threading.local()
 
     @property
     def lookup_endpoint(self):
         return self.LOOKUP_ENDPOINT
 
+    @property
+    def http_session(self):
+        """A requests Session for the current thread, so that connections
+        to the server are kept alive between requests.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
     def _get(self, url, **kwargs):
         """Make an HTTP request. This method is overridden in the mock class."""
         kwargs['timeout'] = kwargs.get('timeout', 300)
-        kwargs['allowed_response_codes'] = kwargs.get('allowed_response_codes', [])
-        kwargs['allowed_response_codes'] += ['2xx', '3xx']
-        return HTTP.get_with_timeout(url, **kwargs)
+        # Copy the list, so that retrying doesn't add to it again.
+        kwargs['allowed_response_codes'] = list(
+            kwargs.get('allowed_response_codes', [])
+        ) + ['2xx', '3xx']
+        return HTTP.get_with_timeout(url, session=self.http_session, **kwargs)
+
+    @classmethod
+    def is_transient(cls, exception):
+        """Might a request that raised `exception` succeed if it was
+        tried again?
+        """
+        if isinstance(exception, BadResponseException):
+            status_code = str(exception.status_code)
+            return status_code == '429' or status_code.startswith('5')
+        return isinstance(exception, RequestNetworkException)
+
+    def _with_retries(self, request, url, *args, **kwargs):
+        """Make an HTTP request, trying again with exponential backoff
+        if it fails in a way that might be temporary.
+
+        :param request: The method that makes the request, e.g. self._get.
+        """
+        attempt = 1
+        while True:
+            try:
+                return request(url, *args, **kwargs)
+            except Exception, e:
+                if attempt >= self.MAX_ATTEMPTS or not self.is_transient(e):
+                    raise
+                delay = self.RETRY_BACKOFF * (2 ** (attempt-1))
+                logging.warn(
+                    "Attempt %d to request %s failed (%s), trying again in %.1f sec.",
+                    attempt, url, e, delay
+                )
+                self.sleep(delay)
+                attempt += 1
+
+    def sleep(self, seconds):
+        """This method is overridden in the mock class."""
+        time.sleep(seconds)
 
     def urn_args(self, identifiers):
         return "&".join(set("urn=%s" % i.urn for i in identifiers))
 
+    def urn_batches(self, identifiers, batch_size=None):
+        """Divide identifiers into batches small enough to send to the
+        server in one request. Identifiers with the same URN are only
+        included once.
+
+        :return: A generator of lists of Identifiers.
+        """
+        batch_size = batch_size or self.URN_BATCH_SIZE
+        seen = set()
+        batch = []
+        length = 0
+        for identifier in identifiers:
+            urn = identifier.urn
+            if urn in seen:
+                continue
+            seen.add(urn)
+            arg_length = len("urn=&") + len(urn)
+            if batch and (
+                len(batch) >= batch_size
+                or length + arg_length > self.MAX_URN_ARGS_LENGTH
+            ):
+                yield batch
+                batch = []
+                length = 0
+            batch.append(identifier)
+            length += arg_length
+        if batch:
+            yield batch
+
+    def _concurrently(self, function, items):
+        """Call `function` on each of `items`, with up to
+        `max_concurrent_requests` calls running at once.
+
+        :return: A generator of 2-tuples (item, result), in the order
+            the calls finish. If a call raised an exception, the
+            exception takes the place of its result, so that one
+            failure doesn't stop the rest.
+        """
+        def call(item):
+            try:
+                return function(item)
+            except Exception, e:
+                return e
+
+        if self.max_concurrent_requests <= 1:
+            for item in items:
+                yield item, call(item)
+            return
+
+        items = iter(items)
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrent_requests)
+        try:
+            pending = dict(
+                (executor.submit(call, item), item)
+                for item in itertools.islice(items, self.max_concurrent_requests)
+            )
+            while pending:
+                done, ignore = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    yield item, future.result()
+
+                    # Keep the number of requests in flight constant.
+                    for next_item in itertools.islice(items, 1):
+                        pending[executor.submit(call, next_item)] = next_item
+        finally:
+            executor.shutdown(wait=False)
+
     def lookup(self, identifiers):
         """Retrieve an OPDS feed with metadata for the given identifiers."""
         args = self.urn_args(identifiers)
         url = self.base_url + self.lookup_endpoint + "?" + args
         logging.info("Lookup URL: %s", url)
-        return self._get(url)
+        return self._with_retries(self._get, url)
+
+    def lookup_in_batches(self, identifiers, batch_size=None):
+        """Look up any number of identifiers, a batch at a time, sending
+        several batches at once.
+
+        :return: A generator of 2-tuples (batch, response) as the
+            responses arrive. `batch` is a list of Identifiers. If
+            looking up a batch failed, `response` is the exception.
+        """
+        return self._concurrently(
+            self.lookup, self.urn_batches(identifiers, batch_size)
+        )
 
 
 class MetadataWranglerOPDSLookup(SimplifiedOPDSLookup, HasSelfTests):
@@ -324,9 +492,13 @@ class MetadataWranglerOPDSLookup(SimplifiedOPDSLookup, HasSelfTests):
             headers.update(self.authorization)
             kwargs['headers'] = headers
         kwargs['timeout'] = kwargs.get('timeout', 120)
-        kwargs['allowed_response_codes'] = kwargs.get('allowed_response_codes', [])
-        kwargs['allowed_response_codes'] += ['2xx', '3xx']
-        return HTTP.post_with_timeout(url, data, **kwargs)
+        # Copy the list, so that retrying doesn't add to it again.
+        kwargs['allowed_response_codes'] = list(
+            kwargs.get('allowed_response_codes', [])
+        ) + ['2xx', '3xx']
+        return HTTP.post_with_timeout(
+            url, data, session=self.http_session, **kwargs
+        )
 
     def add_args(self, url, arg_string):
         joiner = '?'
@@ -358,7 +530,18 @@ class MetadataWranglerOPDSLookup(SimplifiedOPDSLookup, HasSelfTests):
         url = self.add_args(add_url, self.urn_args(identifiers))
 
         logging.info("Metadata Wrangler Collection Addition URL: %s", url)
-        return self._post(url)
+        return self._with_retries(self._post, url)
+
+    def add_in_batches(self, identifiers, batch_size=None):
+        """Add any number of items to an authenticated Metadata Wrangler
+        Collection, a batch at a time, sending several batches at once.
+
+        :return: A generator of 2-tuples (batch, response), as with
+            lookup_in_batches().
+        """
+        return self._concurrently(
+            self.add, self.urn_batches(identifiers, batch_size)
+        )
 
     def add_with_metadata(self, feed):
         """Add a feed of items with metadata to an authenticated Metadata Wrangler Collection."""
@@ -380,7 +563,19 @@ class MetadataWranglerOPDSLookup(SimplifiedOPDSLookup, HasSelfTests):
         url = self.add_args(remove_url, self.urn_args(identifiers))
 
         logging.info("Metadata Wrangler Collection Removal URL: %s", url)
-        return self._post(url)
+        return self._with_retries(self._post, url)
+
+    def remove_in_batches(self, identifiers, batch_size=None):
+        """Remove any number of items from an authenticated Metadata
+        Wrangler Collection, a batch at a time, sending several batches
+        at once.
+
+        :return: A generator of 2-tuples (batch, response), as with
+            lookup_in_batches().
+        """
+        return self._concurrently(
+            self.remove, self.urn_batches(identifiers, batch_size)
+        )
 
     def updates(self, last_update_time, **kwargs):
         """Retrieve updated items from an authenticated Metadata
@@ -394,7 +589,7 @@ class MetadataWranglerOPDSLookup(SimplifiedOPDSLookup, HasSelfTests):
             formatted_time = last_update_time.strftime('%Y-%m-%dT%H:%M:%SZ')
             url = self.add_args(url, ('last_update_time='+formatted_time))
         logging.info("Metadata Wrangler Collection Updates URL: %s", url)
-        return self._get(url, **kwargs)
+        return self._with_retries(self._get, url, **kwargs)
 
     def canonicalize_author_name(self, identifier, working_display_name):
         """Attempt to find the canonical name for the author of a book.
@@ -412,16 +607,39 @@ class MetadataWranglerOPDSLookup(SimplifiedOPDSLookup, HasSelfTests):
             args += "&urn=%s" % urllib.quote(identifier.urn)
         url = self.base_url + self.CANONICALIZE_ENDPOINT + "?" + args
         logging.info("GET %s", url)
-        return self._get(url)
+        return self._with_retries(self._get, url)
+
+    def canonicalize_author_names(self, authors):
+        """Attempt to find the canonical names for a number of authors,
+        sending several requests at once.
+
+        :param authors: A list of 2-tuples (identifier,
+            working_display_name), as would be passed into
+            canonicalize_author_name().
+        :return: A generator of 2-tuples ((identifier,
+            working_display_name), response) as the responses
+            arrive. If a request failed, `response` is the exception.
+        """
+        return self._concurrently(
+            lambda author: self.canonicalize_author_name(*author), authors
+        )
 
 
 class MockSimplifiedOPDSLookup(SimplifiedOPDSLookup):
 
+    # Requests are made one at a time, so responses come back in the
+    # order they were queued.
+    MAX_CONCURRENT_REQUESTS = 1
+
     def __init__(self, *args, **kwargs):
         self.requests = []
         self.responses = []
+        self.sleeps = []
         super(MockSimplifiedOPDSLookup, self).__init__(*args, **kwargs)
 
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
     def queue_response(self, status_code, headers={}, content=None):
         from testing import MockRequestsResponse
         self.responses.insert(
@@ -573,6 +791,11 @@ class OPDSImporter(object):
     # when they show up in <simplified:message> tags.
     SUCCESS_STATUS_CODES = None
 
+    # If this is True, extract_feed_data() reads a feed in a single
+    # streaming pass with lxml, rather than parsing it once with
+    # feedparser and again with lxml.
+    SINGLE_PASS_PARSER = False
+
     def __init__(self, _db, collection, data_source_name=None,
                  identifier_mapping=None, http_get=None,
                  metadata_client=None, content_modifier=None,
@@ -609,6 +832,12 @@ class OPDSImporter(object):
         """
         self._db = _db
         self.log = logging.getLogger("OPDS Importer")
+
+        # The same Subjects, Contributors and Identifiers come up
+        # again and again during an import, so keep the most recently
+        # used ones in memory for as long as the session lasts.
+        LookupCache.install(_db)
+
         self._collection_id = collection.id if collection else None
         if self.collection and not data_source_name:
             # Use the Collection data_source for OPDS import.
@@ -775,6 +1004,38 @@ class OPDSImporter(object):
         # If parsing the overall feed throws an exception, we should address that before
         # moving on. Let the exception propagate.
         metadata_objs, failures = self.extract_feed_data(feed, feed_url)
+
+        with LookupCache.installed(self._db) as lookups:
+            self._import_metadata_objs(
+                metadata_objs, failures, imported_editions, pools, works
+            )
+            self.log.info(
+                "Lookup cache: %(hits)d hits, %(misses)d misses, %(size)d items",
+                lookups.stats
+            )
+
+        return imported_editions.values(), pools.values(), works.values(), failures
+
+    def _import_metadata_objs(
+            self, metadata_objs, failures, imported_editions, pools, works
+    ):
+        """Import a number of Metadata objects, keyed by identifier.
+
+        Editions, pools and works are added to the dictionaries passed
+        in, as are any new CoverageFailures.
+        """
+        # Find or create the database objects needed by every item on
+        # the page in a few queries, rather than a few queries per item.
+        metadatas = [metadata for key, metadata in metadata_objs.items()
+                     if key not in failures]
+        Metadata.prepare_to_apply(self._db, metadatas)
+
+        # If any authors need their names canonicalized, ask the
+        # metadata wrangler about all of them at once.
+        if self.metadata_client:
+            Metadata.find_sort_names(
+                self._db, metadatas, self.metadata_client
+            )
         # make editions.  if have problem, make sure associated pool and work aren't created.
         for key, metadata in metadata_objs.iteritems():
             # key is identifier.urn here
@@ -814,8 +1075,6 @@ class OPDSImporter(object):
                 failure = CoverageFailure(identifier, traceback.format_exc(), data_source=data_source, transient=False)
                 failures[key] = failure
 
-        return imported_editions.values(), pools.values(), works.values(), failures
-
     def import_edition_from_metadata(
             self, metadata
     ):
@@ -944,11 +1203,18 @@ class OPDSImporter(object):
         with associated messages and next_links.
         """
         data_source = self.data_source
-        fp_metadata, fp_failures = self.extract_data_from_feedparser(feed=feed, data_source=data_source)
-        # gets: medium, measurements, links, contributors, etc.
-        xml_data_meta, xml_failures = self.extract_metadata_from_elementtree(
-            feed, data_source=data_source, feed_url=feed_url, do_get=self.http_get
-        )
+        if self.SINGLE_PASS_PARSER:
+            (fp_metadata, fp_failures, xml_data_meta,
+             xml_failures) = self.extract_data_in_one_pass(
+                 feed, data_source=data_source, feed_url=feed_url,
+                 do_get=self.http_get
+             )
+        else:
+            fp_metadata, fp_failures = self.extract_data_from_feedparser(feed=feed, data_source=data_source)
+            # gets: medium, measurements, links, contributors, etc.
+            xml_data_meta, xml_failures = self.extract_metadata_from_elementtree(
+                feed, data_source=data_source, feed_url=feed_url, do_get=self.http_get
+            )
 
         if self.map_from_collection:
             # Build the identifier_mapping based on the Collection.
@@ -1128,12 +1394,13 @@ class OPDSImporter(object):
                 pass
         return new_dict
 
-    def extract_data_from_feedparser(self, feed, data_source):
+    @classmethod
+    def extract_data_from_feedparser(cls, feed, data_source):
         feedparser_parsed = feedparser.parse(feed)
         values = {}
         failures = {}
         for entry in feedparser_parsed['entries']:
-            identifier, detail, failure = self.data_detail_for_feedparser_entry(entry=entry, data_source=data_source)
+            identifier, detail, failure = cls.data_detail_for_feedparser_entry(entry=entry, data_source=data_source)
 
             if identifier:
                 if failure:
@@ -1208,6 +1475,230 @@ class OPDSImporter(object):
                     values[identifier] = detail
         return values, failures
 
+    @classmethod
+    def extract_data_in_one_pass(cls, feed, data_source, feed_url=None,
+                                 do_get=None):
+        """Parse an OPDS feed in a single streaming pass with lxml.
+
+        This gathers the same information as
+        extract_data_from_feedparser() and
+        extract_metadata_from_elementtree() put together. Each <entry>
+        tag is thrown away as soon as it has been processed, so memory
+        use doesn't grow with the size of the feed.
+
+        A relative link can only be resolved against a feed's self
+        link if the self link comes before the entries, as it does in
+        practice.
+
+        :return: A 4-tuple (feedparser_values, feedparser_failures,
+            elementtree_values, elementtree_failures), in the formats
+            returned by extract_data_from_feedparser() and
+            extract_metadata_from_elementtree().
+        """
+        parser = cls.PARSER_CLASS()
+        atom = parser.NAMESPACES['atom']
+        feed_tag_name = '{%s}feed' % atom
+        entry_tag_name = '{%s}entry' % atom
+        link_tag_name = '{%s}link' % atom
+        message_tag_name = '{%s}message' % parser.NAMESPACES['simplified']
+
+        fp_values = {}
+        fp_failures = {}
+        xml_values = {}
+        message_failures = {}
+        entry_failures = {}
+
+        if isinstance(feed, bytes):
+            inp = BytesIO(feed)
+        else:
+            inp = StringIO(feed)
+        tags = etree.iterparse(
+            inp, events=('end',),
+            tag=(entry_tag_name, link_tag_name, message_tag_name)
+        )
+        for event, tag in tags:
+            parent = tag.getparent()
+            if (parent is None or parent.tag != feed_tag_name
+                or parent.getparent() is not None):
+                # This tag is inside an <entry>, or somewhere else we
+                # don't care about.
+                continue
+
+            if tag.tag == link_tag_name:
+                if not feed_url and tag.get('rel') == 'self':
+                    feed_url = tag.get('href')
+            elif tag.tag == message_tag_name:
+                message = cls.extract_message(parser, tag)
+                failure = cls.coveragefailure_from_message(
+                    data_source, message
+                )
+                if isinstance(failure, Identifier):
+                    message_failures[failure.urn] = failure
+                elif failure:
+                    message_failures[failure.obj.urn] = failure
+            else:
+                entry = cls.feedparser_entry_from_elementtree(parser, tag)
+                identifier, detail, failure = cls.data_detail_for_feedparser_entry(
+                    entry=entry, data_source=data_source
+                )
+                if identifier:
+                    if failure:
+                        fp_failures[identifier] = failure
+                    elif detail:
+                        fp_values[identifier] = detail
+                else:
+                    logging.error(
+                        "Tried to parse an element without a valid identifier."
+                    )
+
+                identifier, detail, failure = cls.detail_for_elementtree_entry(
+                    parser, tag, data_source, feed_url, do_get=do_get
+                )
+                if identifier:
+                    if failure:
+                        entry_failures[identifier] = failure
+                    if detail:
+                        xml_values[identifier] = detail
+
+            # We're done with this tag and everything that came
+            # before it.
+            tag.clear()
+            while tag.getprevious() is not None:
+                del parent[0]
+
+        # As in extract_metadata_from_elementtree, a failure associated
+        # with an <entry> takes precedence over a <simplified:message>.
+        xml_failures = dict(message_failures)
+        xml_failures.update(entry_failures)
+        return fp_values, fp_failures, xml_values, xml_failures
+
+    # feedparser's names for the types of Atom text constructs.
+    TEXT_CONSTRUCT_TYPES = {
+        'text': 'text/plain',
+        'html': 'text/html',
+        'xhtml': 'application/xhtml+xml',
+    }
+
+    @classmethod
+    def feedparser_entry_from_elementtree(cls, parser, entry_tag):
+        """Extract the information feedparser would have extracted from
+        an <atom:entry> tag.
+
+        :return: A dictionary that can be passed into
+            data_detail_for_feedparser_entry() in place of a
+            feedparser entry.
+        """
+        entry = dict()
+
+        def subtag(tag, path):
+            # lxml gives ASCII text as str, but feedparser always
+            # gives unicode.
+            value = parser.text_of_optional_subtag(tag, path)
+            if value is not None:
+                value = unicode(value)
+            return value
+
+        identifier = subtag(entry_tag, 'atom:id')
+        if identifier and identifier.strip():
+            entry['id'] = identifier.strip()
+
+        title = parser._xpath1(entry_tag, 'atom:title')
+        if title is not None:
+            entry['title'] = cls._text_construct(title)['value']
+
+        for key, path in (
+            ('schema_alternativeheadline', 'schema:alternativeHeadline'),
+            ('publisher', 'dc:publisher'),
+            ('dcterms_publisher', 'dcterms:publisher'),
+            ('language', 'dc:language'),
+            ('dcterms_language', 'dcterms:language'),
+        ):
+            value = subtag(entry_tag, path)
+            if value is not None:
+                entry[key] = value.strip()
+
+        # As with feedparser, a publication date stands in for a
+        # missing update date.
+        for path in ('atom:published', 'dcterms:issued', 'atom:updated',
+                     'dcterms:modified', 'dc:date'):
+            value = subtag(entry_tag, path)
+            if value:
+                entry['updated_parsed'] = feedparser._parse_date(
+                    value.strip()
+                )
+
+        for path in ('atom:rights', 'dc:rights'):
+            rights = parser._xpath1(entry_tag, path)
+            if rights is not None:
+                entry['rights'] = cls._text_construct(rights)['value']
+                break
+
+        # feedparser treats every <summary> after the first one as
+        # <content>.
+        content = []
+        for tag in parser._xpath(entry_tag, 'atom:summary|atom:content'):
+            detail = cls._text_construct(tag)
+            if (tag.tag.endswith('summary')
+                and 'summary_detail' not in entry):
+                entry['summary_detail'] = detail
+            else:
+                content.append(detail)
+        if content:
+            entry['content'] = content
+
+        # feedparser names tags in unfamiliar namespaces, like
+        # <bibframe:distribution>, after the prefix used in the document.
+        for tag in entry_tag:
+            if (not isinstance(tag.tag, basestring) or tag.prefix != 'bibframe'
+                or etree.QName(tag).localname != 'distribution'):
+                continue
+            prefixes = dict((v, k) for k, v in tag.nsmap.items())
+            attributes = dict()
+            for name, value in tag.attrib.items():
+                name = etree.QName(name)
+                key = name.localname.lower()
+                attributes[key] = unicode(value)
+                prefix = prefixes.get(name.namespace)
+                if prefix:
+                    attributes['%s:%s' % (prefix, key)] = unicode(value)
+            entry['bibframe_distribution'] = attributes
+        return entry
+
+    @classmethod
+    def _text_construct(cls, tag):
+        """Extract the value of an Atom text construct (e.g. <title>) the
+        way feedparser does.
+
+        :return: A dictionary with keys 'type' and 'value'.
+        """
+        type = tag.get('type', 'text')
+        type = cls.TEXT_CONSTRUCT_TYPES.get(type, type)
+        if type == 'application/xhtml+xml':
+            # The value is the markup inside the enclosing <div>.
+            container = tag
+            children = list(tag)
+            if (len(children) == 1 and not (tag.text or '').strip()
+                and etree.QName(children[0]).localname == 'div'):
+                container = children[0]
+            container = copy.deepcopy(container)
+            for element in container.iter(tag=etree.Element):
+                element.tag = etree.QName(element).localname
+            etree.cleanup_namespaces(container)
+            value = (container.text or u'') + u''.join(
+                etree.tostring(x, encoding=unicode) for x in container
+            )
+        else:
+            value = unicode(tag.text or u'')
+        value = value.strip()
+        if value and type in ('text/html', 'application/xhtml+xml'):
+            value = feedparser._resolveRelativeURIs(
+                value, tag.base or u'', 'utf-8', type
+            )
+            value = feedparser._sanitizeHTML(value, 'utf-8', type)
+            if not isinstance(value, unicode):
+                value = value.decode('utf-8', 'ignore')
+        return dict(type=type, value=value)
+
     @classmethod
     def _datetime(cls, entry, key):
         value = entry.get(key, None)
@@ -1385,33 +1876,37 @@ class OPDSImporter(object):
         """
         path = '/atom:feed/simplified:message'
         for message_tag in parser._xpath(feed_tag, path):
+            yield cls.extract_message(parser, message_tag)
 
-            # First thing to do is determine which Identifier we're
-            # talking about.
-            identifier_tag = parser._xpath1(message_tag, 'atom:id')
-            if identifier_tag is None:
-                urn = None
-            else:
-                urn = identifier_tag.text
+    @classmethod
+    def extract_message(cls, parser, message_tag):
+        """Convert a <simplified:message> tag into an OPDSMessage object."""
+        # First thing to do is determine which Identifier we're
+        # talking about.
+        identifier_tag = parser._xpath1(message_tag, 'atom:id')
+        if identifier_tag is None:
+            urn = None
+        else:
+            urn = identifier_tag.text
 
-            # What status code is associated with the message?
-            status_code_tag = parser._xpath1(message_tag, 'simplified:status_code')
-            if status_code_tag is None:
+        # What status code is associated with the message?
+        status_code_tag = parser._xpath1(message_tag, 'simplified:status_code')
+        if status_code_tag is None:
+            status_code = None
+        else:
+            try:
+                status_code = int(status_code_tag.text)
+            except ValueError:
                 status_code = None
-            else:
-                try:
-                    status_code = int(status_code_tag.text)
-                except ValueError:
-                    status_code = None
-
-            # What is the human-readable message?
-            description_tag = parser._xpath1(message_tag, 'schema:description')
-            if description_tag is None:
-                description = ''
-            else:
-                description = description_tag.text
 
-            yield OPDSMessage(urn, status_code, description)
+        # What is the human-readable message?
+        description_tag = parser._xpath1(message_tag, 'schema:description')
+        if description_tag is None:
+            description = ''
+        else:
+            description = description_tag.text
+
+        return OPDSMessage(urn, status_code, description)
 
     @classmethod
     def coveragefailures_from_messages(cls, data_source, parser, feed_tag):
@@ -1821,8 +2316,19 @@ class OPDSImportMonitor(CollectionMonitor, HasSelfTests):
     # specialize OPDS import should override this.
     PROTOCOL = ExternalIntegration.OPDS_IMPORT
 
+    # The number of threads to use when importing the pages of a
+    # feed. If this is more than one, pages are imported in parallel,
+    # each in its own database session. See OPDSImportPageJob.
+    IMPORT_WORKERS = 1
+
+    # In parallel mode, the number of times to try importing a page
+    # that ran into trouble with the database--most likely because
+    # another page was creating the same objects at the same time.
+    IMPORT_ATTEMPTS = 3
+
     def __init__(self, _db, collection, import_class,
-                 force_reimport=False, **import_class_kwargs):
+                 force_reimport=False, import_workers=None,
+                 **import_class_kwargs):
         if not collection:
             raise ValueError(
                 "OPDSImportMonitor can only be run in the context of a Collection."
@@ -1848,6 +2354,12 @@ class OPDSImportMonitor(CollectionMonitor, HasSelfTests):
         self.password = collection.external_integration.password
         self.custom_accept_header = collection.external_integration.custom_accept_header
 
+        self.import_workers = import_workers or self.IMPORT_WORKERS
+
+        # Keep track of how to create an importer, so that each worker
+        # can create one for its own database session.
+        self.import_class = import_class
+        self.import_class_kwargs = import_class_kwargs
         self.importer = import_class(
             _db, collection=collection,
             **import_class_kwargs
@@ -2069,18 +2581,25 @@ class OPDSImportMonitor(CollectionMonitor, HasSelfTests):
 
     def import_one_feed(self, feed):
         """Import every book mentioned in an OPDS feed."""
+        return self._import_one_feed(
+            self.importer, feed, self.opds_url(self.collection)
+        )
 
+    def _import_one_feed(self, importer, feed, feed_url):
+        """Import every book mentioned in an OPDS feed, using the
+        given importer.
+        """
         # Because we are importing into a Collection, we will immediately
         # mark a book as presentation-ready if possible.
-        imported_editions, pools, works, failures = self.importer.import_from_feed(
+        imported_editions, pools, works, failures = importer.import_from_feed(
             feed,
-            feed_url=self.opds_url(self.collection)
+            feed_url=feed_url
         )
 
         # Create CoverageRecords for the successful imports.
         for edition in imported_editions:
             record = CoverageRecord.add_for(
-                edition, self.importer.data_source,
+                edition, importer.data_source,
                 CoverageRecord.IMPORT_OPERATION,
                 status=CoverageRecord.SUCCESS
             )
@@ -2092,6 +2611,15 @@ class OPDSImportMonitor(CollectionMonitor, HasSelfTests):
             )
         return imported_editions, failures
 
+    def importer_for_session(self, _db):
+        """Create an importer like self.importer, but for a different
+        database session.
+        """
+        collection = get_one(_db, Collection, id=self.collection_id)
+        return self.import_class(
+            _db, collection=collection, **self.import_class_kwargs
+        )
+
     def _get_feeds(self):
         feeds = []
         queue = [self.feed_url]
@@ -2122,18 +2650,161 @@ class OPDSImportMonitor(CollectionMonitor, HasSelfTests):
 
     def run_once(self, progress_ignore):
         feeds = self._get_feeds()
+        if self.import_workers > 1:
+            return self.import_feeds_in_parallel(feeds)
+
         total_imported = 0
         total_failures = 0
 
         for link, feed in feeds:
             self.log.info("Importing next feed: %s", link)
+            start = time.time()
             imported_editions, failures = self.import_one_feed(feed)
             total_imported += len(imported_editions)
             total_failures += len(failures)
             self._db.commit()
+            self.log.info(
+                "Imported %s in %.2fs: %d items, %d failures.", link,
+                time.time() - start, len(imported_editions), len(failures)
+            )
 
         achievements = "Items imported: %d. Failures: %d." % (
             total_imported, total_failures
         )
 
         return TimestampData(achievements=achievements)
+
+    def import_feeds_in_parallel(self, feeds, pool=None):
+        """Import a number of feed pages using a pool of worker threads.
+
+        Pages are imported in waves. A page that mentions a book
+        mentioned on an earlier page won't be imported until the
+        earlier page has been imported, so that the most recent
+        information about a book is applied last. Pages in the
+        same wave have no books in common, so they can be imported at
+        the same time.
+
+        :param feeds: A list of 2-tuples (link, feed), in the order the
+            pages should be imported.
+        :param pool: A DatabasePool (or other) object for use in testing
+            environments.
+        :return: A TimestampData.
+        """
+        feeds = list(feeds)
+        jobs = [
+            OPDSImportPageJob(self, link, feed, self.IMPORT_ATTEMPTS)
+            for link, feed in feeds
+        ]
+        waves = self.import_waves(
+            [self.identifiers_on_page(feed) for link, feed in feeds]
+        )
+
+        # Anything the workers need to see has to be committed first.
+        self._db.commit()
+        if pool is None:
+            pool = DatabasePool(
+                self.import_workers,
+                SessionManager.sessionmaker(session=self._db)
+            )
+        with pool as job_queue:
+            for wave in waves:
+                for index in wave:
+                    job_queue.put(jobs[index])
+                # Wait for this wave to finish before starting the next.
+                job_queue.join()
+
+        total_imported = sum(job.imported for job in jobs)
+        total_failures = sum(job.failures for job in jobs)
+        achievements = "Items imported: %d. Failures: %d." % (
+            total_imported, total_failures
+        )
+        pages_failed = len([job for job in jobs if not job.finished])
+        if pages_failed:
+            achievements += " Pages that could not be imported: %d." % (
+                pages_failed
+            )
+        return TimestampData(achievements=achievements)
+
+    def identifiers_on_page(self, feed):
+        """Find the identifiers of the books on a page that has a
+        last-updated date. These are the books for which it matters
+        which page is imported first.
+        """
+        return set(
+            identifier for identifier, updated
+            in self.importer.extract_last_update_dates(feed)
+        )
+
+    @classmethod
+    def import_waves(cls, identifier_sets):
+        """Divide feed pages into waves that can be imported in parallel.
+
+        :param identifier_sets: A list containing the set of identifiers
+            on each page, in the order the pages should be imported.
+        :return: A list of lists of indexes into `identifier_sets`.
+        """
+        waves = []
+        last_wave = {}
+        for index, identifiers in enumerate(identifier_sets):
+            # A page has to go in a later wave than any earlier page
+            # that shares a book with it.
+            wave = max(
+                [last_wave.get(identifier, -1) for identifier in identifiers]
+                + [-1]
+            ) + 1
+            for identifier in identifiers:
+                last_wave[identifier] = wave
+            if wave == len(waves):
+                waves.append([])
+            waves[wave].append(index)
+        return waves
+
+
+class OPDSImportPageJob(DatabaseJob):
+    """Import one page of an OPDS feed in a worker thread, using the
+    worker's database session.
+    """
+
+    def __init__(self, monitor, link, feed, max_attempts=1):
+        self.monitor = monitor
+        self.link = link
+        self.feed = feed
+        self.max_attempts = max_attempts
+
+        self.attempts = 0
+        self.finished = False
+        self.imported = 0
+        self.failures = 0
+        self.elapsed = None
+
+    def do_run(self, _db):
+        log = self.monitor.log
+        start = time.time()
+        while True:
+            self.attempts += 1
+            try:
+                importer = self.monitor.importer_for_session(_db)
+                imported_editions, failures = self.monitor._import_one_feed(
+                    importer, self.feed, self.monitor.feed_url
+                )
+                _db.commit()
+                break
+            except SQLAlchemyError, e:
+                # Most likely another worker created some of the same
+                # objects at the same time. Try again from scratch.
+                _db.rollback()
+                if self.attempts >= self.max_attempts:
+                    raise
+                log.warn(
+                    "Database error importing %s (attempt %d of %d), trying again: %r",
+                    self.link, self.attempts, self.max_attempts, e
+                )
+        self.elapsed = time.time() - start
+        self.imported = len(imported_editions)
+        self.failures = len(failures)
+        self.finished = True
+        log.info(
+            "Imported %s in %.2fs (%d attempt(s)): %d items, %d failures.",
+            self.link, self.elapsed, self.attempts, self.imported,
+            self.failures
+        )
@@ -7,6 +7,15 @@ import logging
 import urlparse
 import urllib
 import sys
+from Queue import (
+    Empty,
+    Full,
+    Queue,
+)
+from threading import (
+    Event,
+    Thread,
+)
 
 from sqlalchemy.orm.exc import (
     NoResultFound,
@@ -50,12 +59,16 @@ from metadata_layer import (
     MeasurementData,
     LinkData,
     SubjectData,
+    TimestampData,
 )
 
 from coverage import (
     BibliographicCoverageProvider,
+    CoverageFailure,
 )
 
+from monitor import CollectionMonitor
+
 from testing import DatabaseTest
 
 from util.http import (
@@ -63,7 +76,10 @@ from util.http import (
     BadResponseException,
 )
 from util.string_helpers import base64
-from util.worker_pools import RLock
+from util.worker_pools import (
+    RateLimiter,
+    RLock,
+)
 
 from testing import MockRequestsResponse
 
@@ -112,6 +128,8 @@ class OverdriveAPI(object):
     METADATA_ENDPOINT = "%(host)s/v1/collections/%(collection_token)s/products/%(item_id)s/metadata"
     EVENTS_ENDPOINT = "%(host)s/v1/collections/%(collection_token)s/products?lastUpdateTime=%(lastupdatetime)s&sort=%(sort)s&limit=%(limit)s"
     AVAILABILITY_ENDPOINT = "%(host)s/v2/collections/%(collection_token)s/products/%(product_id)s/availability"
+    BULK_AVAILABILITY_ENDPOINT = "%(host)s/v2/collections/%(collection_token)s/availability?products=%(product_ids)s"
+    BULK_METADATA_ENDPOINT = "%(host)s/v1/collections/%(collection_token)s/bulkmetadata?reserveIds=%(product_ids)s"
 
     PATRON_INFORMATION_ENDPOINT = "%(patron_host)s/v1/patrons/me"
     CHECKOUTS_ENDPOINT = "%(patron_host)s/v1/patrons/me/checkouts"
@@ -124,6 +142,10 @@ class OverdriveAPI(object):
     MAX_CREDENTIAL_AGE = 50 * 60
 
     PAGE_SIZE_LIMIT = 300
+
+    # The bulk availability and bulk metadata endpoints accept this
+    # many product IDs per request.
+    BULK_LOOKUP_LIMIT = 25
     EVENT_SOURCE = "Overdrive"
 
     EVENT_DELAY = datetime.timedelta(minutes=120)
@@ -417,16 +439,15 @@ class OverdriveAPI(object):
             )
 
     def all_ids(self):
-        """Get IDs for every book in the system, with the most recently added
-        ones at the front.
-        """
-        next_link = self._all_products_link
-        while next_link:
-            page_inventory, next_link = self._get_book_list_page(
-                next_link, 'next'
-            )
+        """Get IDs for every book in the system.
 
-            for i in page_inventory:
+        Pages of inventory are fetched several at a time by an
+        OverdriveInventoryCrawler, so books don't necessarily come out
+        in Overdrive's order (most recently added first).
+        """
+        crawler = OverdriveInventoryCrawler(self)
+        for offset, availability in crawler.crawl():
+            for i in availability:
                 yield i
 
     @property
@@ -438,6 +459,18 @@ class OverdriveAPI(object):
         )
         return self.make_link_safe(url)
 
+    def all_products_page_link(self, offset, limit=PAGE_SIZE_LIMIT):
+        """Find the link to a specific page of the collection's inventory,
+        with the most recently added books at the front.
+
+        This lets us fetch any page directly, rather than following
+        'next' links from the first page.
+        """
+        url = self._all_products_link + "&offset=%d&limit=%d" % (
+            offset, limit
+        )
+        return url
+
     def _get_book_list_page(self, link, rel_to_follow='next'):
         """Process a page of inventory whose circulation we need to check.
 
@@ -509,6 +542,85 @@ class OverdriveAPI(object):
             content = json.loads(content)
         return content
 
+    def metadata_lookup_batch(self, identifiers):
+        """Look up metadata for many Overdrive identifiers, using as few
+        HTTP requests as possible.
+
+        :param identifiers: A list of Identifiers.
+        :return: A dictionary mapping each Overdrive ID (lowercased) to
+            the metadata Overdrive sent for it. IDs Overdrive didn't
+            mention will not be present.
+        """
+        product_ids = [x.identifier for x in identifiers]
+        results = dict()
+        for content in self._bulk_lookup(
+            self.BULK_METADATA_ENDPOINT, product_ids
+        ):
+            for info in content.get('metadata', []):
+                self._add_to_bulk_results(results, info)
+        return results
+
+    def availability_lookup_batch(self, product_ids):
+        """Look up availability information for many Overdrive products,
+        using as few HTTP requests as possible.
+
+        :param product_ids: A list of Overdrive IDs.
+        :return: A dictionary mapping each Overdrive ID (lowercased) to
+            the availability information Overdrive sent for it.
+        """
+        results = dict()
+        for content in self._bulk_lookup(
+            self.BULK_AVAILABILITY_ENDPOINT, product_ids
+        ):
+            for info in content.get('availability', []):
+                self._add_to_bulk_results(results, info)
+        return results
+
+    def circulation_lookup_batch(self, product_ids):
+        """Turn bulk availability information into CirculationData.
+
+        :param product_ids: A list of Overdrive IDs.
+        :yield: A sequence of CirculationData objects.
+        """
+        extractor = OverdriveRepresentationExtractor(self)
+        availability = self.availability_lookup_batch(product_ids)
+        for product_id in product_ids:
+            book = availability.get(product_id.lower())
+            if book is None:
+                continue
+            circulation = extractor.book_info_to_circulation(book)
+            if circulation:
+                yield circulation
+
+    def _bulk_lookup(self, url_template, product_ids):
+        """Send product IDs to a bulk lookup endpoint, BULK_LOOKUP_LIMIT
+        at a time.
+
+        :yield: A sequence of parsed JSON documents, one per request.
+        """
+        for i in range(0, len(product_ids), self.BULK_LOOKUP_LIMIT):
+            batch = product_ids[i:i+self.BULK_LOOKUP_LIMIT]
+            url = self.endpoint(
+                url_template,
+                collection_token=self.collection_token,
+                product_ids=",".join(batch),
+            )
+            status_code, headers, content = self.get(url, {})
+            if status_code != 200:
+                raise BadResponseException.from_response(
+                    url, "Bulk lookup failed", (status_code, headers, content)
+                )
+            if isinstance(content, basestring):
+                content = json.loads(content)
+            yield content
+
+    @classmethod
+    def _add_to_bulk_results(cls, results, info):
+        """File a bulk lookup result under its (lowercased) Overdrive ID."""
+        product_id = info.get('id') or info.get('reserveId')
+        if product_id:
+            results[product_id.lower()] = info
+
     def metadata_lookup_obj(self, identifier):
         url = self.endpoint(
             self.METADATA_ENDPOINT,
@@ -1303,6 +1415,305 @@ class OverdriveAdvantageAccount(object):
         return parent, child
 
 
+class OverdriveInventoryCrawler(object):
+    """Fetch every page of an Overdrive collection's inventory, several
+    pages at a time.
+
+    Overdrive's products endpoint accepts `offset` and `limit`, so
+    once the first page tells us how many books are in the collection,
+    we can calculate the link to every other page up front instead of
+    following 'next' links one page at a time.
+
+    Worker threads never touch the database. Refreshing the Bearer
+    Token means looking up a Credential, so a worker that finds its
+    token has expired hands the page back to the calling thread,
+    which refreshes the token and fetches the page itself.
+    """
+
+    log = logging.getLogger("Overdrive inventory crawler")
+
+    class TokenExpired(Exception):
+        """A worker thread was turned away because the Bearer Token
+        has expired.
+        """
+        def __init__(self, token):
+            super(OverdriveInventoryCrawler.TokenExpired, self).__init__(
+                "Bearer Token has expired"
+            )
+            self.token = token
+
+    DEFAULT_THREADS = 5
+    DEFAULT_REQUESTS_PER_SECOND = 5
+
+    # The maximum number of pages of availability information that may
+    # be fetched but not yet processed.
+    DEFAULT_QUEUE_SIZE = 10
+
+    def __init__(self, api, page_size=None, threads=None,
+                 requests_per_second=None, queue_size=None):
+        """Constructor.
+
+        :param api: An OverdriveAPI.
+        :param page_size: Ask for this many books per page.
+        :param threads: Fetch this many pages at once.
+        :param requests_per_second: Make no more than this many
+            requests per second, across all threads.
+        :param queue_size: Stop fetching pages when this many pages
+            are waiting to be processed.
+        """
+        self.api = api
+        self.page_size = page_size or api.PAGE_SIZE_LIMIT
+        self.threads = threads or self.DEFAULT_THREADS
+        self.rate_limiter = RateLimiter(
+            requests_per_second or self.DEFAULT_REQUESTS_PER_SECOND
+        )
+        self.queue_size = queue_size or self.DEFAULT_QUEUE_SIZE
+
+        # The offset of the first page that has not been completely
+        # processed. A crawl that starts at this offset will not miss
+        # anything.
+        self.checkpoint = 0
+        self._completed = set()
+
+    def get_page(self, offset, refresh_token=True):
+        """Retrieve one page of inventory.
+
+        :param refresh_token: If this is True, the Bearer Token will be
+            refreshed if it has expired. This uses the database, so
+            worker threads must pass in False.
+        :return: A 2-tuple (total_items, availability_info).
+           `total_items` is the number of books in the collection.
+           `availability_info` is a list of dictionaries, as returned by
+           OverdriveRepresentationExtractor.availability_link_list.
+        :raise TokenExpired: If the Bearer Token has expired and
+            `refresh_token` is False.
+        """
+        self.rate_limiter.wait()
+        link = self.api.all_products_page_link(offset, self.page_size)
+
+        if refresh_token:
+            # api.get() will take care of refreshing the Bearer Token if
+            # necessary.
+            status_code, headers, content = self.api.get(link, {})
+        else:
+            # The calling thread has already made sure there's a
+            # token, so this doesn't need the database.
+            token = self.api.token
+            status_code, headers, content = self.api._do_get(
+                link, dict(Authorization="Bearer %s" % token)
+            )
+            if status_code == 401:
+                raise self.TokenExpired(token)
+        if status_code != 200:
+            raise BadResponseException.from_response(
+                link, "Could not retrieve inventory page",
+                (status_code, headers, content)
+            )
+        if isinstance(content, basestring):
+            content = json.loads(content)
+        availability = (
+            OverdriveRepresentationExtractor.availability_link_list(content)
+        )
+        return content.get('totalItems', 0), availability
+
+    def page_offsets(self, total_items, start_offset=0):
+        """Calculate the offsets of every page after the one at
+        `start_offset`.
+        """
+        return range(start_offset + self.page_size, total_items, self.page_size)
+
+    def crawl(self, start_offset=0):
+        """Fetch every page of inventory from `start_offset` onwards.
+
+        The first page is fetched on the calling thread; the rest are
+        fetched by worker threads, and may arrive in any order.
+
+        :yield: A sequence of 2-tuples (offset, availability_info). By
+            the time the caller asks for the next page, it's assumed the
+            previous page has been completely processed, and
+            .checkpoint is updated accordingly.
+        """
+        self.checkpoint = start_offset
+        self._completed = set()
+
+        # Fetching the first page tells us how big the collection is.
+        # It also makes sure we have a Bearer Token and a collection
+        # token before any worker threads need them.
+        total_items, availability = self.get_page(start_offset)
+        yield start_offset, availability
+        self._page_done(start_offset)
+
+        offsets = self.page_offsets(total_items, start_offset)
+        if not offsets:
+            return
+        self.log.info(
+            "Fetching %d more pages of inventory (%d books total).",
+            len(offsets), total_items
+        )
+
+        todo = Queue()
+        for offset in offsets:
+            todo.put(offset)
+        results = Queue(maxsize=self.queue_size)
+        stop = Event()
+        for i in range(min(self.threads, len(offsets))):
+            thread = Thread(target=self._fetch_pages, args=(todo, results, stop))
+            thread.daemon = True
+            thread.start()
+
+        try:
+            for i in range(len(offsets)):
+                offset, availability, exception = results.get()
+                if isinstance(exception, self.TokenExpired):
+                    # Refresh the token here, where it's safe to use
+                    # the database, unless that was already done for
+                    # another page. Workers pick up the new token for
+                    # their next request.
+                    if exception.token == self.api.token:
+                        self.api.check_creds(True)
+                    ignore, availability = self.get_page(offset)
+                elif exception is not None:
+                    raise exception
+                yield offset, availability
+                self._page_done(offset)
+        finally:
+            # Whether we finished or gave up, tell the worker threads
+            # to stop.
+            stop.set()
+
+    def _fetch_pages(self, todo, results, stop):
+        """Fetch pages until there are no more pages to fetch or the
+        crawl is stopped.
+        """
+        while not stop.is_set():
+            try:
+                offset = todo.get_nowait()
+            except Empty:
+                return
+            try:
+                total_items, availability = self.get_page(
+                    offset, refresh_token=False
+                )
+                result = (offset, availability, None)
+            except self.TokenExpired, e:
+                result = (offset, None, e)
+            except Exception, e:
+                self.log.error(
+                    "Error fetching inventory page at offset %d", offset,
+                    exc_info=e
+                )
+                result = (offset, None, e)
+
+            # Wait for room in the queue, but don't wait forever if
+            # the crawl is stopped.
+            while not stop.is_set():
+                try:
+                    results.put(result, timeout=1)
+                    break
+                except Full:
+                    continue
+
+    def _page_done(self, offset):
+        """Record that the page at `offset` has been processed, and move
+        the checkpoint past every page that has been processed.
+        """
+        self._completed.add(offset)
+        while self.checkpoint in self._completed:
+            self._completed.remove(self.checkpoint)
+            self.checkpoint += self.page_size
+
+
+class OverdriveInventoryCrawlMonitor(CollectionMonitor):
+    """Crawl the entire inventory of an Overdrive collection, bringing
+    the availability information for every book up to date.
+
+    The offset of the first page that hasn't been completely processed
+    is stored in Timestamp.counter, so that if the crawl is
+    interrupted, the next run picks up where it left off.
+
+    Offsets are positions in a list sorted by date added, so they move
+    if books are added or removed between runs. A book added since the
+    last run shows up at the front of the list and pushes everything
+    back, so part of a page is processed twice, which does no harm.
+    A book removed pulls everything forward, and the books that move
+    from the unfinished page into the finished ones would be skipped.
+    To avoid that, a resumed crawl starts RESUME_OVERLAP pages before
+    the checkpoint. If more books than that are removed before the
+    checkpoint, some books are skipped until the next full crawl.
+    """
+
+    SERVICE_NAME = "Overdrive Inventory Crawl"
+    PROTOCOL = ExternalIntegration.OVERDRIVE
+    DEFAULT_COUNTER = 0
+
+    # Save progress after processing this many pages.
+    CHECKPOINT_INTERVAL = 10
+
+    # Resume an interrupted crawl this many pages before where it
+    # left off.
+    RESUME_OVERLAP = 1
+
+    def __init__(self, _db, collection, api_class=OverdriveAPI,
+                 **crawler_kwargs):
+        """Constructor.
+
+        :param api_class: Instantiate this class with the given
+            Collection, rather than instantiating OverdriveAPI.
+        :param crawler_kwargs: Keyword arguments to the
+            OverdriveInventoryCrawler constructor.
+        """
+        super(OverdriveInventoryCrawlMonitor, self).__init__(_db, collection)
+        if isinstance(api_class, OverdriveAPI):
+            self.api = api_class
+        else:
+            self.api = api_class(_db, collection)
+        self.crawler = OverdriveInventoryCrawler(self.api, **crawler_kwargs)
+
+    def run_once(self, progress):
+        timestamp = self.timestamp()
+        start_offset = max(
+            0, (timestamp.counter or 0)
+            - self.RESUME_OVERLAP * self.crawler.page_size
+        )
+        pages = 0
+        books = 0
+        for offset, availability in self.crawler.crawl(start_offset):
+            if pages and pages % self.CHECKPOINT_INTERVAL == 0:
+                # The crawler considers the previous page finished
+                # once we ask for this one, so now is the time to save
+                # our progress. If something goes wrong later, we
+                # don't want to lose it.
+                timestamp.update(
+                    counter=self.crawler.checkpoint,
+                    achievements="Books processed: %d." % books
+                )
+                self._db.commit()
+            self.process_books(availability)
+            pages += 1
+            books += len(availability)
+
+        # The crawl is complete; the next one will start from the
+        # beginning.
+        return TimestampData(
+            counter=0, achievements="Books processed: %d." % books
+        )
+
+    def process_books(self, books):
+        """Bring the availability information for a page of books up
+        to date, using Overdrive's bulk availability endpoint.
+
+        :param books: A list of dictionaries, as returned by
+            OverdriveRepresentationExtractor.availability_link_list.
+        :return: A list of the LicensePools that were updated.
+        """
+        product_ids = [book['id'] for book in books]
+        pools = []
+        for circulation in self.api.circulation_lookup_batch(product_ids):
+            pool, ignore = circulation.apply(self._db, self.collection)
+            pools.append(pool)
+        return pools
+
+
 class OverdriveBibliographicCoverageProvider(BibliographicCoverageProvider):
     """Fill in bibliographic metadata for Overdrive records.
 
@@ -1337,8 +1748,42 @@ class OverdriveBibliographicCoverageProvider(BibliographicCoverageProvider):
             _db = Session.object_session(collection)
             self.api = api_class(_db, collection)
 
+    def process_batch(self, batch):
+        """Look up metadata for a batch of identifiers using Overdrive's
+        bulk metadata endpoint, rather than making one request per
+        identifier.
+        """
+        try:
+            infos = self.api.metadata_lookup_batch(batch)
+        except Exception, e:
+            self.log.error("Bulk metadata lookup failed", exc_info=e)
+            return [self.failure(x, repr(e), transient=True) for x in batch]
+
+        results = []
+        for identifier in batch:
+            info = infos.get(identifier.identifier.lower())
+            if info is None:
+                result = self.failure(
+                    identifier,
+                    "Overdrive did not send metadata for %s" %
+                    identifier.identifier
+                )
+            else:
+                result = self.process_metadata(identifier, info)
+            if not isinstance(result, CoverageFailure):
+                self.handle_success(identifier)
+            results.append(result)
+        return results
+
     def process_item(self, identifier):
         info = self.api.metadata_lookup(identifier)
+        return self.process_metadata(identifier, info)
+
+    def process_metadata(self, identifier, info):
+        """Apply the metadata Overdrive sent about an identifier.
+
+        :param info: Overdrive's JSON representation of the book.
+        """
         error = None
         if info.get('errorCode') == 'NotFound':
             error = "ID not recognized by Overdrive: %s" % identifier.identifier
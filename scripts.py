@@ -1,16 +1,19 @@
 import argparse
 import datetime
+import json
 import logging
 import os
 import random
 import re
 import subprocess
 import sys
+import time
 import traceback
 import unicodedata
 import uuid
 from collections import defaultdict
 
+from elasticsearch_dsl import Search
 from enum import Enum
 from sqlalchemy import (
     exists,
@@ -25,6 +28,7 @@ from sqlalchemy.orm.exc import (
 )
 
 # from axis import Axis360BibliographicCoverageProvider
+from classifier import Classifier
 from config import Configuration, CannotLoadConfiguration
 from coverage import (
     CollectionCoverageProviderJob,
@@ -33,9 +37,14 @@ from coverage import (
 from external_search import (
     ExternalSearchIndex,
     Filter,
+    Query,
     SearchIndexCoverageProvider,
+    SearchProfiler,
+)
+from lane import (
+    FeaturedFacets,
+    Lane,
 )
-from lane import Lane
 from metadata_layer import (
     LinkData,
     ReplacementPolicy,
@@ -53,11 +62,13 @@ from model import (
     Collection,
     Complaint,
     ConfigurationSetting,
+    Contribution,
     Contributor,
     CustomList,
     DataSource,
     Edition,
     ExternalIntegration,
+    Genre,
     Hyperlink,
     Identifier,
     Library,
@@ -87,8 +98,10 @@ from opds_import import (
 # )
 from util import fast_query_count
 from util.personal_names import (
+    clear_name_caches,
     contributor_name_match_ratio,
-    display_name_to_sort_name
+    display_name_to_sort_name,
+    normalize_contributor_name_for_matching,
 )
 from util.worker_pools import (
     DatabasePool,
@@ -1542,6 +1555,7 @@ class WorkProcessingScript(IdentifierInputScript):
         args = self.parse_command_line(
             self._db, cmd_args=cmd_args, stdin=stdin
         )
+        self.args = args
         self.identifier_type = args.identifier_type
         self.data_source = args.identifier_data_source
 
@@ -1621,6 +1635,26 @@ class WorkConsolidationScript(WorkProcessingScript):
 
     name = "Work consolidation script"
 
+    def __init__(self, *args, **kwargs):
+        super(WorkConsolidationScript, self).__init__(*args, **kwargs)
+        self.bulk = self.args.bulk
+        if self.bulk and (
+            self.identifiers or self.identifier_type or self.data_source
+        ):
+            raise ValueError(
+                "--bulk can't be restricted to specific identifiers."
+            )
+
+    @classmethod
+    def arg_parser(cls):
+        parser = super(WorkConsolidationScript, cls).arg_parser()
+        parser.add_argument(
+            '--bulk',
+            help="Only assign Works to LicensePools that don't have one, grouping open-access LicensePools with set-based queries instead of one at a time.",
+            action='store_true'
+        )
+        return parser
+
     def make_query(self, _db, identifier_type, identifiers, data_source, log=None):
         # We actually process LicensePools, not Works.
         qu = _db.query(LicensePool).join(LicensePool.identifier)
@@ -1639,7 +1673,10 @@ class WorkConsolidationScript(WorkProcessingScript):
         licensepool.calculate_work()
 
     def do_run(self):
-        super(WorkConsolidationScript, self).do_run()
+        if self.bulk:
+            LicensePool.consolidate_works(self._db, bulk=True)
+        else:
+            super(WorkConsolidationScript, self).do_run()
         qu = self._db.query(Work).outerjoin(Work.license_pools).filter(
             LicensePool.id==None
         )
@@ -1870,18 +1907,25 @@ class OPDSImportScript(CollectionInputScript):
             help='Import the feed from scratch, even if it seems like it was already imported.',
             dest='force', action='store_true'
         )
+        parser.add_argument(
+            '--workers',
+            help='Import this many pages of the feed at once, each in its own thread.',
+            dest='workers', type=int, default=None
+        )
         return parser
 
     def do_run(self, cmd_args=None):
         parsed = self.parse_command_line(self._db, cmd_args=cmd_args)
         collections = parsed.collections or Collection.by_protocol(self._db, self.protocol)
         for collection in collections:
-            self.run_monitor(collection, force=parsed.force)
+            self.run_monitor(
+                collection, force=parsed.force, import_workers=parsed.workers
+            )
 
-    def run_monitor(self, collection, force=None):
+    def run_monitor(self, collection, force=None, import_workers=None):
         monitor = self.monitor_class(
             self._db, collection, import_class=self.importer_class,
-            force_reimport=force
+            force_reimport=force, import_workers=import_workers
         )
         monitor.run()
 
@@ -1894,6 +1938,19 @@ class MirrorResourcesScript(CollectionInputScript):
     # This object contains the actual logic of mirroring.
     MIRROR_UTILITY = MetaToModelUtility()
 
+    # Scale down this many cover images at once.
+    THUMBNAIL_BATCH_SIZE = 50
+
+    @classmethod
+    def arg_parser(cls):
+        parser = CollectionInputScript.arg_parser()
+        parser.add_argument(
+            '--thumbnail-processes',
+            help='Scale down cover images using this many worker processes. Defaults to one per CPU.',
+            dest='thumbnail_processes', type=int, default=None
+        )
+        return parser
+
     def do_run(self, cmd_args=None):
         parsed = self.parse_command_line(self._db, cmd_args=cmd_args)
         collections = parsed.collections
@@ -1903,10 +1960,14 @@ class MirrorResourcesScript(CollectionInputScript):
             collections = self._db.query(Collection).all()
 
         # But only process collections that have an associated MirrorUploader.
-        for collection, policy in self.collections_with_uploader(collections, collection_type):
+        for collection, policy in self.collections_with_uploader(
+                collections, collection_type,
+                thumbnail_processes=parsed.thumbnail_processes
+        ):
             self.process_collection(collection, policy)
 
-    def collections_with_uploader(self, collections, collection_type=CollectionType.OPEN_ACCESS):
+    def collections_with_uploader(self, collections, collection_type=CollectionType.OPEN_ACCESS,
+                                  thumbnail_processes=None):
         """Filter out collections that have no MirrorUploader.
 
         :yield: 2-tuples (Collection, ReplacementPolicy). The
@@ -1930,7 +1991,9 @@ class MirrorResourcesScript(CollectionInputScript):
                     ExternalIntegrationLink.COVERS: covers,
                     books_mirror_type: books
                 }
-                policy = self.replacement_policy(mirrors)
+                policy = self.replacement_policy(
+                    mirrors, thumbnail_processes=thumbnail_processes
+                )
                 yield collection, policy
             else:
                 self.log.info(
@@ -1938,7 +2001,7 @@ class MirrorResourcesScript(CollectionInputScript):
                 )
 
     @classmethod
-    def replacement_policy(cls, mirrors):
+    def replacement_policy(cls, mirrors, thumbnail_processes=None):
         """Create a ReplacementPolicy for this script that uses the
         given mirrors.
         """
@@ -1946,6 +2009,7 @@ class MirrorResourcesScript(CollectionInputScript):
             mirrors=mirrors, link_content=True,
             even_if_not_apparently_updated=True,
             http_get=Representation.cautious_http_get,
+            thumbnail_processes=thumbnail_processes,
         )
 
     def process_collection(self, collection, policy, unmirrored=None):
@@ -1957,9 +2021,19 @@ class MirrorResourcesScript(CollectionInputScript):
 
         """
         unmirrored = unmirrored or Hyperlink.unmirrored
+
+        # Cover images are mirrored as they come up, but their
+        # thumbnails are made in batches, so that the work of scaling
+        # them down can be spread across several processes.
+        thumbnails = []
         for link in unmirrored(collection):
-            self.process_item(collection, link, policy)
+            self.process_item(collection, link, policy, thumbnails)
+            if len(thumbnails) >= self.THUMBNAIL_BATCH_SIZE:
+                self.MIRROR_UTILITY.make_thumbnails(thumbnails, policy)
+                thumbnails = []
             self._db.commit()
+        self.MIRROR_UTILITY.make_thumbnails(thumbnails, policy)
+        self._db.commit()
 
     @classmethod
     def derive_rights_status(cls, license_pool, resource):
@@ -1993,9 +2067,11 @@ class MirrorResourcesScript(CollectionInputScript):
             rights_status = rights_status.uri
         return rights_status
 
-    def process_item(self, collection, link_obj, policy):
+    def process_item(self, collection, link_obj, policy, thumbnails=None):
         """Determine the URL that needs to be mirrored and (for books)
         the rationale that lets us mirror that URL. Then mirror it.
+
+        :param thumbnails: Passed into MetaToModelUtility.mirror_link.
         """
         identifier = link_obj.identifier
         license_pool, ignore = LicensePool.for_foreign_id(
@@ -2034,7 +2110,8 @@ class MirrorResourcesScript(CollectionInputScript):
         # Mirror the link (or not).
         self.MIRROR_UTILITY.mirror_link(
             model_object=license_pool, data_source=collection.data_source,
-            link=linkdata, link_obj=link_obj, policy=policy
+            link=linkdata, link_obj=link_obj, policy=policy,
+            thumbnails=thumbnails
         )
 
 
@@ -3220,7 +3297,10 @@ class RemovesSearchCoverage(object):
         :return: The number of records deleted.
         """
         wcr = WorkCoverageRecord
-        clause = wcr.operation==wcr.UPDATE_SEARCH_INDEX_OPERATION
+        clause = wcr.operation.in_([
+            wcr.UPDATE_SEARCH_INDEX_OPERATION,
+            wcr.UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION,
+        ])
         count = self._db.query(wcr).filter(clause).count()
         self._db.execute(wcr.__table__.delete().where(clause))
         return count
@@ -3267,6 +3347,829 @@ class SearchIndexCoverageRemover(TimestampScript, RemovesSearchCoverage):
         )
 
 
+class QueryConstructionBenchmarkScript(InputScript):
+    """Measure how long it takes to turn query strings into
+    Elasticsearch queries, with and without the query cache.
+
+    Query strings are read from standard input, one per line. A real
+    corpus (e.g. taken from a search log) gives the most realistic
+    results, but a small built-in corpus is used if nothing is
+    provided.
+    """
+
+    name = "Benchmark search query construction"
+
+    DEFAULT_CORPUS = [
+        "harry potter",
+        "the hunger games",
+        "octavia butler",
+        "james patterson",
+        "science fiction about dogs",
+        "young adult romance",
+        "nonfiction asteroids",
+        "grade 5 science",
+        "divorce ages 10 and up",
+        "children's picture books",
+        "the girl on the train",
+        "stephen king it",
+        "pride and prejudice",
+        "the xlomph chronicles",
+        "cookbook",
+        "a brief history of time",
+    ]
+
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            '--repeat',
+            help='Build the query for each query string this many times.',
+            type=int, default=10
+        )
+        return parser
+
+    @classmethod
+    def parse_command_line(cls, _db=None, cmd_args=None, stdin=sys.stdin):
+        parsed = cls.arg_parser().parse_args(cmd_args)
+        parsed.query_strings = (
+            [x for x in cls.read_stdin_lines(stdin) if x]
+            or cls.DEFAULT_CORPUS
+        )
+        return parsed
+
+    def do_run(self, cmd_args=None, stdin=sys.stdin, output=sys.stdout):
+        parsed = self.parse_command_line(cmd_args=cmd_args, stdin=stdin)
+        query_strings = parsed.query_strings
+
+        # Without the cache, every query is built from scratch.
+        cache = Query.QUERY_CACHE
+        Query.QUERY_CACHE = None
+        try:
+            uncached = self.time_queries(query_strings, parsed.repeat)
+        finally:
+            Query.QUERY_CACHE = cache
+
+        # With the cache, only the first request for each query
+        # string has to build the query.
+        if cache is not None:
+            cache.clear()
+        cached = self.time_queries(query_strings, parsed.repeat)
+
+        output.write(
+            "Built queries for %d query strings, %d times each.\n" % (
+                len(query_strings), parsed.repeat
+            )
+        )
+        for label, timings in (("Uncached", uncached), ("Cached", cached)):
+            output.write(
+                "%s: %s\n" % (label, self.summarize(timings))
+            )
+
+    def time_queries(self, query_strings, repeat):
+        """Build the Elasticsearch query for each query string
+        `repeat` times.
+
+        :return: A list of elapsed times, in seconds.
+        """
+        search = Search()
+        timings = []
+        for i in range(repeat):
+            for query_string in query_strings:
+                start = time.time()
+                Query(query_string).build(search)
+                timings.append(time.time() - start)
+        return timings
+
+    @classmethod
+    def summarize(cls, timings):
+        """Summarize a list of elapsed times as a human-readable string."""
+        if not timings:
+            return "no queries"
+        timings = sorted(timings)
+        def ms(seconds):
+            return "%.2fms" % (seconds * 1000)
+        p95 = timings[min(len(timings)-1, int(len(timings) * 0.95))]
+        return "mean %s, median %s, 95th percentile %s, max %s" % (
+            ms(sum(timings)/len(timings)), ms(timings[len(timings)/2]),
+            ms(p95), ms(timings[-1])
+        )
+
+
+class GroupsEngineBenchmarkScript(LaneSweeperScript):
+    """Compare how long it takes to find the works for a grouped
+    feed using one search per sublane, and using a single aggregation
+    query.
+
+    Every lane with sublanes is benchmarked, so the results cover
+    lanes of many different widths.
+    """
+
+    name = "Benchmark grouped feed generation"
+
+    ENGINES = [("multisearch", False), ("aggregation", True)]
+
+    def __init__(self, _db=None, search_index_client=None, repeat=3,
+                 output=sys.stdout):
+        super(GroupsEngineBenchmarkScript, self).__init__(_db)
+        self.search = search_index_client or ExternalSearchIndex(self._db)
+
+        # Cached search results would make the comparison meaningless.
+        self.search.result_cache = None
+        self.repeat = repeat
+        self.output = output
+        self.timings = defaultdict(list)
+
+    def do_run(self, *args, **kwargs):
+        super(GroupsEngineBenchmarkScript, self).do_run(*args, **kwargs)
+        self.output.write("Mean time by number of sublanes:\n")
+        for width in sorted(set(width for width, engine in self.timings)):
+            self.output.write("%d sublanes: %s\n" % (width, ", ".join(
+                "%s %.1fms" % (
+                    name, self.mean(self.timings[(width, name)]) * 1000
+                ) for name, ignore in self.ENGINES
+            )))
+
+    def should_process_lane(self, lane):
+        return isinstance(lane, Lane) and any(
+            isinstance(x, Lane) and x.visible for x in lane.children
+        )
+
+    def process_lane(self, lane):
+        width = len(
+            [x for x in lane.children if isinstance(x, Lane) and x.visible]
+        )
+        results = []
+        for name, by_aggregation in self.ENGINES:
+            lane.GROUPS_BY_AGGREGATION = by_aggregation
+            for i in range(self.repeat):
+                # Use the same facets every time so that both engines
+                # are looking for the same works.
+                facets = FeaturedFacets.default(
+                    lane, random_seed=Filter.DETERMINISTIC
+                )
+                start = time.time()
+                works = list(lane.groups(
+                    self._db, facets=facets, search_engine=self.search
+                ))
+                self.timings[(width, name)].append(time.time() - start)
+            results.append("%s %.1fms (%d works)" % (
+                name, self.mean(self.timings[(width, name)][-self.repeat:]) * 1000,
+                len(works)
+            ))
+        del lane.GROUPS_BY_AGGREGATION
+        self.output.write(
+            "%s (%d sublanes): %s\n" % (
+                lane.full_identifier, width, ", ".join(results)
+            )
+        )
+
+    @classmethod
+    def mean(cls, timings):
+        return sum(timings) / len(timings)
+
+
+class SearchDocumentBenchmarkScript(Script):
+    """Measure how quickly Work.to_search_documents generates search
+    documents, at a variety of batch sizes.
+
+    A synthetic catalog can be created with --seed. Its works are
+    used for the benchmark if present; otherwise any presentation-ready
+    works in the database are used. Results can be saved and compared
+    against an earlier run, so that changes which make reindexing
+    slower are caught.
+    """
+
+    name = "Benchmark search document generation"
+
+    COLLECTION_NAME = u"Search document benchmark"
+
+    DEFAULT_BATCH_SIZES = [1, 50, 500, 5000]
+
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            '--seed',
+            help='Create this many synthetic works before running the benchmark.',
+            type=int, default=0
+        )
+        parser.add_argument(
+            '--contributors',
+            help='Give each synthetic work this many contributors.',
+            type=int, default=2
+        )
+        parser.add_argument(
+            '--classifications',
+            help='Give each synthetic work this many classifications.',
+            type=int, default=5
+        )
+        parser.add_argument(
+            '--license-pools',
+            help='Give each synthetic work this many license pools.',
+            type=int, default=1
+        )
+        parser.add_argument(
+            '--custom-lists',
+            help='Spread the synthetic works across this many custom lists.',
+            type=int, default=3
+        )
+        parser.add_argument(
+            '--random-seed',
+            help='Seed the random numbers used to create synthetic works with this value.',
+            type=int, default=0
+        )
+        parser.add_argument(
+            '--works',
+            help='Generate documents for at most this many works.',
+            type=int, default=5000
+        )
+        parser.add_argument(
+            '--batch-size',
+            help='Generate documents in batches of this size. May be repeated.',
+            type=int, action='append', dest='batch_sizes'
+        )
+        parser.add_argument(
+            '--batches',
+            help='Time at most this many batches of each size.',
+            type=int, default=10
+        )
+        parser.add_argument(
+            '--explain',
+            help='Print the EXPLAIN ANALYZE plan for one batch of each size.',
+            action='store_true'
+        )
+        parser.add_argument(
+            '--save',
+            help='Save the results as JSON to this file.',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Compare the results to a file created earlier with --save, and fail if throughput has regressed.',
+        )
+        parser.add_argument(
+            '--threshold',
+            help='Fail if throughput at any batch size drops by more than this proportion of the baseline.',
+            type=float, default=0.2
+        )
+        return parser
+
+    @classmethod
+    def parse_command_line(cls, _db=None, cmd_args=None):
+        parsed = cls.arg_parser().parse_args(cmd_args)
+        parsed.batch_sizes = parsed.batch_sizes or cls.DEFAULT_BATCH_SIZES
+        return parsed
+
+    def do_run(self, cmd_args=None, output=sys.stdout):
+        parsed = self.parse_command_line(self._db, cmd_args=cmd_args)
+        if parsed.seed:
+            self.seed_catalog(
+                parsed.seed, contributors=parsed.contributors,
+                classifications=parsed.classifications,
+                license_pools=parsed.license_pools,
+                custom_lists=parsed.custom_lists,
+                random_seed=parsed.random_seed
+            )
+
+        works = self.load_works(parsed.works)
+        output.write("Generating search documents for %d works.\n" % len(works))
+        results = {}
+        for batch_size in parsed.batch_sizes:
+            result = self.benchmark(works, batch_size, parsed.batches)
+            results[batch_size] = result
+            output.write(
+                "Batch size %(batch_size)d: %(documents)d documents in %(batches)d batches, %(seconds).2fs, %(documents_per_second).1f documents/sec\n" % result
+            )
+            if parsed.explain and works:
+                output.write(self.explain(works[:batch_size]) + "\n")
+
+        if parsed.save:
+            with open(parsed.save, 'w') as out:
+                json.dump(dict((str(k), v) for k, v in results.items()), out)
+
+        if parsed.baseline:
+            with open(parsed.baseline) as baseline:
+                baseline = json.load(baseline)
+            regressions = self.regressions(baseline, results, parsed.threshold)
+            for regression in regressions:
+                output.write("REGRESSION: %s\n" % regression)
+            if regressions:
+                sys.exit(1)
+        return results
+
+    def seed_catalog(self, count, contributors=2, classifications=5,
+                     license_pools=1, custom_lists=3, random_seed=0):
+        """Create a synthetic catalog of `count` presentation-ready works.
+
+        Every work gets the same number of contributors,
+        classifications and license pools, and the values that vary
+        between works come from a random number generator seeded with
+        `random_seed`, so that the results are comparable between
+        runs.
+        """
+        rng = random.Random(random_seed)
+        source = DataSource.lookup(self._db, DataSource.GUTENBERG)
+        collections = []
+        for i in range(max(license_pools, 1)):
+            name = self.COLLECTION_NAME
+            if i:
+                name += u" (%d)" % i
+            collection, ignore = Collection.by_name_and_protocol(
+                self._db, name, ExternalIntegration.OPDS_IMPORT
+            )
+            collections.append(collection)
+
+        lists = []
+        for i in range(custom_lists):
+            name = u"%s %d" % (self.COLLECTION_NAME, i)
+            custom_list, ignore = get_one_or_create(
+                self._db, CustomList, data_source=source,
+                foreign_identifier=name, create_method_kwargs=dict(name=name)
+            )
+            lists.append(custom_list)
+
+        genres = self._db.query(Genre).order_by(Genre.id).all()
+        audiences = [
+            Classifier.AUDIENCE_ADULT, Classifier.AUDIENCE_YOUNG_ADULT,
+            Classifier.AUDIENCE_CHILDREN
+        ]
+        for i in range(count):
+            foreign_id = u"urn:uuid:%s" % uuid.uuid4()
+            edition, ignore = Edition.for_foreign_id(
+                self._db, source, Identifier.URI, foreign_id
+            )
+            edition.title = u"Benchmark Work %d" % i
+            edition.series = u"Benchmark Series %d" % (i % 100)
+            edition.medium = Edition.BOOK_MEDIUM
+            edition.language = u"eng"
+            # Contributors and subjects are shared between works, as
+            # they would be in a real catalog.
+            for j in range(contributors):
+                edition.add_contributor(
+                    u"Author %d, Benchmark" % (
+                        (i * contributors + j) % max(count / 2, contributors)
+                    ), Contributor.AUTHOR_ROLE
+                )
+            for j in range(classifications):
+                edition.primary_identifier.classify(
+                    source, Subject.TAG, u"benchmark subject %d" % (
+                        (i * classifications + j)
+                        % max(500, classifications)
+                    ), weight=rng.randint(1, 100)
+                )
+
+            work = Work(
+                audience=rng.choice(audiences), fiction=bool(i % 2),
+                quality=rng.random()
+            )
+            self._db.add(work)
+            if genres:
+                work.genres = rng.sample(genres, min(2, len(genres)))
+            for collection in collections[:license_pools]:
+                pool, ignore = LicensePool.for_foreign_id(
+                    self._db, source, Identifier.URI, foreign_id,
+                    collection=collection
+                )
+                pool.licenses_owned = pool.licenses_available = 1
+                pool.presentation_edition = edition
+                work.license_pools.append(pool)
+            work.set_presentation_edition(edition)
+            work.presentation_ready = True
+            if lists:
+                lists[i % len(lists)].add_entry(
+                    work, update_external_index=False
+                )
+            if not i % 1000:
+                self._db.commit()
+        self._db.commit()
+
+    def load_works(self, limit):
+        """Find the works to generate search documents for."""
+        qu = self._db.query(Work).filter(Work.presentation_ready==True)
+        collection = get_one(self._db, Collection, name=self.COLLECTION_NAME)
+        if collection:
+            qu = qu.join(Work.license_pools).filter(
+                LicensePool.collection==collection
+            )
+        return qu.order_by(Work.id).limit(limit).all()
+
+    def benchmark(self, works, batch_size, max_batches):
+        """Time the generation of search documents for `works`, in
+        batches of `batch_size`.
+
+        :return: A dictionary summarizing the results.
+        """
+        batches = [
+            works[i:i+batch_size] for i in range(0, len(works), batch_size)
+        ][:max_batches]
+        documents = 0
+        start = time.time()
+        for batch in batches:
+            documents += len(Work.to_search_documents(batch))
+        seconds = time.time() - start
+        if seconds:
+            documents_per_second = documents / seconds
+        else:
+            documents_per_second = 0
+        return dict(
+            batch_size=batch_size, batches=len(batches), documents=documents,
+            seconds=seconds, documents_per_second=documents_per_second
+        )
+
+    def explain(self, works):
+        """Run EXPLAIN ANALYZE on the query that generates search
+        documents for `works`.
+
+        :return: The query plan, as a string.
+        """
+        connection = self._db.connection()
+        compiled = Work.search_document_query(works).compile(
+            dialect=connection.dialect
+        )
+        rows = connection.execute(
+            "EXPLAIN ANALYZE " + unicode(compiled), compiled.params
+        )
+        return "\n".join(row[0] for row in rows)
+
+    @classmethod
+    def regressions(cls, baseline, results, threshold):
+        """Compare benchmark results to a baseline.
+
+        :param baseline: Results loaded from a file created with --save.
+        :param results: Results from this run, keyed by batch size.
+        :param threshold: The proportion by which throughput may drop
+            before it counts as a regression.
+        :return: A list of human-readable descriptions of regressions.
+        """
+        regressions = []
+        for batch_size, result in sorted(results.items()):
+            expect = baseline.get(str(batch_size))
+            if not expect or not expect.get('documents_per_second'):
+                continue
+            before = expect['documents_per_second']
+            after = result['documents_per_second']
+            if after < before * (1 - threshold):
+                regressions.append(
+                    "Batch size %d: %.1f documents/sec, down from %.1f" % (
+                        batch_size, after, before
+                    )
+                )
+        return regressions
+
+
+class PersonalNameBenchmarkScript(InputScript):
+    """Measure how quickly contributor names are normalized, with and
+    without the name caches in util.personal_names.
+
+    The corpus is read from standard input, one name per line. If
+    nothing is on standard input, the display names of the
+    contributors to books in the database are used, so that names
+    which show up often in the catalog show up often in the corpus.
+    """
+
+    name = "Benchmark personal name normalization"
+
+    FUNCTIONS = [
+        display_name_to_sort_name, normalize_contributor_name_for_matching
+    ]
+
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            '--names',
+            help='Use at most this many names from the database.',
+            type=int, default=10000
+        )
+        parser.add_argument(
+            '--passes',
+            help='Normalize the corpus this many times with the caches enabled.',
+            type=int, default=1
+        )
+        parser.add_argument(
+            '--save',
+            help='Save the results as JSON to this file.',
+        )
+        return parser
+
+    @classmethod
+    def parse_command_line(cls, _db=None, cmd_args=None, stdin=sys.stdin):
+        parsed = cls.arg_parser().parse_args(cmd_args)
+        parsed.corpus = [x for x in cls.read_stdin_lines(stdin) if x]
+        return parsed
+
+    def do_run(self, cmd_args=None, stdin=sys.stdin, output=sys.stdout):
+        parsed = self.parse_command_line(cmd_args=cmd_args, stdin=stdin)
+        names = parsed.corpus or self.load_names(parsed.names)
+        output.write(
+            "Normalizing %d names, %d distinct.\n" % (
+                len(names), len(set(names))
+            )
+        )
+        results = {}
+        for function in self.FUNCTIONS:
+            result = self.benchmark(function, names, parsed.passes)
+            results[function.__name__] = result
+            output.write(
+                "%(function)s: %(uncached_names_per_second).1f names/sec uncached, %(cached_names_per_second).1f names/sec cached, hit rate %(hit_rate).2f\n" % result
+            )
+
+        if parsed.save:
+            with open(parsed.save, 'w') as out:
+                json.dump(results, out)
+        return results
+
+    def load_names(self, limit):
+        """Find the display names of contributors to books in the
+        database, one per contribution.
+        """
+        qu = self._db.query(Contributor.display_name).join(
+            Contributor.contributions
+        ).filter(
+            Contributor.display_name != None
+        ).order_by(Contribution.id).limit(limit)
+        return [display_name for (display_name,) in qu]
+
+    @classmethod
+    def benchmark(cls, function, names, passes=1):
+        """Time a cached name function over a corpus of names, once with
+        its caches emptied before every name, and then `passes` times
+        with the caches in use.
+
+        :return: A dictionary summarizing the results.
+        """
+        start = time.time()
+        for name in names:
+            clear_name_caches()
+            function.uncached(name)
+        uncached_seconds = time.time() - start
+
+        clear_name_caches()
+        function.cache.hits = function.cache.misses = 0
+        start = time.time()
+        for i in range(passes):
+            for name in names:
+                function(name)
+        cached_seconds = time.time() - start
+
+        def per_second(count, seconds):
+            if not seconds:
+                return 0
+            return count / seconds
+
+        return dict(
+            function=function.__name__, names=len(names), passes=passes,
+            uncached_seconds=uncached_seconds,
+            uncached_names_per_second=per_second(
+                len(names), uncached_seconds
+            ),
+            cached_seconds=cached_seconds,
+            cached_names_per_second=per_second(
+                len(names) * passes, cached_seconds
+            ),
+            hit_rate=function.cache.stats['hit_rate'] or 0,
+        )
+
+
+class OPDSParserBenchmarkScript(Script):
+    """Compare how quickly OPDSImporter extracts data from a large OPDS
+    feed using the two-pass parser (feedparser, then lxml) and the
+    single-pass streaming parser.
+
+    A feed is generated with --entries entries, unless a real feed is
+    provided with --feed.
+    """
+
+    name = "Benchmark OPDS feed parsing"
+
+    FEED_TEMPLATE = """<feed xmlns="http://www.w3.org/2005/Atom" xmlns:simplified="http://librarysimplified.org/terms/" xmlns:dcterms="http://purl.org/dc/terms/" xmlns:opds="http://opds-spec.org/2010/catalog" xmlns:schema="http://schema.org/">
+  <id>http://example.com/benchmark</id>
+  <title>OPDS parser benchmark</title>
+  <updated>2020-01-01T00:00:00Z</updated>
+  <link href="http://example.com/benchmark" rel="self"/>
+%s</feed>
+"""
+
+    ENTRY_TEMPLATE = """  <entry schema:additionalType="http://schema.org/EBook">
+    <id>urn:librarysimplified.org/terms/id/Gutenberg%%20ID/%(n)d</id>
+    <title>Book %(n)d</title>
+    <author>
+      <name>Author %(n)d</name>
+      <simplified:sort_name>%(n)d, Author</simplified:sort_name>
+    </author>
+    <summary type="html">A summary of book %(n)d.</summary>
+    <schema:Series schema:name="Series %(n)d" schema:position="1"/>
+    <updated>2020-01-01T00:00:00Z</updated>
+    <schema:Rating schema:ratingValue="0.5000" schema:additionalType="http://librarysimplified.org/terms/rel/quality"/>
+    <link href="http://example.com/covers/%(n)d.png" rel="http://opds-spec.org/image"/>
+    <link href="http://example.com/covers/%(n)d-thumbnail.png" rel="http://opds-spec.org/image/thumbnail"/>
+    <category term="Fantasy fiction" scheme="http://purl.org/dc/terms/LCSH"/>
+    <category term="PZ" scheme="http://purl.org/dc/terms/LCC"/>
+    <category term="Children" scheme="http://schema.org/audience"/>
+    <dcterms:language>en</dcterms:language>
+    <dcterms:publisher>Publisher %(n)d</dcterms:publisher>
+    <dcterms:issued>1910</dcterms:issued>
+    <link href="http://example.com/books/%(n)d.epub" type="application/epub+zip" rel="http://opds-spec.org/acquisition/open-access"/>
+  </entry>
+"""
+
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            '--entries',
+            help='Generate a feed with this many entries.',
+            type=int, default=5000
+        )
+        parser.add_argument(
+            '--feed',
+            help='Parse the OPDS feed in this file instead of generating one.',
+        )
+        parser.add_argument(
+            '--repeat',
+            help='Parse the feed this many times with each parser.',
+            type=int, default=3
+        )
+        parser.add_argument(
+            '--save',
+            help='Save the results as JSON to this file.',
+        )
+        return parser
+
+    def do_run(self, cmd_args=None, output=sys.stdout):
+        parsed = self.parse_command_line(cmd_args=cmd_args)
+        if parsed.feed:
+            with open(parsed.feed) as f:
+                feed = f.read()
+        else:
+            feed = self.generate_feed(parsed.entries)
+
+        # Parsing doesn't touch the database, so there's no need to
+        # look up a real DataSource.
+        data_source = DataSource(name=DataSource.OA_CONTENT_SERVER)
+        output.write("Parsing a feed of %d bytes.\n" % len(feed))
+        results = {}
+        for name, parser in self.parsers():
+            result = self.benchmark(name, parser, feed, data_source, parsed.repeat)
+            results[name] = result
+            output.write(
+                "%(parser)s: %(entries)d entries, best %(best_seconds).2fs, mean %(mean_seconds).2fs, %(entries_per_second).1f entries/sec\n" % result
+            )
+
+        if parsed.save:
+            with open(parsed.save, 'w') as out:
+                json.dump(results, out)
+        return results
+
+    @classmethod
+    def generate_feed(cls, entries):
+        """Generate an OPDS feed with the given number of entries."""
+        return cls.FEED_TEMPLATE % "".join(
+            cls.ENTRY_TEMPLATE % dict(n=n) for n in range(entries)
+        )
+
+    @classmethod
+    def parsers(cls):
+        """The parsers to compare.
+
+        :return: A list of 2-tuples (name, function). Each function
+            takes a feed and a DataSource, and returns the number of
+            entries it extracted data from.
+        """
+        def two_pass(feed, data_source):
+            values, failures = OPDSImporter.extract_data_from_feedparser(
+                feed, data_source
+            )
+            OPDSImporter.extract_metadata_from_elementtree(feed, data_source)
+            return len(values) + len(failures)
+
+        def single_pass(feed, data_source):
+            values, failures, ignore, ignore = (
+                OPDSImporter.extract_data_in_one_pass(feed, data_source)
+            )
+            return len(values) + len(failures)
+
+        return [("two-pass", two_pass), ("single-pass", single_pass)]
+
+    @classmethod
+    def benchmark(cls, name, parser, feed, data_source, repeat=1):
+        """Parse a feed `repeat` times with one parser.
+
+        :return: A dictionary summarizing the results.
+        """
+        timings = []
+        entries = 0
+        for i in range(repeat):
+            start = time.time()
+            entries = parser(feed, data_source)
+            timings.append(time.time() - start)
+
+        best = min(timings) if timings else 0
+        return dict(
+            parser=name, entries=entries, repeat=repeat,
+            best_seconds=best,
+            mean_seconds=sum(timings) / len(timings) if timings else 0,
+            entries_per_second=entries / best if best else 0,
+        )
+
+
+class SearchReportScript(InputScript):
+    """Summarize the search reports logged by SearchProfiler, to find
+    the kinds of searches that are slowest.
+
+    Log lines are read from standard input. Lines that don't contain
+    a search report are ignored.
+    """
+
+    name = "Summarize slow Elasticsearch searches"
+
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            '--top',
+            help='Show this many kinds of search.',
+            type=int, default=10
+        )
+        parser.add_argument(
+            '--order',
+            help='How to rank the kinds of search.',
+            choices=['total', 'max', 'count'], default='total'
+        )
+        return parser
+
+    @classmethod
+    def parse_command_line(cls, _db=None, cmd_args=None, stdin=sys.stdin):
+        parsed = cls.arg_parser().parse_args(cmd_args)
+        parsed.reports = [
+            report for report in
+            map(SearchProfiler.parse_log_line, cls.read_stdin_lines(stdin))
+            if report
+        ]
+        return parsed
+
+    @classmethod
+    def summarize(cls, reports):
+        """Group search reports by fingerprint, lane and facets.
+
+        The same kind of search can be fast in one lane and slow in
+        another, so they're kept separate.
+
+        :return: A list of dictionaries, one per group.
+        """
+        by_group = defaultdict(list)
+        for report in reports:
+            lane_id = report.get('lane_id')
+            if isinstance(lane_id, list):
+                # A grouped search covering several lanes.
+                lane_id = tuple(lane_id)
+            key = (report.get('fingerprint'), lane_id, report.get('facets'))
+            by_group[key].append(report)
+
+        summaries = []
+        for (fingerprint, lane_id, facets), reports in by_group.items():
+            took = [x.get('took_ms') or 0 for x in reports]
+            query_strings = []
+            for report in reports:
+                query_string = report.get('query_string')
+                if query_string and query_string not in query_strings:
+                    query_strings.append(query_string)
+            summaries.append(dict(
+                fingerprint=fingerprint,
+                lane_id=lane_id,
+                facets=facets,
+                count=len(reports),
+                total=sum(took),
+                max=max(took),
+                mean=float(sum(took)) / len(took),
+                shards_failed=sum(x.get('shards_failed') or 0 for x in reports),
+                profiled=len([x for x in reports if 'profile' in x]),
+                query_strings=query_strings,
+            ))
+        return summaries
+
+    def do_run(self, cmd_args=None, stdin=sys.stdin, output=sys.stdout):
+        parsed = self.parse_command_line(cmd_args=cmd_args, stdin=stdin)
+        summaries = sorted(
+            self.summarize(parsed.reports),
+            key=lambda x: x[parsed.order], reverse=True
+        )[:parsed.top]
+        output.write("%d search reports found.\n" % len(parsed.reports))
+        for summary in summaries:
+            lane_id = summary['lane_id']
+            if isinstance(lane_id, tuple):
+                lane_id = ",".join(map(str, lane_id))
+            output.write(
+                "%s (lane %s, facets %s): " % (
+                    summary['fingerprint'], lane_id, summary['facets'] or ""
+                )
+            )
+            output.write(
+                "%(count)d searches, total %(total)dms, mean %(mean).1fms, max %(max)dms, %(shards_failed)d shard failures, %(profiled)d profiled\n" % summary
+            )
+            for query_string in summary['query_strings'][:3]:
+                output.write(" Query string: %s\n" % query_string)
+
+
 class MockStdin(object):
     """Mock a list of identifiers passed in on standard input."""
     def __init__(self, *lines):
@@ -1,6 +1,8 @@
 # encoding: utf-8
 import pytest
 import datetime
+from sqlalchemy import inspect
+from sqlalchemy.orm import defer
 from ...testing import DatabaseTest
 from ...classifier import Classifier
 from ...lane import (
@@ -9,6 +11,7 @@ from ...lane import (
     Lane,
     WorkList,
 )
+from ...model import get_one_or_create
 from ...model.cachedfeed import CachedFeed
 from ...model.configuration import ConfigurationSetting
 from ...opds import AcquisitionFeed
@@ -579,6 +582,60 @@ class TestCachedFeed(DatabaseTest):
 
     # Realistic end-to-end tests.
 
+    def test_content(self):
+        # By default, the content of a feed is stored compressed.
+        feed = CachedFeed()
+        content = u"<feed>%s</feed>" % (u"<entry>\u2603</entry>" * 100)
+        feed.content = content
+        assert None == feed._content
+        assert len(feed.compressed_content) < len(content)
+        assert content == feed.content
+        assert isinstance(feed.content, unicode)
+
+        # Compression can be turned off.
+        class Uncompressed(CachedFeed):
+            COMPRESS_CONTENT = False
+        feed = Uncompressed()
+        feed.content = content
+        assert content == feed._content
+        assert None == feed.compressed_content
+        assert content == feed.content
+
+        # Uncompressed content left over from before compression was
+        # turned on can still be read, and is replaced the next time
+        # the feed is updated.
+        feed = CachedFeed(_content=u"an old feed")
+        assert u"an old feed" == feed.content
+        feed.content = u"a new feed"
+        assert None == feed._content
+        assert u"a new feed" == feed.content
+
+        feed.content = None
+        assert None == feed.content
+
+    def test_repr_does_not_load_content(self):
+        feed, ignore = get_one_or_create(
+            self._db, CachedFeed, library=self._default_library,
+            type=CachedFeed.PAGE_TYPE, pagination=u"", facets=u""
+        )
+        feed.content = u"<feed/>"
+        self._db.commit()
+        self._db.expunge_all()
+
+        # A CachedFeed loaded without its content can be described
+        # without loading the content.
+        [feed] = self._db.query(CachedFeed).options(
+            *[defer(x) for x in CachedFeed.LARGE_FIELDS]
+        ).all()
+        assert "content not loaded" in repr(feed)
+        assert set(CachedFeed.LARGE_FIELDS).issubset(
+            inspect(feed).unloaded
+        )
+
+        # Once the content is loaded, its size is described.
+        assert u"<feed/>" == feed.content
+        assert "compressed" in repr(feed)
+
     def test_lifecycle_with_lane(self):
         facets = Facets.default(self._default_library)
         pagination = Pagination.default()
@@ -606,6 +663,76 @@ class TestCachedFeed(DatabaseTest):
         feed = CachedFeed.fetch(*args, max_age=CachedFeed.CACHE_FOREVER, raw=True)
         assert "This is feed #2" == feed.content
 
+    def test_fetch_records_access(self):
+        facets = Facets.default(self._default_library)
+        pagination = Pagination.default()
+        lane = self._lane()
+        refresher = MockFeedGenerator()
+        args = (self._db, lane, facets, pagination, refresher)
+
+        # Record every request, so the counts are predictable.
+        old_rate = CachedFeed.ACCESS_SAMPLE_RATE
+        CachedFeed.ACCESS_SAMPLE_RATE = 1
+        try:
+            # Generating a feed for the first time counts as an access.
+            feed = CachedFeed.fetch(*args, max_age=1000, raw=True)
+            assert 1 == feed.access_count
+            first_access = feed.last_accessed
+            assert first_access is not None
+
+            # So does finding it in the cache.
+            feed = CachedFeed.fetch(*args, max_age=1000, raw=True)
+            assert 2 == feed.access_count
+            assert feed.last_accessed >= first_access
+
+            # So does regenerating it.
+            feed = CachedFeed.fetch(*args, max_age=0, raw=True)
+            assert 3 == feed.access_count
+            assert "This is feed #2" == feed.content
+
+            # Unless we ask for the access not to be counted.
+            feed = CachedFeed.fetch(
+                *args, max_age=0, raw=True, record_access=False
+            )
+            assert 3 == feed.access_count
+            assert "This is feed #3" == feed.content
+
+            # If the feed isn't cached at all, there's nothing to count.
+            response = CachedFeed.fetch(*args, max_age=CachedFeed.IGNORE_CACHE)
+            assert "This is feed #4" == response.data
+            assert 3 == feed.access_count
+
+            # Normally only some requests are recorded, and each one
+            # that is counts for ACCESS_SAMPLE_RATE requests.
+            CachedFeed.ACCESS_SAMPLE_RATE = 5
+            for i in range(20):
+                feed = CachedFeed.fetch(*args, max_age=1000, raw=True)
+            assert 3 <= feed.access_count <= 3 + 20*5
+            assert 0 == (feed.access_count - 3) % 5
+        finally:
+            CachedFeed.ACCESS_SAMPLE_RATE = old_rate
+
+    def test_record_access(self):
+        # The counter is incremented in the database, so a stale
+        # value in memory doesn't overwrite someone else's requests.
+        feed = CachedFeed(
+            type=u"page", pagination=u"", facets=u"", access_count=None
+        )
+        self._db.add(feed)
+        self._db.flush()
+        old_rate = CachedFeed.ACCESS_SAMPLE_RATE
+        CachedFeed.ACCESS_SAMPLE_RATE = 1
+        try:
+            feed.record_access()
+            assert 1 == feed.access_count
+            self._db.execute(
+                "update cachedfeeds set access_count=10 where id=%d" % feed.id
+            )
+            feed.record_access()
+            assert 11 == feed.access_count
+        finally:
+            CachedFeed.ACCESS_SAMPLE_RATE = old_rate
+
     def test_lifecycle_with_worklist(self):
         facets = Facets.default(self._default_library)
         pagination = Pagination.default()
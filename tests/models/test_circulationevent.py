@@ -169,6 +169,77 @@ class TestCirculationEvent(DatabaseTest):
         assert end == event.end
         assert location == event.location
 
+    def test_bulk_log(self):
+        pool = self._licensepool(edition=None)
+        pool2 = self._licensepool(edition=None)
+        library = self._default_library
+        start = datetime.datetime(2019, 1, 1)
+        end = datetime.datetime(2019, 1, 2)
+
+        # This event has already been recorded.
+        existing, ignore = CirculationEvent.log(
+            self._db, pool, CirculationEvent.DISTRIBUTOR_CHECKOUT,
+            old_value=10, new_value=8, start=start, library=library
+        )
+
+        events = [
+            # Duplicates the existing event.
+            dict(license_pool=pool,
+                 event_name=CirculationEvent.DISTRIBUTOR_CHECKOUT,
+                 old_value=500, new_value=200, start=start, library=library),
+
+            # A new event with no library.
+            dict(license_pool=pool,
+                 event_name=CirculationEvent.DISTRIBUTOR_CHECKOUT,
+                 old_value=10, new_value=8, start=start, end=end,
+                 location="Westgate Branch"),
+
+            # A new event for a different license pool.
+            dict(license_pool=pool2,
+                 event_name=CirculationEvent.DISTRIBUTOR_HOLD_PLACE,
+                 old_value=1, new_value=2, start=start, library=library),
+
+            # Duplicates the previous event within the same batch.
+            dict(license_pool=pool2,
+                 event_name=CirculationEvent.DISTRIBUTOR_HOLD_PLACE,
+                 old_value=1, new_value=2, start=start, library=library),
+
+            # No start date, so the current time is used.
+            dict(license_pool=pool2,
+                 event_name=CirculationEvent.DISTRIBUTOR_CHECKIN,
+                 old_value=None, new_value=3),
+        ]
+        results = CirculationEvent.bulk_log(self._db, events, batch_size=2)
+        assert [False, True, True, False, True] == results
+
+        # The existing event was not changed.
+        assert -2 == existing.delta
+
+        all_events = self._db.query(CirculationEvent).order_by(
+            CirculationEvent.id).all()
+        assert 4 == len(all_events)
+        ignore, no_library, hold, checkin = all_events
+
+        assert pool == no_library.license_pool
+        assert None == no_library.library
+        assert -2 == no_library.delta
+        assert end == no_library.end
+        assert "Westgate Branch" == no_library.location
+
+        assert pool2 == hold.license_pool
+        assert library == hold.library
+        assert 1 == hold.delta
+        assert start == hold.start == hold.end
+
+        assert None == checkin.delta
+        assert 3 == checkin.new_value
+        assert (datetime.datetime.utcnow() - checkin.start).total_seconds() < 2
+
+        # Running the same events through again creates nothing new.
+        assert [False] * 4 == CirculationEvent.bulk_log(
+            self._db, events[:4]
+        )
+
     def test_uniqueness_constraints_no_library(self):
         # If library is null, then license_pool + type + start must be
         # unique.
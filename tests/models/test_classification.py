@@ -13,6 +13,7 @@ from ...model.classification import (
     Subject,
     Genre,
 )
+from ...model.lookupcache import LookupCache
 
 class TestSubject(DatabaseTest):
 
@@ -62,6 +63,33 @@ class TestSubject(DatabaseTest):
         assert subject in [s1, s2]
         assert False == is_new
 
+    def test_prepare_to_look_up(self):
+        existing = self._subject(Subject.TAG, "i1")
+        subjects = [
+            (Subject.TAG, "i1", "A tag"),
+            (Subject.TAG, "i2", "Another tag"),
+            # A Subject with no identifier is ignored.
+            (Subject.TAG, None, "A third tag"),
+        ]
+        with LookupCache.installed(self._db) as cache:
+            Subject.prepare_to_look_up(self._db, subjects)
+            assert 2 == len(cache)
+
+            # The missing Subject was created, and lookup() finds it
+            # in the cache.
+            new = cache.get(self._db, Subject, (Subject.TAG, "i2"))
+            assert "Another tag" == new.name
+            assert (new, False) == Subject.lookup(
+                self._db, Subject.TAG, "i2", None
+            )
+
+            # lookup() still fills in the name of a Subject that
+            # didn't have one.
+            assert (existing, False) == Subject.lookup(
+                self._db, Subject.TAG, "i1", "A tag"
+            )
+            assert "A tag" == existing.name
+
     def test_assign_to_genre_can_remove_genre(self):
         # Here's a Subject that identifies children's books.
         subject, was_new = Subject.lookup(self._db, Subject.TAG, "Children's books", None)
@@ -5,6 +5,7 @@ from ...model.contributor import Contributor
 from ...model.datasource import DataSource
 from ...model.edition import Edition
 from ...model.identifier import Identifier
+from ...model.lookupcache import LookupCache
 
 class TestContributor(DatabaseTest):
 
@@ -75,6 +76,24 @@ class TestContributor(DatabaseTest):
         assert bob1 == bob2
         assert False == new
 
+    def test_prepare_to_look_up(self):
+        # Two contributors named Bob.
+        [bob1], new = Contributor.lookup(self._db, sort_name=u"Bob", lc=u"foo")
+        [bob2], new = Contributor.lookup(self._db, sort_name=u"Bob", lc=u"bar")
+
+        with LookupCache.installed(self._db) as cache:
+            Contributor.prepare_to_look_up(self._db, [u"Bob", u"Alice", None])
+
+            # A Contributor was created for the name nobody had, and
+            # lookup() finds everyone in the cache.
+            assert 2 == len(cache)
+            [alice] = cache.get(self._db, Contributor, u"Alice")
+            assert ([alice], False) == Contributor.lookup(
+                self._db, sort_name=u"Alice"
+            )
+            bobs, new = Contributor.lookup(self._db, sort_name=u"Bob")
+            assert set([bob1, bob2]) == set(bobs)
+
     def test_merge(self):
 
         # Here's Robert.
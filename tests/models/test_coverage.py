@@ -9,6 +9,7 @@ from ...model.coverage import (
 )
 from ...model.datasource import DataSource
 from ...model.identifier import Identifier
+from ...model.lookupcache import LookupCache
 
 class TestTimestamp(DatabaseTest):
 
@@ -304,6 +305,44 @@ class TestCoverageRecord(DatabaseTest):
         assert record5 == record
         assert CoverageRecord.PERSISTENT_FAILURE == record.status
 
+    def test_prepare_to_look_up(self):
+        source = DataSource.lookup(self._db, DataSource.OCLC)
+        covered = self._identifier()
+        uncovered = self._identifier()
+        record = self._coverage_record(covered, source, 'foo')
+
+        with LookupCache.installed(self._db) as cache:
+            CoverageRecord.prepare_to_look_up(
+                self._db, [covered, uncovered], source, 'foo'
+            )
+
+            # lookup() knows about the existing record and the missing
+            # record without going to the database.
+            assert 2 == len(cache)
+            assert record == CoverageRecord.lookup(covered, source, 'foo')
+            assert None == cache.get(
+                self._db, CoverageRecord, (uncovered.id, source.id, 'foo', None)
+            )
+            assert None == CoverageRecord.lookup(uncovered, source, 'foo')
+
+            # add_for() uses the cached record, or replaces the
+            # knowledge that there's no record with the new record.
+            assert (record, False) == CoverageRecord.add_for(
+                covered, source, 'foo'
+            )
+            new_record, is_new = CoverageRecord.add_for(
+                uncovered, source, 'foo'
+            )
+            assert True == is_new
+            assert new_record == CoverageRecord.lookup(uncovered, source, 'foo')
+
+            # bulk_add() makes the cache forget about the records it
+            # touches.
+            CoverageRecord.bulk_add([uncovered], source, 'foo')
+            assert LookupCache.UNKNOWN == cache.get(
+                self._db, CoverageRecord, (uncovered.id, source.id, 'foo', None)
+            )
+
     def test_bulk_add(self):
         source = DataSource.lookup(self._db, DataSource.GUTENBERG)
         operation = u'testing'
@@ -12,6 +12,7 @@ from ...model.datasource import DataSource
 from ...model.edition import Edition
 from ...model.identifier import Identifier
 from ...model.licensing import DeliveryMechanism
+from ...model.lookupcache import LookupCache
 from ...model.resource import (
     Hyperlink,
     Representation,
@@ -97,6 +98,30 @@ class TestEdition(DatabaseTest):
         assert identifier == record.primary_identifier
         assert False == was_new
 
+    def test_prepare_to_look_up(self):
+        gutenberg = DataSource.lookup(self._db, DataSource.GUTENBERG)
+        existing = self._edition(data_source_name=DataSource.GUTENBERG)
+        i1 = existing.primary_identifier
+        i2 = self._identifier()
+
+        with LookupCache.installed(self._db) as cache:
+            Edition.prepare_to_look_up(self._db, gutenberg, [i1, i2])
+
+            # An Edition was created for the Identifier that didn't
+            # have one.
+            [new] = i2.primarily_identifies
+            assert gutenberg == new.data_source
+
+            # for_foreign_id() finds both Editions in the cache.
+            assert new == cache.get(self._db, Edition, (gutenberg.id, i2.id))
+            assert (existing, False) == Edition.for_foreign_id(
+                self._db, gutenberg, i1.type, i1.identifier
+            )
+            assert new == Edition.for_foreign_id(
+                self._db, DataSource.GUTENBERG, i2.type, i2.identifier,
+                create_if_not_exists=False
+            )
+
     def test_missing_coverage_from(self):
         gutenberg = DataSource.lookup(self._db, DataSource.GUTENBERG)
         oclc = DataSource.lookup(self._db, DataSource.OCLC)
@@ -496,6 +521,51 @@ class TestEdition(DatabaseTest):
         edition.calculate_permanent_work_id()
         assert None == edition.permanent_work_id
 
+    def test_calculate_permanent_work_ids(self):
+        # An Edition that needs a permanent work ID.
+        new = self._edition()
+
+        # An Edition whose permanent work ID is out of date.
+        stale = self._edition(authors=[u"Someone Else"])
+        stale.calculate_permanent_work_id()
+        expect_stale = stale.permanent_work_id
+        stale.permanent_work_id = u"out of date"
+
+        # An Edition that can't have a permanent work ID.
+        no_title = self._edition()
+        no_title.title = None
+        no_title.permanent_work_id = u"out of date"
+
+        # An Edition that's already up to date.
+        current = self._edition()
+        current.calculate_permanent_work_id()
+        expect_current = current.permanent_work_id
+        self._db.commit()
+
+        editions = [new, stale, no_title, current]
+        assert 3 == Edition.calculate_permanent_work_ids(self._db, editions)
+
+        # The new values were written to the database, and the objects
+        # in the session know about them without having to be reloaded.
+        assert new.permanent_work_id != None
+        assert expect_stale == stale.permanent_work_id
+        assert None == no_title.permanent_work_id
+        assert expect_current == current.permanent_work_id
+        assert not self._db.dirty
+
+        self._db.expire_all()
+        assert expect_stale == stale.permanent_work_id
+        assert None == no_title.permanent_work_id
+
+        # The results are the same as calculating the IDs one at a time.
+        for edition in editions:
+            old_id = edition.permanent_work_id
+            edition.calculate_permanent_work_id()
+            assert old_id == edition.permanent_work_id
+
+        assert 0 == Edition.calculate_permanent_work_ids(self._db, editions)
+        assert 0 == Edition.calculate_permanent_work_ids(self._db, [])
+
     def test_choose_cover_can_choose_full_image_and_thumbnail_separately(self):
         edition = self._edition()
 
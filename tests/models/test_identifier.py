@@ -11,6 +11,7 @@ from ...model import PresentationCalculationPolicy
 from ...model.datasource import DataSource
 from ...model.edition import Edition
 from ...model.identifier import Identifier
+from ...model.lookupcache import LookupCache
 from ...model.resource import Hyperlink, Representation
 from ...testing import DatabaseTest
 
@@ -69,6 +70,40 @@ class TestIdentifier(DatabaseTest):
         assert None == identifier
         assert False == was_new
 
+    def test_prepare_to_look_up(self):
+        existing = self._identifier(Identifier.OVERDRIVE_ID, "abc")
+        foreign_ids = [
+            (Identifier.OVERDRIVE_ID, "ABC"),
+            (Identifier.ISBN, "9781453219539"),
+            # Invalid identifiers are ignored.
+            (Identifier.BIBLIOTHECA_ID, "foo/bar"),
+        ]
+
+        # Without a LookupCache, nothing happens.
+        Identifier.prepare_to_look_up(self._db, foreign_ids)
+        assert [] == self._db.query(Identifier).filter(
+            Identifier.type==Identifier.ISBN).all()
+
+        with LookupCache.installed(self._db) as cache:
+            Identifier.prepare_to_look_up(self._db, foreign_ids)
+
+            # The missing Identifier was created.
+            [isbn] = self._db.query(Identifier).filter(
+                Identifier.type==Identifier.ISBN).all()
+            assert 2 == len(cache)
+
+            # Both Identifiers are in the cache, where for_foreign_id()
+            # will find them.
+            assert isbn == cache.get(
+                self._db, Identifier, (Identifier.ISBN, "9781453219539")
+            )
+            assert (isbn, False) == Identifier.for_foreign_id(
+                self._db, Identifier.ISBN, "9781453219539"
+            )
+            assert (existing, False) == Identifier.for_foreign_id(
+                self._db, Identifier.OVERDRIVE_ID, "ABC"
+            )
+
     def test_from_asin(self):
         isbn10 = '1449358063'
         isbn13 = '9781449358068'
@@ -0,0 +1,130 @@
+# encoding: utf-8
+from ...testing import DatabaseTest
+from ...model.identifier import Identifier
+from ...model.lookupcache import LookupCache
+
+
+class TestLookupCache(DatabaseTest):
+
+    def test_install(self):
+        assert None == LookupCache.for_session(self._db)
+        assert None == LookupCache.for_session(None)
+
+        cache, is_new = LookupCache.install(self._db)
+        assert True == is_new
+        assert cache == LookupCache.for_session(self._db)
+
+        # Installing a cache a second time does nothing.
+        assert (cache, False) == LookupCache.install(self._db)
+
+        LookupCache.uninstall(self._db)
+        assert None == LookupCache.for_session(self._db)
+
+        # There's nothing to install a cache on if there's no session.
+        assert (None, False) == LookupCache.install(None)
+
+        cache, is_new = LookupCache.install(self._db, max_size=5)
+        assert 5 == cache._objects.max_size
+
+    def test_installed(self):
+        with LookupCache.installed(self._db) as cache:
+            assert cache == LookupCache.for_session(self._db)
+
+            # A nested block uses the cache that's already installed,
+            # and leaves it in place.
+            with LookupCache.installed(self._db) as cache2:
+                assert cache2 == cache
+            assert cache == LookupCache.for_session(self._db)
+        assert None == LookupCache.for_session(self._db)
+
+        # If a cache was already installed, it stays installed, but
+        # it forgets which objects are known not to exist.
+        cache, is_new = LookupCache.install(self._db)
+        identifier = self._identifier()
+        with LookupCache.installed(self._db) as cache2:
+            assert cache2 == cache
+            cache.set(Identifier, "exists", identifier)
+            cache.set(Identifier, "missing", None)
+            assert None == cache.get(self._db, Identifier, "missing")
+        assert cache == LookupCache.for_session(self._db)
+        assert identifier == cache.get(self._db, Identifier, "exists")
+        assert LookupCache.UNKNOWN == cache.get(self._db, Identifier, "missing")
+
+    def test_get_and_set(self):
+        cache = LookupCache()
+        identifier = self._identifier()
+        key = (identifier.type, identifier.identifier)
+        assert LookupCache.UNKNOWN == cache.get(self._db, Identifier, key)
+
+        cache.set(Identifier, key, identifier)
+        assert identifier == cache.get(self._db, Identifier, key)
+        assert 1 == len(cache)
+
+        # An object can be known not to exist.
+        cache.set(Identifier, "missing", None)
+        assert None == cache.get(self._db, Identifier, "missing")
+
+        # A list of objects can be cached.
+        identifier2 = self._identifier()
+        cache.set(Identifier, "both", [identifier, identifier2])
+        assert [identifier, identifier2] == cache.get(self._db, Identifier, "both")
+
+        # If an object is no longer part of the session, it's removed
+        # from the cache.
+        self._db.expunge(identifier2)
+        assert LookupCache.UNKNOWN == cache.get(self._db, Identifier, "both")
+        assert identifier == cache.get(self._db, Identifier, key)
+
+        cache.delete(Identifier, key)
+        assert LookupCache.UNKNOWN == cache.get(self._db, Identifier, key)
+
+        cache.clear()
+        assert 0 == len(cache)
+
+    def test_eviction_and_stats(self):
+        cache = LookupCache(max_size=2)
+        i1 = self._identifier()
+        i2 = self._identifier()
+        i3 = self._identifier()
+        cache.set(Identifier, 1, i1)
+        cache.set(Identifier, 2, i2)
+        assert i1 == cache.get(self._db, Identifier, 1)
+
+        # When the cache fills up, the least recently used object is
+        # the one that goes.
+        cache.set(Identifier, 3, i3)
+        assert LookupCache.UNKNOWN == cache.get(self._db, Identifier, 2)
+        assert i1 == cache.get(self._db, Identifier, 1)
+
+        # Knowing that an object doesn't exist counts as a hit; finding
+        # an object that's no longer in the session counts as a miss.
+        cache.set(Identifier, 4, None)
+        assert None == cache.get(self._db, Identifier, 4)
+        self._db.expunge(i3)
+        assert LookupCache.UNKNOWN == cache.get(self._db, Identifier, 3)
+        assert (
+            dict(hits=3, misses=2, evictions=1, size=1, hit_rate=0.6) ==
+            cache.stats
+        )
+
+    def test_rollback_clears_cache(self):
+        # An Identifier is created and cached, but the transaction
+        # that created it is rolled back.
+        with LookupCache.installed(self._db) as cache:
+            identifier, is_new = Identifier.for_foreign_id(
+                self._db, Identifier.GUTENBERG_ID, "1"
+            )
+            cache.set(Identifier, "missing", None)
+            assert 2 == len(cache)
+            self._db.rollback()
+
+            # The cache forgot everything it knew, so looking up the
+            # Identifier again creates it from scratch instead of
+            # handing out an object whose row no longer exists.
+            assert 0 == len(cache)
+            identifier2, is_new = Identifier.for_foreign_id(
+                self._db, Identifier.GUTENBERG_ID, "1"
+            )
+            assert True == is_new
+            assert identifier2 != identifier
+            assert "1" == identifier2.identifier
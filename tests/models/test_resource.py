@@ -14,6 +14,7 @@ from ...model.resource import (
     Hyperlink,
     Representation,
     Resource,
+    scale_image,
 )
 from ...testing import MockRequestsResponse
 
@@ -862,6 +863,105 @@ class TestCoverResource(DatabaseTest):
         assert None == thumbnail.thumbnail_of
         assert thumbnail.url != url
 
+    def test_scale_image(self):
+        cover = self.sample_cover_representation("test-book-cover.png")
+        result = scale_image(cover.content, 200, 300, ["png", "jpeg"])
+        assert None == result['exception']
+        assert (200, 300) == result['size']
+        assert set(["png", "jpeg"]) == set(result['outputs'].keys())
+        assert result['seconds'] >= 0
+
+        # An image that can't be decoded results in an exception, not
+        # output.
+        result = scale_image("not an image", 200, 300, ["png"])
+        assert {} == result['outputs']
+        assert "cannot identify image file" in result['exception']
+
+    @pytest.mark.parametrize("processes", [0, 2])
+    def test_scale_batch(self, processes):
+        cover = self.sample_cover_representation("test-book-cover.png")
+        wide = self.sample_cover_representation("childrens-book-cover.png")
+        tiny = self.sample_cover_representation("tiny-image-cover.png")
+        not_an_image, ignore = self._representation(
+            media_type="text/plain", content="foo"
+        )
+        requests = [
+            (cover, self._url, "image/png"),
+            (cover, self._url, "image/jpeg"),
+            (wide, self._url, "image/png"),
+            (tiny, self._url, "image/png"),
+            (not_an_image, self._url, "image/png"),
+        ]
+        results = Representation.scale_batch(
+            requests, 300, 400, processes=processes
+        )
+        [(png, png_new, png_stats), (jpeg, jpeg_new, jpeg_stats),
+         (wide_thumb, wide_new, wide_stats),
+         (tiny_result, tiny_new, tiny_stats),
+         (not_scaled, not_scaled_new, not_scaled_stats)] = results
+
+        # The cover was scaled into two different formats.
+        assert True == png_new
+        assert True == jpeg_new
+        assert requests[0][1] == png.url
+        assert requests[1][1] == jpeg.url
+        assert set([png, jpeg]) == set(cover.thumbnails)
+        for thumbnail in png, jpeg:
+            assert cover == thumbnail.thumbnail_of
+            assert 300 == thumbnail.image_height
+            assert 200 == thumbnail.image_width
+            assert None == thumbnail.mirrored_at
+            assert thumbnail.scaled_at is not None
+        assert "image/jpeg" == jpeg.media_type
+
+        # Stats were recorded for each thumbnail.
+        assert len(cover.content) == png_stats['original_bytes']
+        assert len(png.content) == png_stats['thumbnail_bytes']
+        assert len(jpeg.content) == jpeg_stats['thumbnail_bytes']
+        assert png_stats['seconds'] >= 0
+
+        # The wide image was scaled according to its width.
+        assert True == wide_new
+        assert 400 == wide_thumb.image_width
+        assert 200 == wide_thumb.image_height
+
+        # The tiny image didn't need scaling, so no bytes were counted.
+        assert (tiny, False) == (tiny_result, tiny_new)
+        assert [] == tiny.thumbnails
+        assert None == tiny_stats['original_bytes']
+
+        # The non-image couldn't be scaled.
+        assert (not_an_image, False) == (not_scaled, not_scaled_new)
+        assert "Cannot load non-image representation as image" in (
+            not_an_image.scale_exception
+        )
+        assert None == not_scaled_stats['original_bytes']
+
+        # Scaling the same images again does nothing, unless forced.
+        [(again, is_new, stats)] = Representation.scale_batch(
+            requests[:1], 300, 400, processes=processes
+        )
+        assert (png, False) == (again, is_new)
+        assert None == stats['original_bytes']
+        assert None == stats['thumbnail_bytes']
+
+        [(again, is_new, stats)] = Representation.scale_batch(
+            requests[:1], 200, 200, force=True, processes=processes
+        )
+        assert (png, True) == (again, is_new)
+        assert 200 == png.image_height
+        assert 133 == png.image_width
+
+    def test_scale_batch_unsupported_media_type(self):
+        cover = self.sample_cover_representation("test-book-cover.png")
+        with pytest.raises(ValueError) as excinfo:
+            Representation.scale_batch(
+                [(cover, self._url, "text/plain")], 300, 400
+            )
+        assert "Unsupported destination media type: text/plain" in str(
+            excinfo.value
+        )
+
     def test_image_type_priority(self):
         """Test the image_type_priority method.
 
@@ -17,7 +17,10 @@ from ...model import (
     get_one_or_create,
     tuple_to_numericrange,
 )
-from ...model.coverage import WorkCoverageRecord
+from ...model.coverage import (
+    CoverageRecord,
+    WorkCoverageRecord,
+)
 from ...model.classification import (
     Genre,
     Subject,
@@ -395,6 +398,27 @@ class TestWork(DatabaseTest):
         work.calculate_presentation()
         assert True == work.presentation_ready
 
+    def test_calculate_presentation_queues_full_reindex(self):
+        # A change to last_update_time only queues an update of the
+        # availability information in the search document. But
+        # calculate_presentation() always ends up queuing a full
+        # reindex, even with exclude_search=True, since a Work is
+        # reindexed whenever it's found to be presentation-ready or
+        # not.
+        WCR = WorkCoverageRecord
+        work = self._work(with_license_pool=True)
+        for language in ("eng", None):
+            work.presentation_edition.language = language
+            record = work.external_index_needs_updating()
+            record.status = WCR.SUCCESS
+            old_update_time = work.last_update_time
+            work.quality = 0.987654
+
+            work.calculate_presentation(exclude_search=True)
+            assert work.last_update_time != old_update_time
+            assert (language is not None) == work.presentation_ready
+            assert WCR.REGISTERED == record.status
+
     def test_calculate_presentation_uses_default_audience_set_as_collection_setting(self):
         default_audience = Classifier.AUDIENCE_ADULT
         collection = self._default_collection
@@ -1230,6 +1254,43 @@ class TestWork(DatabaseTest):
         assert (set([collection1.id, collection2.id]) ==
             set([x['collection_id'] for x in search_doc['licensepools']]))
 
+    def test_to_availability_search_documents(self):
+        assert [] == Work.to_availability_search_documents([])
+
+        work = self._work(with_license_pool=True)
+        work.last_update_time = datetime.datetime(2020, 1, 1)
+        [pool] = work.license_pools
+        pool.licenses_owned = 10
+        pool.licenses_available = 0
+        no_pools = self._work()
+        self._db.flush()
+
+        # The partial search document contains the same availability
+        # information as the full search document.
+        full = work.to_search_document()
+        [partial] = Work.to_availability_search_documents([work])
+        assert set(['_id', 'last_update_time', 'licensepools']) == set(
+            partial.keys()
+        )
+        assert work.id == partial['_id']
+        assert full['last_update_time'] == partial['last_update_time']
+        assert full['licensepools'] == partial['licensepools']
+        [pool_doc] = partial['licensepools']
+        assert pool.id == pool_doc['licensepool_id']
+        assert False == pool_doc['available']
+        assert True == pool_doc['licensed']
+
+        # When the availability changes, so does the partial document.
+        pool.licenses_available = 1
+        self._db.flush()
+        [partial] = Work.to_availability_search_documents([work])
+        [pool_doc] = partial['licensepools']
+        assert True == pool_doc['available']
+
+        # A work with no licensed LicensePools has no 'licensepools'.
+        [partial] = Work.to_availability_search_documents([no_pools])
+        assert None == partial['licensepools']
+
     def test_age_appropriate_for_patron(self):
         work = self._work()
         work.audience = Classifier.AUDIENCE_YOUNG_ADULT
@@ -1384,9 +1445,8 @@ class TestWork(DatabaseTest):
             """
             records = [
                 x for x in work.coverage_records
-                if x.operation.startswith(
-                        WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
-                )
+                if x.operation ==
+                WorkCoverageRecord.UPDATE_SEARCH_INDEX_OPERATION
             ]
             if records:
                 return records[0]
@@ -1419,13 +1479,20 @@ class TestWork(DatabaseTest):
         record = find_record(work)
         assert registered == record.status
 
-        # If its last_update_time is changed, it needs to be
-        # reindexed. (This happens whenever
-        # LicensePool.update_availability is called, meaning that
-        # patron transactions always trigger a reindex).
+        # If its last_update_time is changed, the availability
+        # information in its search document needs to be updated.
+        # (This happens whenever LicensePool.update_availability is
+        # called, meaning that patron transactions always trigger an
+        # update). A full reindex isn't necessary.
         record.status = success
         work.last_update_time = datetime.datetime.utcnow()
-        assert registered == record.status
+        assert success == record.status
+        [availability_record] = [
+            x for x in work.coverage_records
+            if x.operation ==
+            WorkCoverageRecord.UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION
+        ]
+        assert registered == availability_record.status
 
         # If its collection changes (which shouldn't happen), it needs
         # to be reindexed.
@@ -1486,7 +1553,9 @@ class TestWork(DatabaseTest):
             (work.needs_new_presentation_edition,
              WCR.CHOOSE_EDITION_OPERATION),
             (work.external_index_needs_updating,
-             WCR.UPDATE_SEARCH_INDEX_OPERATION)
+             WCR.UPDATE_SEARCH_INDEX_OPERATION),
+            (work.external_index_availability_needs_updating,
+             WCR.UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION),
         ):
             method()
             assert operation == work.coverage_reset_for
@@ -2657,3 +2726,91 @@ class TestWorkConsolidation(DatabaseTest):
         # Even if the LicensePool had a work before, it gets removed.
         assert (None, False) == lp.calculate_work()
         assert None == lp.work
+
+    def test_consolidate_works_in_bulk(self):
+        # Two open-access books with the same title and author.
+        edition1, pool1 = self._edition(with_license_pool=True)
+        edition2, pool2 = self._edition(
+            title=edition1.title, authors=edition1.author,
+            with_license_pool=True
+        )
+
+        # An open-access book that belongs with an existing Work.
+        existing_edition, existing_pool = self._edition(with_license_pool=True)
+        existing_work, ignore = existing_pool.calculate_work()
+        edition3, pool3 = self._edition(
+            title=existing_edition.title, authors=existing_edition.author,
+            with_license_pool=True
+        )
+
+        # A commercial book, which needs a Work of its own.
+        edition4, pool4 = self._edition(with_license_pool=True)
+        pool4.open_access = False
+
+        # A book with no title.
+        edition5, pool5 = self._edition(with_license_pool=True)
+        pool5.presentation_edition.title = None
+        self._db.commit()
+
+        assigned, created = LicensePool.consolidate_works_in_bulk(self._db)
+        assert 3 == assigned
+        assert 1 == created
+
+        # The first two books share a brand new Work.
+        new_work = pool1.work
+        assert new_work != None
+        assert new_work == pool2.work
+        assert new_work.presentation_edition in (
+            pool1.presentation_edition, pool2.presentation_edition
+        )
+
+        # The third book joined the existing Work.
+        assert existing_work == pool3.work
+        assert set([existing_pool, pool3]) == set(existing_work.license_pools)
+
+        # The others were left alone.
+        assert None == pool4.work
+        assert None == pool5.work
+
+        # Both Works are marked as needing their presentation
+        # recalculated. The new Work won't be presentation-ready until
+        # that happens.
+        assert False == new_work.presentation_ready
+        for work in new_work, existing_work:
+            [record] = [
+                x for x in work.coverage_records
+                if x.operation == WorkCoverageRecord.CLASSIFY_OPERATION
+            ]
+            assert CoverageRecord.REGISTERED == record.status
+
+        # Running it again does nothing.
+        assert (0, 0) == LicensePool.consolidate_works_in_bulk(self._db)
+
+    def test_consolidate_works_in_bulk_leaves_inconsistent_data_alone(self):
+        # Two open-access Works have ended up with the same permanent
+        # work ID.
+        edition1, pool1 = self._edition(with_license_pool=True)
+        edition2, pool2 = self._edition(
+            title=edition1.title, authors=edition1.author,
+            with_license_pool=True
+        )
+        work1, ignore = pool1.calculate_work()
+        pool2.presentation_edition.calculate_permanent_work_id()
+        pool2.work = Work()
+        pool2.work.set_presentation_edition(pool2.presentation_edition)
+
+        # A third book belongs with them.
+        edition3, pool3 = self._edition(
+            title=edition1.title, authors=edition1.author,
+            with_license_pool=True
+        )
+        self._db.commit()
+
+        # Merging Works isn't done in bulk.
+        assert (0, 0) == LicensePool.consolidate_works_in_bulk(self._db)
+        assert None == pool3.work
+
+        # But consolidate_works() will do it the slow way.
+        LicensePool.consolidate_works(self._db, bulk=True)
+        assert pool3.work != None
+        assert pool1.work == pool2.work == pool3.work
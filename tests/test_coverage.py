@@ -28,6 +28,7 @@ from ..model import (
     ExternalIntegration,
     Hyperlink,
     Identifier,
+    LookupCache,
     PresentationCalculationPolicy,
     Representation,
     RightsStatus,
@@ -59,6 +60,7 @@ from ..coverage import (
     OPDSEntryWorkCoverageProvider,
     MARCRecordWorkCoverageProvider,
     PresentationReadyWorkCoverageProvider,
+    NewWorkPresentationCoverageProvider,
     WorkClassificationCoverageProvider,
     WorkPresentationEditionCoverageProvider,
 )
@@ -187,6 +189,9 @@ class TestBaseCoverageProvider(CoverageProviderTest):
         provider = ValidMock(self._db, batch_size=-10)
         assert 50 == provider.batch_size
 
+        # A LookupCache was installed on the database session.
+        assert isinstance(LookupCache.for_session(self._db), LookupCache)
+
     def test_subclass_must_define_service_name(self):
         class NoServiceName(BaseCoverageProvider):
             pass
@@ -2208,6 +2213,40 @@ class TestWorkClassificationCoverageProvider(DatabaseTest):
         )
 
 
+class TestNewWorkPresentationCoverageProvider(DatabaseTest):
+
+    def test_run(self):
+        provider = NewWorkPresentationCoverageProvider(self._db)
+        assert True == provider.registered_only
+
+        # A Work that's not presentation-ready isn't touched unless
+        # it's been registered for coverage.
+        work = self._work(with_license_pool=True)
+        work.presentation_ready = False
+        assert [] == provider.items_that_need_coverage().all()
+
+        WorkCoverageRecord.add_for(
+            work, WorkCoverageRecord.CLASSIFY_OPERATION,
+            status=CoverageRecord.REGISTERED
+        )
+        assert [work] == provider.items_that_need_coverage().all()
+
+        # Running the provider calculates the Work's presentation,
+        # which makes it presentation-ready.
+        provider.run()
+        assert True == work.presentation_ready
+        [record] = [
+            x for x in work.coverage_records
+            if x.operation == WorkCoverageRecord.CLASSIFY_OPERATION
+        ]
+        assert CoverageRecord.SUCCESS == record.status
+
+        # A presentation-ready Work is left to
+        # WorkClassificationCoverageProvider, even if it's registered.
+        record.status = CoverageRecord.REGISTERED
+        assert [] == provider.items_that_need_coverage().all()
+
+
 class TestOPDSEntryWorkCoverageProvider(DatabaseTest):
 
     def test_run(self):
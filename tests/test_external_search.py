@@ -12,7 +12,14 @@ from ..testing import (
     DatabaseTest,
 )
 
-from elasticsearch_dsl import Q
+from elasticsearch_dsl import (
+    Q,
+    Search,
+)
+from elasticsearch_dsl.response import (
+    Hit,
+    Response,
+)
 from elasticsearch_dsl.function import (
     ScriptScore,
     RandomScore,
@@ -71,7 +78,10 @@ from ..external_search import (
     Query,
     QueryParser,
     SearchBase,
+    SearchIndexAvailabilityCoverageProvider,
     SearchIndexCoverageProvider,
+    SearchProfiler,
+    SearchResultCache,
     SortKeyPagination,
     WorkSearchResult,
     mock_search_index,
@@ -80,6 +90,7 @@ from ..external_search import (
 from ..classifier import Classifier
 
 from ..problem_details import INVALID_INPUT
+from ..util.cache import LRUCache
 
 from ..testing import (
     ExternalSearchTest,
@@ -116,6 +127,74 @@ class TestExternalSearch(ExternalSearchTest):
         assert self._db == index.set_works_index_and_alias_called_with
         assert "test_search_term" == index.test_search_term
 
+    def test_configured_result_cache(self):
+        # By default, search results are not cached.
+        ExternalSearchIndex.reset()
+        assert None == ExternalSearchIndex.configured_result_cache(
+            self.integration
+        )
+
+        # Setting a lifetime for cached results enables the cache.
+        self.integration.setting(
+            ExternalSearchIndex.RESULT_CACHE_TTL_KEY
+        ).value = "30"
+        cache = ExternalSearchIndex.configured_result_cache(self.integration)
+        assert isinstance(cache, SearchResultCache)
+        assert 30 == cache.ttl
+        assert (ExternalSearchIndex.DEFAULT_RESULT_CACHE_SIZE ==
+                cache.backend.max_size)
+
+        # The cache is shared by every ExternalSearchIndex in the process.
+        assert cache == ExternalSearchIndex.configured_result_cache(
+            self.integration
+        )
+
+        # If the configuration changes, a new cache is created.
+        self.integration.setting(
+            ExternalSearchIndex.RESULT_CACHE_SIZE_KEY
+        ).value = "10"
+        cache2 = ExternalSearchIndex.configured_result_cache(self.integration)
+        assert cache2 != cache
+        assert 10 == cache2.backend.max_size
+
+        # The constructor finds the configured cache, unless it's
+        # given a different one.
+        index = ExternalSearchIndex(self._db, in_testing=True)
+        assert cache2 == index.result_cache
+        other_cache = SearchResultCache()
+        index = ExternalSearchIndex(
+            self._db, in_testing=True, result_cache=other_cache
+        )
+        assert other_cache == index.result_cache
+        ExternalSearchIndex.reset()
+
+    def test_configured_profiler(self):
+        # By default, nothing is profiled and no searches are
+        # considered slow.
+        profiler = ExternalSearchIndex.configured_profiler(self.integration)
+        assert None == profiler.slow_query_threshold
+        assert 0 == profiler.sample_rate
+
+        self.integration.setting(
+            ExternalSearchIndex.SLOW_QUERY_THRESHOLD_KEY
+        ).value = "500"
+        self.integration.setting(
+            ExternalSearchIndex.PROFILE_SAMPLE_RATE_KEY
+        ).value = "0.01"
+        profiler = ExternalSearchIndex.configured_profiler(self.integration)
+        assert 500 == profiler.slow_query_threshold
+        assert 0.01 == profiler.sample_rate
+
+        # The constructor finds the configured profiler, unless it's
+        # given a different one.
+        index = ExternalSearchIndex(self._db, in_testing=True)
+        assert 500 == index.profiler.slow_query_threshold
+        other_profiler = SearchProfiler()
+        index = ExternalSearchIndex(
+            self._db, in_testing=True, profiler=other_profiler
+        )
+        assert other_profiler == index.profiler
+
     # TODO: would be good to check the put_script calls, but the
     # current constructor makes put_script difficult to mock.
 
@@ -368,6 +447,494 @@ class TestExternalSearch(ExternalSearchTest):
         assert {collection.name: 1} == result
 
 
+class TestSearchResultCache(object):
+
+    def hit(self, work_id, sort):
+        return Hit(dict(
+            _id=unicode(work_id), _index="works", _type="work-type",
+            _score=None, sort=sort, _source=dict(work_id=work_id)
+        ))
+
+    def test_key(self):
+        search = Search().query("match", title="moby dick")
+        key = SearchResultCache.key("alias", "index-v1", search)
+
+        # The key depends on the query document and on the index
+        # being searched.
+        assert key == SearchResultCache.key(
+            "alias", "index-v1", Search().query("match", title="moby dick")
+        )
+        assert key != SearchResultCache.key("alias", "index-v2", search)
+        assert key != SearchResultCache.key(
+            "alias", "index-v1", Search().query("match", title="moby duck")
+        )
+
+    def test_serialize(self):
+        hits = [self.hit(1, ["a", 1]), self.hit(2, ["b", 2])]
+        data = SearchResultCache.serialize(hits)
+
+        # The serialized hits are plain data, suitable for storage
+        # anywhere.
+        json.dumps(data)
+
+        # Deserializing them creates equivalent Hit objects.
+        [h1, h2] = SearchResultCache.deserialize(data)
+        assert 1 == h1.work_id
+        assert "1" == h1.meta.id
+        assert ["a", 1] == h1.meta.sort
+        assert 2 == h2.work_id
+        assert ["b", 2] == h2.meta.sort
+
+        # The deserialized hits work with SortKeyPagination.
+        pagination = SortKeyPagination()
+        pagination.page_loaded([h1, h2])
+        assert ["b", 2] == pagination.next_page.last_item_on_previous_page
+
+    def test_get_and_set(self):
+        cache = SearchResultCache(ttl=30)
+        assert 30 == cache.ttl
+        assert None == cache.get("key")
+        assert dict(hits=0, misses=1, hit_rate=0) == cache.stats
+
+        cache.set("key", [self.hit(1, [1])])
+        [hit] = cache.get("key")
+        assert 1 == hit.work_id
+        assert dict(hits=1, misses=1, hit_rate=0.5) == cache.stats
+
+        cache.clear()
+        assert None == cache.get("key")
+
+    def test_is_complete(self):
+        class MockResponse(object):
+            def __init__(self, **data):
+                self.data = data
+            def to_dict(self):
+                return self.data
+
+        m = SearchResultCache.is_complete
+        shards = dict(total=5, successful=5, failed=0)
+        assert True == m(MockResponse(timed_out=False, _shards=shards))
+        assert True == m(MockResponse())
+
+        # Results that may be missing something shouldn't be cached.
+        assert False == m(MockResponse(timed_out=True, _shards=shards))
+        assert False == m(MockResponse(
+            timed_out=False, _shards=dict(total=5, successful=4, failed=1)
+        ))
+
+    def test_backend(self):
+        # The backend can be anything that stores data.
+        class MockBackend(object):
+            def __init__(self):
+                self.data = {}
+            def get(self, key):
+                return self.data.get(key)
+            def set(self, key, value, ttl):
+                self.data[key] = (value, ttl)
+            def clear(self):
+                self.data = {}
+
+        backend = MockBackend()
+        cache = SearchResultCache(backend, ttl=5)
+        hits = [self.hit(1, [1])]
+        cache.set("key", hits)
+        assert (SearchResultCache.serialize(hits), 5) == backend.data["key"]
+
+
+class TestSearchProfiler(object):
+
+    class MockResponse(object):
+        def __init__(self, **data):
+            self.data = data
+
+        def to_dict(self):
+            return self.data
+
+    class MockLog(object):
+        def __init__(self):
+            self.logged = []
+
+        def log(self, level, message, *args):
+            self.logged.append((level, message % args))
+
+    def response(self, took=10, **kwargs):
+        data = dict(
+            took=took, timed_out=False,
+            _shards=dict(total=5, successful=5, skipped=0, failed=0),
+            hits=dict(total=2, hits=[dict(_id="1")]),
+        )
+        data.update(kwargs)
+        return self.MockResponse(**data)
+
+    def test_should_profile(self):
+        class Mock(SearchProfiler):
+            value = 0.5
+            def random(self):
+                return self.value
+
+        # By default, nothing is profiled.
+        profiler = Mock()
+        assert False == profiler.should_profile()
+
+        # Otherwise, the sample rate determines which searches are
+        # profiled.
+        profiler = Mock(sample_rate=0.6)
+        assert True == profiler.should_profile()
+        profiler.value = 0.7
+        assert False == profiler.should_profile()
+
+    def test_fingerprint(self):
+        m = SearchProfiler.fingerprint
+        search = Search().query("match", title="moby dick").filter(
+            "terms", collection_id=[1, 2]
+        )
+
+        # The fingerprint depends on the structure of the search, not on
+        # the specific values being searched for.
+        assert m(search) == m(
+            Search().query("match", title="hunger games").filter(
+                "terms", collection_id=[3, 4, 5]
+            )
+        )
+        assert m(search) == m(search.extra(profile=True))
+        assert m(search.extra(size=10)) == m(search.extra(size=50))
+        assert m(search) != m(
+            Search().query("match", author="moby dick").filter(
+                "terms", collection_id=[1, 2]
+            )
+        )
+
+    def test_record(self):
+        profiler = SearchProfiler(slow_query_threshold=100, max_reports=2)
+        profiler.log = self.MockLog()
+        search = Search().query("match", title="moby dick")
+
+        # A search that runs quickly is recorded but not logged.
+        report = profiler.record(
+            search, self.response(took=10), 0.0255, query_string="moby dick",
+            searches_in_request=3
+        )
+        assert dict(
+            fingerprint=SearchProfiler.fingerprint(search),
+            query_string="moby dick",
+            lane_id=None,
+            facets=None,
+            took_ms=10,
+            client_ms=25,
+            searches_in_request=3,
+            total_hits=2,
+            hits_returned=1,
+            shards_failed=0,
+            timed_out=False,
+            slow=False,
+        ) == report
+        assert [report] == list(profiler.reports)
+        assert [] == profiler.log.logged
+
+        # A slow search is logged as a warning, along with the lane
+        # and facets it was run for.
+        report = profiler.record(
+            search, self.response(took=100), 0.2, lane_id=5,
+            facets="order=title"
+        )
+        assert True == report['slow']
+        [(level, message)] = profiler.log.logged
+        assert logging.WARN == level
+        assert report == SearchProfiler.parse_log_line(message)
+        assert 5 == report['lane_id']
+        assert "order=title" == report['facets']
+
+        # So is a search that failed on some shards.
+        failures = [dict(shard=1, reason=dict(reason="oops"))]
+        report = profiler.record(
+            search, self.response(
+                _shards=dict(total=5, failed=1, failures=failures)
+            ), 0.01
+        )
+        assert 1 == report['shards_failed']
+        assert ["oops"] == report['shard_failures']
+        assert logging.WARN == profiler.log.logged[-1][0]
+
+        # A profiled search is logged along with its profile.
+        profile = dict(shards=[dict(id="shard 1")])
+        report = profiler.record(
+            search, self.response(profile=profile), 0.01
+        )
+        assert profile == report['profile']
+        level, message = profiler.log.logged[-1]
+        assert logging.INFO == level
+        assert profile == SearchProfiler.parse_log_line(message)['profile']
+
+        # Only the most recent reports are kept in memory.
+        assert 2 == len(profiler.reports)
+        assert report == profiler.reports[-1]
+
+        # With no threshold, no search is considered slow.
+        profiler.slow_query_threshold = None
+        report = profiler.record(search, self.response(took=100000), 0.2)
+        assert False == report['slow']
+
+    def test_parse_log_line(self):
+        m = SearchProfiler.parse_log_line
+        report = dict(fingerprint="abc", took_ms=10)
+        message = SearchProfiler.LOG_MESSAGE + json.dumps(report)
+
+        assert None == m("some other log message")
+        assert None == m(SearchProfiler.LOG_MESSAGE + "not json")
+
+        # A log message can be parsed on its own, as part of a line
+        # written by a plain-text formatter, or as part of a line
+        # written by a JSONFormatter.
+        assert report == m(message)
+        assert report == m("2020-01-01 WARNING " + message)
+        assert report == m(json.dumps(dict(level="WARN", message=message)))
+
+
+class TestQueryWorksGrouped(object):
+
+    class MockClient(object):
+        """Return canned responses to a multi-search request."""
+        def __init__(self, *responses):
+            self.responses = responses
+
+        def msearch(self, body, **kwargs):
+            # Every other item in the body is a search.
+            self.searches = body[1::2]
+            return dict(responses=self.responses)
+
+    @classmethod
+    def bucket(cls, *ids):
+        return dict(top=dict(hits=dict(hits=[
+            dict(_id=unicode(i), _source=dict(work_id=i)) for i in ids
+        ])))
+
+    def mock_index(self, *responses):
+        index = object.__new__(ExternalSearchIndex)
+        index.works_alias = "works-current"
+        index.search = Search(index="works-current")
+        index.profiler = SearchProfiler()
+        index.log = logging.getLogger("test")
+        index._ExternalSearchIndex__client = self.MockClient(*responses)
+        return index
+
+    def test_query_works_grouped(self):
+        # query_works_grouped runs searches with 'filters'
+        # aggregations, and splits the results back up by Filter.
+        bucket = self.bucket
+        index = self.mock_index(
+            dict(took=5, hits=dict(total=10, hits=[]), aggregations=dict(
+                groups0=dict(buckets={"0": bucket(1, 2)}),
+                groups1=dict(buckets={"1": bucket(2, 3)}),
+            )),
+            dict(took=7, hits=dict(total=10, hits=[]), aggregations=dict(
+                groups0=dict(buckets={"2": bucket()}),
+            )),
+        )
+
+        fiction = Filter(fiction=True)
+        nonfiction = Filter(fiction=False)
+        nonfiction.order = "sort_title"
+        romance = Filter(fiction=True)
+        romance.scoring_functions = [dict(weight=2)]
+        for i, filter in enumerate([fiction, nonfiction, romance]):
+            filter.lane_id = i + 10
+            filter.facets = "order=author"
+        pagination = Pagination(size=2, offset=4)
+
+        [h1, h2, h3] = index.query_works_grouped(
+            [fiction, nonfiction, romance], pagination
+        )
+        assert [1, 2] == [x.work_id for x in h1]
+        assert [2, 3] == [x.work_id for x in h2]
+        assert [] == h3
+
+        # Filters with different scoring functions went into
+        # different searches, sent in a single request.
+        [plain, scored] = index._ExternalSearchIndex__client.searches
+
+        # The searches themselves don't return any documents -- only
+        # aggregations.
+        assert 0 == plain['size']
+        assert 0 == scored['size']
+
+        # Each Filter's scoring functions were applied only to the
+        # works in that Filter's bucket.
+        assert 'function_score' not in json.dumps(plain)
+        function_score = scored['query']['bool']['must'][-1]['function_score']
+        assert (
+            [dict(weight=2, filter=romance.to_query().to_dict())] ==
+            function_score['functions']
+        )
+        assert (
+            {"2": romance.to_query().to_dict()} ==
+            scored['aggs']['groups0']['filters']['filters']
+        )
+
+        # Filters with different sort orders went into different
+        # aggregations.
+        groups0 = plain['aggs']['groups0']
+        assert (
+            {"0": fiction.to_query().to_dict()} ==
+            groups0['filters']['filters']
+        )
+        assert (
+            dict(size=2, _source=["work_id"], **{"from": 4}) ==
+            groups0['aggs']['top']['top_hits']
+        )
+
+        groups1 = plain['aggs']['groups1']
+        assert (
+            {"1": nonfiction.to_query().to_dict()} ==
+            groups1['filters']['filters']
+        )
+        assert (nonfiction.sort_order ==
+                groups1['aggs']['top']['top_hits']['sort'])
+
+        # Both searches were recorded by the profiler, along with
+        # the lanes they covered.
+        first, second = index.profiler.reports
+        assert (5, [10, 11], 2) == (
+            first['took_ms'], first['lane_id'], first['searches_in_request']
+        )
+        assert (7, [12]) == (second['took_ms'], second['lane_id'])
+        assert "order=author" == second['facets']
+
+        # With no filters, there's nothing to do.
+        assert [] == index.query_works_grouped([], pagination)
+
+    def test_featured_lists_kept_apart(self):
+        # Two lanes feature works from different CustomLists.
+        response = dict(took=1, hits=dict(total=0, hits=[]), aggregations=dict(
+            groups0=dict(buckets={"0": self.bucket(), "1": self.bucket()})
+        ))
+        index = self.mock_index(response, response)
+        staff_picks = Filter(customlist_restriction_sets=[[1]])
+        best_sellers = Filter(customlist_restriction_sets=[[2]])
+        filters = [staff_picks, best_sellers]
+        for filter in filters:
+            filter.scoring_functions = filter.featurability_scoring_functions(
+                Filter.DETERMINISTIC
+            )
+        index.query_works_grouped(filters, Pagination(size=2))
+
+        # Each lane got its own search, so being featured on one
+        # lane's list doesn't affect the order of the other lane.
+        searches = index._ExternalSearchIndex__client.searches
+        for filter, search, other_list in zip(filters, searches, [2, 1]):
+            [bucket_filter] = (
+                search['aggs']['groups0']['filters']['filters'].values()
+            )
+            assert filter.to_query().to_dict() == bucket_filter
+            functions = (
+                search['query']['bool']['must'][-1]['function_score']['functions']
+            )
+            assert ('"customlists.list_id": [%d]' % other_list
+                    not in json.dumps(functions))
+
+            # Every scoring function is restricted to the lane's bucket.
+            for function in functions:
+                restriction = function['filter']
+                assert bucket_filter in (
+                    restriction, restriction['bool']['filter'][-1]
+                )
+
+
+class TestQueryWorksGroupedEndToEnd(EndToEndSearchTest):
+
+    def populate_works(self):
+        # Both works are on the staff picks list, but only the
+        # low-quality work is featured -- on the best-seller list.
+        self.high_quality = self.default_work(title="High Quality")
+        self.high_quality.quality = 0.9
+        self.low_quality = self.default_work(title="Low Quality")
+        self.low_quality.quality = 0.2
+
+        self.staff_picks, ignore = self._customlist(num_entries=0)
+        self.staff_picks.add_entry(self.high_quality)
+        self.staff_picks.add_entry(self.low_quality)
+        self.best_sellers, ignore = self._customlist(num_entries=0)
+        self.best_sellers.add_entry(self.low_quality, featured=True)
+
+    def test_featured_lists_kept_apart(self):
+        if not self.search:
+            return
+        staff_picks = self._lane("Staff Picks")
+        staff_picks.customlists.append(self.staff_picks)
+        best_sellers = self._lane("Best Sellers")
+        best_sellers.customlists.append(self.best_sellers)
+
+        facets = FeaturedFacets(0, random_seed=Filter.DETERMINISTIC)
+        filters = [
+            Filter.from_worklist(self._db, lane, facets)
+            for lane in (staff_picks, best_sellers)
+        ]
+        staff_picks_hits, best_sellers_hits = self.search.query_works_grouped(
+            filters, Pagination(size=2)
+        )
+
+        # Being featured on the best-seller list doesn't move the
+        # low-quality work ahead in the staff picks.
+        assert ([self.high_quality.id, self.low_quality.id] ==
+                [x.work_id for x in staff_picks_hits])
+        assert [self.low_quality.id] == [x.work_id for x in best_sellers_hits]
+
+
+class TestSearchResultCaching(EndToEndSearchTest):
+
+    def populate_works(self):
+        self.moby_dick = self.default_work(title="Moby Dick")
+        self.moby_duck = self.default_work(title="Moby Duck")
+
+    def test_query_works_multi(self):
+        if not self.search:
+            return
+        cache = SearchResultCache()
+        self.search.result_cache = cache
+
+        def query():
+            pagination = SortKeyPagination(size=1)
+            queries = [("moby", None, pagination),
+                       ("moby duck", None, SortKeyPagination())]
+            return pagination, list(self.search.query_works_multi(queries))
+
+        # The first time the queries run, the results come from
+        # Elasticsearch and are put in the cache.
+        pagination, [[first], [duck]] = query()
+        assert dict(hits=0, misses=2, hit_rate=0) == cache.stats
+        assert self.moby_duck.id == duck.work_id
+        original_next_page = pagination.next_page.last_item_on_previous_page
+
+        # Delete a work from the search index.
+        self.search.bulk(
+            [dict(_op_type="delete", _index=self.search.works_index,
+                  _type=self.search.work_document_type, _id=first.work_id)],
+            refresh=True
+        )
+
+        # The second time, the results come from the cache, and the
+        # deleted work still shows up.
+        pagination, [[cached_first], [cached_duck]] = query()
+        assert dict(hits=2, misses=2, hit_rate=0.5) == cache.stats
+        assert first.work_id == cached_first.work_id
+        assert duck.work_id == cached_duck.work_id
+
+        # Pagination works the same way with cached results.
+        assert (original_next_page ==
+                pagination.next_page.last_item_on_previous_page)
+
+        # Debugging queries always go to Elasticsearch.
+        [results] = self.search.query_works_multi(
+            [("moby duck", None, Pagination.default())], debug=True
+        )
+        assert dict(hits=2, misses=2, hit_rate=0.5) == cache.stats
+
+        # Moving the alias to a different index clears the cache.
+        self.search.transfer_current_alias(self._db, self.search.works_index)
+        pagination, [results, duck_results] = query()
+        assert dict(hits=2, misses=4, hit_rate=1/3.0) == cache.stats
+        assert first.work_id not in [x.work_id for x in results]
+
+
 class TestCurrentMapping(object):
 
     def test_character_filters(self):
@@ -2084,6 +2651,78 @@ class TestQuery(DatabaseTest):
         assert None == query.contains_stopwords
         assert 0 == query.fuzzy_coefficient
 
+    def test_normalize_query_string(self):
+        m = Query.normalize_query_string
+        assert "" == m(None)
+        assert "" == m("  ")
+        assert "a query string" == m(" a  query\tstring ")
+
+        # The constructor normalizes the query string.
+        assert "a query string" == Query(" a  query string").query_string
+
+    def test_spellcheck_failed(self):
+        class MockSpellChecker(object):
+            calls = []
+            def unknown(self, words):
+                self.calls.append(words)
+                return [x for x in words if x == "xlomph"]
+
+        class Mock(Query):
+            SPELLCHECKER = MockSpellChecker()
+            SPELLCHECK_CACHE = LRUCache()
+
+        assert False == Mock.spellcheck_failed(["a", "word"])
+        assert True == Mock.spellcheck_failed(["an", "xlomph"])
+        assert [["a", "word"], ["an", "xlomph"]] == Mock.SPELLCHECKER.calls
+
+        # The results were cached, so checking the same words again
+        # doesn't call the spellchecker.
+        assert False == Mock.spellcheck_failed(["A", "Word"])
+        assert True == Mock.spellcheck_failed(["an", "xlomph"])
+        assert 2 == len(Mock.SPELLCHECKER.calls)
+
+    def test_elasticsearch_query_cache(self):
+        class Mock(Query):
+            QUERY_CACHE = LRUCache()
+            built = []
+
+            def _build_elasticsearch_query(self):
+                self.built.append((self.query_string, self.use_query_parser))
+                return Term(title=self.query_string)
+
+        # The first time a query is built, it's put in the cache.
+        query = Mock("asteroids").elasticsearch_query
+        assert Term(title="asteroids") == query
+        assert [("asteroids", True)] == Mock.built
+
+        # The next time the same query string comes in -- even with
+        # different whitespace -- the cached query is used.
+        assert query is Mock(" asteroids ").elasticsearch_query
+        assert 1 == len(Mock.built)
+
+        # Whether or not the query parser is used is part of the cache
+        # key, since it changes the query.
+        Mock("asteroids", use_query_parser=False).elasticsearch_query
+        assert ("asteroids", False) == Mock.built[-1]
+
+        # The Query subclass is also part of the cache key.
+        class Mock2(Mock):
+            pass
+        Mock2("asteroids").elasticsearch_query
+        assert 3 == len(Mock.built)
+
+        # If there's no cache, the query is built every time.
+        Mock.QUERY_CACHE = None
+        Mock("asteroids").elasticsearch_query
+        Mock("asteroids").elasticsearch_query
+        assert 5 == len(Mock.built)
+
+        # A real Query gives the same result whether or not it was
+        # cached.
+        uncached = Query("asteroids")._build_elasticsearch_query()
+        assert uncached == Query("asteroids").elasticsearch_query
+        assert uncached == Query("asteroids").elasticsearch_query
+
 
     def test_build(self):
         # Verify that the build() method combines the 'query' part of
@@ -3296,6 +3935,7 @@ class TestFilter(DatabaseTest):
         facets = Mock()
 
         filter = Filter.from_worklist(self._db, inherits, facets)
+        assert inherits.id == filter.lane_id
         assert [self._default_collection.id] == filter.collection_ids
         assert parent.media == filter.media
         assert parent.languages == filter.languages
@@ -3371,8 +4011,10 @@ class TestFilter(DatabaseTest):
         for_default_library.initialize(self._default_library)
 
         # Its filter uses all the collections associated with that library.
+        # Since it's not a Lane, the filter isn't associated with a lane.
         filter = Filter.from_worklist(self._db, for_default_library, None)
         assert [self._default_collection.id] == filter.collection_ids
+        assert None == filter.lane_id
 
         # Here's a child of that WorkList associated with a different
         # library.
@@ -3400,6 +4042,113 @@ class TestFilter(DatabaseTest):
         filter = Filter.from_worklist(self._db, for_other_library, None)
         assert True == filter.allow_holds
 
+    def test_from_worklist_cache(self):
+        Filter.WORKLIST_TEMPLATE_CACHE.clear()
+        parent = self._lane(display_name="Parent")
+        parent.languages = ["eng"]
+        child = self._lane(display_name="Child", parent=parent)
+        child.genres = [self.horror]
+        self._db.flush()
+
+        # Creating the lanes changed the site configuration. Pretend
+        # that happened at a known time.
+        Configuration.site_configuration_last_update(
+            self._db, known_value=datetime.datetime(2020, 1, 1)
+        )
+
+        cached = Filter.from_worklist(self._db, child, None, cache=True)
+        assert ["eng"] == cached.languages
+        assert [[self.horror.id]] == cached.genre_restriction_sets
+
+        # A template for the Filter was cached, keyed by the lane and
+        # the last time the site configuration changed.
+        key = (child.id, datetime.datetime(2020, 1, 1))
+        args, kwargs = Filter.WORKLIST_TEMPLATE_CACHE.get(key)
+        assert ["eng"] == args[2]
+
+        # Modifying the Filter doesn't affect the cached template.
+        cached.languages.append("spa")
+        assert ["eng"] == args[2]
+
+        # Changes to the lane hierarchy don't show up until the site
+        # configuration changes.
+        parent.languages = ["fre"]
+        child.genres = [self.fantasy]
+        cached = Filter.from_worklist(self._db, child, None, cache=True)
+        assert ["eng"] == cached.languages
+        assert [[self.horror.id]] == cached.genre_restriction_sets
+
+        # Unless the cache isn't used.
+        uncached = Filter.from_worklist(self._db, child, None)
+        assert ["fre"] == uncached.languages
+
+        # Once the site configuration changes, the new values are used.
+        Configuration.site_configuration_last_update(
+            self._db, known_value=datetime.datetime(2020, 1, 2)
+        )
+        del child._genre_ids
+        cached = Filter.from_worklist(self._db, child, None, cache=True)
+        assert ["fre"] == cached.languages
+        assert [[self.fantasy.id]] == cached.genre_restriction_sets
+
+        # The facets are applied each time a Filter is created, even
+        # when the rest of it comes from the cache.
+        class Mock(object):
+            def modify_search_filter(self, filter):
+                filter.order = "sort_title"
+            def scoring_functions(self, filter):
+                return []
+        cached = Filter.from_worklist(self._db, child, Mock(), cache=True)
+        assert "sort_title" == cached.order
+
+        # Adding a CustomList to a lane, or removing one, changes the
+        # site configuration, so the lane and the lanes beneath it
+        # stop using their cached templates.
+        staff_picks, ignore = self._customlist(num_entries=0)
+        self._db.flush()
+        Configuration.site_configuration_last_update(
+            self._db, known_value=datetime.datetime(2020, 1, 3)
+        )
+        cached = Filter.from_worklist(self._db, child, None, cache=True)
+        assert [] == cached.customlist_restriction_sets
+
+        parent.customlists.append(staff_picks)
+        cached = Filter.from_worklist(self._db, child, None, cache=True)
+        assert [[staff_picks.id]] == cached.customlist_restriction_sets
+
+        parent.customlists.remove(staff_picks)
+        cached = Filter.from_worklist(self._db, child, None, cache=True)
+        assert [] == cached.customlist_restriction_sets
+
+        # WorkLists that aren't Lanes are never cached.
+        Filter.WORKLIST_TEMPLATE_CACHE.clear()
+        worklist = WorkList()
+        worklist.initialize(self._default_library)
+        Filter.from_worklist(self._db, worklist, None, cache=True)
+        assert 0 == len(Filter.WORKLIST_TEMPLATE_CACHE)
+
+        # Neither are Lanes that get their CustomLists from a
+        # DataSource, or their descendants -- a new CustomList from
+        # that DataSource doesn't change the site configuration.
+        best_sellers = self._lane(display_name="Best Sellers", parent=parent)
+        best_sellers.list_datasource = DataSource.lookup(
+            self._db, DataSource.NYT
+        )
+        fiction = self._lane(display_name="Fiction", parent=best_sellers)
+        list1, ignore = self._customlist(num_entries=0)
+        self._db.flush()
+        for lane in best_sellers, fiction:
+            filter = Filter.from_worklist(self._db, lane, None, cache=True)
+            assert [[list1.id]] == filter.customlist_restriction_sets
+        assert 0 == len(Filter.WORKLIST_TEMPLATE_CACHE)
+
+        list2, ignore = self._customlist(num_entries=0)
+        del best_sellers._customlist_ids
+        filter = Filter.from_worklist(self._db, fiction, None, cache=True)
+        assert [sorted([list1.id, list2.id])] == [
+            sorted(x) for x in filter.customlist_restriction_sets
+        ]
+
     def assert_filter_builds_to(self, expect, filter, _chain_filters=None):
         """Helper method for the most common case, where a
         Filter.build() returns a main filter and no nested filters.
@@ -3664,6 +4413,31 @@ class TestFilter(DatabaseTest):
         built_filters, subfilters = self.assert_filter_builds_to([{'term': {'fiction': 'nonfiction'}}], filter)
         assert {} == subfilters
 
+    def test_to_query(self):
+        # A Filter with no restrictions matches everything, apart from
+        # the default exclusion of research material.
+        filter = Filter()
+        base, nested = filter.build()
+        assert Bool(filter=[base]) == filter.to_query()
+
+        # Nested filters become nested queries.
+        filter = Filter(collections=[1, 2])
+        base, nested = filter.build()
+        [collection_filter] = nested['licensepools']
+        assert (
+            Bool(filter=[
+                base,
+                Nested(path='licensepools',
+                       query=Bool(filter=collection_filter))
+            ]) == filter.to_query()
+        )
+
+        # If there are no restrictions at all, everything matches.
+        class Mock(Filter):
+            def build(self):
+                return None, {}
+        assert MatchAll() == Mock().to_query()
+
     def test_build_series(self):
         # Test what happens when a series restriction is placed on a Filter.
         f = Filter(series="Talking Hedgehog Mysteries")
@@ -4521,3 +5295,77 @@ class TestSearchIndexCoverageProvider(DatabaseTest):
         assert work == record.obj
         assert True == record.transient
         assert 'There was an error!' == record.exception
+
+
+class TestSearchIndexAvailabilityCoverageProvider(DatabaseTest):
+
+    def test_operation(self):
+        index = MockExternalSearchIndex()
+        provider = SearchIndexAvailabilityCoverageProvider(
+            self._db, search_index_client=index
+        )
+        assert (
+            WorkCoverageRecord.UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION ==
+            provider.operation
+        )
+
+    def test_success(self):
+        work = self._work(with_license_pool=True)
+        work.set_presentation_ready()
+        [pool] = work.license_pools
+        index = MockExternalSearchIndex()
+        index.bulk_update([work])
+        [doc] = index.docs.values()
+        title = doc['title']
+        assert True == doc['licensepools'][0]['available']
+
+        # The work's availability changes.
+        pool.licenses_available = 0
+        self._db.flush()
+
+        provider = SearchIndexAvailabilityCoverageProvider(
+            self._db, search_index_client=index
+        )
+        assert [work] == provider.process_batch([work])
+
+        # The availability information in the search document was
+        # updated, and the rest of the document was left alone.
+        [doc] = index.docs.values()
+        assert False == doc['licensepools'][0]['available']
+        assert title == doc['title']
+
+    def test_missing_document(self):
+        # If a work has no search document, there's nothing to update,
+        # so the work is queued for a full reindex instead.
+        work = self._work(with_license_pool=True)
+        work.set_presentation_ready()
+        record = work.external_index_needs_updating()
+        record.status = WorkCoverageRecord.SUCCESS
+
+        index = MockExternalSearchIndex()
+        provider = SearchIndexAvailabilityCoverageProvider(
+            self._db, search_index_client=index
+        )
+        assert [work] == provider.process_batch([work])
+        assert {} == index.docs
+        assert WorkCoverageRecord.REGISTERED == record.status
+
+    def test_failure(self):
+        class DoomedExternalSearchIndex(MockExternalSearchIndex):
+            """All updates sent to this index will fail."""
+            def bulk(self, docs, **kwargs):
+                return 0, [
+                    dict(update=dict(_id=unicode(doc['_id']), status=500,
+                                     error="There was an error!"))
+                    for doc in docs
+                ]
+
+        work = self._work(with_license_pool=True)
+        work.set_presentation_ready()
+        provider = SearchIndexAvailabilityCoverageProvider(
+            self._db, search_index_client=DoomedExternalSearchIndex()
+        )
+        [record] = provider.process_batch([work])
+        assert work == record.obj
+        assert True == record.transient
+        assert 'There was an error!' == record.exception
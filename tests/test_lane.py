@@ -2305,6 +2305,59 @@ class TestWorkList(DatabaseTest):
             self._db.delete(lpdm)
             assert [[]] == m(self._db, [[hit2]])
 
+    def test_works_for_resultsets_hydrated_from_search_index(self):
+        # If HYDRATE_FROM_SEARCH_INDEX is set, works_for_resultsets()
+        # gets its Works from works_by_id() instead of
+        # works_from_database().
+        class Mock(WorkList):
+            HYDRATE_FROM_SEARCH_INDEX = True
+            def works_by_id(self, _db, work_ids):
+                self.works_by_id_called_with = work_ids
+                return [w1, w2]
+
+        w1 = self._work(with_license_pool=True)
+        w2 = self._work(with_license_pool=True)
+        class MockHit(object):
+            def __init__(self, work):
+                self.work_id = work.id
+            def __contains__(self, k):
+                return False
+
+        wl = Mock()
+        wl.initialize(self._default_library)
+        hit1 = MockHit(w1)
+        hit2 = MockHit(w2)
+        assert ([[w2, w1], [w1]] ==
+                wl.works_for_resultsets(self._db, [[hit2, hit1], [hit1]]))
+        assert set([w1.id, w2.id]) == wl.works_by_id_called_with
+
+    def test_works_by_id(self):
+        wl = WorkList()
+        wl.initialize(self._default_library)
+
+        w1 = self._work(with_license_pool=True, with_open_access_download=True)
+        w2 = self._work(with_license_pool=True)
+        assert [] == wl.works_by_id(self._db, [])
+        assert (set([w1, w2]) ==
+                set(wl.works_by_id(self._db, [w1.id, w2.id, -100])))
+
+        # The restrictions that the search index would have applied
+        # are not applied here, e.g. presentation-readiness.
+        w2.presentation_ready = False
+        assert set([w1, w2]) == set(wl.works_by_id(self._db, [w1.id, w2.id]))
+
+        # But a work with no way of delivering the book is not
+        # returned.
+        for lpdm in w2.license_pools[0].delivery_mechanisms:
+            self._db.delete(lpdm)
+        self._db.commit()
+        assert [w1] == wl.works_by_id(self._db, [w1.id, w2.id])
+
+        # Neither is a work that's only available in a collection
+        # that's not part of the WorkList.
+        w1.license_pools[0].collection = self._collection()
+        assert [] == wl.works_by_id(self._db, [w1.id, w2.id])
+
     def test_search_target(self):
         # A WorkList can be searched - it is its own search target.
         wl = WorkList()
@@ -4133,6 +4186,12 @@ class TestWorkListGroupsEndToEnd(EndToEndSearchTest):
             ]
         )
 
+        # The aggregation-based groups engine finds the same works.
+        expect = list(make_groups(fiction))
+        fiction.GROUPS_BY_AGGREGATION = True
+        assert_contents(make_groups(fiction), expect)
+        del fiction.GROUPS_BY_AGGREGATION
+
         # Let's see how entry points affect the feeds.
         #
 
@@ -4432,6 +4491,94 @@ class TestWorkListGroups(DatabaseTest):
         # And that's how we got a sequence of 2-tuples mapping out a
         # grouped OPDS feed.
 
+    def test__fill_groups(self):
+        # _fill_groups divides items among lanes, reusing an item
+        # from an earlier lane only when there's no other way to fill
+        # out a lane.
+        items_and_lanes = [
+            (1, "lane1"), (2, "lane1"), (3, "lane1"),
+            (1, "lane2"), (4, "lane2"),
+            (1, "lane3"), (2, "lane3"), (2, "lane3"),
+        ]
+        by_lane = WorkList._fill_groups(
+            items_and_lanes, 2, key=lambda x: x
+        )
+        assert [1, 2] == by_lane["lane1"]
+
+        # Item 1 was used in lane1, so lane2 gets item 4 and then has to
+        # reuse item 1.
+        assert [4, 1] == by_lane["lane2"]
+
+        # Every item in lane3 was used earlier, so lane3 is filled out
+        # by reusing items.
+        assert [1, 2] == by_lane["lane3"]
+
+    def test__featured_works_by_aggregation(self):
+        # _featured_works_by_aggregation sends one Filter per lane to
+        # the search engine's query_works_grouped(), removes duplicates
+        # from the results, and loads the Works all at once.
+        class MockWorkList(WorkList):
+            works_for_resultsets_calls = []
+            def works_for_resultsets(self, _db, resultsets, facets=None):
+                self.works_for_resultsets_calls.append(resultsets)
+                return [
+                    ["work %s" % hit.work_id for hit in hits]
+                    for hits in resultsets
+                ]
+
+        class MockHit(object):
+            def __init__(self, work_id):
+                self.work_id = work_id
+
+        class MockSearchEngine(object):
+            def query_works_grouped(self, filters, pagination, debug=False):
+                self.called_with = (filters, pagination, debug)
+                return [
+                    [MockHit(1), MockHit(2), MockHit(3)],
+                    [MockHit(1), MockHit(4)],
+                ]
+
+        parent = MockWorkList()
+        child1 = self._lane()
+        child2 = self._lane()
+        parent.initialize(
+            library=self._default_library, children=[child1, child2]
+        )
+        search = MockSearchEngine()
+        facets = FeaturedFacets(0.1)
+        pagination = Pagination(size=3)
+        by_lane = parent._featured_works_by_aggregation(
+            self._db, [child1, child2], 2, pagination, facets,
+            search_engine=search, debug=True
+        )
+
+        # One Filter was created for each lane.
+        filters, used_pagination, debug = search.called_with
+        assert pagination == used_pagination
+        assert True == debug
+        for lane, filter in zip([child1, child2], filters):
+            expect = Filter.from_worklist(
+                self._db, lane, lane.overview_facets(self._db, facets)
+            )
+            assert expect.build() == filter.build()
+
+        # Duplicates were removed before works_for_resultsets was
+        # called, so it only had to load four works.
+        [resultsets] = parent.works_for_resultsets_calls
+        assert (
+            [[1, 2], [4, 1]] ==
+            [[hit.work_id for hit in hits] for hits in resultsets]
+        )
+        assert (
+            {child1: ["work 1", "work 2"], child2: ["work 4", "work 1"]} ==
+            by_lane
+        )
+
+        # If there are no lanes, there's nothing to do.
+        assert {} == parent._featured_works_by_aggregation(
+            self._db, [], 2, pagination, facets, search_engine=search
+        )
+
     def test__size_for_facets(self):
 
         lane = self._lane()
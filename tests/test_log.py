@@ -2,6 +2,7 @@
 import json
 import logging
 import sys
+import threading
 
 import pytest
 
@@ -17,6 +18,7 @@ from ..log import (
     CloudwatchLogs,
     Logger,
     CannotLoadConfiguration,
+    QueueHandler,
 )
 from ..model import (
     ExternalIntegration,
@@ -77,6 +79,146 @@ class TestJSONFormatter(object):
             assert u"An important snowman: ☃" == data['message']
 
 
+class BlockingHandler(logging.Handler):
+    """A handler that holds up the background thread of a QueueHandler
+    until it's released.
+    """
+    def __init__(self):
+        super(BlockingHandler, self).__init__()
+        self.started = threading.Event()
+        self.unblock = threading.Event()
+        self.messages = []
+        self.records = []
+
+    def emit(self, record):
+        self.started.set()
+        self.unblock.wait()
+        self.records.append(record)
+        self.messages.append(record.getMessage())
+
+
+class TestQueueHandler(object):
+
+    def record(self, message, level=logging.INFO):
+        return logging.LogRecord(
+            "some logger", level, "pathname", 104, message, (), None
+        )
+
+    def test_records_handled_in_background(self):
+        capture = BlockingHandler()
+        capture.unblock.set()
+        capture.setLevel(logging.INFO)
+        handler = QueueHandler([capture])
+
+        handler.handle(self.record("one"))
+        handler.handle(self.record("too quiet", logging.DEBUG))
+        handler.handle(self.record("two"))
+
+        # Closing the handler makes sure every queued record has been
+        # passed on.
+        handler.close()
+        assert ["one", "two"] == capture.messages
+        assert dict(queued=3, dropped=0, handled=3, pending=0) == handler.stats
+        assert False == handler._thread.is_alive()
+
+    def _overflow(self, policy):
+        """Fill up a small queue while the background thread is stuck."""
+        capture = BlockingHandler()
+        handler = QueueHandler([capture], capacity=2, overflow_policy=policy)
+        handler.handle(self.record("one"))
+        capture.started.wait()
+
+        # The background thread is now processing "one", and the queue
+        # only has room for two more records.
+        for message in ("two", "three", "four"):
+            handler.handle(self.record(message))
+        capture.unblock.set()
+        handler.close()
+        return handler, capture.messages
+
+    def test_drop_newest(self):
+        handler, messages = self._overflow(QueueHandler.DROP_NEWEST)
+        assert ["one", "two", "three"] == messages
+        assert 3 == handler.queued
+        assert 1 == handler.dropped
+
+    def test_drop_oldest(self):
+        handler, messages = self._overflow(QueueHandler.DROP_OLDEST)
+        assert ["one", "three", "four"] == messages
+        assert 4 == handler.queued
+        assert 1 == handler.dropped
+
+    def test_record_prepared_before_queueing(self):
+        capture = BlockingHandler()
+        handler = QueueHandler([capture])
+
+        # The arguments and the exception are dealt with before the
+        # record goes into the queue, so it doesn't matter what
+        # happens to them afterwards.
+        items = ["a"]
+        try:
+            raise ValueError("oops")
+        except ValueError:
+            exc_info = sys.exc_info()
+        record = logging.LogRecord(
+            "some logger", logging.ERROR, "pathname", 104,
+            u"Items: %r %s", (items, b"☃"), exc_info
+        )
+        handler.handle(record)
+        items.append("b")
+        capture.unblock.set()
+        handler.close()
+
+        # The message is a native string, as JSONFormatter would make it.
+        assert ["Items: ['a'] ☃"] == capture.messages
+
+        # The handled record is a copy, with nothing left to format.
+        [queued] = capture.records
+        assert queued is not record
+        assert None == queued.args
+        assert None == queued.exc_info
+        assert "ValueError: oops" in queued.exc_text
+        assert (items, b"☃") == record.args
+        assert exc_info == record.exc_info
+
+        # A JSONFormatter still finds the traceback.
+        data = json.loads(JSONFormatter("some app").format(queued))
+        assert u"Items: ['a'] ☃" == data['message']
+        assert "ValueError: oops" in data['traceback']
+
+    def test_block_policy_from_background_thread(self):
+        # This handler logs two more messages through the QueueHandler
+        # while it's handling a record on the background thread.
+        class Relogger(BlockingHandler):
+            def emit(self, record):
+                super(Relogger, self).emit(record)
+                if record.getMessage() == "one":
+                    for message in ("two", "three"):
+                        self.queue_handler.handle(
+                            TestQueueHandler().record(message)
+                        )
+
+        relogger = Relogger()
+        relogger.unblock.set()
+        handler = QueueHandler(
+            [relogger], capacity=1, overflow_policy=QueueHandler.BLOCK
+        )
+        relogger.queue_handler = handler
+
+        # The background thread can't wait for room in the queue,
+        # since only it can make room. Instead of deadlocking, the
+        # record that doesn't fit is dropped.
+        handler.handle(self.record("one"))
+        handler.close()
+        assert ["one", "two"] == relogger.messages
+        assert 1 == handler.dropped
+
+    def test_unknown_overflow_policy(self):
+        with pytest.raises(ValueError) as excinfo:
+            QueueHandler([], overflow_policy="explode")
+        assert "Unknown overflow policy: explode" in str(excinfo.value)
+
+
 class TestLogConfiguration(DatabaseTest):
 
     def test_configuration(self):
@@ -173,6 +315,45 @@ class TestLogConfiguration(DatabaseTest):
         assert cls.WARN == database_log_level
         assert SysLogger.DEFAULT_MESSAGE_TEMPLATE == handler.formatter._fmt
 
+    def test_queue_handlers(self):
+        m = LogConfiguration.queue_handlers
+        handlers = [logging.StreamHandler()]
+
+        # By default, no log queue is used.
+        assert (handlers, []) == m(self._db, handlers)
+
+        # Once a queue size is configured, the handlers are wrapped in
+        # a QueueHandler -- unless we're running unit tests.
+        ConfigurationSetting.sitewide(
+            self._db, LogConfiguration.LOG_QUEUE_SIZE
+        ).value = "100"
+        assert (handlers, []) == m(self._db, handlers, testing=True)
+
+        [queue_handler], errors = m(self._db, handlers)
+        assert [] == errors
+        assert isinstance(queue_handler, QueueHandler)
+        assert handlers == queue_handler.handlers
+        assert 100 == queue_handler.queue.maxsize
+        assert QueueHandler.DROP_NEWEST == queue_handler.overflow_policy
+        queue_handler.close()
+
+        ConfigurationSetting.sitewide(
+            self._db, LogConfiguration.LOG_QUEUE_OVERFLOW
+        ).value = QueueHandler.BLOCK
+        [queue_handler], errors = m(self._db, handlers)
+        assert QueueHandler.BLOCK == queue_handler.overflow_policy
+        queue_handler.close()
+
+        # A bad overflow policy is reported, and the original handlers
+        # are used.
+        ConfigurationSetting.sitewide(
+            self._db, LogConfiguration.LOG_QUEUE_OVERFLOW
+        ).value = "explode"
+        assert (
+            (handlers, ["Error creating log queue Unknown overflow policy: explode"])
+            == m(self._db, handlers)
+        )
+
     def test_syslog_defaults(self):
         cls = SysLogger
 
@@ -8,6 +8,7 @@ from parameterized import parameterized
 
 from ..testing import (
     DatabaseTest,
+    DummyCanonicalizeLookupResponse,
     DummyHTTPClient,
     DummyMetadataClient,
 )
@@ -15,6 +16,7 @@ from ..analytics import Analytics
 from ..classifier import Classifier
 from ..classifier import NO_VALUE, NO_NUMBER
 from ..metadata_layer import (
+    BulkMetadataImporter,
     CSVMetadataImporter,
     CirculationData,
     ContributorData,
@@ -22,6 +24,7 @@ from ..metadata_layer import (
     LinkData,
     MARCExtractor,
     MeasurementData,
+    MetaToModelUtility,
     Metadata,
     ReplacementPolicy,
     SubjectData,
@@ -33,6 +36,7 @@ from ..model import (
     DataSource,
     Edition,
     Identifier,
+    LookupCache,
     Measurement,
     Hyperlink,
     Representation,
@@ -106,6 +110,29 @@ class TestMetadataImporter(DatabaseTest):
             [(x.type, x.identifier, x.weight)
              for x in sorted(m2.subjects, key=lambda x: x.identifier)])
 
+    def test_parse_in_worker_processes(self):
+        base_path = os.path.split(__file__)[0]
+        path = os.path.join(base_path, "files/csv/staff_picks.csv")
+        importer = CSVMetadataImporter(DataSource.LIBRARY_STAFF)
+        importer.WORKER_CHUNK_SIZE = 7
+
+        def summarize(metadatas):
+            return [
+                (m.title, [x.identifier for x in m.identifiers],
+                 [x.display_name for x in m.contributors], m.csv_row)
+                for m in metadatas
+            ]
+
+        expect = summarize(importer.to_metadata(csv.DictReader(open(path))))
+        assert 101 == len(expect)
+
+        # Rows can be turned into Metadata objects in worker processes,
+        # with the same results, in the same order.
+        actual = summarize(
+            importer.to_metadata(csv.DictReader(open(path)), processes=2)
+        )
+        assert expect == actual
+
     def test_classifications_from_another_source_not_updated(self):
 
         # Set up an edition whose primary identifier has two
@@ -374,6 +401,46 @@ class TestMetadataImporter(DatabaseTest):
         assert thumbnail.mirror_url.startswith('https://test-cover-bucket.s3.amazonaws.com/scaled/300/')
         assert thumbnail.mirror_url.endswith('cover.png')
 
+    def test_mirror_link_thumbnails_in_batch(self):
+        # If mirror_link is given a list, it puts off making a
+        # thumbnail until make_thumbnails is called.
+        mirror = MockS3Uploader()
+        policy = ReplacementPolicy(
+            mirrors=dict(covers_mirror=mirror, books_mirror=None)
+        )
+        utility = MetaToModelUtility()
+        content = open(self.sample_cover_path("test-book-cover.png"), "rb").read()
+        thumbnails = []
+        for i in range(2):
+            edition, pool = self._edition(with_license_pool=True)
+            link = LinkData(
+                rel=Hyperlink.IMAGE, href=self._url,
+                media_type=Representation.PNG_MEDIA_TYPE, content=content
+            )
+            link_obj, ignore = edition.primary_identifier.add_link(
+                rel=link.rel, href=link.href, data_source=edition.data_source,
+                media_type=link.media_type, content=link.content
+            )
+            utility.mirror_link(
+                edition, edition.data_source, link, link_obj, policy,
+                thumbnails
+            )
+
+        # The full-size images were mirrored, but no thumbnails have
+        # been made yet.
+        image1, image2 = mirror.uploaded
+        assert [] == image1.thumbnails
+        assert [image1, image2] == [x[0] for x in thumbnails]
+
+        utility.make_thumbnails(thumbnails, policy)
+        image1, image2, thumbnail1, thumbnail2 = mirror.uploaded
+        assert image1 == thumbnail1.thumbnail_of
+        assert image2 == thumbnail2.thumbnail_of
+        assert Edition.MAX_THUMBNAIL_HEIGHT == thumbnail1.image_height
+        assert thumbnail1.mirror_url.startswith(
+            'https://test-cover-bucket.s3.amazonaws.com/scaled/300/'
+        )
+
     def test_mirror_thumbnail_only(self):
         # Make sure a thumbnail image is mirrored when there's no cover image.
         mirrors = dict(covers_mirror=MockS3Uploader())
@@ -1200,6 +1267,154 @@ class TestMetadata(DatabaseTest):
         # Metadata.apply() does not create a Work if no Work exists.
         assert 0 == self._db.query(Work).count()
 
+    def test_prepare_to_apply(self):
+        isbn = IdentifierData(Identifier.ISBN, u"9781453219539")
+        def metadata(identifier):
+            return Metadata(
+                data_source=DataSource.OVERDRIVE,
+                primary_identifier=IdentifierData(
+                    Identifier.OVERDRIVE_ID, identifier
+                ),
+                identifiers=[isbn],
+                subjects=[SubjectData(Subject.TAG, u"a tag")],
+                contributors=[
+                    ContributorData(sort_name=u"Author, A."),
+                    # This contributor can't be looked up by name.
+                    ContributorData(sort_name=u"Author, B.", viaf=u"1"),
+                ],
+            )
+        metadatas = [metadata(u"abc"), metadata(u"def")]
+
+        # Without a LookupCache, nothing happens.
+        Metadata.prepare_to_apply(self._db, metadatas)
+        assert 0 == self._db.query(Edition).count()
+
+        with LookupCache.installed(self._db) as cache:
+            Metadata.prepare_to_apply(self._db, metadatas)
+
+            # Everything needed to apply the Metadata was created and
+            # put in the cache.
+            overdrive = DataSource.lookup(self._db, DataSource.OVERDRIVE)
+            internal = DataSource.lookup(
+                self._db, DataSource.INTERNAL_PROCESSING
+            )
+            for type, identifier in (
+                (Identifier.OVERDRIVE_ID, u"abc"),
+                (Identifier.OVERDRIVE_ID, u"def"),
+                (Identifier.ISBN, u"9781453219539"),
+            ):
+                assert None != cache.get(self._db, Identifier, (type, identifier))
+            for edition in self._db.query(Edition):
+                assert overdrive == edition.data_source
+                key = (overdrive.id, edition.primary_identifier.id)
+                assert edition == cache.get(self._db, Edition, key)
+
+                # Neither Identifier has any CoverageRecords yet, and
+                # the cache knows it.
+                key = (edition.primary_identifier.id, overdrive.id, None, None)
+                assert None == cache.get(self._db, CoverageRecord, key)
+                key = (
+                    edition.primary_identifier.id, internal.id,
+                    CoverageRecord.METADATA_UPLOAD_OPERATION, None
+                )
+                assert None == cache.get(self._db, CoverageRecord, key)
+            assert 2 == self._db.query(Edition).count()
+
+            assert u"a tag" == cache.get(
+                self._db, Subject, (Subject.TAG, u"a tag")
+            ).identifier
+            [author] = cache.get(self._db, Contributor, u"Author, A.")
+            assert [u"Author, A."] == [
+                x.sort_name for x in self._db.query(Contributor)
+            ]
+
+            # Applying the Metadata uses the objects that were created.
+            for m in metadatas:
+                edition, is_new = m.edition(self._db)
+                assert False == is_new
+                m.apply(edition, None)
+                assert author in edition.author_contributors
+
+    def test_find_sort_names(self):
+        class MockMetadataClient(object):
+            def __init__(self):
+                self.lookups = {}
+                self.requests = []
+
+            def canonicalize_author_names(self, authors):
+                self.requests.append(list(authors))
+                for identifier, display_name in authors:
+                    response = self.lookups[display_name]
+                    if not isinstance(response, Exception):
+                        if response:
+                            response = DummyCanonicalizeLookupResponse.success(
+                                response
+                            )
+                        else:
+                            response = DummyCanonicalizeLookupResponse.failure()
+                    yield (identifier, display_name), response
+
+        existing, ignore = self._contributor(
+            sort_name=u"Author, E.", display_name=u"Existing Author"
+        )
+        def metadata(display_name, sort_name=None):
+            return Metadata(
+                data_source=DataSource.OVERDRIVE,
+                identifiers=[IdentifierData(Identifier.ISBN, u"9781453219539")],
+                contributors=[
+                    ContributorData(
+                        display_name=display_name, sort_name=sort_name
+                    )
+                ],
+            )
+        twain1 = metadata(u"Mark Twain")
+        twain2 = metadata(u"Mark Twain")
+        unknown = metadata(u"New Author")
+        broken = metadata(u"Broken Author")
+        has_sort_name = metadata(u"Sorted Author", u"Sorted, A.")
+        has_existing = metadata(u"Existing Author")
+        metadatas = [
+            twain1, twain2, unknown, broken, has_sort_name, has_existing
+        ]
+
+        client = MockMetadataClient()
+        client.lookups[u"Mark Twain"] = u"Twain, Mark"
+        client.lookups[u"New Author"] = None
+        client.lookups[u"Broken Author"] = RemoteIntegrationException(
+            "http://url/", "Metadata wrangler failure!"
+        )
+        Metadata.find_sort_names(self._db, metadatas, client)
+
+        # One request was made, asking about each author that
+        # needed a sort name once.
+        [request] = client.requests
+        isbn = self._db.query(Identifier).filter(
+            Identifier.type==Identifier.ISBN
+        ).one()
+        assert (
+            set([(isbn, u"Mark Twain"), (isbn, u"New Author"),
+                 (isbn, u"Broken Author")]) == set(request)
+        )
+        assert u"Twain, Mark" == twain1.primary_author.sort_name
+        assert u"Twain, Mark" == twain2.primary_author.sort_name
+
+        # If the canonicalizer doesn't know the author, a sort name
+        # is guessed from the display name.
+        assert u"Author, New" == unknown.primary_author.sort_name
+
+        # If the request failed, the author is left alone.
+        assert None == broken.primary_author.sort_name
+
+        # Existing sort names were used without asking.
+        assert u"Sorted, A." == has_sort_name.primary_author.sort_name
+        assert u"Author, E." == has_existing.primary_author.sort_name
+
+        # A client that can't canonicalize names in bulk isn't asked.
+        Metadata.find_sort_names(
+            self._db, [broken], DummyMetadataClient()
+        )
+        assert None == broken.primary_author.sort_name
+
     def test_apply_wipes_presentation_calculation_records(self):
         # We have a work.
         work = self._work(title="The Wrong Title", with_license_pool=True)
@@ -1862,9 +2077,139 @@ class TestMARCExtractor(DatabaseTest):
         assert 1 == len(record.links)
         assert "Utterson and Enfield are worried about their friend" in record.links[0].content
 
+    def test_iterate(self):
+        data = self.sample_data("ils_plympton_01.mrc")
+
+        # Each of the raw records can be parsed on its own.
+        raw_records = list(MARCExtractor.raw_records(data))
+        assert 36 == len(raw_records)
+        assert data == b"".join(raw_records)
+
+        def summarize(metadatas):
+            return [
+                (m.title, m.primary_identifier.identifier,
+                 [x.sort_name for x in m.contributors])
+                for m in metadatas
+            ]
+
+        expect = summarize(MARCExtractor.parse(data, "Plympton"))
+        assert expect == summarize(MARCExtractor.iterate(data, "Plympton"))
+
+        # The records can also be turned into Metadata objects in
+        # worker processes, with the same results, in the same order.
+        class Mock(MARCExtractor):
+            WORKER_CHUNK_SIZE = 5
+        assert expect == summarize(
+            Mock.iterate(data, "Plympton", processes=2)
+        )
+
     def test_name_cleanup(self):
         """Test basic name cleanup techniques."""
         m = MARCExtractor.name_cleanup
         assert "Dante Alighieri" == m("Dante Alighieri,   1265-1321, author.")
         assert "Stevenson, Robert Louis" == m("Stevenson, Robert Louis.")
         assert "Wells, H.G." == m("Wells,     H.G.")
+
+
+class TestBulkMetadataImporter(DatabaseTest):
+
+    def test_import_metadata(self):
+        identifier = self._identifier(identifier_type=Identifier.ISBN)
+
+        def metadata(title, identifier_type, foreign_id, author):
+            return Metadata(
+                DataSource.LIBRARY_STAFF, title=title,
+                primary_identifier=IdentifierData(
+                    identifier_type, foreign_id
+                ),
+                contributors=[
+                    ContributorData(
+                        sort_name=author, roles=[Contributor.AUTHOR_ROLE]
+                    )
+                ],
+                subjects=[SubjectData(Subject.TAG, "Nail-Biters")],
+            )
+
+        metadatas = [
+            metadata("Book 1", Identifier.ISBN, identifier.identifier,
+                     "Author, Some"),
+            metadata("Book 2", Identifier.GUTENBERG_ID, "1234",
+                     "Author, Some"),
+            # This Metadata can't be applied, since its identifier
+            # isn't valid.
+            metadata("Book 3", Identifier.BIBLIOTHECA_ID, "no/slashes",
+                     "Nobody"),
+            metadata("Book 4", Identifier.GUTENBERG_ID, "5678",
+                     "Author, Another"),
+        ]
+
+        class Mock(BulkMetadataImporter):
+            batches = []
+
+            def import_batch(self, batch, stats):
+                self.batches.append([x.title for x in batch])
+                return super(Mock, self).import_batch(batch, stats)
+
+        importer = Mock(self._db, batch_size=3)
+        stats = importer.import_metadata(iter(metadatas))
+
+        # The Metadata objects were applied in batches.
+        assert [["Book 1", "Book 2", "Book 3"], ["Book 4"]] == importer.batches
+
+        assert 4 == stats['rows']
+        assert 3 == stats['editions']
+        assert 1 == stats['failures']
+        for stage in BulkMetadataImporter.STAGES + ['seconds']:
+            assert stats[stage] >= 0
+        assert stats['rows_per_second'] > 0
+
+        # An Edition was created for each Metadata that could be applied.
+        staff = DataSource.lookup(self._db, DataSource.LIBRARY_STAFF)
+        editions = self._db.query(Edition).filter(
+            Edition.data_source==staff
+        ).order_by(Edition.title).all()
+        assert ["Book 1", "Book 2", "Book 4"] == [x.title for x in editions]
+        assert identifier == editions[0].primary_identifier
+        assert "Author, Some" == editions[1].sort_author
+
+        # The books that have the same author and tag share a
+        # Contributor and a Subject.
+        [contributor1] = editions[0].author_contributors
+        [contributor2] = editions[1].author_contributors
+        assert contributor1 == contributor2
+        [classification1] = editions[0].primary_identifier.classifications
+        [classification2] = editions[1].primary_identifier.classifications
+        assert classification1.subject == classification2.subject
+
+        # The LookupCache used during the import is gone.
+        assert None == LookupCache.for_session(self._db)
+
+    def test_import_metadata_failure(self):
+        # If a Metadata object can't be applied, the changes made for
+        # it are rolled back and the rest of the batch is imported.
+        class BrokenMetadata(Metadata):
+            def apply(self, *args, **kwargs):
+                super(BrokenMetadata, self).apply(*args, **kwargs)
+                raise Exception("Oops")
+
+        metadatas = [
+            cls(DataSource.LIBRARY_STAFF, title=title,
+                primary_identifier=IdentifierData(
+                    Identifier.GUTENBERG_ID, foreign_id
+                ))
+            for cls, title, foreign_id in [
+                (Metadata, "Book 1", "1"),
+                (BrokenMetadata, "Book 2", "2"),
+                (Metadata, "Book 3", "3"),
+            ]
+        ]
+        stats = BulkMetadataImporter(self._db).import_metadata(metadatas)
+        assert 3 == stats['rows']
+        assert 2 == stats['editions']
+        assert 1 == stats['failures']
+
+        staff = DataSource.lookup(self._db, DataSource.LIBRARY_STAFF)
+        editions = self._db.query(Edition).filter(
+            Edition.data_source==staff
+        ).order_by(Edition.title).all()
+        assert ["Book 1", "Book 3"] == [x.title for x in editions]
@@ -28,6 +28,7 @@ from ..model import (
     get_one_or_create,
 )
 from ..monitor import (
+    CachedFeedPrewarmMonitor,
     CachedFeedReaper,
     CirculationEventLocationScrubber,
     CollectionMonitor,
@@ -54,6 +55,17 @@ from ..monitor import (
     WorkReaper,
     WorkSweepMonitor,
 )
+from ..entrypoint import AudiobooksEntryPoint
+from ..external_search import MockExternalSearchIndex
+from ..lane import (
+    Facets,
+    FeaturedFacets,
+    Pagination,
+)
+from ..opds import (
+    Annotator,
+    TestAnnotator,
+)
 from ..testing import (
     AlwaysSuccessfulCoverageProvider,
     NeverSuccessfulCoverageProvider,
@@ -825,6 +837,26 @@ class TestPermanentWorkIDRefresh(DatabaseTest):
         Mock(self._db).process_item(edition)
         assert edition.permanent_work_id != None
 
+    def test_process_items(self):
+        """Permanent work IDs are calculated for a whole batch of Editions
+        at once.
+        """
+        class Mock(PermanentWorkIDRefreshMonitor):
+            SERVICE_NAME = "Mock"
+        edition1 = self._edition()
+        edition2 = self._edition()
+        edition2.calculate_permanent_work_id()
+        expect = edition2.permanent_work_id
+        edition2.permanent_work_id = u"out of date"
+        self._db.commit()
+
+        monitor = Mock(self._db)
+        assert 1000 == monitor.batch_size
+        monitor.run_once()
+        self._db.expire_all()
+        assert edition1.permanent_work_id != None
+        assert expect == edition2.permanent_work_id
+
 
 class TestMakePresentationReadyMonitor(DatabaseTest):
 
@@ -919,6 +951,201 @@ class TestCustomListEntryWorkUpdateMonitor(DatabaseTest):
         assert old_work == entry.work
 
 
+class MockCachedFeedPrewarmMonitor(CachedFeedPrewarmMonitor):
+
+    ANNOTATOR_CLASS = TestAnnotator
+
+    def __init__(self, *args, **kwargs):
+        super(MockCachedFeedPrewarmMonitor, self).__init__(*args, **kwargs)
+        self.refreshed = []
+
+    def refresh(self, lane, facets, pagination, feed_type):
+        self.refreshed.append((lane, facets, pagination, feed_type))
+
+
+class TestCachedFeedPrewarmMonitor(DatabaseTest):
+
+    def setup_method(self):
+        super(TestCachedFeedPrewarmMonitor, self).setup_method()
+        self.lane = self._lane()
+        self.facets = Facets.default(self._default_library)
+        self.pagination = Pagination.default()
+        self.monitor = MockCachedFeedPrewarmMonitor(self._db)
+
+    def cached_feed(self, lane=None, facets=None, pagination=None,
+                    access_count=CachedFeedPrewarmMonitor.MINIMUM_ACCESS_COUNT):
+        feed = CachedFeed.fetch(
+            self._db, lane or self.lane, facets or self.facets,
+            pagination or self.pagination, lambda: u"a feed",
+            max_age=1000, raw=True
+        )
+        feed.access_count = access_count
+        return feed
+
+    def test_annotator(self):
+        # By default, feeds are generated with a plain Annotator.
+        monitor = CachedFeedPrewarmMonitor(self._db)
+        annotator = monitor.annotator(self.lane, self.facets)
+        assert Annotator == annotator.__class__
+
+        # A subclass can use a different Annotator.
+        assert isinstance(
+            self.monitor.annotator(self.lane, self.facets), TestAnnotator
+        )
+
+    def test_query(self):
+        popular = self.cached_feed(access_count=100)
+        less_popular = self.cached_feed(
+            pagination=self.pagination.next_page, access_count=50
+        )
+
+        # These feeds won't be pre-warmed.
+        unpopular = self.cached_feed(
+            pagination=Pagination(100, 50),
+            access_count=self.monitor.MINIMUM_ACCESS_COUNT - 1
+        )
+        not_recent = self.cached_feed(pagination=Pagination(150, 50))
+        not_recent.last_accessed = (
+            datetime.datetime.utcnow() - self.monitor.RECENTLY_ACCESSED
+            - datetime.timedelta(minutes=1)
+        )
+        no_lane, ignore = get_one_or_create(
+            self._db, CachedFeed, type=CachedFeed.PAGE_TYPE,
+            unique_key=u"a worklist", access_count=1000,
+            last_accessed=datetime.datetime.utcnow()
+        )
+
+        # The most popular feeds come first.
+        assert [popular, less_popular] == self.monitor.query().all()
+
+        self.monitor.MAXIMUM_FEEDS = 1
+        assert [popular] == self.monitor.query().all()
+
+    def test_feed_arguments(self):
+        # A page feed is reproduced with a Facets object and a Pagination.
+        feed = self.cached_feed()
+        lane, facets, pagination = self.monitor.feed_arguments(feed)
+        assert self.lane == lane
+        assert isinstance(facets, Facets)
+        assert self.facets.query_string == facets.query_string
+        assert self.pagination.query_string == pagination.query_string
+
+        # The EntryPoint used to generate the feed is preserved.
+        audio = Facets.default(
+            self._default_library, entrypoint=AudiobooksEntryPoint
+        )
+        feed = self.cached_feed(facets=audio)
+        lane, facets, pagination = self.monitor.feed_arguments(feed)
+        assert AudiobooksEntryPoint == facets.entrypoint
+        assert audio.query_string == facets.query_string
+
+        # A groups feed is reproduced with a FeaturedFacets object.
+        featured = FeaturedFacets.default(self.lane)
+        feed = CachedFeed.fetch(
+            self._db, self.lane, featured, None, lambda: u"a feed",
+            max_age=1000, raw=True
+        )
+        lane, facets, pagination = self.monitor.feed_arguments(feed)
+        assert isinstance(facets, FeaturedFacets)
+        assert None == facets.entrypoint
+        assert (
+            self._default_library.minimum_featured_quality ==
+            facets.minimum_featured_quality
+        )
+        assert None == pagination
+
+        # If the original request can't be reproduced exactly,
+        # feed_arguments returns None.
+        feed.facets = u"order=nonsense"
+        assert None == self.monitor.feed_arguments(feed)
+
+        feed = self.cached_feed()
+        feed.facets += u"&unknown=value"
+        assert None == self.monitor.feed_arguments(feed)
+
+        feed = self.cached_feed()
+        feed.pagination = u"after=0&size=nonsense"
+        assert None == self.monitor.feed_arguments(feed)
+
+    def test_prewarm(self):
+        feed = self.cached_feed()
+        now = datetime.datetime.utcnow()
+        max_age = self.lane.max_cache_age(feed.type)
+        lead_time = datetime.timedelta(seconds=self.monitor.LEAD_TIME)
+
+        # A feed that won't go stale for a while is left alone.
+        feed.timestamp = now
+        assert False == self.monitor.prewarm(feed, now)
+        assert [] == self.monitor.refreshed
+
+        # A feed that's about to go stale is regenerated.
+        feed.timestamp = (
+            now - datetime.timedelta(seconds=max_age) + lead_time
+            - datetime.timedelta(seconds=1)
+        )
+        assert True == self.monitor.prewarm(feed, now)
+        [(lane, facets, pagination, feed_type)] = self.monitor.refreshed
+        assert self.lane == lane
+        assert self.facets.query_string == facets.query_string
+        assert self.pagination.query_string == pagination.query_string
+        assert CachedFeed.PAGE_TYPE == feed_type
+
+        # So is a feed that's already stale.
+        feed.timestamp = now - datetime.timedelta(days=1)
+        assert True == self.monitor.prewarm(feed, now)
+
+        # Grouped feeds for Lanes are cached forever, so there's no
+        # need to regenerate them ahead of time.
+        featured = FeaturedFacets.default(self.lane)
+        groups = CachedFeed.fetch(
+            self._db, self.lane, featured, None, lambda: u"a feed",
+            max_age=1000, raw=True
+        )
+        groups.timestamp = now - datetime.timedelta(days=1)
+        assert False == self.monitor.prewarm(groups, now)
+
+        # A feed that can't be reproduced is left alone.
+        feed.facets = u"order=nonsense"
+        assert False == self.monitor.prewarm(feed, now)
+        assert 2 == len(self.monitor.refreshed)
+
+    def test_run_once(self):
+        stale = self.cached_feed()
+        stale.timestamp = datetime.datetime.utcnow() - datetime.timedelta(
+            days=1
+        )
+        fresh = self.cached_feed(pagination=self.pagination.next_page)
+        result = self.monitor.run_once(None)
+        assert (
+            "Feeds considered: 2. Feeds regenerated: 1." == result.achievements
+        )
+        [(lane, facets, pagination, feed_type)] = self.monitor.refreshed
+        assert stale.pagination == pagination.query_string
+
+    def test_refresh(self):
+        # Verify that refresh() really regenerates a feed.
+        feed = self.cached_feed()
+        feed.timestamp = datetime.datetime.utcnow() - datetime.timedelta(
+            days=1
+        )
+        access_count = feed.access_count
+
+        monitor = CachedFeedPrewarmMonitor(
+            self._db, search_engine=MockExternalSearchIndex()
+        )
+        monitor.ANNOTATOR_CLASS = TestAnnotator
+        lane, facets, pagination = monitor.feed_arguments(feed)
+        monitor.refresh(lane, facets, pagination, feed.type)
+
+        # The feed has a new timestamp and new content, and the
+        # regeneration wasn't counted as a patron request.
+        assert u"a feed" != feed.content
+        assert feed.timestamp > datetime.datetime.utcnow() - (
+            datetime.timedelta(minutes=1)
+        )
+        assert access_count == feed.access_count
+
+
 class MockReaperMonitor(ReaperMonitor):
     MODEL_CLASS = Timestamp
     TIMESTAMP_FIELD = 'timestamp'
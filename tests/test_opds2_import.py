@@ -1,6 +1,10 @@
 import datetime
+import json
+import logging
 import os
 
+import pytest
+
 from ..model import (
     Contribution,
     Contributor,
@@ -12,7 +16,13 @@ from ..model import (
     MediaTypes,
     Work,
 )
-from ..opds2_import import OPDS2Importer
+from .. import opds2_import
+from ..opds2_import import (
+    OPDS2Importer,
+    _scan_json_object,
+    parse_feed,
+    parse_feed_incrementally,
+)
 from .test_opds_import import OPDSTest
 
 
@@ -255,3 +265,160 @@ class TestOPDS2Importer(OPDSTest):
             u"Adventures of Huckleberry Finn is a novel by Mark Twain, first published in the United Kingdom in "
             u"December 1884 and in the United States in February 1885." ==
             huckleberry_finn_work.summary_text)
+
+    def test_import_from_feed_streaming(self):
+        collection = self._default_collection
+        collection.data_source = DataSource.lookup(
+            self._db, "OPDS 2.0 Data Source", autocreate=True
+        )
+        content_server_feed = self.sample_opds("feed.json")
+
+        class Mock(OPDS2Importer):
+            STREAMING_PARSER = True
+            STREAMING_BATCH_SIZE = 1
+            batches = []
+
+            def _import_metadata_objs(self, metadata_objs, *args):
+                self.batches.append(sorted(metadata_objs.keys()))
+                return super(Mock, self)._import_metadata_objs(
+                    metadata_objs, *args
+                )
+
+        importer = Mock(self._db, collection)
+        imported_editions, pools, works, failures = importer.import_from_feed(
+            content_server_feed
+        )
+
+        # Each publication was imported in its own batch.
+        assert (
+            [[u"urn:isbn:978-3-16-148410-0"], [u"urn:isbn:9781234567897"]] ==
+            importer.batches)
+
+        # The end result is the same as importing the whole feed at once.
+        assert 2 == len(imported_editions)
+        assert 2 == len(pools)
+        assert 2 == len(works)
+        assert {} == failures
+        moby_dick_edition = self._get_edition_by_identifier(
+            imported_editions, "urn:isbn:978-3-16-148410-0"
+        )
+        assert u"Moby-Dick" == moby_dick_edition.title
+        assert u"Herman Melville" == moby_dick_edition.author
+        assert u"http://example.org/cover.jpg" == moby_dick_edition.cover_full_url
+
+        # extract_feed_data gives the same answer either way.
+        streaming, failures = importer.extract_feed_data(content_server_feed)
+        importer.STREAMING_PARSER = False
+        all_at_once, failures = importer.extract_feed_data(content_server_feed)
+        assert sorted(streaming.keys()) == sorted(all_at_once.keys())
+        for key, metadata in streaming.items():
+            expect = all_at_once[key]
+            assert expect.title == metadata.title
+            assert (
+                [x.href for x in expect.links] ==
+                [x.href for x in metadata.links])
+
+
+class TestParseFeedIncrementally(object):
+
+    def sample_feed(self):
+        base_path = os.path.split(__file__)[0]
+        path = os.path.join(base_path, "files", "opds2", "feed.json")
+        return open(path).read()
+
+    def test_scan_json_object(self):
+        assert [] == list(_scan_json_object(" { } "))
+
+        document = '{"a": [1, 2], "b": [3, {"c": 4}], "d": []}'
+        assert (
+            [(u"a", [1, 2], None), (u"b", 3, 20), (u"b", {u"c": 4}, 23)] ==
+            list(_scan_json_object(document, ("b", "d"))))
+
+        for bad in ['[1]', '{"a": 1,}', '{"a" 1}', '{"a": [1 2]}']:
+            with pytest.raises(ValueError):
+                list(_scan_json_object(bad, ("a",)))
+
+    def test_parse_feed_incrementally(self):
+        content = self.sample_feed()
+        expect = [
+            publication.metadata.identifier for publication in
+            OPDS2Importer._get_publications(parse_feed(content))
+        ]
+        assert (
+            [u"urn:isbn:978-3-16-148410-0", u"urn:isbn:9781234567897"] ==
+            expect)
+
+        # Each publication is parsed as part of a feed that has the
+        # original feed's links, and only that one publication.
+        results = list(parse_feed_incrementally(content))
+        assert expect == [x.metadata.identifier for feed, x in results]
+        for feed, publication in results:
+            assert [publication] == list(feed.publications)
+            assert (
+                [u"http://example.com/new"] == [x.href for x in feed.links])
+
+        # Publications may come before the feed's metadata and links,
+        # or be part of a group.
+        data = json.loads(content)
+        reordered = json.dumps(dict(
+            publications=data["publications"][:1],
+            groups=[dict(
+                metadata=dict(title="A group"),
+                publications=data["publications"][1:],
+            )],
+        ))
+        reordered = reordered[:-1] + ', "links": %s, "metadata": %s}' % (
+            json.dumps(data["links"]), json.dumps(data["metadata"])
+        )
+        results = list(parse_feed_incrementally(reordered))
+        assert expect == [x.metadata.identifier for feed, x in results]
+
+        # A feed that's already been loaded is parsed the normal way.
+        results = list(parse_feed_incrementally(data))
+        assert expect == [x.metadata.identifier for feed, x in results]
+
+    def test_streaming_next_links_and_dates(self):
+        # With STREAMING_PARSER set, the monitor's helper methods look
+        # at the feed one publication at a time, without building an
+        # object graph for the whole document.
+        data = json.loads(self.sample_feed())
+        data["links"].append(
+            dict(href="http://example.com/next", rel=["next", "other"])
+        )
+        data["groups"] = [dict(
+            metadata=dict(title="A group"),
+            links=[dict(href="http://example.com/group", rel="self",
+                        type="application/opds+json")],
+            publications=data["publications"][1:],
+        )]
+        data["publications"] = data["publications"][:1]
+        content = json.dumps(data)
+
+        importer = object.__new__(OPDS2Importer)
+        importer._logger = logging.getLogger("test")
+        importer.STREAMING_PARSER = False
+        expect_links = importer.extract_next_links(content)
+        expect_dates = importer.extract_last_update_dates(content)
+        assert [u"http://example.com/next"] == expect_links
+        assert (
+            [u"urn:isbn:978-3-16-148410-0", u"urn:isbn:9781234567897"] ==
+            [x[0] for x in expect_dates])
+
+        def parse_feed(feed, *args, **kwargs):
+            raise Exception("The whole feed was parsed.")
+        old_parse_feed = opds2_import.parse_feed
+        opds2_import.parse_feed = parse_feed
+        try:
+            importer.STREAMING_PARSER = True
+            assert expect_links == importer.extract_next_links(content)
+            # The dates come out in document order rather than with
+            # grouped publications last.
+            assert sorted(expect_dates) == sorted(
+                importer.extract_last_update_dates(content)
+            )
+
+            # A feed that can't be decoded has no links or dates.
+            assert [] == importer.extract_next_links("{")
+            assert [] == importer.extract_last_update_dates("{")
+        finally:
+            opds2_import.parse_feed = old_parse_feed
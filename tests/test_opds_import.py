@@ -1,5 +1,6 @@
 import os
 import datetime
+import logging
 import random
 import urllib
 from StringIO import StringIO
@@ -8,7 +9,10 @@ import pytest
 
 from lxml import etree
 import pkgutil
+import feedparser
+from mock import patch
 from psycopg2.extras import NumericRange
+from sqlalchemy.exc import IntegrityError
 
 from ..testing import (
     DatabaseTest,
@@ -21,11 +25,19 @@ from ..config import (
 from ..opds_import import (
     AccessNotAuthenticated,
     MetadataWranglerOPDSLookup,
+    MockMetadataWranglerOPDSLookup,
+    MockSimplifiedOPDSLookup,
     OPDSImporter,
     OPDSImportMonitor,
+    OPDSImportPageJob,
     OPDSXMLParser,
     SimplifiedOPDSLookup,
 )
+from ..util.http import (
+    BadResponseException,
+    HTTP,
+    RequestTimedOut,
+)
 from ..util.opds_writer import (
     AtomFeed,
     OPDSFeed,
@@ -34,6 +46,8 @@ from ..util.opds_writer import (
 from ..metadata_layer import (
     LinkData,
     CirculationData,
+    ContributorData,
+    IdentifierData,
     Metadata,
     TimestampData,
 )
@@ -47,10 +61,12 @@ from ..model import (
     Hyperlink,
     Identifier,
     Edition,
+    LookupCache,
     Measurement,
     MediaTypes,
     Representation,
     RightsStatus,
+    SessionManager,
     Subject,
     Work,
     WorkCoverageRecord,
@@ -69,6 +85,7 @@ from ..testing import (
     MockRequestsResponse,
 )
 from ..util.http import BadResponseException
+from ..util.worker_pools import DatabasePool
 
 
 class DoomedOPDSImporter(OPDSImporter):
@@ -100,6 +117,106 @@ class OPDSTest(DatabaseTest):
         return open(os.path.join(resource_path, filename)).read()
 
 
+class TestSimplifiedOPDSLookup(DatabaseTest):
+
+    def test_urn_batches(self):
+        lookup = SimplifiedOPDSLookup("http://lookup/")
+        identifiers = [self._identifier() for i in range(5)]
+
+        # Batches are no larger than the batch size, and an Identifier
+        # only shows up once.
+        batches = list(
+            lookup.urn_batches(identifiers + identifiers[:2], batch_size=2)
+        )
+        assert [identifiers[:2], identifiers[2:4], identifiers[4:]] == batches
+
+        # Batches are also kept short enough to fit in a URL.
+        lookup.MAX_URN_ARGS_LENGTH = len(
+            "urn=&" + identifiers[0].urn + "urn=&" + identifiers[1].urn
+        )
+        assert (
+            [identifiers[:2], identifiers[2:4], identifiers[4:]] ==
+            list(lookup.urn_batches(identifiers))
+        )
+        assert [] == list(lookup.urn_batches([]))
+
+    def test_is_transient(self):
+        m = SimplifiedOPDSLookup.is_transient
+        assert True == m(RequestTimedOut("http://url/", "timeout"))
+        assert True == m(BadResponseException("http://url/", "bad", status_code="503"))
+        assert True == m(BadResponseException("http://url/", "bad", status_code=429))
+        assert False == m(BadResponseException("http://url/", "bad", status_code="404"))
+        assert False == m(ValueError())
+
+    def test_lookup_retries_transient_failures(self):
+        lookup = MockSimplifiedOPDSLookup("http://lookup/")
+        identifier = self._identifier()
+        lookup.queue_response(500)
+        lookup.queue_response(503)
+        lookup.queue_response(200, content="Success")
+        response = lookup.lookup([identifier])
+        assert "Success" == response.content
+        assert 3 == len(lookup.requests)
+
+        # The client waited longer before each retry.
+        assert [1, 2] == lookup.sleeps
+
+        # Eventually it gives up.
+        for i in range(lookup.MAX_ATTEMPTS):
+            lookup.queue_response(500)
+        with pytest.raises(BadResponseException) as excinfo:
+            lookup.lookup([identifier])
+        assert "Got status code 500" in str(excinfo.value)
+        assert 6 == len(lookup.requests)
+
+    def test_lookup_in_batches(self):
+        lookup = MockSimplifiedOPDSLookup("http://lookup/")
+        lookup.MAX_ATTEMPTS = 1
+        identifiers = [self._identifier() for i in range(3)]
+        lookup.queue_response(200, content="Batch 1")
+        lookup.queue_response(500)
+
+        [(batch1, response1), (batch2, response2)] = list(
+            lookup.lookup_in_batches(identifiers, batch_size=2)
+        )
+        assert identifiers[:2] == batch1
+        assert "Batch 1" == response1.content
+
+        # A batch that fails doesn't stop the others.
+        assert identifiers[2:] == batch2
+        assert isinstance(response2, BadResponseException)
+
+        url1 = lookup.requests[0][0]
+        assert url1.startswith("http://lookup/lookup?")
+        assert all("urn=%s" % x.urn in url1 for x in identifiers[:2])
+
+    def test__get_does_not_modify_allowed_response_codes(self):
+        lookup = SimplifiedOPDSLookup("http://lookup/")
+        codes = [404]
+        with patch.object(HTTP, 'get_with_timeout') as get_with_timeout:
+            lookup._get("http://lookup/", allowed_response_codes=codes)
+            lookup._get("http://lookup/", allowed_response_codes=codes)
+        assert [404] == codes
+        assert [[404, '2xx', '3xx'], [404, '2xx', '3xx']] == [
+            kwargs['allowed_response_codes']
+            for args, kwargs in get_with_timeout.call_args_list
+        ]
+
+    def test__concurrently(self):
+        lookup = SimplifiedOPDSLookup("http://lookup/")
+        lookup.max_concurrent_requests = 3
+
+        def double(x):
+            if x == 2:
+                raise ValueError("No twos.")
+            return x * 2
+
+        results = dict(lookup._concurrently(double, range(10)))
+        assert sorted(results.keys()) == range(10)
+        assert 18 == results[9]
+        assert isinstance(results[2], ValueError)
+
+
 class TestMetadataWranglerOPDSLookup(OPDSTest):
 
     def setup_method(self):
@@ -410,6 +527,66 @@ class TestMetadataWranglerOPDSLookup(OPDSTest):
         assert result.protocol == ExternalIntegration.METADATA_WRANGLER
         assert result.goal == ExternalIntegration.METADATA_GOAL
 
+    def test_add_and_remove_in_batches(self):
+        lookup = MockMetadataWranglerOPDSLookup(
+            "http://metadata.in/", shared_secret="secret",
+            collection=self.collection
+        )
+        identifiers = [self._identifier() for i in range(3)]
+        lookup.queue_response(200, content="Added 1")
+        lookup.queue_response(503)
+        lookup.queue_response(200, content="Added 2")
+        results = list(lookup.add_in_batches(identifiers, batch_size=2))
+        assert (
+            [(identifiers[:2], "Added 1"), (identifiers[2:], "Added 2")] ==
+            [(batch, response.content) for batch, response in results]
+        )
+        assert [1] == lookup.sleeps
+        assert all("/add?" in url for url, args, kwargs in lookup.requests)
+
+        lookup.queue_response(200, content="Removed")
+        [(batch, response)] = lookup.remove_in_batches(identifiers)
+        assert identifiers == batch
+        assert "/remove?" in lookup.requests[-1][0]
+
+    def test_updates_and_canonicalize_author_names_retry(self):
+        lookup = MockMetadataWranglerOPDSLookup(
+            "http://metadata.in/", shared_secret="secret",
+            collection=self.collection
+        )
+        lookup.queue_response(502)
+        lookup.queue_response(200, content="Updates")
+        assert "Updates" == lookup.updates(None).content
+        assert [1] == lookup.sleeps
+
+        identifier = self._identifier(Identifier.ISBN)
+        lookup.queue_response(200, content="Twain, Mark")
+        lookup.queue_response(500)
+        lookup.queue_response(200, content="Melville, Herman")
+        authors = [(identifier, u"Mark Twain"), (None, u"Herman Melville")]
+        results = list(lookup.canonicalize_author_names(authors))
+        assert (
+            [(authors[0], "Twain, Mark"), (authors[1], "Melville, Herman")] ==
+            [(author, response.content) for author, response in results]
+        )
+        url = lookup.requests[-1][0]
+        assert "canonical-author-name?display_name=Herman%20Melville" in url
+
+    def test__post_does_not_modify_allowed_response_codes(self):
+        lookup = MetadataWranglerOPDSLookup(
+            "http://metadata.in/", shared_secret="secret",
+            collection=self.collection
+        )
+        codes = [404]
+        with patch.object(HTTP, 'post_with_timeout') as post_with_timeout:
+            lookup._post("http://metadata.in/", allowed_response_codes=codes)
+            lookup._post("http://metadata.in/", allowed_response_codes=codes)
+        assert [404] == codes
+        assert [[404, '2xx', '3xx'], [404, '2xx', '3xx']] == [
+            kwargs['allowed_response_codes']
+            for args, kwargs in post_with_timeout.call_args_list
+        ]
+
 class OPDSImporterTest(OPDSTest):
 
     def setup_method(self):
@@ -444,6 +621,9 @@ class TestOPDSImporter(OPDSImporterTest):
         importer = OPDSImporter(self._db, collection=None, http_get=do_get)
         assert do_get == importer.http_get
 
+        # A LookupCache was installed on the database session.
+        assert isinstance(LookupCache.for_session(self._db), LookupCache)
+
     def test_data_source_autocreated(self):
         name = "New data source " + self._str
         importer = OPDSImporter(
@@ -1028,6 +1208,161 @@ class TestOPDSImporter(OPDSImporterTest):
         assert True == failure.transient
         assert "Utter failure!" in failure.exception
 
+    def _comparable(self, value):
+        """Turn the output of an extraction method into something that
+        can be compared with ==.
+        """
+        if isinstance(value, dict):
+            return dict(
+                (k, self._comparable(v)) for k, v in value.items()
+                # A measurement's timestamp is the time it was extracted.
+                if k != 'taken_at'
+            )
+        if isinstance(value, (list, tuple)):
+            return [self._comparable(x) for x in value]
+        if isinstance(value, CoverageFailure):
+            return (value.obj, value.exception, value.transient)
+        if hasattr(value, '__dict__'):
+            return (value.__class__, self._comparable(value.__dict__))
+        return value
+
+    def test_feedparser_entry_from_elementtree(self):
+        # feedparser_entry_from_elementtree extracts the same
+        # information from an <entry> tag that feedparser does.
+        parser = OPDSXMLParser()
+        keys = [
+            'id', 'title', 'schema_alternativeheadline', 'publisher',
+            'dcterms_publisher', 'language', 'dcterms_language',
+            'rights', 'bibframe_distribution', 'updated_parsed',
+        ]
+        for filename in (
+            "content_server.opds", "audiobooks.opds",
+            "feed_with_id_and_dcterms_identifier.opds",
+            "book_with_license.opds", "unrecognized_distributor.opds",
+        ):
+            feed = self.sample_opds(filename)
+            expect = feedparser.parse(feed)['entries']
+            root = etree.parse(StringIO(feed))
+            tags = parser._xpath(root, '/atom:feed/atom:entry')
+            assert len(expect) == len(tags)
+            for fp_entry, tag in zip(expect, tags):
+                entry = OPDSImporter.feedparser_entry_from_elementtree(
+                    parser, tag
+                )
+                for key in keys:
+                    assert fp_entry.get(key) == entry.get(key)
+                    if isinstance(fp_entry.get(key), unicode):
+                        # lxml gives ASCII text as str, but it's
+                        # converted to unicode to match feedparser.
+                        assert isinstance(entry.get(key), unicode)
+                for key in ('summary_detail', 'content'):
+                    expect_value = fp_entry.get(key)
+                    if key == 'summary_detail' and expect_value:
+                        expect_value = [expect_value]
+                    actual_value = entry.get(key)
+                    if key == 'summary_detail' and actual_value:
+                        actual_value = [actual_value]
+                    assert (
+                        [(x['type'], x['value']) for x in expect_value or []] ==
+                        [(x['type'], x['value']) for x in actual_value or []]
+                    )
+
+    def test_text_construct(self):
+        def construct(xml, type="text"):
+            tag = etree.fromstring(
+                '<title xmlns="http://www.w3.org/2005/Atom" type="%s" '
+                'xml:base="http://example.com/">%s</title>' % (type, xml)
+            )
+            return OPDSImporter._text_construct(tag)
+
+        assert (
+            dict(type='text/plain', value=u'A title') ==
+            construct('  A title ')
+        )
+        assert isinstance(construct('A title')['value'], unicode)
+
+        # HTML is sanitized and relative links are resolved.
+        value = construct(
+            '<div xmlns="http://www.w3.org/1999/xhtml">'
+            '<a href="/book">A</a><script>alert(1)</script></div>',
+            "xhtml"
+        )
+        assert 'application/xhtml+xml' == value['type']
+        assert u'<a href="http://example.com/book">A</a>' == value['value']
+
+    def test_extract_data_in_one_pass(self):
+        data_source = DataSource.lookup(self._db, DataSource.OA_CONTENT_SERVER)
+
+        # A single pass over a feed gathers the same information as
+        # extract_data_from_feedparser and
+        # extract_metadata_from_elementtree put together.
+        for feed in (
+            self.content_server_feed, self.content_server_mini_feed,
+            self.audiobooks_opds, self.feed_with_id_and_dcterms_identifier,
+            self.sample_opds("unrecognized_identifier.opds"),
+        ):
+            fp_values, fp_failures = OPDSImporter.extract_data_from_feedparser(
+                feed, data_source
+            )
+            xml_values, xml_failures = OPDSImporter.extract_metadata_from_elementtree(
+                feed, data_source
+            )
+            expect = (fp_values, fp_failures, xml_values, xml_failures)
+            actual = OPDSImporter.extract_data_in_one_pass(feed, data_source)
+            assert self._comparable(expect) == self._comparable(actual)
+
+        # Spot-check the content server feed.
+        values, failures, xml_values, xml_failures = OPDSImporter.extract_data_in_one_pass(
+            self.content_server_mini_feed, data_source
+        )
+        metadata = values['urn:librarysimplified.org/terms/id/Gutenberg%20ID/10441']
+        assert "The Green Mouse" == metadata['title']
+        assert 2 == len(xml_values)
+
+        # The 202 message became a CoverageFailure.
+        failure = xml_failures['http://www.gutenberg.org/ebooks/1984']
+        assert True == failure.transient
+        assert failure.exception.startswith('202')
+
+    def test_extract_data_in_one_pass_uses_self_link(self):
+        # A relative link is resolved against the feed's self link.
+        data_source = DataSource.lookup(self._db, DataSource.OA_CONTENT_SERVER)
+        feed = """<feed xmlns="http://www.w3.org/2005/Atom">
+ <link rel="self" href="http://example.com/feed/"/>
+ <entry>
+  <id>http://www.gutenberg.org/ebooks/1</id>
+  <title>A book</title>
+  <link rel="http://opds-spec.org/acquisition/open-access" href="/1.epub" type="application/epub+zip"/>
+ </entry>
+</feed>"""
+        values = OPDSImporter.extract_data_in_one_pass(feed, data_source)[2]
+        [link] = values['http://www.gutenberg.org/ebooks/1']['links']
+        assert "http://example.com/1.epub" == link.href
+
+        # A feed URL passed in takes precedence.
+        values = OPDSImporter.extract_data_in_one_pass(
+            feed, data_source, feed_url="http://other.com/"
+        )[2]
+        [link] = values['http://www.gutenberg.org/ebooks/1']['links']
+        assert "http://other.com/1.epub" == link.href
+
+    def test_extract_feed_data_single_pass(self):
+        class SinglePassOPDSImporter(OPDSImporter):
+            SINGLE_PASS_PARSER = True
+
+        feed = self.content_server_mini_feed
+        imported = []
+        for cls in (OPDSImporter, SinglePassOPDSImporter):
+            importer = cls(
+                self._db, collection=self._default_collection
+            )
+            imported.append(importer.extract_feed_data(feed))
+
+        double_pass, single_pass = imported
+        assert self._comparable(double_pass) == self._comparable(single_pass)
+        metadata, failures = single_pass
+        assert 2 == len(metadata)
+
     def test_import_exception_if_unable_to_parse_feed(self):
         feed = "I am not a feed."
         importer = OPDSImporter(self._db, collection=None)
@@ -1173,6 +1508,39 @@ class TestOPDSImporter(OPDSImporterTest):
         assert ('http://www.gutenberg.org/ebooks/10441.epub.images' ==
             mech.resource.url)
 
+    def test_import_canonicalizes_author_names_in_one_batch(self):
+        lookup = MockMetadataWranglerOPDSLookup(
+            "http://metadata.in/", shared_secret="secret",
+            collection=self._default_collection
+        )
+        lookup.queue_response(
+            200, {"Content-Type": "text/plain"}, u"Twain, Mark"
+        )
+        importer = OPDSImporter(
+            self._db, collection=None, metadata_client=lookup
+        )
+        metadata_objs = {}
+        for identifier in (u"1", u"2"):
+            metadata = Metadata(
+                data_source=DataSource.GUTENBERG,
+                primary_identifier=IdentifierData(
+                    Identifier.GUTENBERG_ID, identifier
+                ),
+                identifiers=[IdentifierData(Identifier.ISBN, u"9781453219539")],
+                contributors=[ContributorData(display_name=u"Mark Twain")],
+            )
+            metadata_objs[identifier] = metadata
+        editions = {}
+        importer._import_metadata_objs(metadata_objs, {}, editions, {}, {})
+
+        # Both books have the same author, so the metadata wrangler
+        # was asked about them once, before either book was imported.
+        [(url, args, kwargs)] = lookup.requests
+        assert "canonical-author-name?display_name=Mark%20Twain" in url
+        for edition in editions.values():
+            [author] = edition.author_contributors
+            assert u"Twain, Mark" == author.sort_name
+
     def test_import_with_lendability(self):
         """Test that OPDS import creates Edition, LicensePool, and Work
         objects, as appropriate.
@@ -2589,6 +2957,132 @@ class TestOPDSImportMonitor(OPDSImporterTest):
         assert None == progress.start
         assert None == progress.finish
 
+    def test_run_once_in_parallel(self):
+        class MockOPDSImportMonitor(OPDSImportMonitor):
+            def _get_feeds(self):
+                return [("link1", "page1"), ("link2", "page2")]
+
+            def import_feeds_in_parallel(self, feeds):
+                self.imported_in_parallel = list(feeds)
+                return "parallel import"
+
+        # By default, pages are imported one at a time.
+        monitor = MockOPDSImportMonitor(
+            self._db, collection=self._default_collection,
+            import_class=OPDSImporter
+        )
+        assert 1 == monitor.import_workers
+
+        # If more than one worker is requested, they're imported in
+        # parallel.
+        monitor = MockOPDSImportMonitor(
+            self._db, collection=self._default_collection,
+            import_class=OPDSImporter, import_workers=2
+        )
+        assert 2 == monitor.import_workers
+        assert "parallel import" == monitor.run_once(object())
+        assert [("link1", "page1"), ("link2", "page2")] == monitor.imported_in_parallel
+
+    def test_importer_for_session(self):
+        monitor = OPDSImportMonitor(
+            self._db, collection=self._default_collection,
+            import_class=OPDSImporter, identifier_mapping=dict(a="b")
+        )
+        session = self._db
+        importer = monitor.importer_for_session(session)
+        assert isinstance(importer, OPDSImporter)
+        assert importer != monitor.importer
+        assert session == importer._db
+        assert self._default_collection == importer.collection
+        assert dict(a="b") == importer.identifier_mapping
+
+    def test_import_waves(self):
+        m = OPDSImportMonitor.import_waves
+        assert [] == m([])
+
+        # Pages with no books in common can all be imported at once.
+        assert [[0, 1, 2]] == m([set(["a"]), set(["b"]), set(), ])
+
+        # A page that shares a book with an earlier page has to wait
+        # until that page is imported.
+        assert [[0, 1, 3], [2], [4]] == m([
+            set(["a", "b"]), set(["c"]), set(["b", "d"]), set(["e"]),
+            set(["d", "c"]),
+        ])
+
+    def test_import_feeds_in_parallel(self):
+        class MockOPDSImportMonitor(OPDSImportMonitor):
+            IMPORT_ATTEMPTS = 2
+
+            def __init__(self, *args, **kwargs):
+                super(MockOPDSImportMonitor, self).__init__(*args, **kwargs)
+                self.imports = []
+                self.conflicts = ["page2", "page3", "page3"]
+
+            def identifiers_on_page(self, feed):
+                return dict(
+                    page1=set(["a"]), page2=set(["b"]), page3=set(["a"])
+                )[feed]
+
+            def importer_for_session(self, _db):
+                return _db
+
+            def _import_one_feed(self, importer, feed, feed_url):
+                self.imports.append(feed)
+                if feed in self.conflicts:
+                    self.conflicts.remove(feed)
+                    raise IntegrityError("statement", {}, Exception())
+                return [object(), object()], {"identifier": "Failure"}
+
+        monitor = MockOPDSImportMonitor(
+            self._db, collection=self._default_collection,
+            import_class=OPDSImporter, import_workers=2
+        )
+        pool = DatabasePool(2, SessionManager.sessionmaker(session=self._db))
+        progress = monitor.import_feeds_in_parallel(
+            [("link1", "page1"), ("link2", "page2"), ("link3", "page3")],
+            pool=pool
+        )
+
+        # page3 has a book in common with page1, so it wasn't imported
+        # until page1 was done. page2 ran into a conflict the first
+        # time and was imported on the second try. page3 ran into a
+        # conflict every time and was never imported.
+        assert ["page3", "page3"] == monitor.imports[-2:]
+        assert (
+            ["page1", "page2", "page2", "page3", "page3"] ==
+            sorted(monitor.imports))
+        assert 3 == pool.job_total
+        assert 1 == pool.error_count
+        assert (
+            "Items imported: 4. Failures: 2. Pages that could not be imported: 1." ==
+            progress.achievements)
+
+    def test_import_page_job(self):
+        class MockMonitor(object):
+            log = logging.getLogger("Mock monitor")
+            feed_url = "http://feed/"
+
+            def __init__(self):
+                self.calls = []
+
+            def importer_for_session(self, _db):
+                return "importer for %r" % _db
+
+            def _import_one_feed(self, importer, feed, feed_url):
+                self.calls.append((importer, feed, feed_url))
+                return ["an edition"], {}
+
+        monitor = MockMonitor()
+        job = OPDSImportPageJob(monitor, "link", "feed")
+        job.run(self._db)
+        assert [("importer for %r" % self._db, "feed", "http://feed/")] == monitor.calls
+        assert True == job.finished
+        assert 1 == job.attempts
+        assert 1 == job.imported
+        assert 0 == job.failures
+        assert job.elapsed >= 0
+
     def test_update_headers(self):
         # Test the _update_headers helper method.
         monitor = OPDSImportMonitor(
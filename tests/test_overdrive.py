@@ -10,6 +10,8 @@ from ..overdrive import (
     OverdriveAdvantageAccount,
     OverdriveRepresentationExtractor,
     OverdriveBibliographicCoverageProvider,
+    OverdriveInventoryCrawler,
+    OverdriveInventoryCrawlMonitor,
 )
 
 from ..coverage import (
@@ -32,6 +34,7 @@ from ..model import (
     Measurement,
     MediaTypes,
     Hyperlink,
+    Timestamp,
 )
 from ..scripts import RunCollectionCoverageProviderScript
 
@@ -284,6 +287,80 @@ class TestOverdriveAPI(OverdriveTestWithAPI):
         assert "Got status code 401" in str(excinfo.value)
         assert "can only continue on: 200." in str(excinfo.value)
 
+    def test_metadata_lookup_batch(self):
+        self.api.queue_collection_token()
+        self.api.BULK_LOOKUP_LIMIT = 2
+        raw, info = self.sample_json("overdrive_metadata.json")
+        book_id = info['id']
+
+        identifiers = []
+        for id in (book_id.upper(), "unknown-id", "another-id"):
+            identifier = self._identifier(
+                identifier_type=Identifier.OVERDRIVE_ID
+            )
+            identifier.identifier = id
+            identifiers.append(identifier)
+
+        # Three identifiers means two requests.
+        self.api.queue_response(
+            200, content=json.dumps(dict(metadata=[info]))
+        )
+        another = dict(id="another-id", title="Another book")
+        self.api.queue_response(
+            200, content=json.dumps(dict(metadata=[another]))
+        )
+        results = self.api.metadata_lookup_batch(identifiers)
+
+        # Results are keyed by lowercased Overdrive ID. Overdrive
+        # didn't send anything for the unknown ID.
+        assert set([book_id, "another-id"]) == set(results.keys())
+        assert info == results[book_id]
+        assert another == results["another-id"]
+
+        first, second = [x[0] for x in self.api.requests[1:]]
+        assert first.endswith(
+            "/bulkmetadata?reserveIds=%s,unknown-id" % book_id.upper()
+        )
+        assert second.endswith("/bulkmetadata?reserveIds=another-id")
+
+    def test_metadata_lookup_batch_failure(self):
+        self.api.queue_collection_token()
+        self.api.queue_response(404, content="no such endpoint")
+        identifier = self._identifier(identifier_type=Identifier.OVERDRIVE_ID)
+        with pytest.raises(BadResponseException) as excinfo:
+            self.api.metadata_lookup_batch([identifier])
+        assert "Bulk lookup failed" in str(excinfo.value)
+
+    def test_availability_lookup_batch(self):
+        self.api.queue_collection_token()
+        raw, info = self.sample_json("overdrive_availability_information.json")
+        book_id = info['reserveId']
+        self.api.queue_response(
+            200, content=json.dumps(dict(availability=[info]))
+        )
+        results = self.api.availability_lookup_batch([book_id, "unknown-id"])
+        assert {book_id: info} == results
+        [url] = [x[0] for x in self.api.requests[1:]]
+        assert url.endswith("/availability?products=%s,unknown-id" % book_id)
+
+    def test_circulation_lookup_batch(self):
+        self.api.queue_collection_token()
+        raw, info = self.sample_json("overdrive_availability_information.json")
+        book_id = info['reserveId']
+        self.api.queue_response(
+            200, content=json.dumps(dict(availability=[info]))
+        )
+
+        # We get CirculationData for the book Overdrive told us about,
+        # and nothing for the other one.
+        [circulation] = list(
+            self.api.circulation_lookup_batch([book_id, "unknown-id"])
+        )
+        assert book_id == circulation.primary_identifier(self._db).identifier
+        assert 3 == circulation.licenses_owned
+        assert 1 == circulation.licenses_available
+        assert 10 == circulation.patrons_in_hold_queue
+
     def test_advantage_differences(self):
         # Test the differences between Advantage collections and
         # regular Overdrive collections.
@@ -756,6 +833,236 @@ class TestOverdriveAdvantageAccount(OverdriveTestWithAPI):
         assert "%s / %s" % (parent.name, account.name) == collection.name
 
 
+class OverdriveCrawlTest(OverdriveTestWithAPI):
+    """Helper methods for testing the inventory crawler."""
+
+    def crawler(self, **kwargs):
+        # A single worker thread makes the order of requests, and thus
+        # the order of mock responses, predictable.
+        kwargs.setdefault('threads', 1)
+        kwargs.setdefault('page_size', 2)
+        kwargs.setdefault('requests_per_second', 1000)
+        return OverdriveInventoryCrawler(self.api, **kwargs)
+
+    def queue_page(self, total_items, *ids):
+        products = [
+            dict(id=id, title="Title %s" % id,
+                 links=dict(availability=dict(href="http://availability/%s" % id)))
+            for id in ids
+        ]
+        self.api.queue_response(
+            200, content=json.dumps(
+                dict(totalItems=total_items, products=products)
+            )
+        )
+
+
+class TestOverdriveInventoryCrawler(OverdriveCrawlTest):
+
+    def test_all_products_page_link(self):
+        self.api.queue_collection_token()
+        link = self.api.all_products_page_link(600, 300)
+        assert link.startswith(self.api._all_products_link)
+        assert link.endswith("&offset=600&limit=300")
+
+    def test_all_ids(self):
+        # all_ids() gets its IDs from an OverdriveInventoryCrawler.
+        self.api.queue_collection_token()
+        self.queue_page(3, "a", "b", "c")
+        assert ["a", "b", "c"] == [x['id'] for x in self.api.all_ids()]
+        url, args, kwargs = self.api.requests[-1]
+        assert url.endswith("&offset=0&limit=300")
+
+    def test_page_offsets(self):
+        crawler = self.crawler(page_size=300)
+        assert [300, 600, 900] == crawler.page_offsets(1000)
+        assert [900] == crawler.page_offsets(1000, 600)
+        assert [] == crawler.page_offsets(300)
+        assert [] == crawler.page_offsets(0)
+
+    def test_crawl(self):
+        self.api.queue_collection_token()
+        self.queue_page(5, "a", "b")
+        self.queue_page(5, "c", "d")
+        self.queue_page(5, "e")
+        crawler = self.crawler()
+
+        pages = []
+        for offset, availability in crawler.crawl():
+            pages.append((offset, [x['id'] for x in availability]))
+            for book in availability:
+                assert (
+                    "http://availability/%s" % book['id'] ==
+                    book['availability_link']
+                )
+        assert [(0, ["a", "b"]), (2, ["c", "d"]), (4, ["e"])] == pages
+        assert 6 == crawler.checkpoint
+
+        # Every page was requested with the appropriate offset and limit.
+        urls = [x[0] for x in self.api.requests[1:]]
+        for url, offset in zip(urls, (0, 2, 4)):
+            assert url.endswith("&offset=%d&limit=2" % offset)
+
+    def test_crawl_from_offset(self):
+        self.api.queue_collection_token()
+        self.queue_page(5, "c", "d")
+        self.queue_page(5, "e")
+        crawler = self.crawler()
+        pages = [offset for offset, availability in crawler.crawl(2)]
+        assert [2, 4] == pages
+        assert self.api.requests[1][0].endswith("&offset=2&limit=2")
+
+    def test_checkpoint(self):
+        crawler = self.crawler()
+        crawler.checkpoint = 4
+
+        # Pages may be finished out of order. The checkpoint only
+        # moves past a page once every earlier page is done.
+        crawler._page_done(8)
+        assert 4 == crawler.checkpoint
+        crawler._page_done(6)
+        assert 4 == crawler.checkpoint
+        crawler._page_done(4)
+        assert 10 == crawler.checkpoint
+
+    def test_crawl_error(self):
+        self.api.queue_collection_token()
+        self.queue_page(6, "a", "b")
+        self.api.queue_response(404, content="no such page")
+        crawler = self.crawler()
+
+        pages = []
+        with pytest.raises(BadResponseException) as excinfo:
+            for offset, availability in crawler.crawl():
+                pages.append(offset)
+        assert "Could not retrieve inventory page" in str(excinfo.value)
+
+        # We processed the first page, but the checkpoint doesn't
+        # move past the page that failed.
+        assert [0] == pages
+        assert 2 == crawler.checkpoint
+
+    def test_crawl_refreshes_token_on_calling_thread(self):
+        self.api.queue_collection_token()
+        self.queue_page(4, "a", "b")
+
+        # By the time a worker thread asks for the second page, the
+        # Bearer Token has expired.
+        self.api.queue_response(401, content="expired")
+        self.queue_page(4, "c", "d")
+        crawler = self.crawler()
+
+        pages = []
+        for offset, availability in crawler.crawl():
+            pages.append((offset, [x['id'] for x in availability]))
+            if offset == 0:
+                # The worker threads haven't started yet.
+                old_token = self.api.token
+                token_requests = len(self.api.access_token_requests)
+                self.api.access_token_response = (
+                    self.api.mock_access_token_response("new token")
+                )
+
+        # The worker thread didn't try to refresh the token itself,
+        # since that needs the database. The calling thread got a new
+        # token and fetched the page again.
+        assert [(0, ["a", "b"]), (2, ["c", "d"])] == pages
+        assert token_requests + 1 == len(self.api.access_token_requests)
+        assert "bearer token" == old_token
+        assert "new token" == self.api.token
+        url, args, kwargs = self.api.requests[-1]
+        assert url.endswith("&offset=2&limit=2")
+        assert "Bearer new token" == args[0]['Authorization']
+        assert 4 == crawler.checkpoint
+
+
+class TestOverdriveInventoryCrawlMonitor(OverdriveCrawlTest):
+
+    class Mock(OverdriveInventoryCrawlMonitor):
+        CHECKPOINT_INTERVAL = 1
+
+        def __init__(self, *args, **kwargs):
+            super(TestOverdriveInventoryCrawlMonitor.Mock, self).__init__(
+                *args, **kwargs
+            )
+            self.processed = []
+
+        def process_books(self, books):
+            for book in books:
+                self.processed.append(book['id'])
+                if book['id'] == 'explode':
+                    raise Exception("Kaboom")
+
+    def test_run(self):
+        self.api.queue_collection_token()
+        self.queue_page(3, "a", "b")
+        self.queue_page(3, "explode")
+        monitor = self.Mock(
+            self._db, self.collection, api_class=self.api, threads=1,
+            page_size=2, requests_per_second=1000
+        )
+        monitor.run()
+
+        # The crawl failed on the second page, but we saved our
+        # progress after the first page.
+        assert ["a", "b", "explode"] == monitor.processed
+        timestamp = monitor.timestamp()
+        assert 2 == timestamp.counter
+        assert "Books processed: 2." == timestamp.achievements
+        assert "Kaboom" in timestamp.exception
+
+        # The next run picks up one page before where the last one
+        # left off, and resets the counter once it's done.
+        self.queue_page(3, "a", "b")
+        self.queue_page(3, "c")
+        monitor.run()
+        assert ["a", "b", "explode", "a", "b", "c"] == monitor.processed
+        assert self.api.requests[-2][0].endswith("&offset=0&limit=2")
+        assert self.api.requests[-1][0].endswith("&offset=2&limit=2")
+        assert 0 == timestamp.counter
+        assert None == timestamp.exception
+
+    def test_resume_after_inventory_changes(self):
+        # A crawl was interrupted after processing four books.
+        self.api.queue_collection_token()
+        monitor = self.Mock(
+            self._db, self.collection, api_class=self.api, threads=1,
+            page_size=2, requests_per_second=1000
+        )
+        monitor.timestamp().counter = 4
+
+        # Since then, book "b" was removed from the collection, so "e",
+        # which used to be at offset 4, is now at offset 3. Because the
+        # crawl resumes a page early, "e" isn't skipped.
+        self.queue_page(5, "d", "e")
+        self.queue_page(5, "f")
+        monitor.run()
+        assert ["d", "e", "f"] == monitor.processed
+        assert self.api.requests[-2][0].endswith("&offset=2&limit=2")
+        assert self.api.requests[-1][0].endswith("&offset=4&limit=2")
+
+    def test_process_books(self):
+        # process_books looks up availability for a page of books in
+        # bulk and applies it to their LicensePools.
+        self.api.queue_collection_token()
+        raw, info = self.sample_json("overdrive_availability_information.json")
+        book_id = info['reserveId']
+        self.api.queue_response(
+            200, content=json.dumps(dict(availability=[info]))
+        )
+        monitor = OverdriveInventoryCrawlMonitor(
+            self._db, self.collection, api_class=self.api
+        )
+        [pool] = monitor.process_books([dict(id=book_id)])
+        assert book_id == pool.identifier.identifier
+        assert self.collection == pool.collection
+        assert 3 == pool.licenses_owned
+        assert 1 == pool.licenses_available
+        assert 10 == pool.patrons_in_hold_queue
+        url, args, kwargs = self.api.requests[-1]
+        assert url.endswith("/availability?products=%s" % book_id)
+
+
 class TestOverdriveBibliographicCoverageProvider(OverdriveTest):
     """Test the code that looks up bibliographic information from Overdrive."""
 
@@ -817,9 +1124,12 @@ class TestOverdriveBibliographicCoverageProvider(OverdriveTest):
         # This book has no LicensePool.
         assert [] == identifier.licensed_through
 
-        # Run it through the OverdriveBibliographicCoverageProvider
+        # Run it through the OverdriveBibliographicCoverageProvider,
+        # which looks up metadata in bulk.
         raw, info = self.sample_json("overdrive_metadata.json")
-        self.api.queue_response(200, content=raw)
+        self.api.queue_response(
+            200, content=json.dumps(dict(metadata=[info]))
+        )
 
         [result] = self.provider.process_batch([identifier])
         assert identifier == result
@@ -839,3 +1149,53 @@ class TestOverdriveBibliographicCoverageProvider(OverdriveTest):
         assert "Agile Documentation" == pool.work.title
         assert True == pool.work.presentation_ready
 
+
+    def test_process_batch(self):
+        self.api.queue_collection_token()
+        raw, info = self.sample_json("overdrive_metadata.json")
+        known = self._identifier(identifier_type=Identifier.OVERDRIVE_ID)
+        known.identifier = info['id']
+        unknown = self._identifier(identifier_type=Identifier.OVERDRIVE_ID)
+        unknown.identifier = 'bad guid'
+        missing = self._identifier(identifier_type=Identifier.OVERDRIVE_ID)
+
+        error = dict(
+            id='bad guid', errorCode="InvalidGuid",
+            message="An invalid guid was given."
+        )
+        self.api.queue_response(
+            200, content=json.dumps(dict(metadata=[info, error]))
+        )
+        success, invalid, not_sent = self.provider.process_batch(
+            [known, unknown, missing]
+        )
+
+        # All three identifiers were looked up with a single request.
+        assert 2 == len(self.api.requests)
+
+        assert known == success
+        assert "Agile Documentation" == known.primarily_identifies[0].title
+
+        assert isinstance(invalid, CoverageFailure)
+        assert False == invalid.transient
+        assert "Invalid Overdrive ID: bad guid" == invalid.exception
+
+        assert isinstance(not_sent, CoverageFailure)
+        assert True == not_sent.transient
+        assert ("Overdrive did not send metadata for %s" % missing.identifier
+                == not_sent.exception)
+
+    def test_process_batch_request_failure(self):
+        # If the bulk request fails, every identifier in the batch
+        # gets a transient failure.
+        self.api.queue_collection_token()
+        self.api.queue_response(404, content="no such endpoint")
+        identifiers = [
+            self._identifier(identifier_type=Identifier.OVERDRIVE_ID)
+            for i in range(2)
+        ]
+        failures = self.provider.process_batch(identifiers)
+        assert identifiers == [x.obj for x in failures]
+        for failure in failures:
+            assert True == failure.transient
+            assert "Bulk lookup failed" in failure.exception
@@ -24,7 +24,12 @@ from ..testing import (
 )
 
 from ..util.personal_names import (
+    clear_name_caches,
     display_name_to_sort_name,
+    display_names_to_sort_names,
+    name_cache_stats,
+    name_tidy,
+    normalize_contributor_name_for_matching,
 )
 from ..mock_analytics_provider import MockAnalyticsProvider
 
@@ -107,6 +112,37 @@ class TestNameConversions(DatabaseTest):
         sort_name = display_name_to_sort_name(u"Bitshifter, B.")
         assert u"Bitshifter, B." == sort_name
 
+    def test_names_are_cached(self):
+        clear_name_caches()
+        for function in (display_name_to_sort_name, name_tidy,
+                         normalize_contributor_name_for_matching):
+            function.cache.hits = function.cache.misses = 0
+            name = u"Bitshifter, Bob,"
+            result = function(name)
+            assert function.uncached(name) == result
+            assert result == function(name)
+
+        stats = name_cache_stats()
+        assert 1 == stats['display_name_to_sort_name']['misses']
+        assert 1 == stats['display_name_to_sort_name']['hits']
+
+        # If a name can't be converted, that's cached too.
+        assert None == display_name_to_sort_name(None)
+        assert None == display_name_to_sort_name(None)
+        assert 2 == display_name_to_sort_name.cache.hits
+
+        clear_name_caches()
+        assert 0 == len(display_name_to_sort_name.cache)
+
+    def test_display_names_to_sort_names(self):
+        assert (
+            {u"Mark Twain": u"Twain, Mark", u"Prince": u"Prince"} ==
+            display_names_to_sort_names(
+                [u"Mark Twain", u"Prince", u"Mark Twain"]
+            )
+        )
+        assert {} == display_names_to_sort_names([])
+
 
 
 
@@ -1,4 +1,5 @@
 import datetime
+import json
 import os
 import random
 import shutil
@@ -16,7 +17,10 @@ from ..classifier import Classifier
 from ..config import (
     CannotLoadConfiguration,
 )
-from ..external_search import MockExternalSearchIndex
+from ..external_search import (
+    MockExternalSearchIndex,
+    SearchProfiler,
+)
 from ..lane import (
     Lane,
     WorkList,
@@ -47,6 +51,7 @@ from ..model import (
     WorkCoverageRecord,
 )
 from ..model.configuration import ExternalIntegrationLink
+from ..opds_import import OPDSImporter
 from ..monitor import (
     Monitor,
     CollectionMonitor,
@@ -66,6 +71,7 @@ from ..scripts import (
     DatabaseMigrationInitializationScript,
     DatabaseMigrationScript,
     Explain,
+    GroupsEngineBenchmarkScript,
     IdentifierInputScript,
     LaneSweeperScript,
     LibraryInputScript,
@@ -74,6 +80,9 @@ from ..scripts import (
     MockStdin,
     OPDSImportScript,
     PatronInputScript,
+    OPDSParserBenchmarkScript,
+    PersonalNameBenchmarkScript,
+    QueryConstructionBenchmarkScript,
     RebuildSearchIndexScript,
     ReclassifyWorksForUncheckedSubjectsScript,
     RunCollectionMonitorScript,
@@ -84,7 +93,9 @@ from ..scripts import (
     RunThreadedCollectionCoverageProviderScript,
     RunWorkCoverageProviderScript,
     Script,
+    SearchDocumentBenchmarkScript,
     SearchIndexCoverageRemover,
+    SearchReportScript,
     ShowCollectionsScript,
     ShowIntegrationsScript,
     ShowLanesScript,
@@ -94,6 +105,7 @@ from ..scripts import (
     UpdateLaneSizeScript,
     WhereAreMyBooksScript,
     WorkClassificationScript,
+    WorkConsolidationScript,
     WorkProcessingScript,
     CollectionType)
 from ..testing import (
@@ -2186,6 +2198,14 @@ class TestOPDSImportScript(DatabaseTest):
         monitor = MockOPDSImportMonitor.INSTANCES.pop()
         assert self._default_collection == monitor.collection
         assert True == monitor.kwargs['force_reimport']
+        assert None == monitor.kwargs['import_workers']
+
+        # Setting --workers tells the monitor to import pages in
+        # parallel.
+        args.append('--workers=4')
+        script.do_run(args)
+        monitor = MockOPDSImportMonitor.INSTANCES.pop()
+        assert 4 == monitor.kwargs['import_workers']
 
 
 class MockWhereAreMyBooks(WhereAreMyBooksScript):
@@ -2515,7 +2535,9 @@ class TestMirrorResourcesScript(DatabaseTest):
 
             processed = []
 
-            def collections_with_uploader(self, collections, collection_type):
+            def collections_with_uploader(self, collections, collection_type,
+                                          thumbnail_processes=None):
+                self.thumbnail_processes = thumbnail_processes
                 # Pretend that `has_uploader` is the only Collection
                 # with an uploader.
                 for collection in collections:
@@ -2545,6 +2567,12 @@ class TestMirrorResourcesScript(DatabaseTest):
         script.do_run(cmd_args=["--collection=%s" % has_uploader.name])
         processed = script.processed.pop()
         assert (has_uploader, mock_uploader) == processed
+        assert None == script.thumbnail_processes
+
+        # The number of processes used to make thumbnails can be
+        # set on the command line.
+        script.do_run(cmd_args=["--thumbnail-processes=3"])
+        assert 3 == script.thumbnail_processes
 
     @parameterized.expand([
         (
@@ -2584,7 +2612,7 @@ class TestMirrorResourcesScript(DatabaseTest):
             mock_policy = object()
 
             @classmethod
-            def replacement_policy(cls, uploader):
+            def replacement_policy(cls, uploader, **kwargs):
                 cls.replacement_policy_called_with = uploader
                 return cls.mock_policy
 
@@ -2657,21 +2685,43 @@ class TestMirrorResourcesScript(DatabaseTest):
         assert True == p.link_content
         assert True == p.even_if_not_apparently_updated
         assert False == p.rights
+        assert None == p.thumbnail_processes
+
+        p = MirrorResourcesScript.replacement_policy(
+            uploader, thumbnail_processes=4
+        )
+        assert 4 == p.thumbnail_processes
 
     def test_process_collection(self):
 
+        class MockMirrorUtility(object):
+            def __init__(self):
+                self.make_thumbnails_called_with = []
+
+            def make_thumbnails(self, thumbnails, policy):
+                self.make_thumbnails_called_with.append(
+                    (list(thumbnails), policy)
+                )
+
         class MockScript(MirrorResourcesScript):
+            MIRROR_UTILITY = MockMirrorUtility()
+            THUMBNAIL_BATCH_SIZE = 2
             process_item_called_with = []
-            def process_item(self, collection, link, policy):
+            def process_item(self, collection, link, policy, thumbnails):
                 self.process_item_called_with.append((collection, link, policy))
+                # Pretend every link is a cover image that needs
+                # a thumbnail.
+                thumbnails.append(link)
 
         # Mock the Hyperlink.unmirrored method
         link1 = object()
         link2 = object()
+        link3 = object()
         def unmirrored(collection):
             assert collection == self._default_collection
             yield link1
             yield link2
+            yield link3
 
         script = MockScript(self._db)
         policy = object()
@@ -2679,9 +2729,17 @@ class TestMirrorResourcesScript(DatabaseTest):
 
         # Process_collection called unmirrored() and then called process_item
         # on every item yielded by unmirrored()
-        call1, call2 = script.process_item_called_with
+        call1, call2, call3 = script.process_item_called_with
         assert (self._default_collection, link1, policy) == call1
         assert (self._default_collection, link2, policy) == call2
+        assert (self._default_collection, link3, policy) == call3
+
+        # Thumbnails were made as soon as a batch was full, and again
+        # at the end.
+        assert (
+            [([link1, link2], policy), ([link3], policy)] ==
+            script.MIRROR_UTILITY.make_thumbnails_called_with
+        )
 
     def test_derive_rights_status(self):
         """Test our ability to determine the rights status of a Resource,
@@ -2807,6 +2865,7 @@ class TestMirrorResourcesScript(DatabaseTest):
         assert pool.data_source == attempt['data_source']
         assert pool == attempt['model_object']
         assert download_link == attempt['link_obj']
+        assert None == attempt['thumbnails']
 
         link = attempt['link']
         assert isinstance(link, LinkData)
@@ -2817,9 +2876,11 @@ class TestMirrorResourcesScript(DatabaseTest):
         script.RIGHTS_STATUS = None
         thumb_link = MockLink(Hyperlink.THUMBNAIL_IMAGE, self._url,
                               pool.identifier)
-        m(self._default_collection, thumb_link, policy)
+        thumbnails = []
+        m(self._default_collection, thumb_link, policy, thumbnails)
         attempt = mirror.mirrored.pop()
         assert thumb_link.resource.url == attempt['link'].href
+        assert thumbnails is attempt['thumbnails']
 
 
 class TestRebuildSearchIndexScript(DatabaseTest):
@@ -2841,7 +2902,10 @@ class TestRebuildSearchIndexScript(DatabaseTest):
         decoys = [wcr.QUALITY_OPERATION, wcr.GENERATE_MARC_OPERATION]
 
         # Set up some coverage records.
-        for operation in decoys + [wcr.UPDATE_SEARCH_INDEX_OPERATION]:
+        for operation in decoys + [
+            wcr.UPDATE_SEARCH_INDEX_OPERATION,
+            wcr.UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION
+        ]:
             for w in (work, work2):
                 wcr.add_for(
                     w, operation, status=random.choice(wcr.ALL_STATUSES)
@@ -2874,6 +2938,13 @@ class TestRebuildSearchIndexScript(DatabaseTest):
         assert 2 == len(new_coverage)
         assert set(new_coverage) != set(original_coverage)
 
+        # Pending availability updates were also deleted, since the
+        # new search documents will have up-to-date availability
+        # information.
+        assert 0 == self._db.query(wcr).filter(
+            wcr.operation==wcr.UPDATE_SEARCH_INDEX_AVAILABILITY_OPERATION
+        ).count()
+
 
 class TestSearchIndexCoverageRemover(DatabaseTest):
 
@@ -2905,6 +2976,348 @@ class TestSearchIndexCoverageRemover(DatabaseTest):
             assert sorted(remaining) == sorted(decoys)
 
 
+class TestQueryConstructionBenchmarkScript(object):
+
+    def test_parse_command_line(self):
+        m = QueryConstructionBenchmarkScript.parse_command_line
+        parsed = m(cmd_args=["--repeat=3"], stdin=MockStdin("dogs", "", "cats"))
+        assert 3 == parsed.repeat
+        assert ["dogs", "cats"] == parsed.query_strings
+
+        # If no query strings are provided, the default corpus is used.
+        parsed = m(cmd_args=[], stdin=MockStdin())
+        assert 10 == parsed.repeat
+        assert (
+            QueryConstructionBenchmarkScript.DEFAULT_CORPUS ==
+            parsed.query_strings
+        )
+
+    def test_summarize(self):
+        m = QueryConstructionBenchmarkScript.summarize
+        assert "no queries" == m([])
+        assert (
+            "mean 2.50ms, median 3.00ms, 95th percentile 4.00ms, max 4.00ms" ==
+            m([0.004, 0.001, 0.003, 0.002])
+        )
+
+    def test_do_run(self):
+        output = StringIO()
+        script = QueryConstructionBenchmarkScript()
+        script.do_run(
+            cmd_args=["--repeat=2"], stdin=MockStdin("dogs", "cats"),
+            output=output
+        )
+        lines = output.getvalue().splitlines()
+        assert "Built queries for 2 query strings, 2 times each." == lines[0]
+        assert lines[1].startswith("Uncached: mean ")
+        assert lines[2].startswith("Cached: mean ")
+
+
+class TestGroupsEngineBenchmarkScript(DatabaseTest):
+
+    def test_do_run(self):
+        parent = self._lane(display_name="Parent")
+        child = self._lane(display_name="Child", parent=parent)
+        invisible = self._lane(display_name="Invisible", parent=parent)
+        invisible.visible = False
+
+        output = StringIO()
+        search = MockExternalSearchIndex()
+        search.result_cache = object()
+        script = GroupsEngineBenchmarkScript(
+            self._db, search_index_client=search, repeat=2, output=output
+        )
+
+        # The search result cache was disabled.
+        assert None == search.result_cache
+
+        # Only lanes with visible sublanes are benchmarked.
+        assert True == script.should_process_lane(parent)
+        assert False == script.should_process_lane(child)
+
+        script.do_run(cmd_args=[])
+
+        # Each engine was run twice against the parent lane.
+        assert 2 == len(script.timings[(1, "multisearch")])
+        assert 2 == len(script.timings[(1, "aggregation")])
+        assert "GROUPS_BY_AGGREGATION" not in parent.__dict__
+
+        lines = output.getvalue().splitlines()
+        assert (parent.full_identifier + " (1 sublanes): multisearch "
+                in lines[0])
+        assert "aggregation " in lines[0]
+        assert "Mean time by number of sublanes:" == lines[1]
+        assert lines[2].startswith("1 sublanes: multisearch ")
+
+
+class TestSearchDocumentBenchmarkScript(DatabaseTest):
+
+    def test_seed_catalog(self):
+        script = SearchDocumentBenchmarkScript(self._db)
+        script.seed_catalog(
+            3, contributors=2, classifications=4, license_pools=2,
+            custom_lists=2
+        )
+        works = script.load_works(10)
+        assert 3 == len(works)
+        for work in works:
+            assert True == work.presentation_ready
+            assert 2 == len(work.license_pools)
+            edition = work.presentation_edition
+            assert 2 == len(edition.contributions)
+            assert 4 == len(edition.primary_identifier.classifications)
+            assert 1 == len(work.custom_list_entries)
+
+        # Once the synthetic catalog exists, other works are ignored.
+        other = self._work(with_license_pool=True)
+        assert other not in script.load_works(10)
+
+        # The limit is respected.
+        assert works[:2] == script.load_works(2)
+
+    def test_seed_catalog_is_repeatable(self):
+        # Seeding the catalog twice with the same random seed gives
+        # works with the same randomly chosen values.
+        script = SearchDocumentBenchmarkScript(self._db)
+        script.seed_catalog(3, random_seed=5)
+        script.seed_catalog(3, random_seed=5)
+        works = script.load_works(10)
+        def values(work):
+            return (
+                work.quality, work.audience,
+                sorted(x.name for x in work.genres),
+                sorted(
+                    x.weight for x in
+                    work.presentation_edition.primary_identifier.classifications
+                )
+            )
+        assert [values(x) for x in works[:3]] == [values(x) for x in works[3:]]
+
+    def test_do_run(self):
+        output = StringIO()
+        script = SearchDocumentBenchmarkScript(self._db)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            results = script.do_run(cmd_args=[
+                "--seed=3", "--batch-size=1", "--batch-size=2",
+                "--batches=2", "--explain", "--save=%s" % path
+            ], output=output)
+
+            # Two batches of one work, then all three works in
+            # batches of two.
+            assert [1, 2] == sorted(results.keys())
+            assert 2 == results[1]['documents']
+            assert 2 == results[1]['batches']
+            assert 3 == results[2]['documents']
+
+            out = output.getvalue()
+            assert out.startswith(
+                "Generating search documents for 3 works.\n"
+                "Batch size 1: 2 documents in 2 batches"
+            )
+            assert "Execution Time" in out
+
+            saved = json.load(open(path))
+            assert results[1] == saved["1"]
+
+            # If the baseline was a lot faster, the benchmark fails.
+            saved["1"]["documents_per_second"] = 1e12
+            json.dump(saved, open(path, "w"))
+            with pytest.raises(SystemExit):
+                script.do_run(
+                    cmd_args=["--batch-size=1", "--baseline=%s" % path],
+                    output=output
+                )
+            assert "REGRESSION: Batch size 1: " in output.getvalue()
+        finally:
+            os.remove(path)
+
+    def test_regressions(self):
+        m = SearchDocumentBenchmarkScript.regressions
+        baseline = {
+            "1": dict(documents_per_second=100),
+            "50": dict(documents_per_second=100),
+        }
+        results = {
+            1: dict(documents_per_second=79),
+            50: dict(documents_per_second=81),
+            500: dict(documents_per_second=1),
+        }
+
+        # Batch size 1 dropped by more than 20%. Batch size 50 didn't,
+        # and there's nothing to compare batch size 500 to.
+        assert (
+            ["Batch size 1: 79.0 documents/sec, down from 100.0"] ==
+            m(baseline, results, 0.2)
+        )
+        assert [] == m(baseline, results, 0.5)
+
+
+class TestPersonalNameBenchmarkScript(DatabaseTest):
+
+    def test_load_names(self):
+        edition = self._edition(authors=[u"Mark Twain"])
+        self._edition(authors=[u"Mark Twain"])
+        script = PersonalNameBenchmarkScript(self._db)
+
+        # A name shows up once for every book it's on.
+        assert [u"Mark Twain", u"Mark Twain"] == script.load_names(10)
+        assert [u"Mark Twain"] == script.load_names(1)
+
+    def test_do_run(self):
+        output = StringIO()
+        stdin = MockStdin(u"Mark Twain", u"Mark Twain", u"", u"Herman Melville")
+        script = PersonalNameBenchmarkScript(self._db)
+        results = script.do_run(
+            cmd_args=["--passes=2"], stdin=stdin, output=output
+        )
+        assert (
+            set(["display_name_to_sort_name",
+                 "normalize_contributor_name_for_matching"]) ==
+            set(results.keys())
+        )
+        result = results["display_name_to_sort_name"]
+        assert 3 == result['names']
+        assert 2 == result['passes']
+
+        # Of six lookups, only the first lookup of each distinct name
+        # was a miss.
+        assert 4/6.0 == result['hit_rate']
+
+        out = output.getvalue()
+        assert out.startswith("Normalizing 3 names, 2 distinct.\n")
+        assert "display_name_to_sort_name: " in out
+
+
+class TestOPDSParserBenchmarkScript(object):
+
+    def test_generate_feed(self):
+        feed = OPDSParserBenchmarkScript.generate_feed(3)
+        values, failures = OPDSImporter.extract_data_from_feedparser(
+            feed, DataSource(name=DataSource.OA_CONTENT_SERVER)
+        )
+        assert 3 == len(values)
+        assert {} == failures
+
+    def test_benchmark(self):
+        calls = []
+        def parser(feed, data_source):
+            calls.append((feed, data_source))
+            return 10
+        result = OPDSParserBenchmarkScript.benchmark(
+            "mock", parser, "a feed", "a data source", repeat=2
+        )
+        assert [("a feed", "a data source")] * 2 == calls
+        assert "mock" == result['parser']
+        assert 10 == result['entries']
+        assert 2 == result['repeat']
+
+    def test_do_run(self):
+        output = StringIO()
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            results = OPDSParserBenchmarkScript().do_run(
+                cmd_args=["--entries=4", "--repeat=1", "--save=%s" % path],
+                output=output
+            )
+            # Both parsers found every entry in the generated feed.
+            assert set(["two-pass", "single-pass"]) == set(results.keys())
+            for result in results.values():
+                assert 4 == result['entries']
+
+            out = output.getvalue()
+            assert out.startswith("Parsing a feed of ")
+            assert "\ntwo-pass: 4 entries, " in out
+            assert "\nsingle-pass: 4 entries, " in out
+
+            # The results were saved.
+            with open(path) as f:
+                assert results == json.load(f)
+
+            # A real feed can be parsed instead of a generated one.
+            with open(path, 'w') as f:
+                f.write(OPDSParserBenchmarkScript.generate_feed(2))
+            results = OPDSParserBenchmarkScript().do_run(
+                cmd_args=["--feed=%s" % path, "--repeat=1"], output=output
+            )
+            assert 2 == results['single-pass']['entries']
+        finally:
+            os.remove(path)
+
+
+class TestSearchReportScript(object):
+
+    def log_line(self, **report):
+        return SearchProfiler.LOG_MESSAGE + json.dumps(report)
+
+    def test_parse_command_line(self):
+        stdin = MockStdin(
+            "Some other log message",
+            self.log_line(fingerprint="a", took_ms=10),
+        )
+        parsed = SearchReportScript.parse_command_line(
+            cmd_args=["--top=2", "--order=max"], stdin=stdin
+        )
+        assert 2 == parsed.top
+        assert "max" == parsed.order
+        assert [dict(fingerprint="a", took_ms=10)] == parsed.reports
+
+    def test_summarize(self):
+        reports = [
+            dict(fingerprint="a", took_ms=10, query_string="dogs"),
+            dict(fingerprint="a", took_ms=30, query_string="cats",
+                 shards_failed=1, profile={}),
+            dict(fingerprint="a", took_ms=20, query_string="dogs"),
+            dict(fingerprint="b", took_ms=100),
+            dict(fingerprint="b", took_ms=5, lane_id=7, facets="order=title"),
+            dict(fingerprint="b", took_ms=6, lane_id=[7, 8]),
+        ]
+        a, b, b_grouped, b_lane = sorted(
+            SearchReportScript.summarize(reports),
+            key=lambda x: (x['fingerprint'], -x['total'])
+        )
+        assert dict(
+            fingerprint="a", lane_id=None, facets=None, count=3, total=60,
+            max=30, mean=20.0, shards_failed=1, profiled=1,
+            query_strings=["dogs", "cats"]
+        ) == a
+        assert dict(
+            fingerprint="b", lane_id=None, facets=None, count=1, total=100,
+            max=100, mean=100.0, shards_failed=0, profiled=0,
+            query_strings=[]
+        ) == b
+
+        # Searches with the same fingerprint are kept apart if they
+        # were run for different lanes or facets.
+        assert (7, "order=title") == (b_lane['lane_id'], b_lane['facets'])
+        assert 5 == b_lane['total']
+        assert ((7, 8), None) == (b_grouped['lane_id'], b_grouped['facets'])
+        assert 6 == b_grouped['total']
+
+    def test_do_run(self):
+        stdin = MockStdin(
+            self.log_line(fingerprint="a", took_ms=10, query_string="dogs"),
+            self.log_line(fingerprint="a", took_ms=20, query_string="cats"),
+            self.log_line(fingerprint="a", took_ms=30, query_string="dogs"),
+            self.log_line(fingerprint="b", took_ms=50, lane_id=[1, 2],
+                          facets="order=title"),
+            self.log_line(fingerprint="c", took_ms=1, lane_id=3),
+        )
+        output = StringIO()
+        SearchReportScript().do_run(
+            cmd_args=["--top=2"], stdin=stdin, output=output
+        )
+        assert (
+            "5 search reports found.\n"
+            "a (lane None, facets ): 3 searches, total 60ms, mean 20.0ms, max 30ms, 0 shard failures, 0 profiled\n"
+            " Query string: dogs\n"
+            " Query string: cats\n"
+            "b (lane 1,2, facets order=title): 1 searches, total 50ms, mean 50.0ms, max 50ms, 0 shard failures, 0 profiled\n"
+        ) == output.getvalue()
+
+
 class TestUpdateLaneSizeScript(DatabaseTest):
 
     def test_do_run(self):
@@ -2933,9 +3346,30 @@ class TestUpdateCustomListSizeScript(DatabaseTest):
         assert 1 == customlist.size
 
 
-class TestWorkConsolidationScript(object):
-    """TODO"""
-    pass
+class TestWorkConsolidationScript(DatabaseTest):
+
+    def test_bulk(self):
+        edition, pool = self._edition(with_license_pool=True)
+        orphan = Work()
+        self._db.add(orphan)
+        self._db.commit()
+
+        script = WorkConsolidationScript(_db=self._db, cmd_args=["--bulk"])
+        assert True == script.bulk
+        script.do_run()
+
+        # The LicensePool got a Work, and the Work with no LicensePools
+        # was deleted.
+        assert pool.work != None
+        assert [pool.work] == self._db.query(Work).all()
+
+        # Bulk consolidation can't be limited to particular identifiers.
+        with pytest.raises(ValueError) as excinfo:
+            WorkConsolidationScript(
+                _db=self._db,
+                cmd_args=["--bulk", "--identifier-type=Database ID", "1"]
+            )
+        assert "--bulk can't be restricted" in str(excinfo.value)
 
 
 class TestWorkPresentationScript(object):
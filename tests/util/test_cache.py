@@ -0,0 +1,105 @@
+import pytest
+
+from ...util.cache import LRUCache
+
+
+class MockLRUCache(LRUCache):
+    """An LRUCache with a clock that only moves when told to."""
+
+    def __init__(self, *args, **kwargs):
+        super(MockLRUCache, self).__init__(*args, **kwargs)
+        self.time = 1000
+
+    def now(self):
+        return self.time
+
+
+class TestLRUCache(object):
+
+    def test_constructor(self):
+        with pytest.raises(ValueError) as excinfo:
+            LRUCache(max_size=0)
+        assert "must be able to hold at least one item" in str(excinfo.value)
+
+    def test_get_and_set(self):
+        cache = LRUCache()
+        assert None == cache.get("key")
+        assert "default" == cache.get("key", "default")
+
+        cache.set("key", "value")
+        assert "value" == cache.get("key")
+        assert 1 == len(cache)
+
+        cache.delete("key")
+        assert None == cache.get("key")
+
+        # Deleting an item that's not there does nothing.
+        cache.delete("key")
+
+    def test_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # Looking up 'a' makes it the most recently used item.
+        assert 1 == cache.get("a")
+
+        # So when there's no more room, 'b' is the item that goes.
+        cache.set("c", 3)
+        assert 2 == len(cache)
+        assert None == cache.get("b")
+        assert 1 == cache.get("a")
+        assert 3 == cache.get("c")
+        assert 1 == cache.evictions
+
+        # Setting an item that's already in the cache doesn't evict
+        # anything.
+        cache.set("a", 4)
+        assert 4 == cache.get("a")
+        assert 1 == cache.evictions
+
+    def test_ttl(self):
+        cache = MockLRUCache(ttl=10)
+        cache.set("default", 1)
+        cache.set("short", 2, ttl=1)
+        cache.set("long", 3, ttl=100)
+
+        cache.time += 5
+        assert 1 == cache.get("default")
+        assert None == cache.get("short")
+        assert 3 == cache.get("long")
+
+        cache.time += 5
+        assert None == cache.get("default")
+        assert 3 == cache.get("long")
+
+        # If the cache has no default TTL, items stay around until
+        # they're evicted.
+        cache = MockLRUCache()
+        cache.set("key", "value")
+        cache.time += 1000000
+        assert "value" == cache.get("key")
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.clear()
+        assert 0 == len(cache)
+        assert None == cache.get("a")
+
+    def test_stats(self):
+        cache = LRUCache(max_size=1)
+        assert (
+            dict(hits=0, misses=0, evictions=0, size=0, hit_rate=None) ==
+            cache.stats
+        )
+        cache.get("a")
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.set("b", 1)
+        assert (
+            dict(hits=2, misses=1, evictions=1, size=1, hit_rate=2/3.0) ==
+            cache.stats
+        )
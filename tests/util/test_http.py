@@ -44,6 +44,23 @@ class TestHTTP(object):
         assert 200 == response.status_code
         assert "Success!" == response.content
 
+    def test_request_with_timeout_session(self):
+        # A request can be made through a requests Session.
+        class MockSession(object):
+            def request(self, *args, **kwargs):
+                self.called_with = (args, kwargs)
+                return MockRequestsResponse(200, content="Success!")
+
+        session = MockSession()
+        response = HTTP.request_with_timeout(
+            "GET", "http://url/", session=session, kwarg="value"
+        )
+        assert "Success!" == response.content
+        args, kwargs = session.called_with
+        assert ("GET", "http://url/") == args
+        assert "value" == kwargs["kwarg"]
+        assert "session" not in kwargs
+
     def test_request_with_timeout_failure(self):
 
         def immediately_timeout(*args, **kwargs):
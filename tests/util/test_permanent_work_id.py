@@ -0,0 +1,50 @@
+# encoding: utf-8
+from ...util.permanent_work_id import WorkIDCalculator
+
+
+class TestWorkIDCalculator(object):
+
+    def test_normalization_is_cached(self):
+        class Mock(WorkIDCalculator):
+            calls = []
+
+            @classmethod
+            def _normalize_title(cls, title, num_non_filing_characters=0):
+                cls.calls.append(title)
+                return super(Mock, cls)._normalize_title(
+                    title, num_non_filing_characters
+                )
+
+        title = u"A title that only appears in this test"
+        normalized = Mock.normalize_title(title)
+        assert normalized == WorkIDCalculator._normalize_title(title)
+        assert normalized == Mock.normalize_title(title)
+        assert [title] == Mock.calls
+
+        # The number of non-filing characters is part of the key.
+        Mock.normalize_title(title, 2)
+        assert [title, title] == Mock.calls
+
+        author = u"Author, Only Appears In This Test"
+        normalized = WorkIDCalculator.normalize_author(author)
+        assert normalized == WorkIDCalculator._normalize_author(author)
+        assert normalized == WorkIDCalculator._normalized_authors.get(author)
+
+    def test_permanent_ids(self):
+        w = WorkIDCalculator
+        books = [
+            (u"The Adventures of Tom Sawyer", u"Twain, Mark", "book"),
+            (u"Moby-Dick; or, The Whale", u"Melville, Herman", "book"),
+            (u"The Adventures of Tom Sawyer", u"Twain, Mark", "audio"),
+            (None, None, "book"),
+        ]
+        expect = [
+            w.permanent_id(
+                w._normalize_title(title), w._normalize_author(author),
+                medium
+            )
+            for title, author, medium in books
+        ]
+        assert expect == w.permanent_ids(books)
+        assert expect[0] != expect[2]
+        assert [] == w.permanent_ids([])
@@ -16,6 +16,7 @@ from ...util import (
     MetadataSimilarity,
     MoneyUtility,
     TitleProcessor,
+    batch_lazily,
     fast_query_count,
     slugify
 )
@@ -434,6 +435,20 @@ class TestSlugify(object):
         assert 'already-slugified' == slugify('already-slugified')
 
 
+class TestBatchLazily(object):
+
+    def test_batch_lazily(self):
+        assert [] == list(batch_lazily([], 2))
+        assert [[1, 2], [3, 4], [5]] == list(batch_lazily(range(1, 6), 2))
+
+        # Any iterable can be batched, and it's only consumed as
+        # needed.
+        iterator = iter(range(1, 6))
+        batches = batch_lazily(iterator, 3)
+        assert [1, 2, 3] == next(batches)
+        assert [4, 5] == list(iterator)
+
+
 class TestMoneyUtility(object):
 
     def test_parse(self):
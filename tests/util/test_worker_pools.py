@@ -1,6 +1,8 @@
 import threading
 from contextlib import contextmanager
 
+from concurrent.futures import ThreadPoolExecutor
+
 from ...model import (
     Identifier,
     SessionManager,
@@ -12,7 +14,9 @@ from ...util.worker_pools import (
     Job,
     Pool,
     Queue,
+    RateLimiter,
     Worker,
+    bounded_map,
 )
 
 from ...testing import DatabaseTest
@@ -173,3 +177,68 @@ class TestDatabaseJob(DatabaseTest):
         [identifier] = self._db.query(Identifier).all()
         assert 'Keep It' == identifier.type
         assert '100' == identifier.identifier
+
+
+class MockRateLimiter(RateLimiter):
+    """A RateLimiter that runs on a fake clock."""
+
+    def __init__(self, per_second):
+        super(MockRateLimiter, self).__init__(per_second)
+        self.time = 100.0
+        self.sleeps = []
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+class TestRateLimiter(object):
+
+    def test_wait(self):
+        limiter = MockRateLimiter(4)
+        assert 0.25 == limiter.interval
+
+        # The first caller doesn't have to wait.
+        limiter.wait()
+        assert [] == limiter.sleeps
+
+        # Later callers are spaced out a quarter of a second apart.
+        limiter.wait()
+        limiter.wait()
+        assert [0.25, 0.5] == limiter.sleeps
+
+        # Once enough time has passed, there's no need to wait.
+        limiter.time += 10
+        limiter.wait()
+        assert [0.25, 0.5] == limiter.sleeps
+
+    def test_no_limit(self):
+        limiter = MockRateLimiter(None)
+        for i in range(5):
+            limiter.wait()
+        assert [] == limiter.sleeps
+
+
+class TestBoundedMap(object):
+
+    def test_bounded_map(self):
+        consumed = []
+
+        def items():
+            for i in range(10):
+                consumed.append(i)
+                yield i
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = bounded_map(executor, lambda x: x * 2, items(), 3)
+
+            # Only a few items are taken from the iterable before the
+            # first result is ready.
+            assert 0 == next(results)
+            assert [0, 1, 2] == consumed
+
+            # The results come out in order.
+            assert [2, 4, 6, 8, 10, 12, 14, 16, 18] == list(results)
+            assert list(range(10)) == consumed
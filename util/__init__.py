@@ -1,6 +1,7 @@
 # encoding: utf-8
 """Miscellaneous utilities"""
 
+import itertools
 import re
 import string
 from collections import Counter
@@ -23,6 +24,19 @@ def batch(iterable, size=1):
     for start in range(0, l, size):
         yield iterable[start:min(start+size, l)]
 
+def batch_lazily(iterable, size=1):
+    """Split up `iterable` into lists of size `size`.
+
+    Unlike batch(), this works on any iterable, including one that's
+    too big to hold in memory, and only consumes one batch at a time.
+    """
+    iterator = iter(iterable)
+    while True:
+        items = list(itertools.islice(iterator, size))
+        if not items:
+            return
+        yield items
+
 def fast_query_count(query):
     """Counts the results of a query without using super-slow subquery"""
 
@@ -0,0 +1,104 @@
+"""Simple in-process caches."""
+from collections import OrderedDict
+from threading import RLock
+import time
+
+
+class LRUCache(object):
+    """A thread-safe, size-limited cache that discards the least
+    recently used item when it fills up.
+
+    Items may also be given a time-to-live, after which they will be
+    treated as though they weren't in the cache at all.
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        """Constructor.
+
+        :param max_size: The maximum number of items to keep in the cache.
+        :param ttl: The default number of seconds to keep an item in
+            the cache. If this is None, items will stay in the cache
+            until they are pushed out by newer items.
+        """
+        if max_size < 1:
+            raise ValueError("LRUCache must be able to hold at least one item.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def now(self):
+        """The current time. This method exists so it can be mocked."""
+        return time.time()
+
+    def get(self, key, default=None):
+        """Look up an item in the cache.
+
+        :return: The cached value, or `default` if the item was never
+            cached, has been evicted, or has expired.
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                expires, value = item
+                if expires is None or expires > self.now():
+                    # Put the item back at the 'most recently used'
+                    # end of the list.
+                    self._items[key] = item
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Put an item in the cache.
+
+        :param ttl: Keep the item in the cache for this number of
+            seconds, rather than the default.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is None:
+            expires = None
+        else:
+            expires = self.now() + ttl
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (expires, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove an item from the cache, if it's present."""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Remove every item from the cache."""
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def stats(self):
+        """Describe how well the cache is working.
+
+        :return: A dictionary containing the number of cache hits,
+           misses, and evictions, the current size of the cache, and
+           the proportion of lookups that were hits.
+        """
+        lookups = self.hits + self.misses
+        if lookups:
+            hit_rate = float(self.hits) / lookups
+        else:
+            hit_rate = None
+        return dict(
+            hits=self.hits, misses=self.misses, evictions=self.evictions,
+            size=len(self), hit_rate=hit_rate
+        )
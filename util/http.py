@@ -190,9 +190,17 @@ class HTTP(object):
     def request_with_timeout(cls, http_method, url, *args, **kwargs):
         """Call requests.request and turn a timeout into a RequestTimedOut
         exception.
+
+        :param session: Make the request through this requests Session
+            instead, so that its connections can be reused.
         """
+        session = kwargs.pop('session', None)
+        if session:
+            make_request_with = session.request
+        else:
+            make_request_with = requests.request
         return cls._request_with_timeout(
-            url, requests.request, http_method, *args, **kwargs
+            url, make_request_with, http_method, *args, **kwargs
         )
 
     @classmethod
@@ -4,8 +4,17 @@ import re
 import struct
 import unicodedata
 
+from .cache import LRUCache
+
 class WorkIDCalculator(object):
 
+    # Normalizing a title or an author takes a lot of regular
+    # expressions, and the same authors (and, less often, titles) come
+    # up over and over again, so the results are kept around.
+    NORMALIZATION_CACHE_SIZE = 10000
+    _normalized_titles = LRUCache(max_size=NORMALIZATION_CACHE_SIZE)
+    _normalized_authors = LRUCache(max_size=NORMALIZATION_CACHE_SIZE)
+
     @classmethod
     def permanent_id(self, normalized_title, normalized_author,
                      grouping_category):
@@ -125,8 +134,47 @@ class WorkIDCalculator(object):
         "SeedPacket": "other",
     }
 
+    @classmethod
+    def permanent_ids(cls, books):
+        """Calculate permanent work IDs for a number of books at once.
+
+        Each distinct title and author is only normalized once.
+
+        :param books: A list of 3-tuples (title, author,
+            grouping_category). Titles and authors are not normalized.
+        :return: A list of permanent work IDs, in the same order as
+            `books`.
+        """
+        normalized_titles = {}
+        normalized_authors = {}
+        permanent_ids = []
+        for title, author, grouping_category in books:
+            if title not in normalized_titles:
+                normalized_titles[title] = cls.normalize_title(title)
+            if author not in normalized_authors:
+                normalized_authors[author] = cls.normalize_author(author)
+            permanent_ids.append(
+                cls.permanent_id(
+                    normalized_titles[title], normalized_authors[author],
+                    grouping_category
+                )
+            )
+        return permanent_ids
+
     @classmethod
     def normalize_author(cls, author):
+        """Normalize an author's name, using a cached value if possible.
+
+        See _normalize_author for details.
+        """
+        normalized = cls._normalized_authors.get(author)
+        if normalized is None:
+            normalized = cls._normalize_author(author)
+            cls._normalized_authors.set(author, normalized)
+        return normalized
+
+    @classmethod
+    def _normalize_author(cls, author):
         """
         Converts to NFKD unicode.
         Strips bracket, special characters, dots out.
@@ -212,6 +260,21 @@ class WorkIDCalculator(object):
 
     @classmethod
     def normalize_title(cls, full_title, num_non_filing_characters=0):
+        """Normalize a title, using a cached value if possible.
+
+        See _normalize_title for details.
+        """
+        key = (full_title, num_non_filing_characters)
+        normalized = cls._normalized_titles.get(key)
+        if normalized is None:
+            normalized = cls._normalize_title(
+                full_title, num_non_filing_characters
+            )
+            cls._normalized_titles.set(key, normalized)
+        return normalized
+
+    @classmethod
+    def _normalize_title(cls, full_title, num_non_filing_characters=0):
         """
         Converts to NFKD unicode.
         Strips bracket, special characters.
@@ -1,14 +1,42 @@
 from fuzzywuzzy import fuzz
 from nameparser import HumanName
 
+import functools
 import re
 import unicodedata
 
+from cache import LRUCache
 from permanent_work_id import WorkIDCalculator;
 
 
 """Fallback algorithms for dealing with personal names when VIAF fails us."""
 
+# Parsing a name is slow, and the same names come up over and over
+# again, so the results of the functions below are cached.
+NAME_CACHE_SIZE = 10000
+
+_NOT_CACHED = object()
+
+
+def memoize_name_function(function):
+    """Cache the results of a function that takes a single name.
+
+    The original function is available as the `uncached` attribute of
+    the result, and its LRUCache as the `cache` attribute.
+    """
+    cache = LRUCache(max_size=NAME_CACHE_SIZE)
+
+    @functools.wraps(function)
+    def memoized(name):
+        result = cache.get(name, _NOT_CACHED)
+        if result is _NOT_CACHED:
+            result = function(name)
+            cache.set(name, result)
+        return result
+    memoized.uncached = function
+    memoized.cache = cache
+    return memoized
+
 phdFix = re.compile("((. +)|(, ?))P(h|H)\.? *(D|d)(\.| |$){1}")
 mdFix = re.compile("((. +)|(, ?))M\.? *D(\.| |$){1}")
 # omit exclamation point in case it can be part of stage name
@@ -123,6 +151,7 @@ def is_one_name(human_name):
     return False
 
 
+@memoize_name_function
 def display_name_to_sort_name(display_name):
     """
     Take the "First Name Last Name"-formatted display_name, and convert it
@@ -180,6 +209,7 @@ def display_name_to_sort_name(display_name):
     return sort_name
 
 
+@memoize_name_function
 def name_tidy(name):
     """
     * Converts to NFKD unicode.
@@ -208,6 +238,7 @@ def name_tidy(name):
     return name.strip()
 
 
+@memoize_name_function
 def normalize_contributor_name_for_matching(name):
     """
     Used to standardize author names before matching them to each other to identify best results
@@ -264,7 +295,38 @@ def sort_name_to_display_name(sort_name):
     return display_name
 
 
+# The functions whose results are cached.
+NAME_FUNCTIONS = [
+    display_name_to_sort_name, name_tidy,
+    normalize_contributor_name_for_matching,
+]
 
 
+def display_names_to_sort_names(display_names):
+    """Convert a number of display names to sort names at once.
 
+    :return: A dictionary mapping each distinct display name to its
+        sort name.
+    """
+    return dict(
+        (display_name, display_name_to_sort_name(display_name))
+        for display_name in set(display_names)
+    )
+
+
+def clear_name_caches():
+    """Empty the name caches."""
+    for function in NAME_FUNCTIONS:
+        function.cache.clear()
 
+
+def name_cache_stats():
+    """Describe how well the name caches are working.
+
+    :return: A dictionary mapping the name of each cached function to
+        its LRUCache.stats.
+    """
+    return dict(
+        (function.__name__, function.cache.stats)
+        for function in NAME_FUNCTIONS
+    )
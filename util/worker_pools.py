@@ -1,4 +1,6 @@
 import logging
+import time
+from collections import deque
 from contextlib import contextmanager
 
 from threading import (
@@ -187,3 +189,58 @@ class DatabaseJob(Job):
 
     def do_run(self):
         raise NotImplementedError()
+
+
+class RateLimiter(object):
+    """Keeps a group of threads from doing something more than a certain
+    number of times per second.
+    """
+
+    def __init__(self, per_second):
+        """Constructor.
+
+        :param per_second: The maximum number of times per second that
+            wait() will return, across all threads. If this is None or
+            zero, wait() will always return immediately.
+        """
+        self.interval = 0
+        if per_second:
+            self.interval = 1.0 / per_second
+        self.lock = RLock()
+        self.next_slot = 0
+
+    def wait(self):
+        """Block until this thread is allowed to go ahead."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = self.now()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+    def now(self):
+        """This method is overridden in tests."""
+        return time.time()
+
+    def sleep(self, seconds):
+        """This method is overridden in tests."""
+        time.sleep(seconds)
+
+
+def bounded_map(executor, function, iterable, in_flight):
+    """Like executor.map(), but only keeps `in_flight` calls waiting
+    for a worker at once, so that `iterable` can be consumed lazily.
+
+    :param executor: A concurrent.futures Executor.
+    :return: An iterator over the results, in the same order as
+        `iterable`.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()